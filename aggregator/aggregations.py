@@ -0,0 +1,287 @@
+"""
+Agregaciones configurables sobre el payload, evaluadas en una sola pasada.
+
+Cada spec (ver settings.AGGREGATION_SPECS) se compila UNA vez en una función
+de actualización especializada (getters precalculados, etiquetas de bucket
+precalculadas), de modo que por evento solo se ejecutan closures, sin
+interpretar la spec. Tipos soportados:
+
+    count      recuento por combinación de campos ("by": [...])
+    histogram  histograma de un campo numérico ("field", "buckets")
+    ratio      verdaderos vs falsos de un campo booleano ("field")
+    distinct   valores distintos aproximados con HyperLogLog ("field", "precision")
+    quantiles  cuantiles aproximados con t-digest ("field", "quantiles")
+
+El estado de count/histogram/ratio es un dict {etiqueta: n}: se serializa tal
+cual en los resultados de ventana y se combina sumando (shards, roll-ups).
+distinct/quantiles guardan un sketch de memoria acotada que se serializa con
+to_wire() y se combina con merge().
+"""
+import bisect
+
+from sketches import HyperLogLog, TDigest
+from windows import merge_counts
+
+
+def make_getter(path):
+    """Compila un path con puntos ("payload.crime_type") en un getter."""
+    parts = path.split(".")
+    if len(parts) == 1:
+        key = parts[0]
+        return lambda event: event.get(key)
+    if len(parts) == 2:
+        outer, inner = parts
+
+        def getter(event):
+            value = event.get(outer)
+            return value.get(inner) if isinstance(value, dict) else None
+        return getter
+
+    def getter(event):
+        value = event
+        for part in parts:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(part)
+        return value
+    return getter
+
+
+def bucket_labels(edges):
+    """[18, 30, 45] -> ["<18", "18-29", "30-44", ">=45"]"""
+    labels = [f"<{edges[0]}"]
+    labels += [f"{lo}-{hi - 1}" for lo, hi in zip(edges, edges[1:])]
+    labels.append(f">={edges[-1]}")
+    return labels
+
+
+class Aggregation:
+    """Una spec compilada. update() es el único código que corre por evento."""
+
+    def __init__(self, name, kind, source, update, finalize=None):
+        self.name = name
+        self.kind = kind
+        self.source = source
+        self.update = update
+        self._finalize = finalize
+
+    def new(self):
+        return {}
+
+    def merge(self, state, other):
+        return merge_counts(state, other)
+
+    def to_wire(self, state):
+        return state
+
+    def from_wire(self, wire):
+        return dict(wire)
+
+    def finalize(self, state):
+        return self._finalize(state) if self._finalize else state
+
+
+def compile_count(spec):
+    getters = [make_getter(path) for path in spec["by"]]
+    if len(getters) == 1:
+        (get,) = getters
+
+        def update(state, event):
+            key = str(get(event))
+            state[key] = state.get(key, 0) + 1
+    elif len(getters) == 2:
+        get_a, get_b = getters
+
+        def update(state, event):
+            key = f"{get_a(event)}|{get_b(event)}"
+            state[key] = state.get(key, 0) + 1
+    else:
+        def update(state, event):
+            key = "|".join(str(get(event)) for get in getters)
+            state[key] = state.get(key, 0) + 1
+    return Aggregation(spec["name"], "count", spec.get("source"), update)
+
+
+def compile_histogram(spec):
+    get = make_getter(spec["field"])
+    edges = sorted(spec["buckets"])
+    labels = bucket_labels(edges)
+
+    def update(state, event):
+        value = get(event)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            label = labels[bisect.bisect_right(edges, value)]
+            state[label] = state.get(label, 0) + 1
+    return Aggregation(spec["name"], "histogram", spec.get("source"), update)
+
+
+def compile_ratio(spec):
+    get = make_getter(spec["field"])
+
+    def update(state, event):
+        value = get(event)
+        if isinstance(value, bool):
+            key = "true" if value else "false"
+            state[key] = state.get(key, 0) + 1
+
+    def finalize(state):
+        yes, no = state.get("true", 0), state.get("false", 0)
+        total = yes + no
+        return {"true": yes, "false": no, "ratio": round(yes / total, 4) if total else None}
+    return Aggregation(spec["name"], "ratio", spec.get("source"), update, finalize)
+
+
+class SketchAggregation(Aggregation):
+    """Agregación cuyo estado es un sketch (HyperLogLog, TDigest)."""
+
+    def __init__(self, name, kind, source, update, factory, sketch_cls, finalize):
+        super().__init__(name, kind, source, update, finalize)
+        self._factory = factory
+        self._sketch_cls = sketch_cls
+
+    def new(self):
+        return self._factory()
+
+    def merge(self, state, other):
+        return state.merge(other)
+
+    def to_wire(self, state):
+        return state.to_wire()
+
+    def from_wire(self, wire):
+        return self._sketch_cls.from_wire(wire)
+
+    def finalize(self, state):
+        # El sketch viaja junto al valor legible para poder combinarlo aguas abajo
+        result = self._finalize(state)
+        result["sketch"] = state.to_wire()
+        return result
+
+
+def compile_distinct(spec):
+    get = make_getter(spec["field"])
+    precision = spec.get("precision", 11)
+
+    def update(state, event):
+        value = get(event)
+        if value is not None:
+            state.add(value)
+
+    def finalize(state):
+        return {"estimate": state.estimate()}
+    return SketchAggregation(spec["name"], "distinct", spec.get("source"), update,
+                             lambda: HyperLogLog(precision), HyperLogLog, finalize)
+
+
+def compile_quantiles(spec):
+    get = make_getter(spec["field"])
+    quantiles = spec.get("quantiles", [0.5, 0.95])
+    compression = spec.get("compression", 100)
+
+    def update(state, event):
+        value = get(event)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            state.add(value)
+
+    def finalize(state):
+        result = {"count": state.total}
+        for q in quantiles:
+            value = state.quantile(q)
+            result[f"p{round(q * 100):g}"] = round(value, 2) if value is not None else None
+        return result
+    return SketchAggregation(spec["name"], "quantiles", spec.get("source"), update,
+                             lambda: TDigest(compression), TDigest, finalize)
+
+
+COMPILERS = {
+    "count": compile_count,
+    "histogram": compile_histogram,
+    "ratio": compile_ratio,
+    "distinct": compile_distinct,
+    "quantiles": compile_quantiles,
+}
+
+
+class AggregationPlan:
+    """Conjunto de specs compiladas, indexadas por source."""
+
+    def __init__(self, specs):
+        self.aggregations = {}
+        self._by_source = {}
+        self._any_source = []
+        self._resolved = {}
+        for spec in specs:
+            kind = spec.get("kind", "count")
+            if kind not in COMPILERS:
+                raise ValueError(f"Tipo de agregación desconocido: {kind}")
+            if spec["name"] in self.aggregations:
+                raise ValueError(f"Agregación duplicada: {spec['name']}")
+            agg = COMPILERS[kind](spec)
+            self.aggregations[agg.name] = agg
+            if agg.source:
+                self._by_source.setdefault(agg.source, []).append(agg)
+            else:
+                self._any_source.append(agg)
+
+    def for_source(self, source):
+        """Agregaciones aplicables a una fuente (cacheado tras la primera vez)."""
+        aggs = self._resolved.get(source)
+        if aggs is None:
+            aggs = self._resolved[source] = self._by_source.get(source, []) + self._any_source
+        return aggs
+
+    # --- Estados serializados {region: {nombre: wire}} ---
+    def merge_wire(self, target, wire_by_region):
+        """Combina estados serializados sobre target (in place)."""
+        for region, states in wire_by_region.items():
+            region_target = target.setdefault(region, {})
+            for name, wire in states.items():
+                agg = self.aggregations.get(name)
+                if agg is None:
+                    continue
+                if name in region_target:
+                    merged = agg.merge(agg.from_wire(region_target[name]), agg.from_wire(wire))
+                else:
+                    merged = agg.from_wire(wire)
+                region_target[name] = agg.to_wire(merged)
+        return target
+
+    def finalize_wire(self, wire_by_region):
+        """Forma legible para analytics.window / metrics.daily."""
+        result = {}
+        for region, states in wire_by_region.items():
+            result[region] = {
+                name: self.aggregations[name].finalize(self.aggregations[name].from_wire(wire))
+                for name, wire in states.items() if name in self.aggregations
+            }
+        return result
+
+
+class WindowAggregations:
+    """Estado de las agregaciones de la ventana actual, por región."""
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.states = {}
+
+    def update(self, region, source, event):
+        aggs = self.plan.for_source(source)
+        if not aggs:
+            return
+        region_states = self.states.get(region)
+        if region_states is None:
+            region_states = self.states[region] = {}
+        for agg in aggs:
+            state = region_states.get(agg.name)
+            if state is None:
+                state = region_states[agg.name] = agg.new()
+            agg.update(state, event)
+
+    def to_wire(self):
+        return {
+            region: {name: self.plan.aggregations[name].to_wire(state) for name, state in states.items()}
+            for region, states in self.states.items()
+        }
+
+    def reset(self):
+        self.states = {}
@@ -0,0 +1,92 @@
+"""
+Detección de anomalías en línea sobre los recuentos por ventana.
+
+Por cada celda región x fuente se mantiene una media y varianza con
+media móvil exponencial (EWMA): 3 floats por celda, O(1) por ventana. Los
+recuentos se normalizan a eventos/segundo porque las ventanas no duran
+siempre lo mismo: se cierran con el primer lote procesado (o la primera
+espera de BATCH_WAIT_MS sin tráfico) después de AGGREGATION_WINDOW, y en
+catch-up se alargan por CATCHUP_WINDOW_FACTOR.
+
+Una ventana es anómala si |z| >= threshold, con
+    z = (tasa - media) / max(desvío EWMA, desvío Poisson de la media)
+El piso Poisson evita alertas con varianzas casi nulas al inicio o con
+tasas muy bajas.
+"""
+import math
+import uuid
+from datetime import datetime
+
+
+class EwmaDetector:
+
+    def __init__(self, alpha=0.1, threshold=4.0, warmup=10):
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self.baselines = {}  # (region, source) -> [media, varianza, n]
+
+    def observe(self, key, rate, duration):
+        """Actualiza la línea base de key y devuelve (z, media, desvío) o None en warm-up."""
+        baseline = self.baselines.get(key)
+        if baseline is None:
+            self.baselines[key] = [rate, 0.0, 1]
+            return None
+
+        mean, var, n = baseline
+        result = None
+        if n >= self.warmup:
+            std = max(math.sqrt(var), math.sqrt(max(mean, 1e-9) / duration))
+            result = ((rate - mean) / std, mean, std)
+
+        diff = rate - mean
+        incr = self.alpha * diff
+        baseline[0] = mean + incr
+        baseline[1] = (1 - self.alpha) * (var + diff * incr)
+        baseline[2] = n + 1
+        return result
+
+    def check_window(self, window, frozen=False):
+        """
+        Evalúa todas las celdas conocidas (incluidas las que no tuvieron eventos
+        en esta ventana, que cuentan como 0) y devuelve las alertas.
+
+        frozen: ventana con backlog (modo catch-up). Su tasa mide cuánto se
+        drenó de la cola y no el tráfico real, así que no se evalúa ni entra
+        en las líneas base.
+        """
+        if frozen:
+            return []
+        duration = max(window["window_end"] - window["window_start"], 1e-3)
+        stats = window["stats_by_region"]
+
+        keys = set(self.baselines)
+        for region, region_stats in stats.items():
+            keys.update((region, source) for source in region_stats)
+
+        alerts = []
+        for region, source in keys:
+            count = stats.get(region, {}).get(source, 0)
+            result = self.observe((region, source), count / duration, duration)
+            if result is None:
+                continue
+            z, mean, std = result
+            if abs(z) >= self.threshold:
+                alerts.append(build_alert(window, region, source, count, mean * duration, std * duration, z))
+        return alerts
+
+
+def build_alert(window, region, source, observed, expected, stddev, z):
+    return {
+        "type": "anomaly",
+        "alert_id": str(uuid.uuid4()),
+        "region": region,
+        "source": source,
+        "window_start_iso": datetime.fromtimestamp(window["window_start"]).isoformat(),
+        "window_end_iso": datetime.fromtimestamp(window["window_end"]).isoformat(),
+        "observed": observed,
+        "expected": round(expected, 2),
+        "stddev": round(stddev, 2),
+        "z_score": round(z, 2),
+        "direction": "spike" if z > 0 else "drop",
+    }
@@ -0,0 +1,218 @@
+"""
+Micro-benchmarks del Aggregator (no requieren RabbitMQ).
+
+Uso:
+    python bench.py counters [--events N]
+    python bench.py trace [--events N]
+    python bench.py anomaly [--windows N]
+    python bench.py microbatch [--events N] [--batch-size N]
+"""
+import argparse
+import json
+import random
+import socket
+import sys
+import threading
+import time
+import uuid
+
+import settings
+from aggregations import AggregationPlan
+from anomaly import EwmaDetector
+from counters import CounterMatrix
+from microbatch import MicroBatcher
+from runwindows import RunWindows, is_valid_event
+from tracecodec import attach_trace, trace_event_ids
+
+
+def synthetic_pairs(n, seed=42):
+    rng = random.Random(seed)
+    return [(rng.choice(settings.REGIONS), rng.choice(settings.SOURCES)) for _ in range(n)]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def deep_sizeof(obj, seen=None):
+    """Tamaño aproximado en bytes de un objeto y sus contenedores."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(deep_sizeof(v, seen) for v in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+# --- counters: dict de dicts (versión original) vs CounterMatrix ---
+def dict_counts(pairs):
+    stats_buffer = {}
+    for region, source in pairs:
+        if region not in stats_buffer:
+            stats_buffer[region] = {}
+        if source not in stats_buffer[region]:
+            stats_buffer[region][source] = 0
+        stats_buffer[region][source] += 1
+    return stats_buffer
+
+
+def matrix_counts(pairs):
+    matrix = CounterMatrix(settings.REGIONS, settings.SOURCES)
+    for region, source in pairs:
+        matrix.add(region, source)
+    return matrix
+
+
+def matrix_batch_counts(pairs, batch=100):
+    matrix = CounterMatrix(settings.REGIONS, settings.SOURCES)
+    for i in range(0, len(pairs), batch):
+        matrix.add_batch(pairs[i:i + batch])
+    return matrix
+
+
+def bench_counters(args):
+    pairs = synthetic_pairs(args.events)
+    print(f"[*] {args.events} eventos, {len(settings.REGIONS)} regiones x {len(settings.SOURCES)} fuentes")
+
+    for name, fn in (("dict", dict_counts), ("matrix", matrix_counts), ("matrix+batch", matrix_batch_counts)):
+        elapsed, _ = timed(fn, pairs)
+        print(f"  {name:<14} {elapsed / len(pairs) * 1e9:8.1f} ns/evento")
+
+    stats = dict_counts(pairs)
+    matrix = matrix_counts(pairs)
+    assert stats == matrix.to_dict()
+    # Los strings de región/fuente son compartidos (internados) en ambos casos
+    print(f"  memoria estado: dict={deep_sizeof(stats)} B, matrix={sys.getsizeof(matrix.counts)} B (+ ids)")
+
+    elapsed, _ = timed(matrix.to_dict)
+    print(f"  to_dict (flush) {elapsed * 1e6:8.1f} us")
+
+
+# --- trace: tamaño de metrics.daily según la codificación de la traza ---
+def bench_trace(args):
+    event_ids = [str(uuid.uuid4()) for _ in range(args.events)]
+    base = {"metric_id": str(uuid.uuid4()), "date": "2025-01-01", "region": "norte",
+            "run_id": "default", "metrics": {"security.incident": args.events}}
+    print(f"[*] Traza de {args.events} event_ids")
+
+    for encoding in ("plain", "compact"):
+        elapsed, msgs = timed(lambda: [json.dumps(m) for m in attach_trace(base, event_ids, encoding)])
+        size = sum(len(m) for m in msgs)
+        decode_time, decoded = timed(lambda: [i for m in msgs for i in trace_event_ids(json.loads(m))])
+        assert sorted(decoded) == sorted(event_ids)
+        print(f"  {encoding:<8} {size / 1024:9.1f} KiB  ({size / args.events:5.1f} B/id)  "
+              f"encode {elapsed * 1e3:7.1f} ms  decode {decode_time * 1e3:7.1f} ms")
+
+
+# --- anomaly: costo de check_window por ventana ---
+def bench_anomaly(args):
+    rng = random.Random(3)
+    windows = []
+    for i in range(args.windows):
+        burst = i % 50 == 49  # una ráfaga cada 50 ventanas
+        stats = {
+            region: {source: rng.randint(8, 12) * (6 if burst and source == "security.incident" else 1)
+                     for source in settings.SOURCES}
+            for region in settings.REGIONS
+        }
+        windows.append({"window_start": i * 5.0, "window_end": i * 5.0 + 5.0, "stats_by_region": stats})
+
+    detector = EwmaDetector()
+    elapsed, alerts = timed(lambda: [a for w in windows for a in detector.check_window(w)])
+    cells = len(settings.REGIONS) * len(settings.SOURCES)
+    print(f"[*] {args.windows} ventanas x {cells} celdas")
+    print(f"  check_window {elapsed / args.windows * 1e6:8.1f} us/ventana, {len(alerts)} alertas "
+          f"({args.windows // 50} ráfagas inyectadas)")
+
+
+# --- microbatch: ack por mensaje vs micro-lote con ack(multiple=True) ---
+class SocketChannel:
+    """
+    Canal falso: cada ack escribe un frame Basic.Ack (21 bytes, como pika) en
+    un socket local, así el costo por ack incluye la syscall como en producción.
+    """
+
+    def __init__(self):
+        self.sock, peer = socket.socketpair()
+        self.acks = 0
+        threading.Thread(target=self._drain, args=(peer,), daemon=True).start()
+
+    def _drain(self, peer):
+        while peer.recv(65536):
+            pass
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.sock.sendall(b"\x01\x00\x01\x00\x00\x00\x0d\x00\x3c\x00\x50" + bytes(10))
+        self.acks += 1
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        self.basic_ack(delivery_tag)
+
+    def close(self):
+        self.sock.close()
+
+
+def bench_microbatch(args):
+    rng = random.Random(5)
+    bodies = [json.dumps({"event_id": str(uuid.uuid4()), "region": rng.choice(settings.REGIONS),
+                          "source": rng.choice(settings.SOURCES), "payload": {"n": n}}).encode()
+              for n in range(args.events)]
+    plan = AggregationPlan(settings.AGGREGATION_SPECS)
+    print(f"[*] {args.events} mensajes, {len(plan.aggregations)} agregaciones del payload")
+
+    for name, size in (("ack por mensaje", 1), (f"lotes de {args.batch_size}", args.batch_size)):
+        windows = RunWindows(settings.REGIONS, settings.SOURCES, plan)
+
+        def process(channel, batch):
+            windows.admit([e for e in map(json.loads, batch) if is_valid_event(e)])
+
+        channel = SocketChannel()
+        batcher = MicroBatcher(process, size, max_wait=1.0)
+
+        def run():
+            for tag, body in enumerate(bodies, start=1):
+                if batcher.add(tag, body):
+                    batcher.flush(channel)
+            batcher.flush(channel)
+        elapsed, _ = timed(run)
+        channel.close()
+        assert windows.total_processed == args.events
+        print(f"  {name:<16} {args.events / elapsed:10.0f} msg/s  {elapsed / args.events * 1e6:6.2f} us/msg  "
+              f"{channel.acks} acks")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    counters = sub.add_parser("counters", help="dict de dicts vs matriz densa")
+    counters.add_argument("--events", type=int, default=500_000)
+    counters.set_defaults(func=bench_counters)
+
+    trace = sub.add_parser("trace", help="tamaño de la traza plain vs compact")
+    trace.add_argument("--events", type=int, default=100_000)
+    trace.set_defaults(func=bench_trace)
+
+    anomaly = sub.add_parser("anomaly", help="latencia del detector EWMA por ventana")
+    anomaly.add_argument("--windows", type=int, default=10_000)
+    anomaly.set_defaults(func=bench_anomaly)
+
+    microbatch = sub.add_parser("microbatch", help="ack por mensaje vs micro-lotes con ack múltiple")
+    microbatch.add_argument("--events", type=int, default=200_000)
+    microbatch.add_argument("--batch-size", type=int, default=settings.BATCH_SIZE)
+    microbatch.set_defaults(func=bench_microbatch)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
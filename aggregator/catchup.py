@@ -0,0 +1,84 @@
+"""
+Modo catch-up del Aggregator.
+
+Tras una caída aguas arriba (p.ej. run_chaos.sh) la cola acumula un backlog.
+En vez de procesarlo al ritmo normal, el controlador pasa a modo catch-up
+cuando el lag (ahora - timestamp del evento) o la profundidad de la cola
+superan un umbral: se sube el prefetch, los lotes son más grandes, se
+decodifica en bloque y las ventanas se alargan para no inundar a los
+consumidores con muchos resúmenes pequeños. Vuelve al modo normal (baja
+latencia) cuando lag y profundidad bajan de los umbrales de salida
+(histéresis para no oscilar).
+"""
+import calendar
+import json
+import time
+
+NORMAL = "normal"
+CATCHUP = "catchup"
+
+
+def event_lag(event, now=None):
+    """Segundos entre el timestamp del evento (UTC, ...Z) y ahora. None si no se puede calcular."""
+    try:
+        ts = calendar.timegm(time.strptime(event["timestamp"], "%Y-%m-%dT%H:%M:%SZ"))
+    except (KeyError, TypeError, ValueError):
+        return None
+    return (time.time() if now is None else now) - ts
+
+
+def bulk_decode(bodies):
+    """
+    Decodifica un lote con un único json.loads sobre un array JSON armado
+    con los bytes crudos. Si algún mensaje está corrupto se cae a la
+    decodificación uno a uno para aislarlo. Devuelve (eventos, errores).
+    """
+    try:
+        events = json.loads(b"[" + b",".join(bodies) + b"]")
+        if len(events) == len(bodies) and all(isinstance(e, dict) for e in events):
+            return events, 0
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        pass
+    events, errors = [], 0
+    for body in bodies:
+        try:
+            event = json.loads(body)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            errors += 1
+            continue
+        if isinstance(event, dict):
+            events.append(event)
+        else:
+            errors += 1
+    return events, errors
+
+
+class CatchUpController:
+
+    def __init__(self, enter_lag, exit_lag, enter_depth, exit_depth):
+        self.enter_lag = enter_lag
+        self.exit_lag = exit_lag
+        self.enter_depth = enter_depth
+        self.exit_depth = exit_depth
+        self.mode = NORMAL
+        self.lag = 0.0
+        self.depth = 0
+
+    def observe(self, lag=None, depth=None):
+        """Registra una medición y devuelve el nuevo modo si cambió (o None)."""
+        if lag is not None:
+            self.lag = lag
+        if depth is not None:
+            self.depth = depth
+
+        if self.mode == NORMAL and (self.lag > self.enter_lag or self.depth > self.enter_depth):
+            self.mode = CATCHUP
+            return CATCHUP
+        if self.mode == CATCHUP and self.lag < self.exit_lag and self.depth < self.exit_depth:
+            self.mode = NORMAL
+            return NORMAL
+        return None
+
+    @property
+    def catching_up(self):
+        return self.mode == CATCHUP
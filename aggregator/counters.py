@@ -0,0 +1,111 @@
+"""
+Contadores región x fuente en una matriz densa.
+
+Los dominios de región y fuente son pequeños y conocidos, así que en vez de un
+dict de dicts usamos un array plano de enteros indexado por ids internados:
+celda = region_id * n_sources + source_id. Valores fuera del dominio conocido
+(p.ej. "unknown") se internan al vuelo ampliando la matriz.
+"""
+from array import array
+from collections import Counter
+
+
+class CounterMatrix:
+
+    def __init__(self, regions=(), sources=()):
+        self.region_ids = {}
+        self.source_ids = {}
+        self.regions = []
+        self.sources = []
+        self.counts = array("q")
+        self._cells = {}  # cache (region, source) -> índice plano
+        for region in regions:
+            self._intern_region(region)
+        for source in sources:
+            self._intern_source(source)
+
+    # --- Internado de ids ---
+    def _intern_region(self, region):
+        idx = self.region_ids.get(region)
+        if idx is None:
+            idx = self.region_ids[region] = len(self.regions)
+            self.regions.append(region)
+            self.counts.extend([0] * len(self.sources))
+        return idx
+
+    def _intern_source(self, source):
+        idx = self.source_ids.get(source)
+        if idx is None:
+            idx = self.source_ids[source] = len(self.sources)
+            self.sources.append(source)
+            # Nueva columna: reconstruimos el array (ocurre muy rara vez)
+            n_old = idx
+            old = self.counts
+            counts = array("q", bytes(8 * len(self.regions) * (n_old + 1)))
+            for r in range(len(self.regions)):
+                counts[r * (n_old + 1):r * (n_old + 1) + n_old] = old[r * n_old:(r + 1) * n_old]
+            self.counts = counts
+            self._cells.clear()  # cambió el ancho de fila
+        return idx
+
+    def cell(self, region, source):
+        """Índice plano de la celda (región, fuente)."""
+        key = (region, source)
+        cell = self._cells.get(key)
+        if cell is None:
+            r = self._intern_region(region)
+            s = self._intern_source(source)
+            cell = self._cells[key] = r * len(self.sources) + s
+        return cell
+
+    # --- Incrementos ---
+    def add(self, region, source, n=1):
+        cell = self._cells.get((region, source))
+        if cell is None:
+            cell = self.cell(region, source)
+        self.counts[cell] += n
+
+    def add_batch(self, pairs):
+        """
+        Incremento en bloque para un lote de tuplas (region, source): se agrupan las
+        celdas repetidas y se toca cada celda una sola vez.
+        """
+        cell_of = self._cells.get
+        cells = Counter(map(cell_of, pairs))
+        missing = cells.pop(None, 0)
+        if missing:
+            # Algún par no internado aún: primero internamos todo (puede cambiar
+            # el ancho de fila) y recién después calculamos las celdas
+            for region, source in pairs:
+                self.cell(region, source)
+            cells = Counter(self.cell(region, source) for region, source in pairs)
+        counts = self.counts
+        for cell, n in cells.items():
+            counts[cell] += n
+
+    # --- Ventanas ---
+    def total(self):
+        return sum(self.counts)
+
+    def is_empty(self):
+        return not any(self.counts)
+
+    def snapshot(self):
+        """Copia inmutable de la ventana actual (array + dominios)."""
+        return list(self.regions), list(self.sources), array("q", self.counts)
+
+    def reset(self):
+        """Pone los contadores a cero conservando los ids internados."""
+        self.counts = array("q", bytes(8 * len(self.counts)))
+
+    def to_dict(self, snapshot=None):
+        """Forma JSON histórica: { "norte": { "security.incident": 5 }, ... } sin ceros."""
+        regions, sources, counts = snapshot or (self.regions, self.sources, self.counts)
+        n_sources = len(sources)
+        result = {}
+        for r, region in enumerate(regions):
+            row = counts[r * n_sources:(r + 1) * n_sources]
+            if not any(row):
+                continue
+            result[region] = {sources[s]: n for s, n in enumerate(row) if n}
+        return result
@@ -1,18 +1,37 @@
 import json
 import time
-import uuid
 from datetime import datetime
 
 import pika
 
 import settings
+from aggregations import AggregationPlan
+from anomaly import EwmaDetector
+from catchup import CATCHUP, CatchUpController, bulk_decode, event_lag
+from rollups import RollupStore
+from microbatch import MicroBatcher
+from runwindows import DEFAULT_RUN, RunWindows, event_run_id, is_valid_event
+from tracecodec import attach_trace
+
+# Agregaciones del payload: specs compiladas una sola vez al arrancar
+AGGREGATION_PLAN = AggregationPlan(settings.AGGREGATION_SPECS)
 
 # --- ESTADO EN MEMORIA --
 # En un sistema real distribuido, esto debería estar en Redis
 current_window_start = time.time()
-processed_ids = set()     # Para Deduplicación
-stats_buffer = {}         # Estructura: { "norte": { "theft": 5, "assault": 1 }, ... }
-event_ids_by_region = {}  # Estructura: { "norte": {"id1", "id2"} }
+backlog_in_window = False  # La ventana en curso pasó por modo catch-up
+# Por corrida (run_id): contadores región x fuente (matriz densa, se convierte
+# a { "norte": { "security.incident": 5 }, ... } solo al cerrar la ventana),
+# agregaciones, event_ids por región y deduplicación por (run_id, event_id)
+run_windows = RunWindows(settings.REGIONS, settings.SOURCES, AGGREGATION_PLAN)
+
+# Roll-ups hora/día (solo los mantiene quien emite: este proceso o merge.py)
+rollups = RollupStore(AGGREGATION_PLAN, settings.ROLLUP_RETENTION_HOURS)
+
+# Líneas base EWMA por región x fuente para alerts.anomaly
+anomaly_detector = EwmaDetector(
+    settings.ANOMALY_ALPHA, settings.ANOMALY_Z_THRESHOLD, settings.ANOMALY_WARMUP_WINDOWS
+) if settings.ANOMALY_DETECTION else None
 
 def connect_rabbitmq():
     while True:
@@ -26,32 +45,38 @@ def connect_rabbitmq():
             channel.exchange_declare(exchange=settings.OUTPUT_EXCHANGE, exchange_type='topic', durable=True)
 
             # Declarar y bindear cola
-            channel.queue_declare(queue=settings.QUEUE_NAME, durable=True)
-            # Escuchamos TODO (#) lo que venga validado
-            channel.queue_bind(exchange=settings.INPUT_EXCHANGE, queue=settings.QUEUE_NAME, routing_key="#")
+            queue_name, binding_key = queue_and_binding()
+            channel.queue_declare(queue=queue_name, durable=True)
+            # Sin particiones escuchamos TODO (#); un shard solo su partición
+            channel.queue_bind(exchange=settings.INPUT_EXCHANGE, queue=queue_name, routing_key=binding_key)
 
-            print(f"[*] Aggregator conectado. Ventana de {settings.AGGREGATION_WINDOW}s")
+            print(f"[*] Aggregator conectado ({binding_key}). Ventana de {settings.AGGREGATION_WINDOW}s")
             return connection, channel
         except pika.exceptions.AMQPConnectionError:
             print(f"[!] Esperando a RabbitMQ...")
             time.sleep(5)
 
-def flush_window(channel):
-    """Publica los resultados acumulados y reinicia el buffer"""
-    global current_window_start, stats_buffer, processed_ids, event_ids_by_region
+def queue_and_binding():
+    """Cola y binding key según el modo (único o shard de una partición)"""
+    if settings.PARTITIONS > 0:
+        return f"{settings.QUEUE_NAME}.p{settings.SHARD_ID}", f"#.p{settings.SHARD_ID}"
+    return settings.QUEUE_NAME, "#"
 
-    if not stats_buffer:
-        # Si no hubo datos, solo actualizamos el tiempo
-        current_window_start = time.time()
-        return
+def emit_window(channel, window):
+    """Publica analytics.window, los roll-ups metrics.hourly / metrics.daily y alerts.anomaly de una ventana"""
+    run_id = window.get("run_id", DEFAULT_RUN)
+    stats_by_region = window["stats_by_region"]
+    aggregations_by_region = AGGREGATION_PLAN.finalize_wire(window.get("aggregations_by_region", {}))
 
     # Crear mensaje de resumen
     summary = {
         "type": "window_summary",
-        "window_start_iso": datetime.fromtimestamp(current_window_start).isoformat(),
-        "window_end_iso": datetime.now().isoformat(),
-        "total_processed": len(processed_ids),
-        "stats_by_region": stats_buffer
+        "run_id": run_id,
+        "window_start_iso": datetime.fromtimestamp(window["window_start"]).isoformat(),
+        "window_end_iso": datetime.fromtimestamp(window["window_end"]).isoformat(),
+        "total_processed": window["total_processed"],
+        "stats_by_region": stats_by_region,
+        "aggregations_by_region": aggregations_by_region,
     }
 
     # Publicar al exchange de analytics
@@ -62,85 +87,194 @@ def flush_window(channel):
         properties=pika.BasicProperties(delivery_mode=2)
     )
 
-    # Publicar métricas diarias por región con trazabilidad
-    for region, region_stats in stats_buffer.items():
-        metric_msg = {
-            "metric_id": str(uuid.uuid4()),
-            "date": datetime.now().date().isoformat(),
-            "region": region,
-            "run_id": "default",
-            "metrics": region_stats,
-            "input_event_ids": sorted(event_ids_by_region.get(region, set())),
-        }
+    # Roll-ups hora/día: upserts con metric_id determinístico por (periodo, región, run_id).
+    # La traza de metrics.daily solo lleva los event_id nuevos de esta ventana.
+    for routing_key, metric_msg, event_ids in rollups.apply_window(window, run_id):
+        if routing_key == "metrics.daily":
+            # Uno o más mensajes según TRACE_ENCODING / TRACE_CHUNK_SIZE
+            msgs = attach_trace(metric_msg, event_ids, settings.TRACE_ENCODING, settings.TRACE_CHUNK_SIZE)
+        else:
+            msgs = [metric_msg]
+        for msg in msgs:
+            channel.basic_publish(
+                exchange=settings.OUTPUT_EXCHANGE,
+                routing_key=routing_key,
+                body=json.dumps(msg),
+                properties=pika.BasicProperties(delivery_mode=2),
+            )
+
+    # Anomalías: O(celdas) por ventana, sin pasar de nuevo por los eventos. Las
+    # líneas base son del tráfico normal: ni un replay ni una ventana con
+    # backlog de catch-up (ráfaga falsa) las alteran
+    if run_id == DEFAULT_RUN:
+        check_anomalies(channel, window)
+
+def check_anomalies(channel, window):
+    """Evalúa la ventana en vivo con el detector y publica sus alertas (alerts.anomaly)"""
+    if anomaly_detector is None:
+        return
+    for alert in anomaly_detector.check_window(window, frozen=window.get("backlog", False)):
         channel.basic_publish(
             exchange=settings.OUTPUT_EXCHANGE,
-            routing_key="metrics.daily",
-            body=json.dumps(metric_msg),
+            routing_key=settings.ANOMALY_ROUTING_KEY,
+            body=json.dumps(alert),
             properties=pika.BasicProperties(delivery_mode=2),
         )
+        print(f" [!] Anomalía {alert['direction']} en {alert['region']}/{alert['source']}: "
+              f"{alert['observed']} eventos (esperado {alert['expected']}, z={alert['z_score']})")
 
-    print(f" [S] Ventana cerrada. Publicado resumen de {len(processed_ids)} eventos.")
-    
-    # Reiniciar estado
-    stats_buffer = {}
-    processed_ids = set()
-    event_ids_by_region = {}
-    current_window_start = time.time()
+def flush_window(channel):
+    """
+    Publica los resultados acumulados (uno por corrida) y reinicia el buffer.
 
-def process_event(event):
-    """Lógica de agregación pura"""
-    region = event.get("region", "unknown")
-    source = event.get("source", "unknown")
-    event_id = event.get("event_id")
-    
-    # Inicializar contadores si no existen
-    if region not in stats_buffer:
-        stats_buffer[region] = {}
-    if source not in stats_buffer[region]:
-        stats_buffer[region][source] = 0
-        
-    stats_buffer[region][source] += 1
-
-    if event_id:
-        event_ids_by_region.setdefault(region, set()).add(event_id)
+    Si una publicación falla, la ventana se descarta igual: emit_window puede
+    haber aplicado ya los roll-ups, y reintentarla los sumaría dos veces.
 
-def callback(ch, method, properties, body):
-    
+    Una ventana sin tráfico en vivo (vacía o solo de replays) igual pasa por
+    el detector con todas las celdas en 0: si no, una caída total del tráfico
+    nunca alertaría.
+    """
+    global current_window_start, backlog_in_window
+
+    window_end = time.time()
+    backlog = backlog_in_window or catchup.catching_up
+    windows = [] if run_windows.is_empty() else run_windows.results(
+        window_start=current_window_start,
+        window_end=window_end,
+        shard_id=settings.SHARD_ID if settings.PARTITIONS > 0 else None,
+        backlog=backlog,
+    )
     try:
-        event = json.loads(body)
-        event_id = event.get("event_id")
+        if not settings.MERGE_SHARDS and all(w["run_id"] != DEFAULT_RUN for w in windows):
+            # Con MERGE_SHARDS el detector corre en merge.py sobre la ventana combinada
+            check_anomalies(channel, {"window_start": current_window_start, "window_end": window_end,
+                                      "stats_by_region": {}, "backlog": backlog})
+        for window in windows:
+            if settings.MERGE_SHARDS:
+                # Resultado parcial: lo combina merge.py con el de los demás shards
+                channel.basic_publish(
+                    exchange=settings.OUTPUT_EXCHANGE,
+                    routing_key=settings.SHARD_ROUTING_KEY,
+                    body=json.dumps(window),
+                    properties=pika.BasicProperties(delivery_mode=2),
+                )
+            else:
+                emit_window(channel, window)
+    except Exception as e:
+        print(f" [!] Error cerrando ventana: {e}. Se descarta (no se reintenta una ventana a medio publicar)")
+    else:
+        if windows:
+            runs = ", ".join(f"{w['run_id']}: {w['total_processed']}" for w in windows)
+            print(f" [S] Ventana cerrada. Publicado resumen de {run_windows.total_processed} eventos ({runs}).")
 
-        # 1. DEDUPLICACIÓN (Idempotencia)
-        if event_id in processed_ids:
-            print(f" [d] Duplicado detectado e ignorado: {event_id}")
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-            return
+    # Reiniciar estado (también tras un error)
+    run_windows.reset()
+    current_window_start = time.time()
+    backlog_in_window = catchup.catching_up
 
-        # 2. PROCESAMIENTO
-        process_event(event)
-        processed_ids.add(event_id)
+# --- CONSUMO EN MICRO-LOTES ---
+# callback solo acumula entregas; process_events decodifica, deduplica y agrega
+# hasta BATCH_SIZE mensajes juntos y el lote se confirma con un único
+# basic_ack(multiple=True) en vez de un ack por mensaje, solo si se procesó
+# entero (si no, se reprocesa uno a uno: ver microbatch.py).
 
-        # 3. VERIFICAR SI CERRAMOS VENTANA
-        # verificamos el tiempo en cada mensaje. Si no llegan mensajes, la ventana no se cierra.
-        if time.time() - current_window_start >= settings.AGGREGATION_WINDOW:
-            flush_window(ch)
+# Modo catch-up: lotes/prefetch más grandes, decodificación en bloque y ventanas largas
+catchup = CatchUpController(
+    settings.CATCHUP_ENTER_LAG, settings.CATCHUP_EXIT_LAG,
+    settings.CATCHUP_ENTER_DEPTH, settings.CATCHUP_EXIT_DEPTH,
+)
 
-    except Exception as e:
-        print(f" [!] Error agregando: {e}")
-    
-    finally:
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+def batch_size():
+    return settings.CATCHUP_BATCH_SIZE if catchup.catching_up else settings.BATCH_SIZE
+
+def window_length():
+    """En catch-up se coalescen ventanas para no emitir muchos resúmenes pequeños"""
+    factor = settings.CATCHUP_WINDOW_FACTOR if catchup.catching_up else 1.0
+    return settings.AGGREGATION_WINDOW * factor
+
+def apply_mode(ch, mode):
+    """Ajusta el prefetch del canal y el tamaño de lote al cambiar de modo"""
+    global backlog_in_window
+    batcher.max_size = batch_size()
+    if mode == CATCHUP:
+        backlog_in_window = True
+        ch.basic_qos(prefetch_count=settings.CATCHUP_PREFETCH_COUNT)
+        print(f" [C] Modo catch-up (lag {catchup.lag:.0f}s, cola {catchup.depth}): "
+              f"lotes de {settings.CATCHUP_BATCH_SIZE}, ventana {window_length():.0f}s")
+    else:
+        ch.basic_qos(prefetch_count=settings.PREFETCH_COUNT)
+        print(f" [C] Backlog recuperado (lag {catchup.lag:.0f}s, cola {catchup.depth}): modo normal")
+
+def process_events(ch, bodies):
+    """Agrega un lote. Si falla, el estado de la ventana queda como estaba (RunWindows.admit)"""
+    # 1. DECODIFICACIÓN (en bloque durante catch-up)
+    if catchup.catching_up:
+        events, errors = bulk_decode(bodies)
+    else:
+        events, errors = [], 0
+        for body in bodies:
+            try:
+                events.append(json.loads(body))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                errors += 1
+    valid = [event for event in events if is_valid_event(event)]
+    errors += len(events) - len(valid)
+    if errors:
+        print(f" [!] Error agregando: {errors} mensajes no son un evento JSON válido")
+
+    # 2. DEDUPLICACIÓN (Idempotencia) por (run_id, event_id), también dentro del mismo lote
+    # 3. PROCESAMIENTO
+    fresh, duplicates = run_windows.admit(valid)
+    for event_id in duplicates:
+        print(f" [d] Duplicado detectado e ignorado: {event_id}")
+
+    # 4. LAG: basta con el último evento del tráfico normal (un replay trae timestamps viejos)
+    live = next((e for e in reversed(valid) if event_run_id(e) == DEFAULT_RUN), None)
+    if live is not None:
+        mode = catchup.observe(lag=event_lag(live))
+        if mode:
+            apply_mode(ch, mode)
+
+batcher = MicroBatcher(process_events, settings.BATCH_SIZE, settings.BATCH_WAIT_MS / 1000.0)
+
+def callback(ch, method, properties, body):
+    if batcher.add(method.delivery_tag, body):
+        process_batch(ch)
+
+def process_batch(ch):
+    """Procesa y confirma el lote pendiente; cierra la ventana si ya pasó su duración"""
+    batcher.flush(ch)
+    # 5. VERIFICAR SI CERRAMOS VENTANA
+    if time.time() - current_window_start >= window_length():
+        flush_window(ch)
 
 def main():
     connection, channel = connect_rabbitmq()
-    channel.basic_qos(prefetch_count=10) # Traer varios mensajes para ser eficiente
-    channel.basic_consume(queue=settings.QUEUE_NAME, on_message_callback=callback)
-    
-    print(' [*] Aggregator corriendo...')
+    channel.basic_qos(prefetch_count=settings.PREFETCH_COUNT)
+    channel.basic_consume(queue=queue_and_binding()[0], on_message_callback=callback)
+
+    print(f' [*] Aggregator corriendo (lotes de {settings.BATCH_SIZE} / {settings.BATCH_WAIT_MS} ms)...')
+    wait = settings.BATCH_WAIT_MS / 1000.0
+    last_depth_poll = 0.0
     try:
-        channel.start_consuming()
+        while True:
+            connection.process_data_events(time_limit=wait)
+            # Lote incompleto que ya esperó BATCH_WAIT_MS
+            if batcher.due():
+                process_batch(channel)
+            # Sin tráfico la ventana también se cierra a tiempo
+            elif not batcher.pending and time.time() - current_window_start >= window_length():
+                flush_window(channel)
+
+            # Profundidad de la cola (consulta pasiva, cada CATCHUP_DEPTH_POLL s)
+            if time.time() - last_depth_poll >= settings.CATCHUP_DEPTH_POLL:
+                last_depth_poll = time.time()
+                depth = channel.queue_declare(queue=queue_and_binding()[0], passive=True).method.message_count
+                mode = catchup.observe(depth=depth)
+                if mode:
+                    apply_mode(channel, mode)
     except KeyboardInterrupt:
-        channel.stop_consuming()
+        process_batch(channel)
         connection.close()
 
 if __name__ == "__main__":
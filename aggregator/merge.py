@@ -0,0 +1,83 @@
+"""
+Etapa de merge para el modo particionado.
+
+Cada shard del Aggregator publica su resultado parcial (SHARD_ROUTING_KEY);
+este proceso los junta cada MERGE_INTERVAL segundos y publica los mensajes
+habituales analytics.window / metrics.daily, de modo que el Dashboard y el
+Audit no notan si hay uno o N aggregators.
+"""
+import json
+import time
+
+import pika
+
+import settings
+from main import AGGREGATION_PLAN, emit_window
+from windows import group_by_run, merge_window_results
+
+
+def connect_rabbitmq():
+    while True:
+        try:
+            params = pika.ConnectionParameters(host=settings.RABBIT_HOST, port=settings.RABBIT_PORT)
+            connection = pika.BlockingConnection(params)
+            channel = connection.channel()
+
+            channel.exchange_declare(exchange=settings.OUTPUT_EXCHANGE, exchange_type='topic', durable=True)
+            channel.queue_declare(queue=settings.MERGE_QUEUE_NAME, durable=True)
+            channel.queue_bind(
+                exchange=settings.OUTPUT_EXCHANGE,
+                queue=settings.MERGE_QUEUE_NAME,
+                routing_key=settings.SHARD_ROUTING_KEY,
+            )
+
+            print(f"[*] Merge conectado. Intervalo de {settings.MERGE_INTERVAL}s")
+            return connection, channel
+        except pika.exceptions.AMQPConnectionError:
+            print("[!] Esperando a RabbitMQ...")
+            time.sleep(5)
+
+
+def main():
+    connection, channel = connect_rabbitmq()
+    channel.basic_qos(prefetch_count=50)
+
+    pending = []          # Resultados parciales recibidos en el intervalo
+    last_tag = None       # Último delivery_tag sin confirmar
+    last_merge = time.time()
+
+    print(' [*] Merge corriendo...')
+    try:
+        # inactivity_timeout permite cerrar el intervalo aunque no lleguen mensajes
+        for method, properties, body in channel.consume(settings.MERGE_QUEUE_NAME, inactivity_timeout=1.0):
+            if method is not None:
+                try:
+                    pending.append(json.loads(body))
+                except json.JSONDecodeError as e:
+                    print(f" [!] Resultado de shard inválido, se descarta: {e}")
+                last_tag = method.delivery_tag
+
+            if time.time() - last_merge < settings.MERGE_INTERVAL:
+                continue
+
+            # Cada corrida (run_id) se combina y emite por separado
+            for run_id, results in group_by_run(pending).items():
+                merged = merge_window_results(results, AGGREGATION_PLAN)
+                emit_window(channel, merged)
+                shards = sorted({p.get("shard_id") for p in results if p.get("shard_id") is not None})
+                print(f" [S] Merge de {len(results)} resultados de {run_id} (shards {shards}): "
+                      f"{merged['total_processed']} eventos.")
+
+            # Confirmamos los parciales solo después de publicar el resultado combinado
+            if last_tag is not None:
+                channel.basic_ack(delivery_tag=last_tag, multiple=True)
+                last_tag = None
+            pending = []
+            last_merge = time.time()
+    except KeyboardInterrupt:
+        channel.cancel()
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
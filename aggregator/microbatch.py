@@ -0,0 +1,74 @@
+"""
+Consumo en micro-lotes con confirmación al final.
+
+El callback de pika solo acumula (delivery_tag, body); el lote se procesa
+al llegar a max_size o cuando el primer mensaje ya esperó max_wait
+segundos, y se confirma con un único basic_ack(multiple=True) sobre el
+último tag: las entregas de un canal se confirman en orden, así que ese tag
+cubre todo el lote.
+
+El ack va solo si el lote se procesó entero. Si process() falla (debe
+dejar el estado como estaba, ver RunWindows.admit) se reprocesa uno a uno
+para aislar el mensaje culpable: los buenos se confirman de a uno y los que
+vuelven a fallar se rechazan con nack sin requeue (un mensaje envenenado
+volvería a fallar en cada reentrega).
+"""
+import time
+
+
+class MicroBatcher:
+
+    def __init__(self, process, max_size, max_wait, clock=time.monotonic):
+        self.process = process      # process(channel, bodies): procesa el lote completo o lanza una excepción
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.clock = clock
+        self.pending = []           # [(delivery_tag, body)] del lote en curso
+        self.pending_since = None   # Momento en que llegó el primer mensaje del lote
+        self.batches = 0
+        self.fallbacks = 0
+        self.rejected = 0
+
+    def add(self, delivery_tag, body):
+        """Acumula una entrega. Devuelve True si el lote ya llegó a max_size."""
+        if not self.pending:
+            self.pending_since = self.clock()
+        self.pending.append((delivery_tag, body))
+        return len(self.pending) >= self.max_size
+
+    def due(self):
+        """Hay un lote incompleto que ya esperó max_wait."""
+        return bool(self.pending) and self.clock() - self.pending_since >= self.max_wait
+
+    def flush(self, channel):
+        """Procesa y confirma el lote pendiente. Devuelve (confirmados, rechazados)."""
+        if not self.pending:
+            return 0, 0
+        batch = self.pending
+        self.pending = []
+        self.pending_since = None
+        self.batches += 1
+
+        try:
+            self.process(channel, [body for _, body in batch])
+        except Exception as e:
+            print(f" [!] Error agregando lote de {len(batch)}: {e}. Reprocesando uno a uno")
+            self.fallbacks += 1
+            return self._one_at_a_time(channel, batch)
+        channel.basic_ack(delivery_tag=batch[-1][0], multiple=True)
+        return len(batch), 0
+
+    def _one_at_a_time(self, channel, batch):
+        acked = rejected = 0
+        for delivery_tag, body in batch:
+            try:
+                self.process(channel, [body])
+            except Exception as e:
+                print(f" [!] Mensaje descartado (tag {delivery_tag}): {e}")
+                channel.basic_nack(delivery_tag=delivery_tag, requeue=False)
+                rejected += 1
+            else:
+                channel.basic_ack(delivery_tag=delivery_tag)
+                acked += 1
+        self.rejected += rejected
+        return acked, rejected
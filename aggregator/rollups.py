@@ -0,0 +1,105 @@
+"""
+Roll-ups jerárquicos incrementales: ventana -> hora -> día.
+
+Cada flush de ventana se suma a los acumulados de su hora y de su día,
+con clave (periodo, región, run_id). El metric_id de cada acumulado es
+determinístico (uuid5 de la clave), así que lo que se publica son upserts
+de la misma fila y no filas nuevas por ventana: el almacenamiento aguas
+abajo crece O(días x regiones) y no O(ventanas).
+
+Los acumulados viven en memoria: al reiniciar, el Aggregator vuelve a
+empezar el día desde cero y su revision desde 1. Por eso cada proceso
+publica con su propia `generation` y el Audit guarda el último acumulado de
+cada generación y suma todas (audit/db.py merge_generations): lo contado
+antes del reinicio no se descarta ni se pisa. Lo mismo vale para varios
+shards sin etapa de merge, cada uno con su generación.
+"""
+import secrets
+import uuid
+from datetime import datetime, timedelta
+
+from windows import merge_counts
+
+ROLLUP_NAMESPACE = uuid.UUID("6f2d6a8e-2f0b-4a53-9a4f-3f3a0c1d5e7b")
+
+GRANULARITIES = {
+    # granularidad: (formato del periodo, routing key)
+    "hour": ("%Y-%m-%dT%H", "metrics.hourly"),
+    "day": ("%Y-%m-%d", "metrics.daily"),
+}
+
+
+def rollup_metric_id(granularity, period, region, run_id):
+    return str(uuid.uuid5(ROLLUP_NAMESPACE, f"{granularity}|{period}|{region}|{run_id}"))
+
+
+class RollupStore:
+    """Acumulados en memoria por (granularidad, periodo, región, run_id)."""
+
+    def __init__(self, plan=None, retention_hours=48, generation=None):
+        self.plan = plan
+        # Identifica este arranque: las revisiones solo se comparan dentro de una generación
+        self.generation = generation or secrets.token_hex(6)
+        self.retention = timedelta(hours=retention_hours)
+        self.rollups = {}
+
+    def apply_window(self, window, run_id="default"):
+        """
+        Suma un resultado de ventana a sus roll-ups y devuelve los mensajes
+        actualizados: [(routing_key, metric_msg, event_ids_nuevos), ...].
+        Los event_ids son solo los de esta ventana (la traza crece por delta).
+        """
+        when = datetime.fromtimestamp(window["window_end"])
+        aggregations = window.get("aggregations_by_region", {})
+        updates = []
+
+        for granularity, (fmt, routing_key) in GRANULARITIES.items():
+            period = when.strftime(fmt)
+            for region, region_stats in window["stats_by_region"].items():
+                key = (granularity, period, region, run_id)
+                rollup = self.rollups.get(key)
+                if rollup is None:
+                    rollup = self.rollups[key] = {
+                        "metrics": {}, "aggregations": {}, "revision": 0,
+                        "first_window": window["window_start"], "updated": when,
+                    }
+                merge_counts(rollup["metrics"], region_stats)
+                if self.plan is not None and region in aggregations:
+                    self.plan.merge_wire(rollup["aggregations"], {region: aggregations[region]})
+                rollup["revision"] += 1
+                rollup["last_window"] = window["window_end"]
+                rollup["updated"] = when
+
+                event_ids = window["event_ids_by_region"].get(region, []) if granularity == "day" else []
+                updates.append((routing_key, self._message(key, rollup), event_ids))
+
+        self._prune(when)
+        return updates
+
+    def _message(self, key, rollup):
+        granularity, period, region, run_id = key
+        aggregations = {}
+        if self.plan is not None and rollup["aggregations"]:
+            aggregations = self.plan.finalize_wire(rollup["aggregations"]).get(region, {})
+        msg = {
+            "metric_id": rollup_metric_id(granularity, period, region, run_id),
+            "granularity": granularity,
+            "date": period[:10],
+            "region": region,
+            "run_id": run_id,
+            "generation": self.generation,
+            "revision": rollup["revision"],
+            "window_start_iso": datetime.fromtimestamp(rollup["first_window"]).isoformat(),
+            "window_end_iso": datetime.fromtimestamp(rollup["last_window"]).isoformat(),
+            "metrics": dict(rollup["metrics"]),
+            "aggregations": aggregations,
+        }
+        if granularity == "hour":
+            msg["hour"] = period
+        return msg
+
+    def _prune(self, now):
+        """Descarta acumulados sin actualizar dentro de la retención."""
+        stale = [key for key, rollup in self.rollups.items() if now - rollup["updated"] > self.retention]
+        for key in stale:
+            del self.rollups[key]
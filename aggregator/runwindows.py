@@ -0,0 +1,141 @@
+"""
+Estado de la ventana en curso separado por corrida (run_id).
+
+El tráfico normal es la corrida "default"; el replay etiqueta sus eventos
+con otro run_id (en el cuerpo) y se agregan aparte: recuentos, agregaciones,
+roll-ups y trazas de una corrida no se mezclan con los de la original. La
+deduplicación es por (run_id, event_id): el mismo evento reinyectado cuenta
+una vez en su corrida.
+"""
+from aggregations import WindowAggregations
+from counters import CounterMatrix
+from windows import build_window_result
+
+DEFAULT_RUN = "default"
+
+
+def event_run_id(event):
+    return event.get("run_id") or DEFAULT_RUN
+
+
+def is_valid_event(event):
+    """Un evento que se puede agregar: objeto JSON con ids y claves de texto (o ausentes)."""
+    if not isinstance(event, dict):
+        return False
+    if not all(isinstance(event.get(field), (str, type(None))) for field in ("event_id", "run_id", "region", "source")):
+        return False
+    return isinstance(event.get("payload"), (dict, type(None)))
+
+
+class RunWindow:
+    """Acumulado de una corrida en la ventana en curso."""
+
+    def __init__(self, regions, sources, plan):
+        self.stats = CounterMatrix(regions, sources)
+        self.aggregations = WindowAggregations(plan)
+        self.event_ids_by_region = {}  # { "norte": {"id1", "id2"} }
+        self.processed = 0
+
+    def add(self, events):
+        """
+        Agregación de un lote ya deduplicado (incremento en bloque de la matriz).
+        Las agregaciones del payload van primero: si una falla, los recuentos
+        y la traza de la ventana quedan sin tocar.
+        """
+        for event in events:
+            self.aggregations.update(event.get("region", "unknown"), event.get("source", "unknown"), event)
+        self.stats.add_batch([(e.get("region", "unknown"), e.get("source", "unknown")) for e in events])
+        for event in events:
+            event_id = event.get("event_id")
+            if event_id:
+                self.event_ids_by_region.setdefault(event.get("region", "unknown"), set()).add(event_id)
+        self.processed += len(events)
+
+
+class RunWindows:
+    """Ventana en curso: un RunWindow por corrida con eventos."""
+
+    def __init__(self, regions, sources, plan):
+        self.regions = regions
+        self.sources = sources
+        self.plan = plan
+        self.runs = {}
+        self.seen = set()  # (run_id, event_id) ya contados en la ventana
+
+    def dedup(self, events):
+        """(nuevos, event_ids duplicados), también dentro del mismo lote."""
+        fresh, duplicates = [], []
+        for event in events:
+            key = (event_run_id(event), event.get("event_id"))
+            if key in self.seen:
+                duplicates.append(key[1])
+                continue
+            self.seen.add(key)
+            fresh.append(event)
+        return fresh, duplicates
+
+    def forget(self, events):
+        """Deshace las marcas de dedup de events (lote que no se llegó a sumar)."""
+        self.seen.difference_update((event_run_id(e), e.get("event_id")) for e in events)
+
+    def admit(self, events):
+        """
+        dedup + add de un lote. Si una corrida falla al sumarse se deshacen las
+        marcas de dedup de sus eventos y de las corridas que faltaban, así el
+        lote se puede reprocesar (uno a uno, ver microbatch.py) sin que esos
+        eventos cuenten como duplicados ni se sumen dos veces los que ya entraron.
+        """
+        fresh, duplicates = self.dedup(events)
+        groups = list(self._by_run(fresh).items())
+        for i, (run_id, run_events) in enumerate(groups):
+            try:
+                self._run(run_id).add(run_events)
+            except Exception:
+                self.forget([e for _, pending in groups[i:] for e in pending])
+                raise
+        return fresh, duplicates
+
+    def add(self, events):
+        for run_id, run_events in self._by_run(events).items():
+            self._run(run_id).add(run_events)
+
+    def _by_run(self, events):
+        by_run = {}
+        for event in events:
+            by_run.setdefault(event_run_id(event), []).append(event)
+        return by_run
+
+    def _run(self, run_id):
+        run = self.runs.get(run_id)
+        if run is None:
+            run = self.runs[run_id] = RunWindow(self.regions, self.sources, self.plan)
+        return run
+
+    @property
+    def total_processed(self):
+        return sum(run.processed for run in self.runs.values())
+
+    def is_empty(self):
+        return all(run.stats.is_empty() for run in self.runs.values())
+
+    def results(self, window_start, window_end, shard_id=None, backlog=False):
+        """Un resultado de ventana (windows.build_window_result) por corrida con datos."""
+        return [
+            build_window_result(
+                window_start=window_start,
+                window_end=window_end,
+                total_processed=run.processed,
+                stats_by_region=run.stats.to_dict(),
+                event_ids_by_region=run.event_ids_by_region,
+                aggregations_by_region=run.aggregations.to_wire(),
+                shard_id=shard_id,
+                run_id=run_id,
+                backlog=backlog,
+            )
+            for run_id, run in sorted(self.runs.items())
+            if not run.stats.is_empty()
+        ]
+
+    def reset(self):
+        self.runs = {}
+        self.seen = set()
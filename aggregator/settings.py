@@ -1,3 +1,4 @@
+import json
 import os
 
 # RabbitMQ
@@ -12,4 +13,79 @@ OUTPUT_EXCHANGE = 'analytics_exchange'  # Resultados agregados
 QUEUE_NAME = 'aggregator_queue'
 
 # Configuración de Agregación
-AGGREGATION_WINDOW = float(os.getenv('AGGREGATION_WINDOW', 5.0)) # Segundos
\ No newline at end of file
+AGGREGATION_WINDOW = float(os.getenv('AGGREGATION_WINDOW', 5.0)) # Segundos
+
+# --- Modo particionado (escalado horizontal) ---
+# PARTITIONS = 0 -> un único Aggregator que escucha todo ('#').
+# PARTITIONS = N -> este proceso es el shard SHARD_ID y solo recibe las routing
+# keys "<source>.p<SHARD_ID>" que emite el Validator.
+PARTITIONS = int(os.getenv('PARTITIONS', 0))
+SHARD_ID = int(os.getenv('SHARD_ID', 0))
+
+# Si MERGE_SHARDS está activo, los shards publican su resultado parcial en
+# SHARD_ROUTING_KEY y la etapa merge.py emite analytics.window / metrics.daily.
+MERGE_SHARDS = os.getenv('MERGE_SHARDS', 'false').lower() == 'true'
+SHARD_ROUTING_KEY = 'shard.window'
+MERGE_QUEUE_NAME = 'aggregator_merge_queue'
+MERGE_INTERVAL = float(os.getenv('MERGE_INTERVAL', AGGREGATION_WINDOW))
+
+# Dominios conocidos para la matriz de contadores región x fuente
+# (valores nuevos se internan al vuelo, esto solo pre-reserva las celdas)
+REGIONS = os.getenv('REGIONS', 'norte,sur,centro,este,oeste').split(',')
+SOURCES = ["security.incident", "survey.victimization", "migration.case"]
+
+# Agregaciones sobre el payload (se compilan una vez al arrancar, ver aggregations.py)
+# Se pueden reemplazar con AGGREGATION_SPECS='[{"name": ..., "kind": ...}, ...]'
+DEFAULT_AGGREGATION_SPECS = [
+    {"name": "incidents_by_type_severity", "source": "security.incident", "kind": "count",
+     "by": ["payload.crime_type", "payload.severity"]},
+    {"name": "respondent_age_histogram", "source": "survey.victimization", "kind": "histogram",
+     "field": "payload.respondent_age", "buckets": [18, 30, 45, 60, 75]},
+    {"name": "reported_ratio", "source": "survey.victimization", "kind": "ratio",
+     "field": "payload.reported"},
+    {"name": "cases_by_type_status", "source": "migration.case", "kind": "count",
+     "by": ["payload.case_type", "payload.status"]},
+    # Sketches (memoria acotada por ventana, combinables entre ventanas y shards)
+    {"name": "distinct_correlation_ids", "kind": "distinct", "field": "correlation_id"},
+    {"name": "distinct_survey_ids", "source": "survey.victimization", "kind": "distinct",
+     "field": "payload.survey_id"},
+    {"name": "distinct_origin_countries", "source": "migration.case", "kind": "distinct",
+     "field": "payload.origin_country", "precision": 6},
+    {"name": "respondent_age_quantiles", "source": "survey.victimization", "kind": "quantiles",
+     "field": "payload.respondent_age", "quantiles": [0.5, 0.95]},
+]
+AGGREGATION_SPECS = json.loads(os.getenv('AGGREGATION_SPECS', 'null')) or DEFAULT_AGGREGATION_SPECS
+
+# Traza de metrics.daily: "plain" (lista JSON de event_id) o "compact"
+# (UUIDs binarios con deltas en base64, ver tracecodec.py). Con
+# TRACE_CHUNK_SIZE > 0 la traza se reparte en varios mensajes.
+TRACE_ENCODING = os.getenv('TRACE_ENCODING', 'plain')
+TRACE_CHUNK_SIZE = int(os.getenv('TRACE_CHUNK_SIZE', 0))
+
+# Roll-ups incrementales (hora y día) que se publican como upserts en
+# metrics.hourly / metrics.daily. Se descartan tras ROLLUP_RETENTION_HOURS sin cambios.
+ROLLUP_RETENTION_HOURS = float(os.getenv('ROLLUP_RETENTION_HOURS', 48))
+
+# Detección de anomalías (EWMA por región x fuente) -> alerts.anomaly
+ANOMALY_DETECTION = os.getenv('ANOMALY_DETECTION', 'true').lower() == 'true'
+ANOMALY_ALPHA = float(os.getenv('ANOMALY_ALPHA', 0.1))
+ANOMALY_Z_THRESHOLD = float(os.getenv('ANOMALY_Z_THRESHOLD', 4.0))
+ANOMALY_WARMUP_WINDOWS = int(os.getenv('ANOMALY_WARMUP_WINDOWS', 10))
+ANOMALY_ROUTING_KEY = 'alerts.anomaly'
+
+# Consumo en micro-lotes: se procesan hasta BATCH_SIZE mensajes o lo que haya
+# llegado en BATCH_WAIT_MS, y se confirman juntos con basic_ack(multiple=True)
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', 200))
+BATCH_WAIT_MS = float(os.getenv('BATCH_WAIT_MS', 50))
+PREFETCH_COUNT = int(os.getenv('PREFETCH_COUNT', max(2 * BATCH_SIZE, 10)))
+
+# Modo catch-up (backlog): entra si el lag de los eventos o la profundidad de la
+# cola superan los umbrales de entrada y sale cuando ambos bajan de los de salida.
+CATCHUP_ENTER_LAG = float(os.getenv('CATCHUP_ENTER_LAG', 30.0))      # segundos
+CATCHUP_EXIT_LAG = float(os.getenv('CATCHUP_EXIT_LAG', 5.0))
+CATCHUP_ENTER_DEPTH = int(os.getenv('CATCHUP_ENTER_DEPTH', 5000))    # mensajes en cola
+CATCHUP_EXIT_DEPTH = int(os.getenv('CATCHUP_EXIT_DEPTH', 500))
+CATCHUP_DEPTH_POLL = float(os.getenv('CATCHUP_DEPTH_POLL', 5.0))     # cada cuánto consultar la cola
+CATCHUP_BATCH_SIZE = int(os.getenv('CATCHUP_BATCH_SIZE', 2000))
+CATCHUP_PREFETCH_COUNT = int(os.getenv('CATCHUP_PREFETCH_COUNT', 2 * CATCHUP_BATCH_SIZE))
+CATCHUP_WINDOW_FACTOR = float(os.getenv('CATCHUP_WINDOW_FACTOR', 6.0))  # ventanas más largas
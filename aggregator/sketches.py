@@ -0,0 +1,168 @@
+"""
+Sketches con memoria acotada y combinables (entre ventanas y entre shards).
+
+    HyperLogLog  cardinalidad aproximada (valores distintos)
+    TDigest      cuantiles aproximados (p50, p95, ...)
+
+Ambos se serializan a un dict JSON compacto (to_wire / from_wire) para viajar
+en los resultados de ventana y combinarse en los roll-ups diarios.
+"""
+import base64
+import hashlib
+import math
+import zlib
+
+
+def hash64(value) -> int:
+    digest = hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class HyperLogLog:
+    """HLL clásico con 2^p registros de 1 byte (p=11 -> 2 KB, error ~2.3%)."""
+
+    def __init__(self, p=11, registers=None):
+        if not 4 <= p <= 16:
+            raise ValueError("La precisión de HyperLogLog debe estar entre 4 y 16")
+        self.p = p
+        self.m = 1 << p
+        self.registers = registers if registers is not None else bytearray(self.m)
+
+    def add(self, value):
+        h = hash64(value)
+        idx = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError("No se pueden combinar HLL de distinta precisión")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+    def estimate(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # Corrección de rango bajo (linear counting)
+            return round(m * math.log(m / zeros))
+        return round(raw)
+
+    def to_wire(self):
+        # Los registros de una ventana son mayormente ceros: comprimen muy bien
+        return {"p": self.p, "r": base64.b64encode(zlib.compress(bytes(self.registers))).decode("ascii")}
+
+    @classmethod
+    def from_wire(cls, wire):
+        return cls(wire["p"], bytearray(zlib.decompress(base64.b64decode(wire["r"]))))
+
+
+class TDigest:
+    """
+    t-digest "merging" simplificado: centroides (media, peso) ordenados cuyo
+    tamaño máximo depende del cuantil (más finos en las colas).
+    """
+
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.means = []
+        self.weights = []
+        self.total = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self._buffer = []
+
+    def add(self, value, weight=1):
+        self._buffer.append((float(value), weight))
+        self.total += weight
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if len(self._buffer) >= 5 * self.compression:
+            self._compress()
+
+    def _k(self, q):
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _k_inv(self, k):
+        return (math.sin(2 * math.pi * k / self.compression) + 1) / 2
+
+    def _compress(self):
+        points = sorted(list(zip(self.means, self.weights)) + self._buffer)
+        self._buffer = []
+        if not points:
+            return
+        total = sum(w for _, w in points)
+        means, weights = [], []
+        cur_mean, cur_weight = points[0]
+        cumulative = 0.0
+        q_limit = self._k_inv(self._k(0.0) + 1)
+        for mean, weight in points[1:]:
+            if (cumulative + cur_weight + weight) / total <= q_limit:
+                cur_weight += weight
+                cur_mean += (mean - cur_mean) * weight / cur_weight
+            else:
+                means.append(cur_mean)
+                weights.append(cur_weight)
+                cumulative += cur_weight
+                q_limit = self._k_inv(self._k(cumulative / total) + 1)
+                cur_mean, cur_weight = mean, weight
+        means.append(cur_mean)
+        weights.append(cur_weight)
+        self.means, self.weights = means, weights
+
+    def merge(self, other):
+        other._compress()
+        self._buffer.extend(zip(other.means, other.weights))
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        self._compress()
+        if not self.means:
+            return None
+        if len(self.means) == 1:
+            return self.means[0]
+        target = q * self.total
+        # Centro acumulado de cada centroide, con min/max en los extremos
+        cumulative = 0.0
+        prev_center, prev_mean = 0.0, self.min
+        for mean, weight in zip(self.means, self.weights):
+            center = cumulative + weight / 2
+            if target < center:
+                span = center - prev_center
+                frac = (target - prev_center) / span if span else 0.0
+                return prev_mean + (mean - prev_mean) * frac
+            prev_center, prev_mean = center, mean
+            cumulative += weight
+        span = self.total - prev_center
+        frac = (target - prev_center) / span if span else 1.0
+        return prev_mean + (self.max - prev_mean) * min(frac, 1.0)
+
+    def to_wire(self):
+        self._compress()
+        return {
+            "c": self.compression,
+            "min": self.min if self.means else None,
+            "max": self.max if self.means else None,
+            "m": [round(m, 4) for m in self.means],
+            "w": self.weights,
+        }
+
+    @classmethod
+    def from_wire(cls, wire):
+        digest = cls(wire.get("c", 100))
+        digest.means = list(wire.get("m", []))
+        digest.weights = list(wire.get("w", []))
+        digest.total = sum(digest.weights)
+        if digest.means:
+            digest.min, digest.max = wire["min"], wire["max"]
+        return digest
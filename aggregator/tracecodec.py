@@ -0,0 +1,91 @@
+"""
+Codificación compacta de los input_event_ids de metrics.daily.
+
+Formato "uuid-delta-v1": los UUID se ordenan como enteros de 128 bits; el
+primero se escribe en 16 bytes y los siguientes como deltas de ancho fijo
+(1 byte de cabecera con el ancho, el del delta más grande). Con ids
+aleatorios los deltas ahorran ~log2(n)/8 bytes por id; el resultado va en
+base64. Frente a la lista JSON de strings de 36 chars (~40 bytes por id)
+queda en ~20 bytes por id.
+
+Además los ids pueden repartirse en varios mensajes (chunks) con el mismo
+metric_id; cada chunk lleva "trace_chunk": {"index": i, "count": n}.
+
+OJO: audit/tracecodec.py es una copia de este archivo (cada servicio se
+construye con su propio contexto Docker). Mantener ambos sincronizados.
+"""
+import base64
+import uuid
+
+TRACE_ENCODING = "uuid-delta-v1"
+
+
+def _format_uuid(value):
+    h = "%032x" % value
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def encode_event_ids(event_ids):
+    """Lista de UUIDs -> string base64. None si algún id no es un UUID."""
+    try:
+        values = sorted({uuid.UUID(event_id).int for event_id in event_ids})
+    except (ValueError, AttributeError, TypeError):
+        return None
+    if not values:
+        return ""
+    deltas = [b - a for a, b in zip(values, values[1:])]
+    width = max((d.bit_length() + 7) // 8 for d in deltas) if deltas else 0
+    out = bytes([width]) + values[0].to_bytes(16, "big")
+    out += b"".join(d.to_bytes(width, "big") for d in deltas)
+    return base64.b64encode(out).decode("ascii")
+
+
+def decode_event_ids(packed):
+    data = base64.b64decode(packed)
+    if not data:
+        return []
+    width = data[0]
+    value = int.from_bytes(data[1:17], "big")
+    ids = [_format_uuid(value)]
+    if not width:
+        return ids
+    from_bytes = int.from_bytes
+    for pos in range(17, len(data), width):
+        value += from_bytes(data[pos:pos + width], "big")
+        ids.append(_format_uuid(value))
+    return ids
+
+
+def attach_trace(metric_msg, event_ids, encoding="plain", chunk_size=0):
+    """
+    Genera uno o más mensajes metrics.daily con la traza de event_ids.
+    encoding: "plain" (lista JSON, formato histórico) o "compact".
+    chunk_size: máximo de ids por mensaje (0 = todo en uno).
+    """
+    event_ids = sorted(event_ids)
+    if chunk_size and len(event_ids) > chunk_size:
+        chunks = [event_ids[i:i + chunk_size] for i in range(0, len(event_ids), chunk_size)]
+    else:
+        chunks = [event_ids]
+
+    for index, chunk in enumerate(chunks):
+        msg = dict(metric_msg)
+        packed = encode_event_ids(chunk) if encoding == "compact" else None
+        if packed is not None:
+            msg["trace_encoding"] = TRACE_ENCODING
+            msg["input_event_ids_packed"] = packed
+            msg["input_event_count"] = len(chunk)
+        else:
+            msg["input_event_ids"] = chunk
+        if len(chunks) > 1:
+            msg["trace_chunk"] = {"index": index, "count": len(chunks)}
+        yield msg
+
+
+def trace_event_ids(metric_msg):
+    """Ids de la traza de un mensaje metrics.daily, en cualquiera de los formatos."""
+    if metric_msg.get("trace_encoding") == TRACE_ENCODING:
+        return decode_event_ids(metric_msg["input_event_ids_packed"])
+    if "trace_encoding" in metric_msg:
+        raise ValueError(f"Codificación de traza desconocida: {metric_msg['trace_encoding']}")
+    return metric_msg.get("input_event_ids", [])
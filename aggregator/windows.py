@@ -0,0 +1,77 @@
+"""
+Resultados de ventana en forma serializable (JSON) y su combinación.
+
+Un "resultado de ventana" es lo que un Aggregator (o un shard) acumuló entre
+dos flush. En modo particionado cada shard publica el suyo y la etapa de
+merge los combina antes de emitir analytics.window / metrics.daily.
+Cada resultado es de una sola corrida (run_id, ver runwindows.py).
+"""
+
+
+def build_window_result(window_start, window_end, total_processed, stats_by_region,
+                        event_ids_by_region, aggregations_by_region=None, shard_id=None, run_id="default",
+                        backlog=False):
+    return {
+        "type": "shard_window",
+        "shard_id": shard_id,
+        "run_id": run_id,
+        "window_start": window_start,
+        "window_end": window_end,
+        "total_processed": total_processed,
+        "stats_by_region": stats_by_region,
+        "event_ids_by_region": {
+            region: sorted(ids) for region, ids in event_ids_by_region.items()
+        },
+        # Estados serializados de aggregations.py (combinables entre shards)
+        "aggregations_by_region": aggregations_by_region or {},
+        # La ventana drenó backlog (modo catch-up): sus tasas no sirven para anomaly.py
+        "backlog": backlog,
+    }
+
+
+def merge_counts(target, counts):
+    """Suma recuentos {clave: n} sobre target (in place)."""
+    for key, value in counts.items():
+        target[key] = target.get(key, 0) + value
+    return target
+
+
+def group_by_run(results):
+    """{run_id: [resultados]} para combinar cada corrida por separado."""
+    groups = {}
+    for result in results:
+        groups.setdefault(result.get("run_id", "default"), []).append(result)
+    return groups
+
+
+def merge_window_results(results, plan=None):
+    """
+    Combina resultados de varios shards (de una misma corrida) en uno solo.
+    Los recuentos se suman y los event_id se unen (cada shard es dueño de sus
+    eventos, así que no hay doble conteo entre shards). Las agregaciones del
+    payload se combinan con el AggregationPlan (si se entrega).
+    """
+    if not results:
+        return None
+
+    stats_by_region = {}
+    event_ids_by_region = {}
+    aggregations_by_region = {}
+    for result in results:
+        if plan is not None:
+            plan.merge_wire(aggregations_by_region, result.get("aggregations_by_region", {}))
+        for region, region_stats in result.get("stats_by_region", {}).items():
+            merge_counts(stats_by_region.setdefault(region, {}), region_stats)
+        for region, ids in result.get("event_ids_by_region", {}).items():
+            event_ids_by_region.setdefault(region, set()).update(ids)
+
+    return build_window_result(
+        window_start=min(r["window_start"] for r in results),
+        window_end=max(r["window_end"] for r in results),
+        total_processed=sum(r.get("total_processed", 0) for r in results),
+        stats_by_region=stats_by_region,
+        event_ids_by_region=event_ids_by_region,
+        aggregations_by_region=aggregations_by_region,
+        run_id=results[0].get("run_id", "default"),
+        backlog=any(r.get("backlog", False) for r in results),
+    )
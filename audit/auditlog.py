@@ -0,0 +1,132 @@
+"""
+Log JSONL del Audit Service con un writer de larga vida.
+
+En vez de abrir el archivo, decodificar y re-serializar cada evento, se
+escriben los bytes crudos del mensaje envueltos en un prefijo fijo:
+
+    {"audit_timestamp":"<iso>","event_content":<body>}\\n
+
+Las líneas se acumulan en memoria y se vuelcan al archivo al superar
+flush_bytes o flush_interval segundos. Política de fsync:
+  - "none":  el SO decide cuándo bajar a disco
+  - "flush": fsync en cada volcado
+  - "batch": sync() vuelca y hace fsync antes de confirmar cada lote
+
+Con segment_bytes / segment_seconds el archivo rota: el segmento lleno se
+renombra y se comprime e indexa en un hilo aparte (ver logsegments.py).
+"""
+import json
+import os
+import threading
+import time
+
+import logsegments
+
+FSYNC_POLICIES = ("none", "flush", "batch")
+
+
+def format_record(body, timestamp):
+    """Línea JSONL para un body JSON ya validado (bytes)."""
+    body = body.strip()
+    if b"\n" in body or b"\r" in body:
+        # JSON con saltos de línea (pretty print): hay que re-serializarlo
+        body = json.dumps(json.loads(body), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return b'{"audit_timestamp":"' + timestamp.encode("ascii") + b'","event_content":' + body + b"}\n"
+
+
+class AuditLogWriter:
+
+    def __init__(self, path, flush_bytes=1 << 20, flush_interval=1.0, fsync="none",
+                 segment_bytes=0, segment_seconds=0, index_every=1000, compress_level=6, seal_async=True):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Política de fsync desconocida: {fsync}")
+        self.path = path
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.index_every = index_every
+        self.compress_level = compress_level
+        self.seal_async = seal_async
+        self.sealers = []
+        self.buffer = []
+        self.buffered = 0
+        self.last_flush = time.monotonic()
+        # Segmentos que quedaron rotados sin sellar en una ejecución anterior
+        logsegments.seal_pending(path, index_every, compress_level)
+        self._open()
+
+    def _open(self):
+        self.file = open(self.path, "ab", buffering=0)
+        self.segment_size = self.file.tell()
+        self.segment_opened = time.monotonic()
+
+    def write(self, body, timestamp):
+        record = format_record(body, timestamp)
+        self.buffer.append(record)
+        self.buffered += len(record)
+        if self.buffered >= self.flush_bytes:
+            self.flush()
+
+    def maybe_flush(self):
+        """Vuelca si pasó flush_interval desde el último volcado."""
+        if self.buffer and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            data = b"".join(self.buffer)
+            self.file.write(data)
+            self.segment_size += len(data)
+            self.buffer = []
+            self.buffered = 0
+            if self.fsync == "flush":
+                os.fsync(self.file.fileno())
+        self.last_flush = time.monotonic()
+        if self._should_rotate():
+            self.rotate()
+
+    def _should_rotate(self):
+        if not self.segment_size:
+            return False
+        if self.segment_bytes and self.segment_size >= self.segment_bytes:
+            return True
+        return bool(self.segment_seconds) and time.monotonic() - self.segment_opened >= self.segment_seconds
+
+    def rotate(self):
+        """Cierra el segmento activo, lo renombra y lo manda a sellar."""
+        if self.fsync != "none":
+            os.fsync(self.file.fileno())
+        self.file.close()
+        seq = logsegments.next_seq(self.path)
+        os.replace(self.path, logsegments.raw_path(self.path, seq))
+        self._open()
+        self._seal(seq)
+
+    def _seal(self, seq):
+        if not self.seal_async:
+            logsegments.seal_segment(self.path, seq, self.index_every, self.compress_level)
+            return
+        self.sealers = [t for t in self.sealers if t.is_alive()]
+        sealer = threading.Thread(target=self._run_sealer, args=(seq,), name="audit-log-sealer", daemon=True)
+        sealer.start()
+        self.sealers.append(sealer)
+
+    def _run_sealer(self, seq):
+        try:
+            logsegments.seal_segment(self.path, seq, self.index_every, self.compress_level)
+        except Exception as e:
+            print(f"[!] Error sellando segmento {seq} del log: {e}")
+
+    def sync(self):
+        """Punto de durabilidad antes de confirmar un lote (solo con fsync="batch")."""
+        if self.fsync == "batch":
+            self.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        for sealer in self.sealers:
+            sealer.join()
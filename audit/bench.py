@@ -0,0 +1,279 @@
+"""
+Micro-benchmarks del Audit Service (no requieren RabbitMQ).
+
+Uso:
+    python bench.py lineage [--events N] [--db PATH]
+    python bench.py payload [--events N] [--batch 500]
+    python bench.py writer [--events N] [--batch 500]
+
+`lineage` arma (o reutiliza) una DB sintética con N eventos, métricas de
+~1000 eventos cada una, y mide las consultas de lineage.py.
+
+`payload` carga N eventos con payloads como los del publisher en una DB con
+payload_json en texto y en otra con AUDIT_PAYLOAD_CODEC=zlib, y compara
+tamaño, velocidad de inserción y de lectura.
+
+`writer` escribe N eventos en lotes con un lector concurrente (como las
+consultas de linaje) con el auto-checkpoint de SQLite y con el scheduler de
+maintenance.py, y compara p50 / p99 / máximo del commit por tramo y el WAL final.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+
+import db
+import lineage
+import payloadcodec
+from maintenance import MaintenanceScheduler
+
+REGIONS = ["norte", "centro", "sur"]
+SOURCES = ["incident.created", "case.updated", "survey.submitted"]
+EVENTS_PER_METRIC = 1000
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def build_lineage_db(path, n_events, seed=42):
+    """Carga n_events eventos (1 por segundo desde 2025-01-01) y su traza."""
+    rng = random.Random(seed)
+    conn = db.init_db(path)
+    base = 1735689600
+    chunk = 50000
+    for offset in range(0, n_events, chunk):
+        rows = []
+        for n in range(offset, min(offset + chunk, n_events)):
+            rows.append((
+                str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(base + n)),
+                rng.choice(REGIONS), rng.choice(SOURCES), "1.0", None,
+                json.dumps({"severity": rng.randint(1, 5)}), "default",
+            ))
+        with conn:
+            db.store_events(conn, rows)
+    with conn:
+        # Cada métrica agrupa EVENTS_PER_METRIC eventos consecutivos
+        conn.execute(
+            """
+            INSERT INTO metrics_out(metric_id, date, region, run_id, metrics_json)
+            SELECT 'm' || (id / ?), '2025-01-01', 'norte', 'default', '{}'
+            FROM events_in WHERE id % ? = 1
+            """,
+            (EVENTS_PER_METRIC, EVENTS_PER_METRIC),
+        )
+        conn.execute(
+            """
+            INSERT INTO trace(metric_rowid, event_rowid)
+            SELECT m.id, e.id FROM events_in e JOIN metrics_out m ON m.metric_id = 'm' || (e.id / ?)
+            """,
+            (EVENTS_PER_METRIC,),
+        )
+    conn.close()
+
+
+def bench_lineage(args):
+    path = args.db or os.path.join(tempfile.mkdtemp(), "audit_bench.db")
+    if not os.path.exists(path):
+        print(f"Creando DB sintética con {args.events} eventos en {path} ...")
+        elapsed, _ = timed(build_lineage_db, path, args.events)
+        print(f"  carga: {elapsed:.1f} s, {os.path.getsize(path) / 1e6:.0f} MB")
+
+    pool = lineage.ReadOnlyPool(path, size=1)
+    with pool.connection() as conn:
+        n_events = conn.execute("SELECT max(id) FROM events_in").fetchone()[0]
+        n_metrics = conn.execute("SELECT max(id) FROM metrics_out").fetchone()[0]
+        rng = random.Random(1)
+
+        def run(name, fn, repeat=50):
+            times = []
+            for _ in range(repeat):
+                elapsed, _ = timed(fn)
+                times.append(elapsed * 1000)
+            print(f"{name:<42} p50 {statistics.median(times):7.2f} ms   max {max(times):7.2f} ms")
+
+        def metric_id():
+            return conn.execute("SELECT metric_id FROM metrics_out WHERE id = ?",
+                                (rng.randint(1, n_metrics),)).fetchone()[0]
+
+        def event_id():
+            return conn.execute("SELECT event_id FROM events_in WHERE id = ?",
+                                (rng.randint(1, n_events),)).fetchone()[0]
+
+        def deep_metric_page():
+            page = lineage.events_for_metric(conn, metric_id(), 100)
+            for _ in range(5):
+                page = lineage.events_for_metric(conn, metric_id(), 100, page["next"])
+            return page
+
+        def region_page(pages):
+            cursor = None
+            start = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(1735689600 + rng.randint(0, n_events)))
+            for _ in range(pages):
+                cursor = lineage.find_events(conn, "norte", None, start, None, 100, cursor)["next"]
+
+        print(f"DB: {n_events} eventos, {n_metrics} métricas")
+        run("metric -> events (100)", lambda: lineage.events_for_metric(conn, metric_id(), 100))
+        run("metric -> events, 6 páginas", deep_metric_page)
+        run("event -> metrics", lambda: lineage.metrics_for_event(conn, event_id()))
+        run("events por región desde T (100)", lambda: region_page(1))
+        run("events por región desde T, 10 páginas", lambda: region_page(10))
+        run("events por fuente + rango 1h (100)", lambda: lineage.find_events(
+            conn, None, "case.updated", "2025-01-01T10:00:00Z", "2025-01-01T11:00:00Z", 100))
+    pool.close()
+
+
+def synthetic_payload(rng, source):
+    """Payloads con la forma de los que genera el publisher."""
+    if source == "security.incident":
+        return {
+            "crime_type": rng.choice(["theft", "assault", "burglary", "homicide"]),
+            "severity": rng.choice(["low", "medium", "high"]),
+            "location": {"latitude": round(rng.uniform(-55.0, -17.0), 4),
+                         "longitude": round(rng.uniform(-75.0, -66.0), 4)},
+            "reported_by": rng.choice(["citizen", "police", "app"]),
+        }
+    if source == "survey.victimization":
+        return {
+            "survey_id": f"srv-{rng.randint(10000, 99999)}",
+            "respondent_age": rng.randint(18, 90),
+            "victimization_type": rng.choice(["theft", "assault"]),
+            "incident_date": "2025-01-01",
+            "reported": rng.choice([True, False]),
+        }
+    return {
+        "case_id": f"mig-{rng.randint(10000, 99999)}",
+        "case_type": rng.choice(["asylum", "visa", "residence"]),
+        "status": rng.choice(["pending", "approved", "rejected"]),
+        "origin_country": rng.choice(["Venezuela", "Haiti", "Peru", "Colombia"]),
+        "application_date": "2025-01-01",
+    }
+
+
+def bench_payload(args):
+    sources = ["security.incident", "survey.victimization", "migration.case"]
+    rng = random.Random(7)
+    events = [
+        {"event_id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+         "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(1735689600 + n)),
+         "region": rng.choice(REGIONS), "source": source, "schema_version": "1.0",
+         "correlation_id": f"corr-{rng.randint(1000, 9999)}", "payload": synthetic_payload(rng, source)}
+        for n, source in enumerate(rng.choice(sources) for _ in range(args.events))
+    ]
+    rows = [db.event_row(e, "default") for e in events]
+    tmp = tempfile.mkdtemp()
+    results = {}
+    for codec in payloadcodec.CODECS:
+        path = os.path.join(tmp, f"audit_{codec}.db")
+        conn = db.init_db(path)
+        encoder = payloadcodec.PayloadEncoder(conn) if codec == "zlib" else None
+        start = time.perf_counter()
+        for offset in range(0, len(rows), args.batch):
+            with conn:
+                db.store_events(conn, rows[offset:offset + args.batch], encoder)
+            if encoder is not None:
+                encoder.train_pending()
+        insert = time.perf_counter() - start
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        payload_bytes = conn.execute(
+            "SELECT sum(coalesce(length(payload_blob), length(CAST(payload_json AS BLOB)))) FROM events_in"
+        ).fetchone()[0]
+        start = time.perf_counter()
+        conn.execute("SELECT count(json_valid(audit_payload(payload_json, payload_blob))) FROM events_in").fetchone()
+        read = time.perf_counter() - start
+        conn.close()
+        results[codec] = (os.path.getsize(path), payload_bytes, insert, read)
+
+    print(f"{args.events} eventos, lotes de {args.batch}")
+    print(f"{'modo':<6} {'DB':>9} {'payloads':>9} {'B/payload':>9} {'insert ev/s':>12} {'lectura ev/s':>13}")
+    for codec, (size, payload_bytes, insert, read) in results.items():
+        print(f"{codec:<6} {size / 1e6:>7.1f}MB {payload_bytes / 1e6:>7.1f}MB {payload_bytes / args.events:>9.1f}"
+              f" {args.events / insert:>12,.0f} {args.events / read:>13,.0f}")
+    json_size, zlib_size = results["json"][0], results["zlib"][0]
+    print(f"DB con zlib: {100 * zlib_size / json_size:.0f}% del tamaño en texto")
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def bench_writer(args):
+    rng = random.Random(3)
+    tmp = tempfile.mkdtemp()
+    slices = 5
+    for mode in ("autocheckpoint", "scheduler"):
+        path = os.path.join(tmp, f"audit_{mode}.db")
+        conn = db.init_db(path)
+        scheduler = MaintenanceScheduler() if mode == "scheduler" else None
+        stop = threading.Event()
+
+        def reader():
+            # Lector de fondo: fija instantáneas del WAL como lo haría el pool de linaje
+            ro = lineage.ReadOnlyPool(path, size=1)
+            while not stop.is_set():
+                with ro.connection() as c:
+                    c.execute("SELECT count(*) FROM events_in WHERE region = 'norte'").fetchone()
+                time.sleep(0.01)
+            ro.close()
+
+        thread = threading.Thread(target=reader, daemon=True)
+        thread.start()
+        latencies = []
+        for offset in range(0, args.events, args.batch):
+            rows = [db.event_row({"event_id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                                  "timestamp": "2025-01-01T00:00:00Z", "region": rng.choice(REGIONS),
+                                  "source": rng.choice(SOURCES), "payload": synthetic_payload(rng, "x")}, "default")
+                    for _ in range(args.batch)]
+            elapsed, _ = timed(lambda: db.store_events(conn, rows) or conn.commit())
+            latencies.append(elapsed)
+            if scheduler is not None:
+                scheduler.note_write()
+                scheduler.run(conn, path)
+        stop.set()
+        thread.join()
+        wal = os.path.getsize(path + "-wal") if os.path.exists(path + "-wal") else 0
+        conn.close()
+
+        print(f"{mode}: {args.events} eventos en lotes de {args.batch}, WAL final {wal / 1e6:.1f}MB")
+        if scheduler is not None:
+            tasks = scheduler.stats()["tasks"]
+            print("  " + ", ".join(f"{name} x{t['runs']} (máx {t['max_ms']} ms)" for name, t in tasks.items()))
+        step = max(1, len(latencies) // slices)
+        for i in range(0, len(latencies), step):
+            chunk = latencies[i:i + step]
+            print(f"  lotes {i:>5}-{i + len(chunk) - 1:<5} p50 {percentile(chunk, 0.5) * 1000:6.1f} ms"
+                  f"  p99 {percentile(chunk, 0.99) * 1000:6.1f} ms  máx {max(chunk) * 1000:6.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks del Audit Service")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("lineage", help="Consultas de linaje sobre una DB sintética")
+    p.add_argument("--events", type=int, default=1_000_000)
+    p.add_argument("--db", help="Reutilizar (o crear) la DB en esta ruta")
+    p = sub.add_parser("payload", help="Payloads en texto vs comprimidos (tamaño e inserción)")
+    p.add_argument("--events", type=int, default=200_000)
+    p.add_argument("--batch", type=int, default=500)
+    p = sub.add_parser("writer", help="Latencia del commit con auto-checkpoint vs scheduler de mantenimiento")
+    p.add_argument("--events", type=int, default=500_000)
+    p.add_argument("--batch", type=int, default=500)
+    args = parser.parse_args()
+    if args.command == "lineage":
+        bench_lineage(args)
+    elif args.command == "payload":
+        bench_payload(args)
+    elif args.command == "writer":
+        bench_writer(args)
+
+
+if __name__ == "__main__":
+    main()
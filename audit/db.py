@@ -0,0 +1,629 @@
+"""
+Base de datos SQLite del Audit Service: esquema, migraciones y escrituras.
+
+Esquema normalizado (user_version = SCHEMA_VERSION):
+  events_in    id INTEGER PRIMARY KEY (rowid) + UNIQUE(event_id, run_id)
+  metrics_out  id INTEGER PRIMARY KEY (rowid) + metric_id TEXT UNIQUE
+  metrics_hourly  roll-ups por hora (metrics.hourly), sin traza
+  trace        (metric_rowid, event_rowid) enteros, WITHOUT ROWID
+  trace_view   vista con los ids de texto, para consultas a mano
+  trace_external  traza hacia eventos de otro shard (event_id + shard_id)
+  payload_dicts   diccionarios de compresión de payloads (payloadcodec.py)
+
+El payload de un evento va en payload_json (texto) o, con
+AUDIT_PAYLOAD_CODEC=zlib, comprimido en payload_blob; audit_payload(...)
+(registrada en cada conexión) devuelve siempre el JSON.
+
+La traza guarda pares de enteros en vez de dos UUID de 36 chars (más el
+índice de la PK compuesta): ~10 bytes por fila en lugar de ~150.
+
+Las DBs viejas (user_version = 0 con el esquema de ids de texto) se migran
+al abrir. Cada cambio posterior de esquema es una función en MIGRATIONS.
+
+Un mismo evento puede estar una vez por corrida (run_id): el replay lo
+reinyecta con un run_id nuevo y la traza de las métricas de esa corrida
+apunta a esas filas, no a las originales.
+"""
+import json
+import sqlite3
+import uuid
+
+import payloadcodec
+from tracecodec import trace_event_ids
+
+SCHEMA_VERSION = 9
+
+
+def create_schema(conn: sqlite3.Connection) -> None:
+    """
+    Esquema actual (SCHEMA_VERSION) para una DB nueva: el mismo resultado que
+    crear v2 y aplicar todas las migraciones, sin reconstruir events_in dos
+    veces ni hacer VACUUM (importa con shards: cada shard nuevo es una DB).
+    """
+    conn.execute(events_in_ddl("events_in"))
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS metrics_out (
+          id INTEGER PRIMARY KEY,
+          metric_id TEXT NOT NULL UNIQUE,
+          date TEXT NOT NULL,
+          region TEXT NOT NULL,
+          run_id TEXT DEFAULT 'default',
+          metrics_json TEXT NOT NULL,
+          created_at TEXT DEFAULT (datetime('now')),
+          revision INTEGER DEFAULT 0,
+          change_seq INTEGER DEFAULT 0,
+          generations_json TEXT
+        );
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS metrics_by_change ON metrics_out(change_seq)")
+    create_trace_table(conn)
+    create_trace_view(conn)
+    migrate_v3_lineage_indexes(conn)
+    migrate_v5_trace_external(conn)
+    create_payload_dicts(conn)
+    create_metrics_hourly(conn)
+
+
+def create_schema_v2(conn: sqlite3.Connection) -> None:
+    """Esquema v2 (destino de migrate_v2_normalized; lo siguiente lo agregan las migraciones)."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS events_in (
+          id INTEGER PRIMARY KEY,
+          event_id TEXT NOT NULL UNIQUE,
+          timestamp TEXT NOT NULL,
+          region TEXT NOT NULL,
+          source TEXT NOT NULL,
+          schema_version TEXT,
+          correlation_id TEXT,
+          payload_json TEXT NOT NULL,
+          run_id TEXT DEFAULT 'default',
+          inserted_at TEXT DEFAULT (datetime('now'))
+        );
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS metrics_out (
+          id INTEGER PRIMARY KEY,
+          metric_id TEXT NOT NULL UNIQUE,
+          date TEXT NOT NULL,
+          region TEXT NOT NULL,
+          run_id TEXT DEFAULT 'default',
+          metrics_json TEXT NOT NULL,
+          created_at TEXT DEFAULT (datetime('now')),
+          revision INTEGER DEFAULT 0
+        );
+        """
+    )
+    create_trace_table(conn)
+    create_trace_view(conn)
+
+
+def create_trace_table(conn: sqlite3.Connection) -> None:
+    # Sin FOREIGN KEY: los rowids salen de events_in/metrics_out en la misma
+    # transacción (store_metric_and_trace verifica que no falte ninguno), y el
+    # chequeo por fila duplicaba el costo del INSERT masivo.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS trace (
+          metric_rowid INTEGER NOT NULL,
+          event_rowid INTEGER NOT NULL,
+          PRIMARY KEY (metric_rowid, event_rowid)
+        ) WITHOUT ROWID;
+        """
+    )
+
+
+def create_trace_view(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE VIEW IF NOT EXISTS trace_view AS
+        SELECT e.event_id, m.metric_id, 'window_member' AS contribution_type
+        FROM trace t
+        JOIN metrics_out m ON m.id = t.metric_rowid
+        JOIN events_in e ON e.id = t.event_rowid;
+        """
+    )
+
+
+def migrate_v2_normalized(conn: sqlite3.Connection) -> bool:
+    """v1 (ids de texto como PK, trace con PK compuesta de texto) -> v2 normalizado."""
+    # DBs creadas antes de los roll-ups no tienen la columna revision
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(metrics_out)")}
+    revision = "revision" if "revision" in columns else "0"
+
+    for table in ("events_in", "metrics_out", "trace"):
+        conn.execute(f"ALTER TABLE {table} RENAME TO {table}_v1")
+    create_schema_v2(conn)
+    conn.execute(
+        """
+        INSERT INTO events_in
+        (event_id, timestamp, region, source, schema_version, correlation_id, payload_json, run_id, inserted_at)
+        SELECT event_id, timestamp, region, source, schema_version, correlation_id, payload_json, run_id, inserted_at
+        FROM events_in_v1 ORDER BY rowid
+        """
+    )
+    conn.execute(
+        f"""
+        INSERT INTO metrics_out(metric_id, date, region, run_id, metrics_json, created_at, revision)
+        SELECT metric_id, date, region, run_id, metrics_json, created_at, {revision}
+        FROM metrics_out_v1 ORDER BY rowid
+        """
+    )
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO trace(metric_rowid, event_rowid)
+        SELECT m.id, e.id
+        FROM trace_v1 t
+        JOIN metrics_out m ON m.metric_id = t.metric_id
+        JOIN events_in e ON e.event_id = t.event_id
+        """
+    )
+    for table in ("trace", "metrics_out", "events_in"):
+        conn.execute(f"DROP TABLE {table}_v1")
+    return True  # pedir VACUUM: las tablas viejas dejan muchas páginas libres
+
+
+def migrate_v3_lineage_indexes(conn: sqlite3.Connection) -> None:
+    """Índices para las consultas de linaje (lineage.py)."""
+    # metric -> events usa la PK de trace; event -> metrics necesita el índice inverso
+    conn.execute("CREATE INDEX IF NOT EXISTS trace_by_event ON trace(event_rowid, metric_rowid)")
+    # Búsquedas por región/fuente/tiempo paginadas por (timestamp, id): el id
+    # (rowid) va implícito en cada índice, así que el ORDER BY sale del índice
+    conn.execute("CREATE INDEX IF NOT EXISTS events_by_region_time ON events_in(region, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS events_by_source_time ON events_in(source, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS events_by_time ON events_in(timestamp)")
+
+
+def migrate_v4_metric_change_seq(conn: sqlite3.Connection) -> None:
+    """
+    Contador de cambios en metrics_out para la exportación incremental
+    (export.py): las métricas se actualizan por upsert, así que created_at no
+    sirve de watermark y updated_at (resolución de 1 s) perdería cambios.
+    """
+    conn.execute("ALTER TABLE metrics_out ADD COLUMN change_seq INTEGER DEFAULT 0")
+    conn.execute("UPDATE metrics_out SET change_seq = id")
+    conn.execute("CREATE INDEX IF NOT EXISTS metrics_by_change ON metrics_out(change_seq)")
+
+
+def migrate_v5_trace_external(conn: sqlite3.Connection) -> None:
+    """
+    Traza hacia eventos guardados en otro shard (shards.py): una métrica del
+    shard activo puede incluir eventos que llegaron antes de la rotación.
+    Se guarda el event_id de texto y el shard donde vive el evento.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS trace_external (
+          id INTEGER PRIMARY KEY,
+          metric_rowid INTEGER NOT NULL,
+          event_id TEXT NOT NULL,
+          shard_id INTEGER NOT NULL,
+          UNIQUE (metric_rowid, event_id)
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS trace_external_by_event ON trace_external(event_id)")
+
+
+def migrate_v6_payload_blob(conn: sqlite3.Connection) -> bool:
+    """
+    payload_blob para los payloads comprimidos (payloadcodec.py); payload_json
+    pasa a admitir NULL. SQLite no cambia un NOT NULL con ALTER, así que
+    events_in se reconstruye conservando los rowids (la traza los referencia).
+    """
+    conn.execute("DROP VIEW IF EXISTS trace_view")  # si no, el RENAME falla con la vista rota
+    conn.execute(
+        """
+        CREATE TABLE events_in_v6 (
+          id INTEGER PRIMARY KEY,
+          event_id TEXT NOT NULL UNIQUE,
+          timestamp TEXT NOT NULL,
+          region TEXT NOT NULL,
+          source TEXT NOT NULL,
+          schema_version TEXT,
+          correlation_id TEXT,
+          payload_json TEXT,
+          run_id TEXT DEFAULT 'default',
+          inserted_at TEXT DEFAULT (datetime('now')),
+          payload_blob BLOB,
+          CHECK (payload_json IS NOT NULL OR payload_blob IS NOT NULL)
+        )
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO events_in_v6
+        (id, event_id, timestamp, region, source, schema_version, correlation_id, payload_json, run_id, inserted_at)
+        SELECT id, event_id, timestamp, region, source, schema_version, correlation_id, payload_json, run_id, inserted_at
+        FROM events_in ORDER BY id
+        """
+    )
+    conn.execute("DROP TABLE events_in")
+    conn.execute("ALTER TABLE events_in_v6 RENAME TO events_in")
+    migrate_v3_lineage_indexes(conn)
+    create_trace_view(conn)
+    create_payload_dicts(conn)
+    return True  # la tabla vieja deja todas sus páginas libres
+
+
+def create_payload_dicts(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payload_dicts (
+          id INTEGER PRIMARY KEY,
+          source TEXT NOT NULL,
+          dict BLOB NOT NULL,
+          created_at TEXT DEFAULT (datetime('now'))
+        )
+        """
+    )
+
+
+def events_in_ddl(table: str) -> str:
+    """events_in desde v7: payload JSON o comprimido, único por (event_id, run_id)."""
+    return f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+          id INTEGER PRIMARY KEY,
+          event_id TEXT NOT NULL,
+          timestamp TEXT NOT NULL,
+          region TEXT NOT NULL,
+          source TEXT NOT NULL,
+          schema_version TEXT,
+          correlation_id TEXT,
+          payload_json TEXT,
+          run_id TEXT NOT NULL DEFAULT 'default',
+          inserted_at TEXT DEFAULT (datetime('now')),
+          payload_blob BLOB,
+          CHECK (payload_json IS NOT NULL OR payload_blob IS NOT NULL),
+          UNIQUE (event_id, run_id)
+        )
+        """
+
+
+def migrate_v7_event_run_unique(conn: sqlite3.Connection) -> bool:
+    """
+    Unicidad por (event_id, run_id) en vez de event_id: un replay con otro
+    run_id guarda sus propias filas. run_id pasa a NOT NULL (con NULL el
+    UNIQUE no deduplicaría). Se reconstruye events_in conservando los rowids.
+    """
+    conn.execute("DROP VIEW IF EXISTS trace_view")
+    conn.execute(events_in_ddl("events_in_v7"))
+    conn.execute(
+        """
+        INSERT INTO events_in_v7
+        (id, event_id, timestamp, region, source, schema_version, correlation_id, payload_json, run_id,
+         inserted_at, payload_blob)
+        SELECT id, event_id, timestamp, region, source, schema_version, correlation_id, payload_json,
+               coalesce(run_id, 'default'), inserted_at, payload_blob
+        FROM events_in ORDER BY id
+        """
+    )
+    conn.execute("DROP TABLE events_in")
+    conn.execute("ALTER TABLE events_in_v7 RENAME TO events_in")
+    migrate_v3_lineage_indexes(conn)
+    create_trace_view(conn)
+    return True
+
+
+def migrate_v8_incremental_vacuum(conn: sqlite3.Connection) -> bool:
+    """
+    auto_vacuum=INCREMENTAL: las páginas libres quedan marcadas y el
+    mantenimiento (maintenance.py) las devuelve de a poco con
+    incremental_vacuum. El modo se aplica con el VACUUM del final de migrate.
+    """
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    return True
+
+
+def migrate_v9_rollup_generations(conn: sqlite3.Connection) -> None:
+    """
+    Roll-ups por generación (ver merge_generations): generations_json guarda
+    el último acumulado de cada arranque del Aggregator. Y metrics_hourly
+    para los roll-ups por hora, aparte de metrics_out (que exportan y
+    consultan lineage / export como métricas diarias).
+    """
+    conn.execute("ALTER TABLE metrics_out ADD COLUMN generations_json TEXT")
+    create_metrics_hourly(conn)
+
+
+def create_metrics_hourly(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS metrics_hourly (
+          id INTEGER PRIMARY KEY,
+          metric_id TEXT NOT NULL UNIQUE,
+          hour TEXT NOT NULL,
+          date TEXT NOT NULL,
+          region TEXT NOT NULL,
+          run_id TEXT DEFAULT 'default',
+          metrics_json TEXT NOT NULL,
+          created_at TEXT DEFAULT (datetime('now')),
+          revision INTEGER DEFAULT 0,
+          generations_json TEXT
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS metrics_hourly_by_hour ON metrics_hourly(hour, region)")
+
+
+# versión destino -> función que migra desde la versión anterior (si devuelve
+# True se hace VACUUM al terminar)
+MIGRATIONS = {
+    2: migrate_v2_normalized,
+    3: migrate_v3_lineage_indexes,
+    4: migrate_v4_metric_change_seq,
+    5: migrate_v5_trace_external,
+    6: migrate_v6_payload_blob,
+    7: migrate_v7_event_run_unique,
+    8: migrate_v8_incremental_vacuum,
+    9: migrate_v9_rollup_generations,
+}
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Lleva la DB a SCHEMA_VERSION. Una DB nueva se crea directamente con el
+    esquema actual (create_schema), sin migraciones. Devuelve la cantidad de
+    migraciones aplicadas.
+    """
+    version = schema_version(conn)
+    if version == 0:
+        legacy = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'events_in'").fetchone()
+        if legacy:
+            version = 1
+        else:
+            with conn:
+                conn.execute("BEGIN")  # el DDL no abre transacción implícita en sqlite3
+                create_schema(conn)
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            version = SCHEMA_VERSION
+
+    applied = 0
+    vacuum = False
+    # Las FKs se desactivan durante la migración (no se pueden cambiar dentro de una transacción)
+    conn.execute("PRAGMA foreign_keys=OFF;")
+    try:
+        for target in sorted(v for v in MIGRATIONS if v > version):
+            with conn:
+                conn.execute("BEGIN")
+                vacuum = MIGRATIONS[target](conn) or vacuum
+                conn.execute(f"PRAGMA user_version = {target}")
+            print(f"[*] DB de auditoría migrada a la versión {target}")
+            applied += 1
+    finally:
+        conn.execute("PRAGMA foreign_keys=ON;")
+    if vacuum:
+        conn.execute("VACUUM")  # devolver al disco el espacio de las tablas viejas
+    return applied
+
+
+def init_db(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+
+    # auto_vacuum (v8) solo se puede fijar antes de que exista el archivo: el
+    # modo WAL ya lo crea. En una DB existente no hace nada (lo aplica el VACUUM de v8)
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+    # Pragmas: concurrencia y consistencia
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA foreign_keys=ON;")
+    conn.execute("PRAGMA busy_timeout=5000;")  # ms
+
+    migrate(conn)
+    payloadcodec.register(conn)
+    return conn
+
+
+def get_run_id(properties, payload: dict) -> str:
+    headers = getattr(properties, "headers", None) or {}
+    return headers.get("run_id") or payload.get("run_id") or "default"
+
+
+def event_row(event: dict, run_id: str) -> tuple:
+    """Fila de events_in para un evento (valida los campos requeridos)."""
+    if not event.get("event_id") or not event.get("timestamp") or not event.get("region") or not event.get("source"):
+        raise ValueError("Evento inválido: faltan campos requeridos (event_id, timestamp, region, source)")
+
+    return (
+        event.get("event_id"),
+        event.get("timestamp"),
+        event.get("region"),
+        event.get("source"),
+        event.get("schema_version"),
+        event.get("correlation_id"),
+        json.dumps(event.get("payload", {}), ensure_ascii=False),
+        run_id,
+    )
+
+
+def store_events(conn: sqlite3.Connection, rows: list, encoder=None) -> None:
+    """
+    INSERT masivo (executemany) de filas de event_row. El COMMIT lo hace el caller.
+    Con un payloadcodec.PayloadEncoder los payloads se guardan comprimidos.
+    """
+    if encoder is None:
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO events_in
+            (event_id, timestamp, region, source, schema_version, correlation_id, payload_json, run_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+        return
+    conn.executemany(
+        """
+        INSERT OR IGNORE INTO events_in
+        (event_id, timestamp, region, source, schema_version, correlation_id, payload_json, run_id, payload_blob)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        encoder.encode_rows(rows),
+    )
+
+
+def store_event(conn: sqlite3.Connection, event: dict, run_id: str) -> None:
+    """
+    Solo ejecuta INSERT. El COMMIT lo hace el caller.
+    """
+    store_events(conn, [event_row(event, run_id)])
+
+
+def sum_counts(total: dict, counts: dict) -> dict:
+    """Suma recuentos (anidados) de counts en total."""
+    for key, value in counts.items():
+        if isinstance(value, dict):
+            sum_counts(total.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            total[key] = total.get(key, 0) + value
+        else:
+            total[key] = value
+    return total
+
+
+def merge_generations(current, generation: str, revision: int, metrics: dict):
+    """
+    Upsert de un roll-up con generación. Cada arranque del Aggregator es una
+    generación nueva cuyo acumulado y revision empiezan de cero: se guarda el
+    último acumulado de cada generación y la fila es la suma de todas, así
+    que un reinicio a mitad del día no descarta ni pisa lo ya contado.
+
+    current: (revision, metrics_json, generations_json) de la fila. Una fila
+    sin generations_json (anterior a v9, o de un productor sin generación)
+    cuenta como la generación "". Devuelve (generations_json, metrics_json,
+    revision) o None si esa revisión de la generación ya está guardada
+    (redelivery o mensaje fuera de orden). La revision de la fila es la suma
+    de las de cada generación, así que sigue creciendo tras un reinicio.
+    """
+    stored_revision, stored_metrics, stored_generations = current
+    if stored_generations:
+        generations = json.loads(stored_generations)
+    elif stored_revision or stored_metrics != "{}":
+        generations = {"": {"revision": stored_revision, "metrics": json.loads(stored_metrics)}}
+    else:
+        generations = {}  # fila recién creada
+    previous = generations.get(generation)
+    if previous is not None and previous["revision"] >= revision:
+        return None
+    generations[generation] = {"revision": revision, "metrics": metrics}
+    total = {}
+    for entry in generations.values():
+        sum_counts(total, entry["metrics"])
+    return (json.dumps(generations, ensure_ascii=False), json.dumps(total, ensure_ascii=False),
+            sum(entry["revision"] for entry in generations.values()))
+
+
+def upsert_rollup(conn: sqlite3.Connection, table: str, metric_id: str, columns: dict, metric_msg: dict,
+                  track_changes: bool = False, previous_rollup=None) -> None:
+    """
+    Alta o actualización por generación (merge_generations) de una fila de
+    metrics_out / metrics_hourly. Con track_changes la fila toma el siguiente
+    change_seq (solo metrics_out: es el watermark de export.py y tiene índice).
+
+    previous_rollup(table, metric_id) -> (revision, metrics_json,
+    generations_json) o None: con shards, una fila que se crea en el shard
+    activo arranca desde la del shard previo (rotación a mitad del día), así
+    que sigue teniendo el total de todas las generaciones y la revision más alta.
+    """
+    names = ", ".join(columns)
+    created = conn.execute(
+        f"INSERT OR IGNORE INTO {table}(metric_id, {names}, metrics_json, revision) "
+        f"VALUES (?, {', '.join('?' * len(columns))}, '{{}}', 0)",
+        (metric_id, *columns.values()),
+    ).rowcount
+    if created and previous_rollup is not None:
+        previous = previous_rollup(table, metric_id)
+        if previous is not None:
+            conn.execute(f"UPDATE {table} SET revision = ?, metrics_json = ?, generations_json = ? WHERE metric_id = ?",
+                         (*previous, metric_id))
+    current = conn.execute(f"SELECT revision, metrics_json, generations_json FROM {table} WHERE metric_id = ?",
+                           (metric_id,)).fetchone()
+    merged = merge_generations(current, metric_msg.get("generation") or "", metric_msg.get("revision", 0),
+                               metric_msg["metrics"])
+    if merged is None:
+        return
+    assignments = ", ".join(f"{name} = ?" for name in columns)
+    if track_changes:
+        assignments += f", change_seq = (SELECT coalesce(max(change_seq), 0) + 1 FROM {table})"
+    conn.execute(
+        f"UPDATE {table} SET {assignments}, generations_json = ?, metrics_json = ?, revision = ? WHERE metric_id = ?",
+        (*columns.values(), *merged, metric_id),
+    )
+
+
+def store_hourly_metric(conn: sqlite3.Connection, metric_msg: dict, previous_rollup=None) -> None:
+    """Roll-up por hora (metrics.hourly) en metrics_hourly: mismo upsert por generación, sin traza."""
+    upsert_rollup(conn, "metrics_hourly", metric_msg["metric_id"], {
+        "hour": metric_msg["hour"],
+        "date": metric_msg["date"],
+        "region": metric_msg["region"],
+        "run_id": metric_msg.get("run_id", "default"),
+    }, metric_msg, previous_rollup=previous_rollup)
+
+
+def store_metric_and_trace(conn: sqlite3.Connection, metric_msg: dict, resolve_external=None,
+                           previous_rollup=None) -> None:
+    """
+    Inserta metrics_out + trace en UNA sola transacción (caller).
+    Si falta algún evento de la traza se revierte TODO (métrica incluida) con
+    IntegrityError, igual que antes con la FK: el mensaje vuelve a la cola
+    hasta que los eventos estén auditados.
+
+    Los roll-ups del Aggregator reutilizan el metric_id de (fecha, región, run_id):
+    la fila se actualiza (upsert por generación, ver merge_generations) y la
+    traza crece con los eventos de cada ventana. Una revisión ya guardada de
+    la misma generación (redelivery fuera de orden) no pisa la fila.
+    Cada alta o cambio toma el siguiente change_seq (watermark de export.py).
+
+    La traza se resuelve contra los eventos del mismo run_id que la métrica.
+    resolve_external(event_ids, run_id) -> {event_id: shard_id} busca en otros
+    shards los eventos que no están en esta DB y previous_rollup la fila de
+    la métrica en un shard previo (ver upsert_rollup y shards.py).
+    """
+    metric_id = metric_msg.get("metric_id") or str(uuid.uuid4())
+    run_id = metric_msg.get("run_id", "default")
+    upsert_rollup(conn, "metrics_out", metric_id, {
+        "date": metric_msg["date"],
+        "region": metric_msg["region"],
+        "run_id": run_id,
+    }, metric_msg, track_changes=True, previous_rollup=previous_rollup)
+
+    # La traza puede venir como lista JSON o codificada (uuid-delta-v1)
+    event_ids = set(trace_event_ids(metric_msg))
+    if not event_ids:
+        return
+    metric_rowid = conn.execute("SELECT id FROM metrics_out WHERE metric_id = ?", (metric_id,)).fetchone()[0]
+
+    # Resolver todos los event_id -> rowid en una sola consulta (json_each)
+    found = dict(
+        conn.execute(
+            """
+            SELECT e.event_id, e.id FROM json_each(?) j
+            JOIN events_in e ON e.event_id = j.value AND e.run_id = ?
+            """,
+            (json.dumps(list(event_ids)), run_id),
+        )
+    )
+    missing = event_ids.difference(found)
+    external = resolve_external(missing, run_id) if missing and resolve_external else {}
+    if len(external) != len(missing):
+        raise sqlite3.IntegrityError(
+            f"FOREIGN KEY constraint failed: faltan {len(missing) - len(external)} eventos de la traza de {metric_id}"
+        )
+
+    conn.execute(
+        "INSERT OR IGNORE INTO trace(metric_rowid, event_rowid) SELECT ?, value FROM json_each(?)",
+        (metric_rowid, json.dumps(list(found.values()))),
+    )
+    if external:
+        conn.executemany(
+            "INSERT OR IGNORE INTO trace_external(metric_rowid, event_id, shard_id) VALUES (?, ?, ?)",
+            [(metric_rowid, event_id, shard_id) for event_id, shard_id in external.items()],
+        )
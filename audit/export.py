@@ -0,0 +1,395 @@
+"""
+Exportación incremental de la DB de auditoría a archivos columnares
+(Parquet o Arrow IPC) para análisis, sin que los analistas lean audit.db.
+
+  events/date=YYYY-MM-DD/region=R/source=S/part-<run>.parquet
+  metrics/date=YYYY-MM-DD/region=R/part-<run>.parquet
+  trace/date=YYYY-MM-DD/part-<run>.parquet       (date = fecha del evento)
+
+- Los campos del payload se aplanan en columnas tipadas (payload_<campo>,
+  los anidados con "_"); lo que no encaja en el esquema del archivo (campo
+  nuevo o tipo distinto) va a payload_extra como JSON.
+- High-watermark por tabla en _watermark.json:
+    events_in:   (inserted_at, id). Solo se exportan eventos con más de
+                 settle segundos, para que sus métricas (y su traza) ya hayan
+                 llegado; la traza se exporta junto con sus eventos.
+    metrics_out: change_seq (las métricas cambian por upsert; cada revisión
+                 nueva se vuelve a exportar, se queda la de mayor revision).
+    trace_external: id (traza hacia eventos de un shard anterior; va a la
+                 partición de la fecha de la métrica).
+  Con shards (shards.py) hay un watermark por shard en "shards"; un shard
+  sellado y exportado entero queda marcado "done" y no se vuelve a abrir.
+- Memoria constante: se lee con fetchmany por bloques y cada bloque se
+  escribe como un row group en el archivo de su partición.
+- Al menos una vez: el watermark se guarda después de cerrar los archivos;
+  si la corrida se corta se repiten filas, no se pierden.
+
+pyarrow es opcional: solo lo necesita este script.
+
+Uso:
+    python export.py [--out DIR] [--format parquet|arrow] [--settle SEGUNDOS] [--shards DIR]
+"""
+import argparse
+import json
+import os
+import time
+
+from lineage import ReadOnlyPool
+from shards import list_shards, open_catalog
+
+WATERMARK_FILE = "_watermark.json"
+
+# Columnas de cada archivo: las claves de partición (date, region, source) no
+# se repiten dentro de los archivos, van en la ruta (convención Hive)
+EVENT_FIELDS = ["event_id", "timestamp", "schema_version", "correlation_id", "run_id", "inserted_at"]
+METRIC_FIELDS = ["metric_id", "run_id", "revision", "created_at"]
+TRACE_FIELDS = ["metric_id", "event_id"]
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise SystemExit("[!] La exportación requiere pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+# --- aplanado y tipos (sin pyarrow) ---
+def flatten(payload, prefix="payload"):
+    """
+    {"a": {"b": 1}} -> {"payload_a_b": 1}. Las listas quedan como valor; los
+    puntos de las claves (p.ej. "incident.created") pasan a "_".
+    """
+    flat = {}
+    for key, value in payload.items():
+        name = f"{prefix}_{key}".replace(".", "_")
+        if isinstance(value, dict) and value:
+            flat.update(flatten(value, name))
+        else:
+            flat[name] = value
+    return flat
+
+
+def value_kind(value):
+    """Tipo de columna para un valor: bool, int, float, string o json (None si es nulo)."""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "float"
+    if isinstance(value, str):
+        return "string"
+    return "json"
+
+
+def infer_kinds(rows):
+    """Tipo de cada columna de payload en un bloque; int+float -> float, otra mezcla -> json."""
+    kinds = {}
+    for row in rows:
+        for name, value in row.items():
+            kind = value_kind(value)
+            if kind is None:
+                kinds.setdefault(name, None)
+                continue
+            current = kinds.get(name)
+            if current is None or current == kind:
+                kinds[name] = kind
+            elif {current, kind} == {"int", "float"}:
+                kinds[name] = "float"
+            else:
+                kinds[name] = "json"
+    return {name: kind or "string" for name, kind in kinds.items()}
+
+
+def fits(value, kind):
+    if value is None:
+        return True
+    actual = value_kind(value)
+    return actual == kind or (kind == "float" and actual == "int") or kind == "json"
+
+
+def split_payload(flat, kinds):
+    """Separa los campos que encajan en el esquema del archivo de los que van a payload_extra."""
+    columns, extra = {}, {}
+    for name, value in flat.items():
+        if name in kinds and fits(value, kinds[name]):
+            columns[name] = json.dumps(value, ensure_ascii=False) if kinds[name] == "json" and value is not None else value
+        else:
+            extra[name] = value
+    return columns, extra
+
+
+def partition_dir(table, **keys):
+    """events/date=2025-01-01/region=norte/... (estilo Hive)."""
+    parts = [table] + [f"{k}={str(v).replace('/', '_')}" for k, v in keys.items()]
+    return os.path.join(*parts)
+
+
+def table_watermark():
+    return {"events_in": {"inserted_at": "", "id": 0}, "metrics_out": {"change_seq": 0}, "trace_external": {"id": 0}}
+
+
+def load_watermark(out_dir):
+    try:
+        with open(os.path.join(out_dir, WATERMARK_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"run": 0, **table_watermark()}
+
+
+def save_watermark(out_dir, watermark):
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(watermark, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+# --- escritura (pyarrow) ---
+class PartitionWriters:
+    """Un archivo abierto por partición durante la corrida; cada bloque es un row group."""
+
+    def __init__(self, pa, out_dir, fmt, run_tag):
+        self.pa = pa
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.run_tag = run_tag
+        self.writers = {}  # dir -> (writer, schema, kinds, tmp_path, final_path)
+        self.rows = 0
+
+    def arrow_type(self, kind):
+        pa = self.pa
+        return {"bool": pa.bool_(), "int": pa.int64(), "float": pa.float64()}.get(kind, pa.string())
+
+    def write(self, directory, base_columns, payload_rows, extra_column="payload_extra"):
+        """
+        base_columns: {nombre: (tipo, valores)}; payload_rows: dicts aplanados
+        (o None si la tabla no tiene payload).
+        """
+        pa = self.pa
+        entry = self.writers.get(directory)
+        if entry is None:
+            kinds = infer_kinds(payload_rows) if payload_rows is not None else {}
+            fields = [pa.field(name, self.arrow_type(kind)) for name, (kind, _) in base_columns.items()]
+            fields += [pa.field(name, self.arrow_type(kind)) for name, kind in sorted(kinds.items())]
+            if payload_rows is not None:
+                fields.append(pa.field(extra_column, pa.string()))
+            schema = pa.schema(fields)
+            entry = self._open(directory, schema, kinds)
+
+        writer, schema, kinds = entry[0], entry[1], entry[2]
+        arrays = [pa.array(values, type=self.arrow_type(kind)) for kind, values in base_columns.values()]
+        if payload_rows is not None:
+            split = [split_payload(row, kinds) for row in payload_rows]
+            for name in sorted(kinds):
+                arrays.append(pa.array([cols.get(name) for cols, _ in split], type=self.arrow_type(kinds[name])))
+            arrays.append(pa.array([json.dumps(extra, ensure_ascii=False) if extra else None for _, extra in split],
+                                   type=pa.string()))
+        table = pa.Table.from_arrays(arrays, schema=schema)
+        if self.fmt == "parquet":
+            writer.write_table(table)
+        else:
+            writer.write(table)
+        self.rows += table.num_rows
+
+    def _open(self, directory, schema, kinds):
+        pa = self.pa
+        ext = "parquet" if self.fmt == "parquet" else "arrow"
+        final_dir = os.path.join(self.out_dir, directory)
+        os.makedirs(final_dir, exist_ok=True)
+        final_path = os.path.join(final_dir, f"part-{self.run_tag}.{ext}")
+        tmp_path = final_path + ".tmp"
+        if self.fmt == "parquet":
+            writer = pa.parquet.ParquetWriter(tmp_path, schema, compression="zstd")
+        else:
+            writer = pa.ipc.new_file(tmp_path, schema)
+        entry = (writer, schema, kinds, tmp_path, final_path)
+        self.writers[directory] = entry
+        return entry
+
+    def close(self):
+        for writer, _, _, tmp_path, final_path in self.writers.values():
+            writer.close()
+            os.replace(tmp_path, final_path)
+        self.writers = {}
+
+
+def group_by(rows, key):
+    groups = {}
+    for row in rows:
+        groups.setdefault(key(row), []).append(row)
+    return groups
+
+
+def export_events(conn, writers, watermark, settle, chunk_rows):
+    """Eventos asentados después del watermark. Devuelve el rango de rowids exportado."""
+    wm = watermark["events_in"]
+    first_id = last_id = wm["id"]
+    cursor = conn.execute(
+        """
+        SELECT id, region, source, event_id, timestamp, schema_version, correlation_id, run_id, inserted_at,
+               audit_payload(payload_json, payload_blob)
+        FROM events_in
+        WHERE id > ? AND inserted_at <= datetime('now', ?)
+        ORDER BY id
+        """,
+        (wm["id"], f"-{int(settle)} seconds"),
+    )
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            break
+        for (date, region, source), group in group_by(rows, lambda r: (r[4][:10], r[1], r[2])).items():
+            columns = {name: ("string", [r[i + 3] for r in group]) for i, name in enumerate(EVENT_FIELDS)}
+            payloads = [flatten(json.loads(r[9])) for r in group]
+            writers.write(partition_dir("events", date=date, region=region, source=source), columns, payloads)
+        last_id = rows[-1][0]
+        wm.update(id=last_id, inserted_at=rows[-1][8])
+    return first_id, last_id
+
+
+def export_trace(conn, writers, first_id, last_id, chunk_rows):
+    """Traza de los eventos exportados en esta corrida (por rango de rowid del evento)."""
+    cursor = conn.execute(
+        """
+        SELECT substr(e.timestamp, 1, 10), m.metric_id, e.event_id
+        FROM trace t
+        JOIN events_in e ON e.id = t.event_rowid
+        JOIN metrics_out m ON m.id = t.metric_rowid
+        WHERE t.event_rowid > ? AND t.event_rowid <= ?
+        ORDER BY t.event_rowid
+        """,
+        (first_id, last_id),
+    )
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            break
+        for date, group in group_by(rows, lambda r: r[0]).items():
+            columns = {name: ("string", [r[i + 1] for r in group]) for i, name in enumerate(TRACE_FIELDS)}
+            writers.write(partition_dir("trace", date=date), columns, None)
+
+
+def export_trace_external(conn, writers, watermark, chunk_rows):
+    """Traza hacia eventos de otro shard, por id (el event_id ya viene en la fila)."""
+    wm = watermark.setdefault("trace_external", {"id": 0})
+    cursor = conn.execute(
+        """
+        SELECT x.id, m.date, m.metric_id, x.event_id
+        FROM trace_external x JOIN metrics_out m ON m.id = x.metric_rowid
+        WHERE x.id > ?
+        ORDER BY x.id
+        """,
+        (wm["id"],),
+    )
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            break
+        for date, group in group_by(rows, lambda r: r[1]).items():
+            columns = {name: ("string", [r[i + 2] for r in group]) for i, name in enumerate(TRACE_FIELDS)}
+            writers.write(partition_dir("trace", date=date), columns, None)
+        wm["id"] = rows[-1][0]
+
+
+def export_metrics(conn, writers, watermark, chunk_rows):
+    wm = watermark["metrics_out"]
+    cursor = conn.execute(
+        """
+        SELECT change_seq, date, region, metric_id, run_id, revision, created_at, metrics_json
+        FROM metrics_out
+        WHERE change_seq > ?
+        ORDER BY change_seq
+        """,
+        (wm["change_seq"],),
+    )
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            break
+        for (date, region), group in group_by(rows, lambda r: (r[1], r[2])).items():
+            columns = {
+                name: ("int" if name == "revision" else "string", [r[i + 3] for r in group])
+                for i, name in enumerate(METRIC_FIELDS)
+            }
+            metrics = [flatten(json.loads(r[7]), prefix="metrics") for r in group]
+            writers.write(partition_dir("metrics", date=date, region=region), columns, metrics, "metrics_extra")
+        wm["change_seq"] = rows[-1][0]
+
+
+def export_database(db_path, writers, watermark, settle, chunk_rows):
+    """
+    Exporta una DB (o un shard) desde su watermark. Devuelve True si no le
+    quedan eventos sin exportar (sirve para dar por terminado un shard sellado).
+    """
+    pool = ReadOnlyPool(db_path, size=1)
+    try:
+        with pool.connection() as conn:
+            # Una sola transacción de lectura: las tablas se ven en el mismo instante
+            conn.execute("BEGIN")
+            first_id, last_id = export_events(conn, writers, watermark, settle, chunk_rows)
+            if last_id > first_id:
+                export_trace(conn, writers, first_id, last_id, chunk_rows)
+            export_trace_external(conn, writers, watermark, chunk_rows)
+            export_metrics(conn, writers, watermark, chunk_rows)
+            pending = conn.execute("SELECT 1 FROM events_in WHERE id > ? LIMIT 1", (last_id,)).fetchone()
+            conn.execute("COMMIT")
+    finally:
+        pool.close()
+    return pending is None
+
+
+def run_export(db_path, out_dir, fmt="parquet", settle=300, chunk_rows=10000, shard_dir=None):
+    """Una corrida incremental (de la DB o de todos los shards). Devuelve la cantidad de filas escritas."""
+    pa = import_pyarrow()
+    os.makedirs(out_dir, exist_ok=True)
+    watermark = load_watermark(out_dir)
+    # Número de corrida en el nombre: dos corridas nunca pisan el mismo archivo
+    watermark["run"] = watermark.get("run", 0) + 1
+    run_tag = f"{watermark['run']:06d}-{time.strftime('%Y%m%dT%H%M%S')}"
+    writers = PartitionWriters(pa, out_dir, fmt, run_tag)
+    if shard_dir is None:
+        export_database(db_path, writers, watermark, settle, chunk_rows)
+    else:
+        catalog = open_catalog(shard_dir, readonly=True)
+        try:
+            shards = list_shards(catalog)
+        finally:
+            catalog.close()
+        for shard in shards:
+            wm = watermark.setdefault("shards", {}).setdefault(str(shard.id), table_watermark())
+            if wm.get("done"):
+                continue
+            exhausted = export_database(shard.path, writers, wm, settle, chunk_rows)
+            # Un shard sellado ya no cambia: exportado entero, no se vuelve a abrir
+            wm["done"] = shard.state == "sealed" and exhausted
+    writers.close()
+    save_watermark(out_dir, watermark)
+    return writers.rows
+
+
+def main(argv=None):
+    import settings
+
+    parser = argparse.ArgumentParser(description="Exportación incremental de la DB de auditoría")
+    parser.add_argument("--db", default=settings.AUDIT_DB_PATH)
+    parser.add_argument("--out", default=settings.EXPORT_DIR)
+    parser.add_argument("--format", choices=["parquet", "arrow"], default=settings.EXPORT_FORMAT)
+    parser.add_argument("--settle", type=int, default=settings.EXPORT_SETTLE_SECONDS,
+                        help="Antigüedad mínima (s) de un evento para exportarlo")
+    parser.add_argument("--chunk-rows", type=int, default=settings.EXPORT_CHUNK_ROWS)
+    parser.add_argument("--shards", default=settings.AUDIT_SHARD_DIR if settings.AUDIT_SHARD_BY != "none" else None,
+                        help="Directorio de shards (shards.py) en vez de --db")
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    rows = run_export(args.db, args.out, args.format, args.settle, args.chunk_rows, args.shards)
+    print(f"[OK] Exportadas {rows} filas a {args.out} en {time.time() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
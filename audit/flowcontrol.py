@@ -0,0 +1,191 @@
+"""
+Control de flujo del writer del Audit Service.
+
+Cada cola (audit_queue / audit_metrics_queue) se consume por su propio canal
+con su propio prefetch, así una ráfaga de eventos no ocupa las entregas sin
+ack de las métricas ni al revés.
+
+- PrefetchController: ajusta el prefetch de una cola después de cada lote
+  (AIMD). Sube de a `step` mientras el commit tarda menos que el objetivo y
+  no hay señales de contención; baja a la mitad si el commit supera el
+  objetivo, si hubo "database is locked" (busy_timeout agotado) o si el WAL
+  pasa de wal_limit (el checkpoint no da abasto). Siempre entre mínimo y máximo.
+- DeliveryQueue: cola acotada por tipo entre los callbacks de pika y el
+  writer; el writer toma primero las métricas y completa el lote con eventos.
+- QueueStats: recibidos, confirmados, reencolados, latencia (recepción ->
+  commit) y throughput por cola, para /stats.
+"""
+import collections
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+
+def wal_size(db_path):
+    """Bytes del -wal de la DB (0 si no existe)."""
+    try:
+        return os.path.getsize(db_path + "-wal")
+    except OSError:
+        return 0
+
+
+# SQLSTATE de Postgres equivalentes: serialización, deadlock, lock no disponible
+PG_BUSY_CODES = {"40001", "40P01", "55P03"}
+
+
+def is_busy(error):
+    """True si la excepción es contención de la DB (lock / busy de SQLite o su par en Postgres)."""
+    if getattr(error, "pgcode", None) in PG_BUSY_CODES:
+        return True
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+class PrefetchController:
+
+    def __init__(self, minimum, maximum, initial=None, step=None, target_seconds=0.2, wal_limit=64 << 20):
+        if not 0 < minimum <= maximum:
+            raise ValueError("se requiere 0 < mínimo <= máximo")
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step or max(1, minimum // 2)
+        self.target_seconds = target_seconds
+        self.wal_limit = wal_limit
+        self.prefetch = min(max(initial or minimum, minimum), maximum)
+        self.reason = "inicio"  # motivo del último cambio (para /stats)
+
+    def observe(self, commit_seconds, busy=False, wal_bytes=0):
+        """Registra un lote y devuelve el nuevo prefetch si cambió (o None)."""
+        if busy:
+            reason = "busy"
+        elif self.wal_limit and wal_bytes > self.wal_limit:
+            reason = "wal"
+        elif commit_seconds > self.target_seconds:
+            reason = "latencia"
+        else:
+            reason = None
+
+        if reason is None:
+            prefetch = min(self.prefetch + self.step, self.maximum)
+        else:
+            prefetch = max(self.prefetch // 2, self.minimum)
+        if prefetch == self.prefetch:
+            return None
+        self.prefetch = prefetch
+        self.reason = reason or "commit rápido"
+        return prefetch
+
+
+class DeliveryQueue:
+    """
+    Como queue.Queue pero con una cola acotada por tipo y prioridad entre
+    tipos (el primero de `kinds` sale antes). Dentro de cada tipo es FIFO,
+    así el ack múltiple por canal sigue cubriendo solo entregas ya escritas.
+    """
+
+    def __init__(self, maxsize, kinds=("metric", "event")):
+        self.maxsize = maxsize
+        self.kinds = kinds
+        self.items = {kind: collections.deque() for kind in kinds}
+        self.cond = threading.Condition()
+
+    def put(self, item):
+        with self.cond:
+            items = self.items[item.kind]
+            while self.maxsize and len(items) >= self.maxsize:
+                self.cond.wait()
+            items.append(item)
+            self.cond.notify_all()
+
+    def get(self, timeout=None):
+        with self.cond:
+            if not self.cond.wait_for(self._ready, timeout):
+                raise queue.Empty
+            return self._pop()
+
+    def get_nowait(self):
+        with self.cond:
+            if not self._ready():
+                raise queue.Empty
+            return self._pop()
+
+    def empty(self):
+        with self.cond:
+            return not self._ready()
+
+    def qsize(self, kind=None):
+        with self.cond:
+            if kind is not None:
+                return len(self.items[kind])
+            return sum(len(items) for items in self.items.values())
+
+    def _ready(self):
+        return any(self.items.values())
+
+    def _pop(self):
+        for kind in self.kinds:
+            if self.items[kind]:
+                item = self.items[kind].popleft()
+                self.cond.notify_all()
+                return item
+        raise queue.Empty
+
+
+class QueueStats:
+    """Contadores de una cola; latencia como media móvil exponencial y throughput en una ventana deslizante."""
+
+    def __init__(self, window=10.0, alpha=0.2):
+        self.window = window
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        self.received = 0
+        self.committed = 0
+        self.requeued = 0
+        self.latency = None       # segundos, media móvil de recepción -> commit
+        self.latency_max = 0.0    # máximo del último lote
+        self.recent = collections.deque()  # (monotonic, confirmados)
+
+    def note_received(self, n=1):
+        with self.lock:
+            self.received += n
+
+    def note_batch(self, latencies, requeued=0, now=None):
+        """latencies: segundos de cada entrega confirmada del lote."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.requeued += requeued
+            if not latencies:
+                return
+            self.committed += len(latencies)
+            mean = sum(latencies) / len(latencies)
+            self.latency = mean if self.latency is None else self.latency + self.alpha * (mean - self.latency)
+            self.latency_max = max(latencies)
+            self.recent.append((now, len(latencies)))
+            self._trim(now)
+
+    def throughput(self, now=None):
+        """Entregas confirmadas por segundo en la última ventana."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self._trim(now)
+            return sum(n for _, n in self.recent) / self.window
+
+    def snapshot(self, now=None):
+        throughput = self.throughput(now)
+        with self.lock:
+            return {
+                "received": self.received,
+                "committed": self.committed,
+                "requeued": self.requeued,
+                "latency_ms": None if self.latency is None else round(self.latency * 1000, 1),
+                "latency_max_ms": round(self.latency_max * 1000, 1),
+                "throughput": round(throughput, 1),
+            }
+
+    def _trim(self, now):
+        while self.recent and self.recent[0][0] < now - self.window:
+            self.recent.popleft()
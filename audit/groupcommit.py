@@ -0,0 +1,34 @@
+"""
+Group commit para el Audit Service.
+
+Las entregas de RabbitMQ se acumulan hasta BATCH_SIZE filas o BATCH_WAIT_MS
+y se escriben en UNA transacción (executemany para eventos). Si el lote
+falla, se bisecta recursivamente hasta aislar la(s) entrega(s) culpable(s):
+el resto se confirma y solo las malas vuelven a la cola, manteniendo la
+semántica al menos una vez sin que un mensaje venenoso bloquee el lote.
+"""
+from collections import namedtuple
+
+# kind: "event" | "metric"; data: mensaje ya decodificado; received: time.monotonic() al llegar
+Delivery = namedtuple("Delivery", "kind delivery_tag routing_key properties body data received", defaults=(None,))
+
+
+def commit_with_bisect(conn, items, write):
+    """
+    Ejecuta write(conn, items) en una transacción. Si falla, divide el lote
+    en mitades y reintenta cada una. Devuelve (ok, failed) donde failed es
+    una lista de (item, excepción).
+    """
+    if not items:
+        return [], []
+    try:
+        with conn:  # COMMIT al salir o ROLLBACK si hay excepción
+            write(conn, items)
+        return list(items), []
+    except Exception as e:
+        if len(items) == 1:
+            return [], [(items[0], e)]
+        mid = len(items) // 2
+        ok_left, failed_left = commit_with_bisect(conn, items[:mid], write)
+        ok_right, failed_right = commit_with_bisect(conn, items[mid:], write)
+        return ok_left + ok_right, failed_left + failed_right
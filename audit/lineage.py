@@ -0,0 +1,549 @@
+"""
+Consultas de linaje sobre la DB de auditoría (solo lectura).
+
+  metric -> events   eventos que aportaron a una métrica
+  event -> metrics   métricas a las que aportó un evento
+  events             eventos por región / fuente / run_id / rango de tiempo
+
+Un evento reinyectado por el replay está una vez por run_id; event ->
+metrics toma la corrida indicada (run_id) o, si no, la primera.
+
+Todas las consultas paginan por keyset (cursor `after` con la última clave
+devuelta) en vez de OFFSET, así la página N cuesta lo mismo que la primera.
+Las conexiones son de solo lectura (`mode=ro`) y salen de un pool propio:
+con WAL los lectores no bloquean al writer del servicio ni al revés.
+
+Uso:
+    python lineage.py metric <metric_id> [--limit N] [--after CURSOR]
+    python lineage.py event <event_id> [--run-id RUN]
+    python lineage.py events [--region R] [--source S] [--run-id RUN] [--start TS] [--end TS]
+    python lineage.py serve [--port 8081]
+    (--db RUTA para una DB, --shards DIR para los shards de shards.py)
+
+HTTP (GET, JSON):
+    /metrics/<metric_id>/events?limit=&after=
+    /events/<event_id>/metrics?run_id=&limit=&after=
+    /events?region=&source=&run_id=&start=&end=&limit=&after=
+    /stats   (dentro del Audit Service: latencia, throughput y prefetch por cola)
+"""
+import argparse
+import heapq
+import itertools
+import json
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import payloadcodec
+from shards import list_shards, open_catalog, shards_for_range
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+EVENT_COLUMNS = ("e.id, e.event_id, e.timestamp, e.region, e.source, e.schema_version, e.correlation_id, e.run_id, "
+                 "audit_payload(e.payload_json, e.payload_blob)")
+METRIC_COLUMNS = "m.id, m.metric_id, m.date, m.region, m.run_id, m.revision, m.metrics_json"
+
+
+class ReadOnlyPool:
+    """Pool de conexiones SQLite de solo lectura, seguro entre hilos."""
+
+    def __init__(self, db_path, size=4):
+        self.db_path = db_path
+        self.connections = queue.Queue()
+        for _ in range(size):
+            self.connections.put(self._connect())
+
+    def _connect(self):
+        conn = sqlite3.connect(f"file:{_uri_path(self.db_path)}?mode=ro", uri=True, check_same_thread=False, timeout=5)
+        conn.execute("PRAGMA query_only=ON;")
+        conn.execute("PRAGMA busy_timeout=5000;")
+        payloadcodec.register(conn)  # payloads comprimidos: se leen como JSON
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self.connections.get()
+        try:
+            yield conn
+        finally:
+            self.connections.put(conn)
+
+    def close(self):
+        while not self.connections.empty():
+            self.connections.get_nowait().close()
+
+
+def _uri_path(path):
+    return path.replace("?", "%3f").replace("#", "%23")
+
+
+def _limit(limit):
+    return max(1, min(int(limit or DEFAULT_LIMIT), MAX_LIMIT))
+
+
+def _event(row):
+    return {
+        "event_id": row[1], "timestamp": row[2], "region": row[3], "source": row[4],
+        "schema_version": row[5], "correlation_id": row[6], "run_id": row[7],
+        "payload": json.loads(row[8]),
+    }
+
+
+def _page(rows, limit, to_item, cursor_of):
+    """Con limit + 1 filas se sabe si hay otra página sin un COUNT."""
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "items": [to_item(row) for row in rows],
+        "next": cursor_of(rows[-1]) if more else None,
+    }
+
+
+def _metric(row):
+    return {"metric_id": row[1], "date": row[2], "region": row[3], "run_id": row[4],
+            "revision": row[5], "metrics": json.loads(row[6])}
+
+
+def _metric_event_rows(conn, metric_rowid, after, limit):
+    return conn.execute(
+        f"""
+        SELECT {EVENT_COLUMNS}
+        FROM trace t JOIN events_in e ON e.id = t.event_rowid
+        WHERE t.metric_rowid = ? AND t.event_rowid > ?
+        ORDER BY t.event_rowid
+        LIMIT ?
+        """,
+        (metric_rowid, after, limit),
+    ).fetchall()
+
+
+def _event_metric_rows(conn, event_rowid, after, limit):
+    return conn.execute(
+        f"""
+        SELECT {METRIC_COLUMNS}
+        FROM trace t JOIN metrics_out m ON m.id = t.metric_rowid
+        WHERE t.event_rowid = ? AND t.metric_rowid > ?
+        ORDER BY t.metric_rowid
+        LIMIT ?
+        """,
+        (event_rowid, after, limit),
+    ).fetchall()
+
+
+def _event_filter(region=None, source=None, start=None, end=None, run_id=None):
+    where, params = [], []
+    if run_id:
+        where.append("e.run_id = ?")
+        params.append(run_id)
+    if region:
+        where.append("e.region = ?")
+        params.append(region)
+    if source:
+        where.append("e.source = ?")
+        params.append(source)
+    if start:
+        where.append("e.timestamp >= ?")
+        params.append(start)
+    if end:
+        where.append("e.timestamp <= ?")
+        params.append(end)
+    return where, params
+
+
+def _find_event_rows(conn, where, params, limit):
+    return conn.execute(
+        f"""
+        SELECT {EVENT_COLUMNS}
+        FROM events_in e
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY e.timestamp, e.id
+        LIMIT ?
+        """,
+        params + [limit],
+    ).fetchall()
+
+
+def events_for_metric(conn, metric_id, limit=DEFAULT_LIMIT, after=None):
+    """Eventos de la traza de una métrica (None si la métrica no existe). Cursor: rowid del evento."""
+    metric = conn.execute("SELECT id FROM metrics_out WHERE metric_id = ?", (metric_id,)).fetchone()
+    if metric is None:
+        return None
+    limit = _limit(limit)
+    rows = _metric_event_rows(conn, metric[0], int(after or 0), limit + 1)
+    return _page(rows, limit, _event, lambda row: str(row[0]))
+
+
+def _find_event(conn, event_id, run_id=None):
+    """(rowid, run_id) del evento en esa corrida; sin run_id, la primera vez que se guardó."""
+    if run_id:
+        return conn.execute("SELECT id, run_id FROM events_in WHERE event_id = ? AND run_id = ?",
+                            (event_id, run_id)).fetchone()
+    return conn.execute("SELECT id, run_id FROM events_in WHERE event_id = ? ORDER BY id LIMIT 1",
+                        (event_id,)).fetchone()
+
+
+def metrics_for_event(conn, event_id, limit=DEFAULT_LIMIT, after=None, run_id=None):
+    """
+    Métricas a las que aportó un evento (None si el evento no existe). Cursor:
+    rowid de la métrica. Un evento reinyectado está una vez por run_id.
+    """
+    event = _find_event(conn, event_id, run_id)
+    if event is None:
+        return None
+    limit = _limit(limit)
+    rows = _event_metric_rows(conn, event[0], int(after or 0), limit + 1)
+    return _page(rows, limit, _metric, lambda row: str(row[0]))
+
+
+def find_events(conn, region=None, source=None, start=None, end=None, limit=DEFAULT_LIMIT, after=None,
+                run_id=None):
+    """
+    Eventos filtrados por región, fuente, run_id y rango [start, end] del
+    timestamp, ordenados por (timestamp, id). Cursor: "<timestamp>|<id>".
+    """
+    where, params = _event_filter(region, source, start, end, run_id)
+    if after:
+        ts, _, rowid = after.rpartition("|")
+        where.append("(e.timestamp, e.id) > (?, ?)")
+        params += [ts, int(rowid)]
+    limit = _limit(limit)
+    rows = _find_event_rows(conn, where, params, limit + 1)
+    return _page(rows, limit, _event, lambda row: f"{row[2]}|{row[0]}")
+
+
+class LineageService:
+    """Consultas sobre una sola DB con un pool de solo lectura."""
+
+    def __init__(self, db_path, pool_size=4):
+        self.pool = ReadOnlyPool(db_path, pool_size)
+
+    def events_for_metric(self, metric_id, limit=DEFAULT_LIMIT, after=None):
+        with self.pool.connection() as conn:
+            return events_for_metric(conn, metric_id, limit, after)
+
+    def metrics_for_event(self, event_id, limit=DEFAULT_LIMIT, after=None, run_id=None):
+        with self.pool.connection() as conn:
+            return metrics_for_event(conn, event_id, limit, after, run_id)
+
+    def find_events(self, region=None, source=None, start=None, end=None, limit=DEFAULT_LIMIT, after=None,
+                    run_id=None):
+        with self.pool.connection() as conn:
+            return find_events(conn, region, source, start, end, limit, after, run_id)
+
+    def close(self):
+        self.pool.close()
+
+
+def _keyed_page(rows, limit, cursor_of):
+    """Como _page, para filas (clave, item) ya armadas de varios shards."""
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "items": [item for _, item in rows],
+        "next": cursor_of(rows[-1][0]) if more else None,
+    }
+
+
+def _shard_cursor(after):
+    """Cursor "<shard>:<tipo>:<n>" de las consultas de traza sobre shards."""
+    if not after:
+        return (0, 0, 0)
+    shard_id, kind, n = after.split(":")
+    return (int(shard_id), int(kind), int(n))
+
+
+class ShardedLineageService:
+    """
+    Consultas sobre los shards de shards.py (mismas respuestas que LineageService).
+
+    - events: solo se abren los shards cuyo rango [min_ts, max_ts] del
+      catálogo se solapa con [start, end]; los resultados de cada shard se
+      mezclan por (timestamp, shard, id). Cursor: "<timestamp>|<shard>|<id>".
+    - metric -> events / event -> metrics: la traza local de cada shard más
+      trace_external (eventos guardados en un shard anterior).
+      Cursor: "<shard>:<0 local | 1 externa>:<id>".
+    """
+
+    def __init__(self, directory, pool_size=2):
+        self.directory = directory
+        self.pool_size = pool_size
+        self.pools = {}  # (shard_id, state) -> ReadOnlyPool; al sellarse se reabre
+        self.lock = threading.Lock()
+
+    def _shards(self):
+        catalog = open_catalog(self.directory, readonly=True)
+        try:
+            return list_shards(catalog)
+        finally:
+            catalog.close()
+
+    @contextmanager
+    def _connection(self, shard):
+        key = (shard.id, shard.state)
+        with self.lock:
+            pool = self.pools.get(key)
+            if pool is None:
+                for stale in [k for k in self.pools if k[0] == shard.id]:
+                    self.pools.pop(stale).close()
+                pool = self.pools[key] = ReadOnlyPool(shard.path, self.pool_size)
+        with pool.connection() as conn:
+            yield conn
+
+    def _external_events(self, refs, shards, run_id):
+        """[(clave, item)] para filas (clave, event_id, shard_id) de trace_external (corrida run_id)."""
+        by_shard = {}
+        for _, event_id, shard_id in refs:
+            by_shard.setdefault(shard_id, []).append(event_id)
+        events = {}
+        for shard_id, event_ids in by_shard.items():
+            if shard_id not in shards:
+                continue
+            with self._connection(shards[shard_id]) as conn:
+                for row in conn.execute(
+                    f"""
+                    SELECT {EVENT_COLUMNS} FROM json_each(?) j
+                    JOIN events_in e ON e.event_id = j.value AND e.run_id = ?
+                    """,
+                    (json.dumps(event_ids), run_id),
+                ):
+                    events[row[1]] = _event(row)
+        return [(key, events[event_id]) for key, event_id, _ in refs if event_id in events]
+
+    def events_for_metric(self, metric_id, limit=DEFAULT_LIMIT, after=None):
+        limit = _limit(limit)
+        cursor = _shard_cursor(after)
+        shards = {s.id: s for s in self._shards()}
+        found, rows = False, []
+        for shard in shards.values():
+            if len(rows) > limit:
+                break
+            with self._connection(shard) as conn:
+                metric = conn.execute("SELECT id, run_id FROM metrics_out WHERE metric_id = ?",
+                                      (metric_id,)).fetchone()
+                if metric is None:
+                    continue
+                found = True
+                if (shard.id, 0) >= cursor[:2]:
+                    start = cursor[2] if (shard.id, 0) == cursor[:2] else 0
+                    rows += [((shard.id, 0, row[0]), _event(row))
+                             for row in _metric_event_rows(conn, metric[0], start, limit + 1 - len(rows))]
+                refs = []
+                if (shard.id, 1) >= cursor[:2] and len(rows) <= limit:
+                    start = cursor[2] if (shard.id, 1) == cursor[:2] else 0
+                    refs = conn.execute(
+                        """
+                        SELECT id, event_id, shard_id FROM trace_external
+                        WHERE metric_rowid = ? AND id > ? ORDER BY id LIMIT ?
+                        """,
+                        (metric[0], start, limit + 1 - len(rows)),
+                    ).fetchall()
+            rows += self._external_events([((shard.id, 1, ref[0]), ref[1], ref[2]) for ref in refs], shards,
+                                          metric[1] or "default")
+        if not found:
+            return None
+        return _keyed_page(rows, limit, lambda key: "%d:%d:%d" % key)
+
+    def metrics_for_event(self, event_id, limit=DEFAULT_LIMIT, after=None, run_id=None):
+        limit = _limit(limit)
+        cursor = _shard_cursor(after)
+        shards = self._shards()
+        home = None
+        # Sin run_id: la primera vez que se guardó (el shard más viejo que lo tenga)
+        for shard in (shards if not run_id else reversed(shards)):
+            with self._connection(shard) as conn:
+                event = _find_event(conn, event_id, run_id)
+            if event is not None:
+                home = (shard, event[0], event[1])
+                break
+        if home is None:
+            return None
+
+        rows = []
+        shard, event_rowid, event_run = home
+        if (shard.id, 0) >= cursor[:2]:
+            start = cursor[2] if (shard.id, 0) == cursor[:2] else 0
+            with self._connection(shard) as conn:
+                rows += [((shard.id, 0, row[0]), _metric(row))
+                         for row in _event_metric_rows(conn, event_rowid, start, limit + 1)]
+        # Métricas de shards posteriores que lo referencian por trace_external
+        for later in shards:
+            if later.id <= shard.id or (later.id, 1) < cursor[:2] or len(rows) > limit:
+                continue
+            start = cursor[2] if (later.id, 1) == cursor[:2] else 0
+            with self._connection(later) as conn:
+                rows += [((later.id, 1, row[0]), _metric(row)) for row in conn.execute(
+                    """
+                    SELECT x.id, m.metric_id, m.date, m.region, m.run_id, m.revision, m.metrics_json
+                    FROM trace_external x JOIN metrics_out m ON m.id = x.metric_rowid
+                    WHERE x.event_id = ? AND m.run_id = ? AND x.id > ?
+                    ORDER BY x.id
+                    LIMIT ?
+                    """,
+                    (event_id, event_run, start, limit + 1 - len(rows)),
+                )]
+        return _keyed_page(rows, limit, lambda key: "%d:%d:%d" % key)
+
+    def find_events(self, region=None, source=None, start=None, end=None, limit=DEFAULT_LIMIT, after=None,
+                    run_id=None):
+        limit = _limit(limit)
+        where, params = _event_filter(region, source, start, end, run_id)
+        if after:
+            ts, shard_id, rowid = after.rsplit("|", 2)
+            shard_id, rowid = int(shard_id), int(rowid)
+        streams = []
+        for shard in shards_for_range(self._shards(), start, end):
+            shard_where, shard_params = list(where), list(params)
+            if after:
+                # Orden global (timestamp, shard, id): el desempate por shard
+                # define si el timestamp del cursor se incluye
+                if shard.id < shard_id:
+                    shard_where.append("e.timestamp > ?")
+                    shard_params.append(ts)
+                elif shard.id > shard_id:
+                    shard_where.append("e.timestamp >= ?")
+                    shard_params.append(ts)
+                else:
+                    shard_where.append("(e.timestamp, e.id) > (?, ?)")
+                    shard_params += [ts, rowid]
+            with self._connection(shard) as conn:
+                rows = _find_event_rows(conn, shard_where, shard_params, limit + 1)
+            streams.append([((row[2], shard.id, row[0]), _event(row)) for row in rows])
+        rows = list(itertools.islice(heapq.merge(*streams, key=lambda r: r[0]), limit + 1))
+        return _keyed_page(rows, limit, lambda key: "%s|%d|%d" % key)
+
+    def close(self):
+        with self.lock:
+            for pool in self.pools.values():
+                pool.close()
+            self.pools.clear()
+
+
+def iter_events(service, region=None, source=None, start=None, end=None, run_id=None, page_size=MAX_LIMIT):
+    """Todos los eventos de find_events (cualquier servicio), página a página en orden de timestamp."""
+    after = None
+    while True:
+        page = service.find_events(region, source, start, end, page_size, after, run_id)
+        yield from page["items"]
+        after = page["next"]
+        if after is None:
+            return
+
+
+def _as_service(source, pool_size):
+    """Acepta la ruta de una DB (compatibilidad), un servicio ya armado o None (solo /stats)."""
+    return LineageService(source, pool_size) if isinstance(source, str) else source
+
+
+# --- HTTP ---
+class LineageHandler(BaseHTTPRequestHandler):
+    service = None  # LineageService o ShardedLineageService, se asigna en make_server
+    stats = None    # callable -> dict para /stats (opcional), se asigna en make_server
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        parts = [unquote(p) for p in url.path.strip("/").split("/") if p]
+        if self.service is None and parts != ["stats"]:
+            return self._send(404, {"error": "linaje no disponible con este backend"})
+        try:
+            if len(parts) == 3 and parts[0] == "metrics" and parts[2] == "events":
+                result = self.service.events_for_metric(parts[1], params.get("limit"), params.get("after"))
+            elif len(parts) == 3 and parts[0] == "events" and parts[2] == "metrics":
+                result = self.service.metrics_for_event(parts[1], params.get("limit"), params.get("after"),
+                                                        params.get("run_id"))
+            elif parts == ["stats"] and self.stats is not None:
+                result = self.stats()
+            elif parts == ["events"]:
+                result = self.service.find_events(
+                    params.get("region"), params.get("source"), params.get("start"), params.get("end"),
+                    params.get("limit"), params.get("after"), params.get("run_id"),
+                )
+            else:
+                return self._send(404, {"error": "ruta desconocida"})
+        except ValueError as e:
+            return self._send(400, {"error": f"parámetro inválido: {e}"})
+        if result is None:
+            return self._send(404, {"error": "no encontrado"})
+        self._send(200, result)
+
+    def _send(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # sin una línea por request en el log del servicio
+
+
+def make_server(source, port, pool_size=4, handler=LineageHandler, stats=None):
+    """source: ruta de la DB o un LineageService / ShardedLineageService; stats: callable para /stats."""
+    attrs = {"service": _as_service(source, pool_size), "stats": staticmethod(stats) if stats else None}
+    handler = type("BoundLineageHandler", (handler,), attrs)
+    return ThreadingHTTPServer(("0.0.0.0", port), handler)
+
+
+def serve_in_background(source, port, pool_size=4, handler=LineageHandler, stats=None):
+    server = make_server(source, port, pool_size, handler, stats)
+    threading.Thread(target=server.serve_forever, name="lineage-http", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Consultas de linaje sobre la DB de auditoría")
+    parser.add_argument("--db", help="Ruta de la DB (por defecto AUDIT_DB_PATH)")
+    parser.add_argument("--shards", help="Directorio de shards (por defecto AUDIT_SHARD_DIR si AUDIT_SHARD_BY != none)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    metric = sub.add_parser("metric", help="Eventos que aportaron a una métrica")
+    metric.add_argument("metric_id")
+    event = sub.add_parser("event", help="Métricas a las que aportó un evento")
+    event.add_argument("event_id")
+    event.add_argument("--run-id")
+    events = sub.add_parser("events", help="Eventos por región / fuente / tiempo")
+    events.add_argument("--region")
+    events.add_argument("--source")
+    events.add_argument("--run-id")
+    events.add_argument("--start")
+    events.add_argument("--end")
+    for p in (metric, event, events):
+        p.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+        p.add_argument("--after")
+    serve = sub.add_parser("serve", help="Servidor HTTP de consultas")
+    serve.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args(argv)
+
+    db_path, shard_dir = args.db, args.shards
+    if db_path is None and shard_dir is None:
+        import settings
+        if settings.AUDIT_SHARD_BY == "none":
+            db_path = settings.AUDIT_DB_PATH
+        else:
+            shard_dir = settings.AUDIT_SHARD_DIR
+    pool_size = 4 if args.command == "serve" else 1
+    service = ShardedLineageService(shard_dir, pool_size) if shard_dir else LineageService(db_path, pool_size)
+
+    if args.command == "serve":
+        print(f"[*] Consultas de linaje en http://0.0.0.0:{args.port}")
+        make_server(service, args.port).serve_forever()
+        return
+
+    if args.command == "metric":
+        result = service.events_for_metric(args.metric_id, args.limit, args.after)
+    elif args.command == "event":
+        result = service.metrics_for_event(args.event_id, args.limit, args.after, args.run_id)
+    else:
+        result = service.find_events(args.region, args.source, args.start, args.end, args.limit, args.after,
+                                     args.run_id)
+    if result is None:
+        raise SystemExit("[!] No encontrado")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""
+Segmentos del log JSONL de auditoría.
+
+El segmento activo es LOG_FILE_PATH (audit_log.jsonl). Al rotar se renombra
+a audit_log.<seq>.jsonl y se sella en segundo plano:
+
+  audit_log.000001.jsonl.gz    bloques de K líneas, cada uno un miembro gzip
+                               (el archivo completo sigue siendo un .gz válido)
+  audit_log.000001.idx.json    rango de tiempos, cantidad de eventos y, por
+                               bloque, offset/largo comprimido y sus rangos
+
+Los tiempos del índice son el audit_timestamp (hora local de escritura) y el
+timestamp del evento (UTC, ...Z); ambos se comparan como strings ISO. Una
+lectura por rango de tiempo de evento solo descomprime los bloques que se
+solapan con el rango. Los límites del rango pueden venir truncados
+(2025-01-01, 2025-01-01T11:00) y se completan a YYYY-MM-DDTHH:MM:SSZ: el
+inicio con ceros y el fin hasta el último segundo que cubre (T11:00:59Z).
+
+Los archivos planos (activo y rotados sin sellar) se leen con mmap en
+ventanas de MAP_WINDOW bytes cortadas en el último salto de línea, y los
+segmentos sellados por bloque gzip: iter_line_blocks entrega listas de
+líneas (split en C) y quien consume no paga un generador por línea.
+
+Uso:
+    python logsegments.py count
+    python logsegments.py stats
+    python logsegments.py cat [--start 2025-01-01T10:00] [--end 2025-01-01T11:00]
+"""
+import argparse
+import glob
+import gzip
+import itertools
+import json
+import mmap
+import os
+import re
+import sys
+
+PREFIX = b'{"audit_timestamp":"'
+MAP_WINDOW = 256 << 10  # por ventana del mmap; medido, ventanas más grandes salen más lentas (caché)
+EVENT_TS_RE = re.compile(rb'"event_content":\s*\{.*?"timestamp":\s*"([^"]*)"')
+SEGMENT_RE = re.compile(r"\.(\d{6})\.(jsonl|jsonl\.gz|idx\.json)$")
+# Relleno de límites truncados (time_bound); el día 31 alcanza para comparar strings
+FULL_START = "0000-01-01T00:00:00"
+FULL_END = "9999-12-31T23:59:59"
+
+
+def _base(log_path):
+    return log_path[:-len(".jsonl")] if log_path.endswith(".jsonl") else log_path
+
+
+def raw_path(log_path, seq):
+    return f"{_base(log_path)}.{seq:06d}.jsonl"
+
+
+def sealed_paths(log_path, seq):
+    """(archivo .gz, índice) del segmento seq."""
+    return f"{_base(log_path)}.{seq:06d}.jsonl.gz", f"{_base(log_path)}.{seq:06d}.idx.json"
+
+
+def list_segments(log_path):
+    """Secuencias de segmentos rotados (sellados o pendientes), en orden."""
+    seqs = set()
+    for path in glob.glob(glob.escape(_base(log_path)) + ".*"):
+        match = SEGMENT_RE.search(path)
+        if match:
+            seqs.add(int(match.group(1)))
+    return sorted(seqs)
+
+
+def next_seq(log_path):
+    segments = list_segments(log_path)
+    return segments[-1] + 1 if segments else 1
+
+
+def is_sealed(log_path, seq):
+    return all(os.path.exists(path) for path in sealed_paths(log_path, seq))
+
+
+def record_times(line):
+    """(audit_timestamp, timestamp del evento) de una línea; None si no se encuentran."""
+    audit_ts = event_ts = None
+    if line.startswith(PREFIX):
+        end = line.find(b'"', len(PREFIX))
+        if end > 0:
+            audit_ts = line[len(PREFIX):end].decode("ascii", "replace")
+    match = EVENT_TS_RE.search(line)
+    if match:
+        event_ts = match.group(1).decode("ascii", "replace")
+    return audit_ts, event_ts
+
+
+def _ranges(lines):
+    audit, events = [], []
+    for line in lines:
+        audit_ts, event_ts = record_times(line)
+        if audit_ts:
+            audit.append(audit_ts)
+        if event_ts:
+            events.append(event_ts)
+    return (
+        min(audit) if audit else None, max(audit) if audit else None,
+        min(events) if events else None, max(events) if events else None,
+    )
+
+
+def seal_segment(log_path, seq, every=1000, level=6):
+    """
+    Comprime el segmento rotado seq en bloques gzip de `every` líneas y
+    escribe su índice. Es idempotente: si se corta a mitad, el segmento
+    crudo sigue ahí y se vuelve a sellar.
+    """
+    src_path = raw_path(log_path, seq)
+    gz_path, idx_path = sealed_paths(log_path, seq)
+    blocks = []
+
+    def write_block(dst, lines):
+        data = b"".join(lines)
+        offset = dst.tell()
+        dst.write(gzip.compress(data, compresslevel=level))
+        audit_start, audit_end, event_start, event_end = _ranges(lines)
+        blocks.append({
+            "offset": offset, "length": dst.tell() - offset, "count": len(lines), "raw_bytes": len(data),
+            "audit_start": audit_start, "audit_end": audit_end,
+            "event_start": event_start, "event_end": event_end,
+        })
+
+    with open(src_path, "rb") as src, open(gz_path + ".tmp", "wb") as dst:
+        lines = []
+        for line in src:
+            if not line.strip():
+                continue
+            lines.append(line if line.endswith(b"\n") else line + b"\n")
+            if len(lines) >= every:
+                write_block(dst, lines)
+                lines = []
+        if lines:
+            write_block(dst, lines)
+
+    def bound(key, pick):
+        values = [b[key] for b in blocks if b[key]]
+        return pick(values) if values else None
+
+    index = {
+        "segment": os.path.basename(gz_path),
+        "seq": seq,
+        "count": sum(b["count"] for b in blocks),
+        "raw_bytes": sum(b["raw_bytes"] for b in blocks),
+        "bytes": sum(b["length"] for b in blocks),
+        "audit_start": bound("audit_start", min),
+        "audit_end": bound("audit_end", max),
+        "event_start": bound("event_start", min),
+        "event_end": bound("event_end", max),
+        "every": every,
+        "blocks": blocks,
+    }
+    os.replace(gz_path + ".tmp", gz_path)
+    with open(idx_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(idx_path + ".tmp", idx_path)
+    os.remove(src_path)
+    return index
+
+
+def seal_pending(log_path, every=1000, level=6):
+    """Sella los segmentos rotados que quedaron sin sellar (p.ej. tras un reinicio)."""
+    for seq in list_segments(log_path):
+        if not os.path.exists(raw_path(log_path, seq)):
+            continue
+        if is_sealed(log_path, seq):
+            os.remove(raw_path(log_path, seq))
+        else:
+            seal_segment(log_path, seq, every, level)
+
+
+def load_index(log_path, seq):
+    with open(sealed_paths(log_path, seq)[1], encoding="utf-8") as f:
+        return json.load(f)
+
+
+def time_bound(value, end=False):
+    """Completa un límite de rango a YYYY-MM-DDTHH:MM:SSZ (el fin, hasta el último segundo que cubre)."""
+    if value is None:
+        return None
+    value = value.rstrip("Z")
+    if len(value) >= len(FULL_START):
+        return value + "Z"
+    fill = FULL_END if end else FULL_START
+    return value + fill[len(value):] + "Z"
+
+
+def _overlaps(first, last, start, end):
+    if first is None or last is None:
+        return True  # sin tiempos conocidos: hay que mirar
+    return (start is None or last >= start) and (end is None or first <= end)
+
+
+def _in_range(line, start, end):
+    if start is None and end is None:
+        return True
+    event_ts = record_times(line)[1]
+    return event_ts is not None and (start is None or event_ts >= start) and (end is None or event_ts <= end)
+
+
+def mapped_blocks(path, window=MAP_WINDOW):
+    """
+    Listas de líneas (bytes, con su salto) de un archivo plano vía mmap. Se
+    mapea el tamaño al abrir: lo que el writer agregue después no se lee.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = 0
+            while pos < size:
+                stop = pos + window
+                if stop >= size:
+                    cut = size
+                else:
+                    # Cortar en el último salto de la ventana (o el primero después, si la línea es enorme)
+                    newline = mm.rfind(b"\n", pos, stop)
+                    if newline < 0:
+                        newline = mm.find(b"\n", stop)
+                    cut = size if newline < 0 else newline + 1
+                yield mm[pos:cut].splitlines(keepends=True)
+                pos = cut
+
+
+def _select(lines, start, end):
+    if start is None and end is None:
+        return [line for line in lines if line.strip()]
+    return [line for line in lines if line.strip() and _in_range(line, start, end)]
+
+
+def _count_plain(path, start, end):
+    return sum(len(_select(lines, start, end)) for lines in mapped_blocks(path))
+
+
+def iter_line_blocks(log_path, start=None, end=None):
+    """
+    Como iter_lines pero en listas de líneas (un bloque gzip o una ventana
+    del mmap por lista), para consumir con itertools.chain sin un yield por línea.
+    """
+    start, end = time_bound(start), time_bound(end, end=True)
+    for seq in list_segments(log_path):
+        if not is_sealed(log_path, seq):
+            for lines in mapped_blocks(raw_path(log_path, seq)):
+                yield _select(lines, start, end)
+            continue
+        index = load_index(log_path, seq)
+        if not _overlaps(index["event_start"], index["event_end"], start, end):
+            continue
+        with open(sealed_paths(log_path, seq)[0], "rb") as f:
+            for block in index["blocks"]:
+                if not _overlaps(block["event_start"], block["event_end"], start, end):
+                    continue
+                f.seek(block["offset"])
+                yield _select(gzip.decompress(f.read(block["length"])).splitlines(keepends=True), start, end)
+    for lines in mapped_blocks(log_path):
+        yield _select(lines, start, end)
+
+
+def iter_lines(log_path, start=None, end=None):
+    """
+    Líneas (bytes) del log en orden de escritura: segmentos sellados,
+    rotados pendientes y por último el activo. start/end filtran por el
+    timestamp del evento (inclusive, ver time_bound); con el índice se saltan
+    segmentos y bloques completos fuera del rango.
+    """
+    return itertools.chain.from_iterable(iter_line_blocks(log_path, start, end))
+
+
+def count_records(log_path):
+    """Eventos registrados: suma de los índices + líneas de lo no sellado."""
+    total = 0
+    for seq in list_segments(log_path):
+        if is_sealed(log_path, seq):
+            total += load_index(log_path, seq)["count"]
+        else:
+            total += _count_plain(raw_path(log_path, seq), None, None)
+    return total + _count_plain(log_path, None, None)
+
+
+def estimate_records(log_path, start=None, end=None):
+    """
+    Cota superior de las líneas que devuelve iter_lines(log_path, start, end)
+    sin descomprimir: bloques del índice que se solapan con el rango + las
+    líneas del rango en lo no sellado. Sin rango coincide con count_records.
+    """
+    if start is None and end is None:
+        return count_records(log_path)
+    start, end = time_bound(start), time_bound(end, end=True)
+    total = 0
+    for seq in list_segments(log_path):
+        if is_sealed(log_path, seq):
+            total += sum(block["count"] for block in load_index(log_path, seq)["blocks"]
+                         if _overlaps(block["event_start"], block["event_end"], start, end))
+        else:
+            total += _count_plain(raw_path(log_path, seq), start, end)
+    return total + _count_plain(log_path, start, end)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Consulta de los segmentos del log de auditoría")
+    parser.add_argument("--log", help="Ruta del segmento activo (por defecto LOG_FILE_PATH)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("count", help="Cantidad de eventos registrados")
+    sub.add_parser("stats", help="Segmentos, tamaños y rangos de tiempo")
+    cat = sub.add_parser("cat", help="Imprime las líneas (opcionalmente por rango de tiempo del evento)")
+    cat.add_argument("--start")
+    cat.add_argument("--end")
+    args = parser.parse_args(argv)
+
+    log_path = args.log
+    if log_path is None:
+        import settings
+        log_path = settings.LOG_FILE_PATH
+
+    if args.command == "count":
+        print(count_records(log_path))
+    elif args.command == "stats":
+        for seq in list_segments(log_path):
+            if is_sealed(log_path, seq):
+                idx = load_index(log_path, seq)
+                ratio = idx["raw_bytes"] / idx["bytes"] if idx["bytes"] else 0
+                print(f"{idx['segment']}: {idx['count']} eventos, {idx['bytes']} B ({ratio:.1f}x), "
+                      f"eventos {idx['event_start']} .. {idx['event_end']}")
+            else:
+                print(f"{os.path.basename(raw_path(log_path, seq))}: pendiente de sellar")
+        if os.path.exists(log_path):
+            print(f"{os.path.basename(log_path)}: activo, {os.path.getsize(log_path)} B")
+    else:
+        out = sys.stdout.buffer
+        for line in iter_lines(log_path, args.start, args.end):
+            out.write(line)
+
+
+if __name__ == "__main__":
+    main()
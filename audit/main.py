@@ -1,13 +1,24 @@
+import collections
+import functools
 import json
 import os
+import queue
 import sqlite3
+import threading
 import time
-import uuid
 from datetime import datetime
 
 import pika
 
 import settings
+from auditlog import AuditLogWriter
+from db import event_row, get_run_id
+from flowcontrol import DeliveryQueue, PrefetchController, QueueStats, is_busy, wal_size
+from groupcommit import Delivery, commit_with_bisect
+from lineage import LineageService, ShardedLineageService, serve_in_background
+from maintenance import MaintenanceScheduler
+from payloadcodec import CODECS
+from storage import open_storage
 
 
 def connect_rabbitmq():
@@ -33,225 +44,335 @@ def connect_rabbitmq():
             # Escuchar TODO lo que entra al exchange principal
             channel.queue_bind(exchange=settings.TARGET_EXCHANGE, queue=settings.QUEUE_NAME, routing_key="#")
 
-            # Escuchar routing key de métricas
-            channel.queue_bind(
-                exchange=settings.METRICS_EXCHANGE,
-                queue=settings.METRICS_QUEUE_NAME,
-                routing_key=settings.METRICS_ROUTING_KEY,
-            )
-
+            # Escuchar routing keys de métricas (roll-ups diarios y por hora)
+            for routing_key in (settings.METRICS_ROUTING_KEY, settings.METRICS_HOURLY_ROUTING_KEY):
+                if routing_key:
+                    channel.queue_bind(
+                        exchange=settings.METRICS_EXCHANGE,
+                        queue=settings.METRICS_QUEUE_NAME,
+                        routing_key=routing_key,
+                    )
+
+            # Un canal por cola: cada una con su propio prefetch (ver flowcontrol.py)
+            channels = {"event": channel, "metric": connection.channel()}
             print(f"[*] Audit Service conectado. Guardando en {settings.LOG_FILE_PATH}")
-            return connection, channel
+            return connection, channels
 
         except pika.exceptions.AMQPConnectionError:
             print("[!] Esperando a RabbitMQ...")
             time.sleep(5)
 
 
-def append_to_log(event_body: bytes) -> None:
-    """Escribe el evento en un archivo (JSON Lines). Best-effort."""
-    try:
-        data = json.loads(event_body)
-
-        audit_entry = {
-            "audit_timestamp": datetime.now().isoformat(),
-            "event_content": data,
-        }
-
-        with open(settings.LOG_FILE_PATH, "a", encoding="utf-8") as f:
-            f.write(json.dumps(audit_entry, ensure_ascii=False) + "\n")
-
-    except Exception as e:
-        # No abortamos la auditoría DB por falla de archivo, pero lo reportamos.
-        print(f"[!] Error escribiendo log en disco: {e}")
-
-
-def init_db(db_path: str) -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
-
-    # Pragmas: concurrencia y consistencia
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute("PRAGMA synchronous=NORMAL;")
-    conn.execute("PRAGMA foreign_keys=ON;")
-    conn.execute("PRAGMA busy_timeout=5000;")  # ms
-
-    # Schema
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS events_in (
-          event_id TEXT PRIMARY KEY,
-          timestamp TEXT NOT NULL,
-          region TEXT NOT NULL,
-          source TEXT NOT NULL,
-          schema_version TEXT,
-          correlation_id TEXT,
-          payload_json TEXT NOT NULL,
-          run_id TEXT DEFAULT 'default',
-          inserted_at TEXT DEFAULT (datetime('now'))
-        );
-        """
-    )
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS metrics_out (
-          metric_id TEXT PRIMARY KEY,
-          date TEXT NOT NULL,
-          region TEXT NOT NULL,
-          run_id TEXT DEFAULT 'default',
-          metrics_json TEXT NOT NULL,
-          created_at TEXT DEFAULT (datetime('now'))
-        );
-        """
-    )
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS trace (
-          event_id TEXT NOT NULL,
-          metric_id TEXT NOT NULL,
-          contribution_type TEXT DEFAULT 'window_member',
-          PRIMARY KEY (event_id, metric_id),
-          FOREIGN KEY (event_id) REFERENCES events_in(event_id),
-          FOREIGN KEY (metric_id) REFERENCES metrics_out(metric_id)
-        );
-        """
-    )
-    conn.commit()
-    return conn
-
-
-def get_run_id(properties, payload: dict) -> str:
-    headers = getattr(properties, "headers", None) or {}
-    return headers.get("run_id") or payload.get("run_id") or "default"
-
-
-def store_event(conn: sqlite3.Connection, event: dict, run_id: str) -> None:
+def write_deliveries(conn, items: list) -> None:
     """
-    Solo ejecuta INSERT. El COMMIT lo hace el caller (transacción en handle_event).
+    Escribe un lote de entregas (sin COMMIT). Primero los eventos, con una
+    única escritura masiva, y después las métricas, cuyas trazas referencian
+    a esos eventos. Con shards, los eventos que ya están en un shard previo
+    no se vuelven a insertar y las trazas pueden apuntar a esos shards.
     """
-    if not event.get("event_id") or not event.get("timestamp") or not event.get("region") or not event.get("source"):
-        raise ValueError("Evento inválido: faltan campos requeridos (event_id, timestamp, region, source)")
-
-    conn.execute(
-        """
-        INSERT OR IGNORE INTO events_in
-        (event_id, timestamp, region, source, schema_version, correlation_id, payload_json, run_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            event.get("event_id"),
-            event.get("timestamp"),
-            event.get("region"),
-            event.get("source"),
-            event.get("schema_version"),
-            event.get("correlation_id"),
-            json.dumps(event.get("payload", {}), ensure_ascii=False),
-            run_id,
-        ),
-    )
-
-
-def store_metric_and_trace(conn: sqlite3.Connection, metric_msg: dict) -> None:
+    storage.store_events(conn, [event_row(d.data, get_run_id(d.properties, d.data))
+                                for d in items if d.kind == "event"])
+    for d in items:
+        if d.kind != "metric":
+            continue
+        if d.data.get("granularity") == "hour":
+            storage.store_hourly_metric(conn, d.data)  # metrics.hourly: sin traza
+        else:
+            storage.store_metric_and_trace(conn, d.data)
+
+
+# --- WRITER THREAD + GROUP COMMIT ---
+# Los callbacks de pika solo encolan la entrega en una cola acotada. Un hilo
+# writer arma lotes (BATCH_SIZE / BATCH_WAIT_MS), escribe el log JSONL y la
+# DB en una sola transacción, y devuelve los ack/nack al hilo de pika con
+# add_callback_threadsafe. Como las entregas no se confirman hasta después
+# del commit, un disco lento frena a RabbitMQ vía prefetch sin bloquear el
+# loop de I/O (heartbeats). El prefetch de cada cola lo ajusta su
+# PrefetchController después de cada lote, y el writer toma las métricas
+# antes que los eventos.
+write_queue = None        # DeliveryQueue acotada por tipo: callbacks de pika -> writer
+audit_log = None          # AuditLogWriter de larga vida
+storage = None            # storage.SQLiteStorage (DB o shards) o pgstorage.PostgresStorage
+
+QUEUES = {"event": settings.QUEUE_NAME, "metric": settings.METRICS_QUEUE_NAME}
+queue_stats = {kind: QueueStats() for kind in QUEUES}
+prefetch = {
+    "event": PrefetchController(
+        settings.PREFETCH_MIN, settings.PREFETCH_MAX, settings.PREFETCH_COUNT,
+        target_seconds=settings.COMMIT_TARGET_MS / 1000.0, wal_limit=settings.WAL_LIMIT_BYTES,
+    ),
+    "metric": PrefetchController(
+        settings.METRICS_PREFETCH_MIN, settings.METRICS_PREFETCH_MAX, settings.METRICS_PREFETCH_COUNT,
+        target_seconds=settings.COMMIT_TARGET_MS / 1000.0, wal_limit=settings.WAL_LIMIT_BYTES,
+    ),
+}
+writer_stats = {"batches": 0, "commit_ms": None, "wal_bytes": 0, "busy": 0}
+commit_times = collections.deque(maxlen=1000)  # segundos de los últimos commits (p50 / p99 en /stats)
+maintenance = None        # MaintenanceScheduler si MAINTENANCE_ENABLED
+
+
+def enqueue(kind: str, ch, method, properties, body: bytes) -> None:
+    queue_stats[kind].note_received()
+    write_queue.put(Delivery(kind, method.delivery_tag, method.routing_key, properties, body, None, time.monotonic()))
+
+
+def write_batch(batch: list):
     """
-    Inserta metrics_out + trace en UNA sola transacción (caller).
-    Si falla un trace por FK, se revierte TODO (métrica incluida).
+    Escribe un lote (log + DB) y devuelve las confirmaciones a aplicar:
+    ({tipo: tag para ack múltiple}, [(tipo, tag) a confirmar], [(tipo, tag)
+    a reencolar]), más los segundos del commit y si hubo contención (busy).
+    Los delivery tags son por canal, de ahí el tipo.
     """
-    metric_id = metric_msg.get("metric_id") or str(uuid.uuid4())
-    date = metric_msg["date"]
-    region = metric_msg["region"]
-    run_id = metric_msg.get("run_id", "default")
-    metrics_json = json.dumps(metric_msg["metrics"], ensure_ascii=False)
-
-    conn.execute(
-        """
-        INSERT OR REPLACE INTO metrics_out(metric_id, date, region, run_id, metrics_json)
-        VALUES (?, ?, ?, ?, ?)
-        """,
-        (metric_id, date, region, run_id, metrics_json),
-    )
-
-    for event_id in metric_msg.get("input_event_ids", []):
-        conn.execute(
-            """
-            INSERT OR IGNORE INTO trace(event_id, metric_id, contribution_type)
-            VALUES (?, ?, 'window_member')
-            """,
-            (event_id, metric_id),
-        )
-
-
-def handle_event(conn: sqlite3.Connection, ch, method, properties, body: bytes):
-    append_to_log(body)
+    # 1. Decodificar: lo que no es JSON se descarta (ack) como antes
+    items, discarded = [], []
+    for d in batch:
+        try:
+            items.append(d._replace(data=json.loads(d.body)))
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            print(f"[!] {'Evento' if d.kind == 'event' else 'Métrica'} no es JSON válido. Se descarta. Error: {e}")
+            discarded.append(d)
 
+    # 2. Log JSONL con los bytes crudos (best-effort, no aborta la DB)
     try:
-        event = json.loads(body)
-        run_id = get_run_id(properties, event)
-
-        with conn:  # transacción atómica
-            store_event(conn, event, run_id)
-
-        print(f" [A] Auditado evento con RK: {method.routing_key}")
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-
-    except json.JSONDecodeError as e:
-        print(f"[!] Evento no es JSON válido. Se descarta. Error: {e}")
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-
-    except (sqlite3.OperationalError, sqlite3.IntegrityError) as e:
-        print(f"[!] Error DB guardando evento (requeue): {e}")
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-
+        timestamp = datetime.now().isoformat()
+        for d in items:
+            if d.kind == "event":
+                audit_log.write(d.body, timestamp)
     except Exception as e:
-        print(f"[!] Error inesperado guardando evento (requeue): {e}")
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-
+        print(f"[!] Error escribiendo log en disco: {e}")
 
-def handle_metric(conn: sqlite3.Connection, ch, method, properties, body: bytes):
+    # 3. Una transacción para todo el lote (bisección si falla)
+    # (con shards, la rotación se hace acá, entre transacciones)
+    conn = storage.connection()
+    # Las métricas llegan primero (prioridad) pero van después de los eventos:
+    # al bisectar, cada mitad lleva los eventos antes que las trazas que los usan
+    items.sort(key=lambda d: d.kind == "metric")
+    started = time.monotonic()
     try:
-        metric_msg = json.loads(body)
+        ok, failed = commit_with_bisect(conn, items, write_deliveries)
+    finally:
+        storage.release(conn)
+    committed = time.monotonic()
+    busy = any(is_busy(e) for _, e in failed)
 
-        with conn:  # métrica + trazas juntas o nada
-            store_metric_and_trace(conn, metric_msg)
-
-        print(f" [M] Métrica auditada con RK: {method.routing_key}")
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-
-    except json.JSONDecodeError as e:
-        print(f"[!] Métrica no es JSON válido. Se descarta. Error: {e}")
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+    try:
+        audit_log.sync()
+    except Exception as e:
+        print(f"[!] Error sincronizando log en disco: {e}")
+
+    n_events = sum(1 for d in ok if d.kind == "event")
+    storage.after_batch(n_events)
+    print(f" [A] Lote auditado: {n_events} eventos, {len(ok) - n_events} métricas, {len(failed)} reintentos")
+    for kind, stats in queue_stats.items():
+        stats.note_batch([committed - d.received for d in ok if d.kind == kind and d.received is not None],
+                         requeued=sum(1 for d, _ in failed if d.kind == kind))
+
+    # 4. Sin fallas, un único ack por canal cubre todas las entregas del lote
+    # (cada tipo sale del DeliveryQueue en orden, así que el último tag es el mayor)
+    if not failed:
+        return {d.kind: d.delivery_tag for d in batch}, [], [], committed - started, busy
+    for d, e in failed:
+        if isinstance(e, storage.Error):
+            print(f"[!] Error DB guardando {d.kind} (requeue): {e}")
+        else:
+            print(f"[!] Error inesperado guardando {d.kind} (requeue): {e}")
+    return ({}, [(d.kind, d.delivery_tag) for d in ok + discarded], [(d.kind, d.delivery_tag) for d, _ in failed],
+            committed - started, busy)
+
+
+def apply_acks(channels, last_tags, ack_tags, nack_tags, prefetch_changes) -> None:
+    """Corre en el hilo de pika (los canales no son thread-safe)."""
+    for kind, tag in last_tags.items():
+        channels[kind].basic_ack(delivery_tag=tag, multiple=True)
+    for kind, tag in ack_tags:
+        channels[kind].basic_ack(delivery_tag=tag)
+    for kind, tag in nack_tags:
+        channels[kind].basic_nack(delivery_tag=tag, requeue=True)
+    for kind, count in prefetch_changes.items():
+        set_prefetch(channels[kind], count)
+
+
+def set_prefetch(ch, count) -> None:
+    # global_qos: límite del canal (un consumidor por canal), que RabbitMQ
+    # reajusta en caliente; el prefetch por consumidor solo vale para consumidores nuevos
+    ch.basic_qos(prefetch_count=count, global_qos=True)
+
+
+def adjust_prefetch(commit_seconds: float, busy: bool) -> dict:
+    """Pasa la medición del lote a los controladores y devuelve {tipo: prefetch nuevo}."""
+    wal_bytes = wal_size(storage.db_path) if storage.db_path else 0
+    writer_stats.update(batches=writer_stats["batches"] + 1, commit_ms=round(commit_seconds * 1000, 1),
+                        wal_bytes=wal_bytes, busy=writer_stats["busy"] + busy)
+    commit_times.append(commit_seconds)
+    if not settings.ADAPTIVE_PREFETCH:
+        return {}
+    changes = {}
+    for kind, controller in prefetch.items():
+        count = controller.observe(commit_seconds, busy, wal_bytes)
+        if count is not None:
+            changes[kind] = count
+            print(f" [F] Prefetch de {QUEUES[kind]}: {count} ({controller.reason})")
+    return changes
+
+
+def stats_snapshot() -> dict:
+    """Latencia y throughput por cola, prefetch actual, writer y mantenimiento (GET /stats)."""
+    queues = {}
+    for kind, name in QUEUES.items():
+        queues[name] = dict(queue_stats[kind].snapshot(), queued=write_queue.qsize(kind),
+                            prefetch=prefetch[kind].prefetch, prefetch_reason=prefetch[kind].reason)
+    times = sorted(commit_times)
+    writer = dict(writer_stats)
+    if times:
+        writer.update(commit_p50_ms=round(times[len(times) // 2] * 1000, 1),
+                      commit_p99_ms=round(times[min(len(times) - 1, int(len(times) * 0.99))] * 1000, 1))
+    result = {"queues": queues, "writer": writer}
+    if maintenance is not None:
+        result["maintenance"] = maintenance.stats()
+    return result
+
+
+def next_batch() -> list:
+    """Espera la primera entrega y junta las que lleguen en BATCH_WAIT_MS."""
+    wait = settings.BATCH_WAIT_MS / 1000.0
+    try:
+        batch = [write_queue.get(timeout=wait)]
+    except queue.Empty:
+        return []
+    deadline = time.monotonic() + wait
+    while len(batch) < settings.BATCH_SIZE:
+        # Vencido el plazo igual se toma lo que ya esté encolado
+        remaining = deadline - time.monotonic()
+        try:
+            batch.append(write_queue.get(timeout=remaining) if remaining > 0 else write_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+def writer_loop(connection, channels, stop: threading.Event) -> None:
+    while not (stop.is_set() and write_queue.empty()):
+        batch = next_batch()
+        if batch:
+            last_tags, ack_tags, nack_tags, commit_seconds, busy = write_batch(batch)
+            changes = adjust_prefetch(commit_seconds, busy)
+            if maintenance is not None:
+                maintenance.note_write()
+            try:
+                connection.add_callback_threadsafe(
+                    functools.partial(apply_acks, channels, last_tags, ack_tags, nack_tags, changes)
+                )
+            except Exception as e:
+                # Conexión cerrada: RabbitMQ reentregará lo no confirmado
+                print(f"[!] No se pudo confirmar el lote: {e}")
+        try:
+            audit_log.maybe_flush()
+        except Exception as e:
+            print(f"[!] Error escribiendo log en disco: {e}")
+        run_maintenance()
 
-    except (sqlite3.OperationalError, sqlite3.IntegrityError) as e:
-        print(f"[!] Error DB guardando métrica/trace (requeue): {e}")
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
 
-    except Exception as e:
-        print(f"[!] Error inesperado guardando métrica (requeue): {e}")
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+def run_maintenance() -> None:
+    """Checkpoints / optimize / vacuum vencidos, entre lotes y en el hilo writer."""
+    if maintenance is None:
+        return
+    try:
+        done = maintenance.run(storage.maintenance_connection(), storage.db_path)
+    except sqlite3.Error as e:
+        print(f"[!] Error en el mantenimiento de la DB: {e}")
+        return
+    for task in done:
+        entry = maintenance.tasks.get(task, {})
+        if task != "passive":
+            print(f" [M] {task}: {entry.get('last_ms')} ms, WAL {maintenance.wal_bytes} bytes")
+
+
+def connect_storage():
+    """Abre el backend de AUDIT_STORAGE; Postgres puede tardar en aceptar conexiones."""
+    while True:
+        try:
+            return open_storage(settings)
+        except Exception as e:
+            if settings.AUDIT_STORAGE != "postgres" or isinstance(e, ValueError):
+                raise
+            print(f"[!] Esperando a Postgres... ({e})")
+            time.sleep(5)
 
 
 def main():
+    global storage, audit_log, write_queue, maintenance
     os.makedirs(os.path.dirname(settings.LOG_FILE_PATH), exist_ok=True)
     os.makedirs(os.path.dirname(settings.AUDIT_DB_PATH), exist_ok=True)
+    if settings.AUDIT_PAYLOAD_CODEC not in CODECS:
+        raise ValueError(f"AUDIT_PAYLOAD_CODEC desconocido: {settings.AUDIT_PAYLOAD_CODEC}")
+
+    storage = connect_storage()
+    if settings.AUDIT_STORAGE == "postgres":
+        print(f"[*] DB de auditoría en Postgres (pool de {settings.POSTGRES_POOL_SIZE} conexiones)")
+    elif settings.AUDIT_SHARD_BY != "none":
+        print(f"[*] DB de auditoría en shards ({settings.AUDIT_SHARD_BY}): {storage.db_path}")
+    audit_log = AuditLogWriter(
+        settings.LOG_FILE_PATH,
+        flush_bytes=settings.LOG_FLUSH_BYTES,
+        flush_interval=settings.LOG_FLUSH_INTERVAL_MS / 1000.0,
+        fsync=settings.LOG_FSYNC,
+        segment_bytes=settings.LOG_SEGMENT_BYTES,
+        segment_seconds=settings.LOG_SEGMENT_SECONDS,
+        index_every=settings.LOG_INDEX_EVERY,
+        compress_level=settings.LOG_COMPRESS_LEVEL,
+    )
+    write_queue = DeliveryQueue(settings.WRITER_QUEUE_SIZE, kinds=("metric", "event"))
+    if settings.MAINTENANCE_ENABLED and storage.maintenance_connection() is not None:
+        maintenance = MaintenanceScheduler(
+            quiet_seconds=settings.MAINTENANCE_QUIET_MS / 1000.0,
+            checkpoint_seconds=settings.CHECKPOINT_SECONDS,
+            truncate_seconds=settings.CHECKPOINT_TRUNCATE_SECONDS,
+            wal_limit=settings.WAL_LIMIT_BYTES,
+            optimize_seconds=settings.OPTIMIZE_SECONDS,
+            vacuum_seconds=settings.VACUUM_SECONDS,
+            vacuum_pages=settings.VACUUM_PAGES,
+        )
 
-    conn = init_db(settings.AUDIT_DB_PATH)
-
-    connection, channel = connect_rabbitmq()
+    # Consultas de linaje: conexiones de solo lectura propias (no compiten con el writer)
+    if settings.LINEAGE_HTTP_PORT:
+        if settings.AUDIT_STORAGE == "postgres":
+            lineage = None  # las consultas de linaje leen SQLite; con Postgres solo queda /stats
+        elif settings.AUDIT_SHARD_BY == "none":
+            lineage = LineageService(settings.AUDIT_DB_PATH, settings.LINEAGE_POOL_SIZE)
+        else:
+            lineage = ShardedLineageService(settings.AUDIT_SHARD_DIR, settings.LINEAGE_POOL_SIZE)
+        serve_in_background(lineage, settings.LINEAGE_HTTP_PORT, stats=stats_snapshot)
+        print(f"[*] Consultas de linaje y /stats en el puerto {settings.LINEAGE_HTTP_PORT}")
+
+    connection, channels = connect_rabbitmq()
+
+    # El prefetch acota cuántas entregas sin confirmar puede tener cada cola
+    for kind, ch in channels.items():
+        set_prefetch(ch, prefetch[kind].prefetch)
+        ch.basic_consume(
+            queue=QUEUES[kind],
+            on_message_callback=functools.partial(enqueue, kind),
+        )
 
-    channel.basic_qos(prefetch_count=1)
-    channel.basic_consume(
-        queue=settings.QUEUE_NAME,
-        on_message_callback=lambda ch, method, properties, body: handle_event(conn, ch, method, properties, body),
-    )
-    channel.basic_consume(
-        queue=settings.METRICS_QUEUE_NAME,
-        on_message_callback=lambda ch, method, properties, body: handle_metric(conn, ch, method, properties, body),
-    )
+    stop = threading.Event()
+    writer = threading.Thread(target=writer_loop, args=(connection, channels, stop), name="audit-writer", daemon=True)
+    writer.start()
 
-    print(" [*] Audit Service grabando eventos...")
+    print(f" [*] Audit Service grabando eventos (lotes de {settings.BATCH_SIZE} / {settings.BATCH_WAIT_MS} ms)...")
     try:
-        channel.start_consuming()
+        while writer.is_alive():
+            connection.process_data_events(time_limit=1)
     except KeyboardInterrupt:
-        channel.stop_consuming()
-        connection.close()
+        pass
+    finally:
+        # Drenar lo encolado, aplicar las últimas confirmaciones y cerrar
+        stop.set()
+        writer.join()
+        audit_log.close()
+        storage.close()
+        if connection.is_open:
+            connection.process_data_events(time_limit=0)
+            connection.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,137 @@
+"""
+Mantenimiento de la DB de auditoría (WAL, estadísticas y espacio libre).
+
+Corre en el hilo writer, entre lotes, con la misma conexión: no compite por
+el lock de escritura con nadie y nunca cae dentro de un commit. Con el
+scheduler activo se apaga el auto-checkpoint de SQLite (que se dispara
+dentro del commit que cruza las 1000 páginas y mete picos en la latencia
+del writer) y el scheduler decide cuándo:
+
+- checkpoint PASSIVE cada checkpoint_seconds si quedan escrituras sin
+  copiar, o una vez apenas el writer queda quieto (quiet_seconds sin lotes);
+- checkpoint TRUNCATE en un período quieto cada truncate_seconds, o bajo
+  carga si el -wal supera wal_limit: el archivo vuelve a 0 y las lecturas
+  no recorren un WAL enorme. Usa un busy_timeout corto para no colgarse
+  esperando a un lector (lineage); si hay lectores queda para la próxima;
+- PRAGMA optimize (ANALYZE acotado de lo que cambió) cada optimize_seconds
+  y PRAGMA incremental_vacuum de a vacuum_pages cada vacuum_seconds, solo
+  en períodos quietos (auto_vacuum=INCREMENTAL desde el esquema v8).
+
+stats() devuelve tamaño del WAL, duración y resultado de cada tarea para /stats.
+"""
+import time
+
+from flowcontrol import wal_size
+
+PASSIVE = "PASSIVE"
+TRUNCATE = "TRUNCATE"
+
+
+def checkpoint(conn, mode=PASSIVE):
+    """(busy, frames del WAL, frames copiados) de PRAGMA wal_checkpoint(mode)."""
+    return tuple(conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone())
+
+
+class MaintenanceScheduler:
+
+    def __init__(self, quiet_seconds=2.0, checkpoint_seconds=2.0, truncate_seconds=300.0, wal_limit=64 << 20,
+                 optimize_seconds=3600.0, vacuum_seconds=600.0, vacuum_pages=2000, busy_timeout_ms=200,
+                 clock=time.monotonic):
+        self.quiet_seconds = quiet_seconds
+        self.checkpoint_seconds = checkpoint_seconds
+        self.truncate_seconds = truncate_seconds
+        self.wal_limit = wal_limit
+        self.optimize_seconds = optimize_seconds
+        self.vacuum_seconds = vacuum_seconds
+        self.vacuum_pages = vacuum_pages
+        self.busy_timeout_ms = busy_timeout_ms
+        self.clock = clock
+        now = clock()
+        self.last_write = now
+        self.dirty = False   # escrituras desde el último checkpoint completo
+        self.conn = None     # conexión ya preparada (cambia al rotar shards)
+        self.last = {"checkpoint": now, "truncate": now, "optimize": now, "vacuum": now}
+        self.tasks = {}      # tarea -> {"runs", "last_ms", "max_ms", "last_result"}
+        self.wal_bytes = 0
+
+    def note_write(self, now=None):
+        self.last_write = self.clock() if now is None else now
+        self.dirty = True
+
+    def quiet(self, now=None):
+        now = self.clock() if now is None else now
+        return now - self.last_write >= self.quiet_seconds
+
+    def prepare(self, conn):
+        """Apaga el auto-checkpoint de la conexión: los checkpoints los hace run()."""
+        conn.execute("PRAGMA wal_autocheckpoint=0")
+        self.conn = conn
+
+    def run(self, conn, db_path, now=None):
+        """Corre las tareas vencidas (llamar entre transacciones). Devuelve sus nombres."""
+        if conn is not self.conn:
+            self.prepare(conn)
+        now = self.clock() if now is None else now
+        quiet = self.quiet(now)
+        done = []
+
+        # Primero lo que escribe (optimize / vacuum): el checkpoint de abajo ya lo incluye
+        if quiet and self._due("optimize", self.optimize_seconds, now):
+            self._timed("optimize", now, lambda: conn.executescript("PRAGMA analysis_limit=1000; PRAGMA optimize;"))
+            done.append("optimize")
+            self.dirty = True
+        if quiet and self._due("vacuum", self.vacuum_seconds, now):
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if free:
+                # executescript recorre todos los pasos (execute solo libera una página)
+                self._timed("vacuum", now, lambda: conn.executescript(
+                    f"PRAGMA incremental_vacuum({self.vacuum_pages});"), result={"free_pages": free})
+                done.append("vacuum")
+                self.dirty = True
+            else:
+                self.last["vacuum"] = now
+        self.wal_bytes = wal_size(db_path)
+        oversized = self.wal_limit and self.wal_bytes > self.wal_limit
+        if self.wal_bytes and (oversized and self._due("truncate", self.checkpoint_seconds, now)
+                               or quiet and self._due("truncate", self.truncate_seconds, now)):
+            self._checkpoint(conn, TRUNCATE, now)
+            done.append("truncate")
+        elif self.dirty and (quiet and self.last_write >= self.last["checkpoint"]
+                             or self._due("checkpoint", self.checkpoint_seconds, now)):
+            self._checkpoint(conn, PASSIVE, now)
+            done.append("passive")
+
+        if done:
+            self.wal_bytes = wal_size(db_path)
+        return done
+
+    def stats(self):
+        return {"wal_bytes": self.wal_bytes, "dirty": self.dirty, "tasks": {k: dict(v) for k, v in self.tasks.items()}}
+
+    def _due(self, task, every, now):
+        return now - self.last[task] >= every
+
+    def _checkpoint(self, conn, mode, now):
+        previous = conn.execute("PRAGMA busy_timeout").fetchone()[0]
+        if mode == TRUNCATE:
+            conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        try:
+            busy, frames, copied = self._timed(mode.lower(), now, lambda: checkpoint(conn, mode))
+        finally:
+            conn.execute(f"PRAGMA busy_timeout={previous}")
+        self.last["checkpoint"] = now
+        if not busy and frames == copied:
+            self.dirty = False
+        self.tasks[mode.lower()]["last_result"] = {"busy": busy, "frames": frames, "copied": copied}
+
+    def _timed(self, task, now, fn, result=None):
+        started = time.monotonic()
+        value = fn()
+        elapsed_ms = round((time.monotonic() - started) * 1000, 1)
+        entry = self.tasks.setdefault(task, {"runs": 0, "last_ms": 0.0, "max_ms": 0.0, "last_result": None})
+        entry.update(runs=entry["runs"] + 1, last_ms=elapsed_ms, max_ms=max(entry["max_ms"], elapsed_ms))
+        if result is not None:
+            entry["last_result"] = result
+        if task in self.last:
+            self.last[task] = now
+        return value
@@ -0,0 +1,157 @@
+"""
+Payloads comprimidos en events_in (AUDIT_PAYLOAD_CODEC=zlib).
+
+Los payloads de una misma fuente repiten las mismas claves (y muchos
+valores) millones de veces. En vez de guardar el JSON en texto, se comprime
+el JSON con deflate usando un diccionario preentrenado por fuente
+(zdict): aunque cada payload se comprime por separado, las claves ya están
+en el diccionario y cuestan un par de bytes.
+
+  payload_blob = <id del diccionario: 2 bytes big endian> + deflate crudo
+  (id 0 = sin diccionario; un payload que no achica queda en payload_json)
+
+Los diccionarios viven en la tabla payload_dicts de la misma DB y no se
+modifican: un diccionario nuevo es otra fila con otro id. El entrenamiento
+es con la stdlib: los fragmentos `"clave":valor` más repetidos en una muestra
+de payloads de la fuente, con los más frecuentes al final (deflate codifica
+más barato las distancias cortas).
+
+La lectura es transparente: audit_payload(payload_json, payload_blob)
+devuelve siempre el JSON en texto (ver register).
+"""
+import re
+import struct
+import zlib
+from collections import Counter
+
+CODECS = ("json", "zlib")
+HEADER = struct.Struct(">H")
+# Ventana de 4 KiB (deflate crudo: sin cabecera ni checksum zlib, 6 bytes
+# menos por fila). Los payloads son chicos, y con la ventana y memLevel por
+# defecto copiar el estado del compresor costaba ~90 us por fila contra ~8 us.
+# WBITS es parte del formato guardado: no cambiarlo sin un id de formato nuevo.
+WBITS = -12
+MEM_LEVEL = 4
+DICT_SIZE = 3 * 1024  # deja lugar en la ventana para el payload
+
+# "clave": (con o sin espacio, como lo deja json.dumps) seguida de un escalar corto (string, número, bool, null) o sola
+_FRAGMENT = re.compile(r'"(?:[^"\\]|\\.)*": ?(?:"(?:[^"\\]|\\.){0,40}"|[-\w.+]{1,24})?')
+
+
+def train_dictionary(samples, size=DICT_SIZE) -> bytes:
+    """Diccionario zdict a partir de payloads de muestra (JSON en texto)."""
+    counts = Counter()
+    for text in samples:
+        counts.update(set(_FRAGMENT.findall(text)))
+    # Los que aparecen 2+ veces, aunque sean valores casi únicos (ids,
+    # coordenadas): igual aportan prefijos; medido, filtrarlos comprimía peor
+    chosen, total = [], 0
+    for fragment, count in counts.most_common():
+        if count < 2:
+            break
+        data = fragment.encode("utf-8")
+        if total + len(data) > size:
+            continue
+        chosen.append(data)
+        total += len(data)
+    return b"".join(reversed(chosen))
+
+
+def _compressor(level, zdict=None):
+    if zdict:
+        return zlib.compressobj(level, zlib.DEFLATED, WBITS, MEM_LEVEL, zdict=zdict)
+    return zlib.compressobj(level, zlib.DEFLATED, WBITS, MEM_LEVEL)
+
+
+def decompress(blob: bytes, zdict=None) -> str:
+    inflater = zlib.decompressobj(WBITS, zdict=zdict) if zdict else zlib.decompressobj(WBITS)
+    return (inflater.decompress(blob[HEADER.size:]) + inflater.flush()).decode("utf-8")
+
+
+class PayloadEncoder:
+    """
+    Lado escritor (uno por conexión / shard). encode_rows corre dentro de la
+    transacción del lote y solo usa diccionarios ya guardados; los nuevos se
+    entrenan y guardan con train_pending, entre transacciones, así un lote
+    revertido nunca deja filas apuntando a un diccionario inexistente.
+    """
+
+    def __init__(self, conn, level=6, sample_size=1000, seed=None):
+        self.conn = conn
+        self.level = level
+        self.sample_size = sample_size
+        self.compressors = {}  # source -> (dict_id, compressobj base que se copia por fila)
+        self.zdicts = {}       # source -> diccionario vigente
+        self.samples = {}      # source -> payloads de muestra (fuentes sin diccionario)
+        self.plain = _compressor(level)
+        for dict_id, source, zdict in conn.execute("SELECT id, source, dict FROM payload_dicts ORDER BY id"):
+            self._use(source, dict_id, zdict)
+        # Shard nuevo: se copian los diccionarios del anterior en vez de volver a entrenar
+        if seed is not None:
+            for source, zdict in seed.zdicts.items():
+                if source not in self.compressors:
+                    self._store(source, zdict)
+
+    def _use(self, source, dict_id, zdict):
+        self.compressors[source] = (dict_id, _compressor(self.level, zdict))
+        self.zdicts[source] = zdict
+        self.samples.pop(source, None)
+
+    def _store(self, source, zdict):
+        with self.conn:
+            cur = self.conn.execute("INSERT INTO payload_dicts(source, dict) VALUES (?, ?)", (source, zdict))
+        self._use(source, cur.lastrowid, zdict)
+
+    def encode(self, source, text):
+        """(payload_json, payload_blob): uno de los dos queda en None."""
+        entry = self.compressors.get(source)
+        if entry is None:
+            samples = self.samples.setdefault(source, [])
+            if len(samples) < self.sample_size:
+                samples.append(text)
+            dict_id, base = 0, self.plain
+        else:
+            dict_id, base = entry
+        # Copiar el compresor ya cargado con el diccionario es más barato que volver a cargarlo
+        compressor = base.copy()
+        blob = HEADER.pack(dict_id) + compressor.compress(text.encode("utf-8")) + compressor.flush()
+        if len(blob) >= len(text):
+            return text, None
+        return None, blob
+
+    def encode_rows(self, rows):
+        """Filas de db.event_row -> filas con payload_json / payload_blob."""
+        encoded = []
+        for row in rows:
+            text, blob = self.encode(row[3], row[6])
+            encoded.append(row[:6] + (text,) + row[7:] + (blob,))
+        return encoded
+
+    def train_pending(self):
+        """Entrena y guarda los diccionarios de las fuentes con muestra completa (fuera de una transacción)."""
+        for source, samples in list(self.samples.items()):
+            if len(samples) >= self.sample_size:
+                zdict = train_dictionary(samples)
+                if zdict:
+                    self._store(source, zdict)
+                    print(f"[*] Diccionario de payloads para {source}: {len(zdict)} bytes")
+                else:
+                    self.samples[source] = []  # nada repetido todavía: se vuelve a muestrear
+
+
+def register(conn):
+    """
+    Registra audit_payload(payload_json, payload_blob) en la conexión. Los
+    diccionarios se cargan a demanda y quedan en caché (no cambian nunca).
+    """
+    zdicts = {0: None}
+
+    def audit_payload(text, blob):
+        if blob is None:
+            return text
+        dict_id = HEADER.unpack_from(blob)[0]
+        if dict_id not in zdicts:
+            zdicts[dict_id] = conn.execute("SELECT dict FROM payload_dicts WHERE id = ?", (dict_id,)).fetchone()[0]
+        return decompress(blob, zdicts[dict_id])
+
+    conn.create_function("audit_payload", 2, audit_payload, deterministic=True)
@@ -0,0 +1,233 @@
+"""
+Backend Postgres del Audit Service (AUDIT_STORAGE=postgres, ver storage.py).
+
+Mismo modelo que la DB SQLite (events_in / metrics_out / trace con ids
+enteros, trace_view), pero sin el límite de un solo writer: varios
+consumidores del Audit pueden escribir en paralelo en la misma base.
+
+- Eventos: COPY del lote a una tabla temporal de la conexión y un único
+  INSERT ... SELECT ... ON CONFLICT (event_id, run_id) DO NOTHING. Las filas
+  van ordenadas por clave para que dos consumidores con eventos repetidos
+  tomen los locks en el mismo orden (sin deadlocks).
+- Métricas: upsert por metric_id y generación con la misma regla que
+  SQLite (db.merge_generations), con la fila bloqueada (FOR UPDATE) para
+  que dos consumidores no se pisen; change_seq sale de una secuencia.
+- Conexiones de un pool (ThreadedConnectionPool); una conexión rota se
+  descarta al devolverla y el pool abre otra.
+
+psycopg2 es opcional: solo lo necesita este backend.
+"""
+import io
+import uuid
+
+from db import merge_generations
+from tracecodec import trace_event_ids
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events_in (
+  id BIGSERIAL PRIMARY KEY,
+  event_id TEXT NOT NULL,
+  timestamp TEXT NOT NULL,
+  region TEXT NOT NULL,
+  source TEXT NOT NULL,
+  schema_version TEXT,
+  correlation_id TEXT,
+  payload_json TEXT NOT NULL,
+  run_id TEXT NOT NULL DEFAULT 'default',
+  inserted_at TIMESTAMPTZ DEFAULT now(),
+  UNIQUE (event_id, run_id)
+);
+CREATE INDEX IF NOT EXISTS events_by_region_time ON events_in(region, timestamp, id);
+CREATE INDEX IF NOT EXISTS events_by_source_time ON events_in(source, timestamp, id);
+CREATE INDEX IF NOT EXISTS events_by_time ON events_in(timestamp, id);
+
+CREATE SEQUENCE IF NOT EXISTS metrics_change_seq;
+CREATE TABLE IF NOT EXISTS metrics_out (
+  id BIGSERIAL PRIMARY KEY,
+  metric_id TEXT NOT NULL UNIQUE,
+  date TEXT NOT NULL,
+  region TEXT NOT NULL,
+  run_id TEXT NOT NULL DEFAULT 'default',
+  metrics_json TEXT NOT NULL,
+  created_at TIMESTAMPTZ DEFAULT now(),
+  revision INTEGER DEFAULT 0,
+  change_seq BIGINT NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS metrics_by_change ON metrics_out(change_seq);
+ALTER TABLE metrics_out ADD COLUMN IF NOT EXISTS generations_json TEXT;
+
+CREATE TABLE IF NOT EXISTS metrics_hourly (
+  id BIGSERIAL PRIMARY KEY,
+  metric_id TEXT NOT NULL UNIQUE,
+  hour TEXT NOT NULL,
+  date TEXT NOT NULL,
+  region TEXT NOT NULL,
+  run_id TEXT NOT NULL DEFAULT 'default',
+  metrics_json TEXT NOT NULL,
+  created_at TIMESTAMPTZ DEFAULT now(),
+  revision INTEGER DEFAULT 0,
+  generations_json TEXT
+);
+CREATE INDEX IF NOT EXISTS metrics_hourly_by_hour ON metrics_hourly(hour, region);
+
+CREATE TABLE IF NOT EXISTS trace (
+  metric_rowid BIGINT NOT NULL,
+  event_rowid BIGINT NOT NULL,
+  PRIMARY KEY (metric_rowid, event_rowid)
+);
+CREATE INDEX IF NOT EXISTS trace_by_event ON trace(event_rowid, metric_rowid);
+
+CREATE OR REPLACE VIEW trace_view AS
+SELECT e.event_id, m.metric_id, 'window_member' AS contribution_type
+FROM trace t
+JOIN metrics_out m ON m.id = t.metric_rowid
+JOIN events_in e ON e.id = t.event_rowid;
+"""
+
+EVENT_COLUMNS = "event_id, timestamp, region, source, schema_version, correlation_id, payload_json, run_id"
+
+# Clave arbitraria del advisory lock que serializa la creación del esquema entre consumidores
+SCHEMA_LOCK = 0x417564
+
+COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def import_psycopg2():
+    try:
+        import psycopg2
+        import psycopg2.pool  # noqa: F401
+    except ImportError:
+        raise SystemExit("[!] AUDIT_STORAGE=postgres requiere psycopg2 (pip install psycopg2-binary)")
+    return psycopg2
+
+
+def copy_text(rows):
+    """Filas -> formato text de COPY (tabs entre columnas, \\N para NULL)."""
+    return "".join(
+        "\t".join("\\N" if value is None else str(value).translate(COPY_ESCAPES) for value in row) + "\n"
+        for row in rows
+    )
+
+
+class PostgresStorage:
+    name = "postgres"
+    db_path = None  # no hay archivo (ni WAL propio que mirar)
+
+    def __init__(self, dsn, pool_size=4, schema=None):
+        self.psycopg2 = import_psycopg2()
+        self.Error = self.psycopg2.Error
+        kwargs = {"options": f"-c search_path={schema}"} if schema else {}
+        self.pool = self.psycopg2.pool.ThreadedConnectionPool(1, pool_size, dsn, **kwargs)
+        self.staged = set()  # id() de las conexiones del pool que ya tienen la tabla temporal
+        conn = self.pool.getconn()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK,))
+                    if schema:
+                        cur.execute(f'CREATE SCHEMA IF NOT EXISTS "{schema}"')
+                    cur.execute(SCHEMA)
+        finally:
+            self.release(conn)
+
+    def connection(self):
+        conn = self.pool.getconn()
+        if id(conn) not in self.staged:
+            # Tabla temporal de la sesión para el COPY (se vacía en cada COMMIT)
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS events_stage ({self._stage_columns()}) "
+                                "ON COMMIT DELETE ROWS")
+            self.staged.add(id(conn))
+        return conn
+
+    def release(self, conn):
+        broken = bool(conn.closed)
+        if broken:
+            self.staged.discard(id(conn))
+        self.pool.putconn(conn, close=broken)
+
+    def maintenance_connection(self):
+        return None  # autovacuum / checkpoints los maneja el servidor
+
+    def store_events(self, conn, rows):
+        if not rows:
+            return
+        with conn.cursor() as cur:
+            cur.copy_expert(f"COPY events_stage ({EVENT_COLUMNS}) FROM STDIN", io.StringIO(copy_text(rows)))
+            cur.execute(
+                f"""
+                INSERT INTO events_in ({EVENT_COLUMNS})
+                SELECT {EVENT_COLUMNS} FROM events_stage ORDER BY event_id, run_id
+                ON CONFLICT (event_id, run_id) DO NOTHING
+                """
+            )
+            cur.execute("TRUNCATE events_stage")  # por si hay otro COPY en la misma transacción
+
+    def store_metric_and_trace(self, conn, metric_msg):
+        """Misma semántica que db.store_metric_and_trace (upsert por generación, traza completa o nada)."""
+        metric_id = metric_msg.get("metric_id") or str(uuid.uuid4())
+        run_id = metric_msg.get("run_id", "default")
+        with conn.cursor() as cur:
+            self._upsert_rollup(cur, "metrics_out", metric_id, {
+                "date": metric_msg["date"], "region": metric_msg["region"], "run_id": run_id,
+            }, metric_msg, track_changes=True)
+            event_ids = sorted(set(trace_event_ids(metric_msg)))
+            if not event_ids:
+                return
+            cur.execute("SELECT id FROM metrics_out WHERE metric_id = %s", (metric_id,))
+            metric_rowid = cur.fetchone()[0]
+            cur.execute("SELECT id FROM events_in WHERE run_id = %s AND event_id = ANY(%s) ORDER BY id",
+                        (run_id, event_ids))
+            found = [row[0] for row in cur.fetchall()]
+            if len(found) != len(event_ids):
+                raise self.psycopg2.IntegrityError(
+                    f"faltan {len(event_ids) - len(found)} eventos de la traza de {metric_id}"
+                )
+            cur.execute(
+                "INSERT INTO trace(metric_rowid, event_rowid) SELECT %s, unnest(%s::bigint[]) "
+                "ON CONFLICT DO NOTHING",
+                (metric_rowid, found),
+            )
+
+    def store_hourly_metric(self, conn, metric_msg):
+        with conn.cursor() as cur:
+            self._upsert_rollup(cur, "metrics_hourly", metric_msg["metric_id"], {
+                "hour": metric_msg["hour"], "date": metric_msg["date"], "region": metric_msg["region"],
+                "run_id": metric_msg.get("run_id", "default"),
+            }, metric_msg)
+
+    def after_batch(self, n_events):
+        pass
+
+    def close(self):
+        self.pool.closeall()
+
+    @staticmethod
+    def _upsert_rollup(cur, table, metric_id, columns, metric_msg, track_changes=False):
+        # La fila se crea vacía si falta y se bloquea: el merge por generación
+        # es leer-modificar-escribir y otro consumidor puede traer la misma métrica
+        names = ", ".join(columns)
+        cur.execute(
+            f"INSERT INTO {table}(metric_id, {names}, metrics_json, revision) "
+            f"VALUES (%s, {', '.join(['%s'] * len(columns))}, '{{}}', 0) ON CONFLICT (metric_id) DO NOTHING",
+            (metric_id, *columns.values()),
+        )
+        cur.execute(f"SELECT revision, metrics_json, generations_json FROM {table} WHERE metric_id = %s FOR UPDATE",
+                    (metric_id,))
+        merged = merge_generations(cur.fetchone(), metric_msg.get("generation") or "",
+                                   metric_msg.get("revision", 0), metric_msg["metrics"])
+        if merged is None:
+            return
+        assignments = ", ".join(f"{name} = %s" for name in columns)
+        if track_changes:  # solo metrics_out: watermark de export.py
+            assignments += ", change_seq = nextval('metrics_change_seq')"
+        cur.execute(
+            f"UPDATE {table} SET {assignments}, generations_json = %s, metrics_json = %s, revision = %s "
+            "WHERE metric_id = %s",
+            (*columns.values(), *merged, metric_id),
+        )
+
+    @staticmethod
+    def _stage_columns():
+        return ", ".join(f"{column} TEXT" for column in EVENT_COLUMNS.split(", "))
@@ -1,86 +1,303 @@
-import json
-import time
+"""
+Reinyecta eventos del log de auditoría en el pipeline (events_exchange).
+
+Lee los segmentos sellados y el log activo (con --start/--end solo los
+bloques del rango), o con --input db la DB de auditoría (o sus shards) por
+los índices de linaje, o con --file un corpus / JSONL cualquiera, y publica
+con varios workers, cada uno con su propia conexión (ver replayengine.py).
+Cada worker publica en lotes de --batch-size con publisher confirms y
+espera los confirms del lote juntos: un solo ida y vuelta al broker por
+lote en lugar de uno por mensaje.
+Guarda un checkpoint para retomar con --resume.
+
+Selección: --region / --source / --run-id (corrida de origen, por defecto
+"default"; --any-run para todas). Cada evento sale con run_id = --as-run (en
+el cuerpo y en el header run_id), por defecto replay-<fecha UTC>: el
+Aggregator y el Audit lo guardan como una corrida aparte.
+
+--faithful reproduce los intervalos originales entre eventos (divididos por
+--speed) con un solo worker, en orden.
+
+Uso:
+    python replay.py [--input log|db | --file RUTA] [--start TS] [--end TS] [--region R] [--source S] [--run-id RUN]
+                     [--as-run RUN] [--rate EV_POR_S | --faithful [--speed X]] [--workers N] [--batch-size N] [--resume]
+"""
+import argparse
+import itertools
 import os
+import time
+
 import pika
+
 import settings  # Usa la configuración local de audit
+from lineage import LineageService, ShardedLineageService, iter_events
+from logsegments import estimate_records, iter_lines, list_segments
+from replayengine import (DEFAULT_RUN, FaithfulPacer, ReplayError, Selection, format_duration, load_checkpoint,
+                          run_replay, save_checkpoint)
+
+# Enviamos al 'events_exchange' (el inicio del pipeline) para probar que el Validator y Aggregator vuelvan a procesar todo.
+TARGET_REPLAY_EXCHANGE = "events_exchange"
+
+
+class RabbitPublisher:
+    """
+    Una conexión por worker (los canales de pika no son thread-safe) con
+    publisher confirms. BlockingConnection espera el confirm de cada mensaje
+    antes de publicar el siguiente; con SelectConnection el lote se publica
+    entero y después se espera a que el broker confirme todos (sus acks
+    suelen llegar agrupados con multiple=True): un ida y vuelta por lote.
+    El ioloop de la conexión corre solo dentro de las llamadas del worker.
+    """
+
+    def __init__(self, exchange, run_id, timeout=30.0):
+        self.exchange = exchange
+        self.timeout = timeout
+        self.properties = pika.BasicProperties(
+            delivery_mode=2,  # Persistente
+            headers={"x-replay": "true", "run_id": run_id},  # Marca de agua + corrida del replay
+        )
+        self.channel = None
+        self.ready = False
+        self.closing = False
+        self.error = None
+        self.last_tag = 0         # delivery_tag del último mensaje publicado en el canal
+        self.unconfirmed = set()  # tags publicados sin ack/nack del broker
+        self.nacked = 0
+        self._done = None
+        self.connection = pika.SelectConnection(
+            pika.ConnectionParameters(host=settings.RABBIT_HOST, port=settings.RABBIT_PORT),
+            on_open_callback=self._on_connection_open,
+            on_open_error_callback=self._on_connection_error,
+            on_close_callback=self._on_connection_closed,
+        )
+        try:
+            self._wait(lambda: self.ready)
+        except Exception:
+            self.close()
+            raise
+
+    def publish(self, routing_key, body):
+        self.publish_batch([(routing_key, body)])
+
+    def publish_batch(self, messages):
+        # Si algo falla el bloque se reintenta entero: lo que el broker ya había
+        # aceptado se repite, y la deduplicación por (run_id, event_id) lo absorbe
+        self.nacked = 0
+        for message in messages:
+            self.channel.basic_publish(exchange=self.exchange, routing_key=message[0], body=message[1],
+                                       properties=self.properties)
+            self.last_tag += 1
+            self.unconfirmed.add(self.last_tag)
+        self._wait(lambda: not self.unconfirmed)
+        if self.nacked:
+            raise ReplayError(f"el broker rechazó (nack) {self.nacked} de {len(messages)} mensajes")
+
+    def close(self):
+        self.closing = True
+        self.error = None  # el publisher se descarta: solo esperamos a que cierre el socket
+        if not (self.connection.is_closing or self.connection.is_closed):
+            self.connection.close()
+        self._wait(lambda: self.connection.is_closed, raise_error=False)
+
+    # --- ioloop: corre hasta que se cumple la condición, hay un error o vence el timeout ---
+    def _wait(self, done, raise_error=True):
+        if not done() and self.error is None:
+            self._done = done
+            timer = self.connection.ioloop.call_later(self.timeout, self._on_timeout)
+            self.connection.ioloop.start()
+            self.connection.ioloop.remove_timeout(timer)
+            self._done = None
+        if raise_error and self.error is not None:
+            raise self.error
+
+    def _check(self):
+        if self._done is not None and (self.error is not None or self._done()):
+            self.connection.ioloop.stop()
+
+    def _on_timeout(self):
+        self.error = ReplayError(f"sin respuesta del broker en {self.timeout:g}s "
+                                 f"({len(self.unconfirmed)} confirms pendientes)")
+        self._check()
+
+    def _on_connection_open(self, connection):
+        connection.channel(on_open_callback=self._on_channel_open)
 
-def replay_events():
-    # 1. Ubicación del log (definida en tus settings de Audit)
-    log_path = settings.LOG_FILE_PATH 
-    
-    if not os.path.exists(log_path):
+    def _on_connection_error(self, connection, error):
+        self.error = error if isinstance(error, Exception) else ReplayError(str(error))
+        self._check()
+
+    def _on_connection_closed(self, connection, reason):
+        if self.error is None and not self.closing:
+            self.error = reason if isinstance(reason, Exception) else ReplayError(str(reason))
+        self._check()
+
+    def _on_channel_open(self, channel):
+        self.channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        # Aseguramos que el exchange exista (por si acaso)
+        channel.exchange_declare(exchange=self.exchange, exchange_type="topic", durable=True,
+                                 callback=self._on_exchange_declared)
+
+    def _on_channel_closed(self, channel, reason):
+        if not self.closing and self.connection.is_open:
+            self.error = reason if isinstance(reason, Exception) else ReplayError(str(reason))
+            self.connection.close()
+        self._check()
+
+    def _on_exchange_declared(self, frame):
+        self.channel.confirm_delivery(ack_nack_callback=self._on_confirm, callback=self._on_confirm_selected)
+
+    def _on_confirm_selected(self, frame):
+        self.ready = True
+        self._check()
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        if method.multiple:
+            tags = {tag for tag in self.unconfirmed if tag <= method.delivery_tag}
+        else:
+            tags = {method.delivery_tag} & self.unconfirmed
+        self.unconfirmed -= tags
+        if isinstance(method, pika.spec.Basic.Nack):
+            self.nacked += len(tags)
+        self._check()
+
+
+def open_lineage():
+    """Servicio de linaje sobre la DB o los shards, según AUDIT_SHARD_BY."""
+    if settings.AUDIT_SHARD_BY == "none":
+        return LineageService(settings.AUDIT_DB_PATH, pool_size=1)
+    return ShardedLineageService(settings.AUDIT_SHARD_DIR, pool_size=1)
+
+
+def db_events(service, start, end, selection):
+    """Eventos de la DB en orden de timestamp; región / fuente / run_id se filtran con los índices."""
+    for item in iter_events(service, selection.region, selection.source, start, end, selection.run_id):
+        yield {k: v for k, v in item.items() if v is not None}
+
+
+def replay_events(start=None, end=None, rate=0, workers=4, resume=False, checkpoint_path=None,
+                  exchange=TARGET_REPLAY_EXCHANGE, chunk_size=500, source_input="log", region=None, source=None,
+                  run_id=DEFAULT_RUN, as_run=None, faithful=False, speed=1.0, batch_size=None, path=None):
+    # 1. Ubicación del log (definida en tus settings de Audit). Incluye los segmentos rotados.
+    log_path = settings.LOG_FILE_PATH
+    if path is not None:
+        # Un archivo suelto (corpus o JSONL): mismo lector, sin segmentos
+        source_input, log_path = "file", path
+        if not os.path.exists(path):
+            raise SystemExit(f"[!] No existe el archivo: {path}")
+
+    if source_input == "log" and not os.path.exists(log_path) and not list_segments(log_path):
         print(f"[!] No se encontró el archivo de log en: {log_path}")
         print("    (Asegúrate de que el sistema haya corrido y generado datos primero)")
         return
 
-    print(f"[*] Conectando a RabbitMQ en host: {settings.RABBIT_HOST}...")
-    
+    # Identifica la consulta: un checkpoint solo sirve para la misma selección
+    query = {"input": source_input if path is None else f"file:{os.path.abspath(path)}", "start": start,
+             "end": end, "region": region, "source": source, "run_id": run_id}
+    checkpoint_path = checkpoint_path or settings.REPLAY_CHECKPOINT_PATH
+    offset = 0
+    if resume:
+        checkpoint = load_checkpoint(checkpoint_path)
+        if checkpoint is None:
+            print(f"[!] No hay checkpoint en {checkpoint_path}; se empieza desde el principio")
+        elif {k: checkpoint.get(k) for k in query} != query:
+            raise SystemExit(f"[!] El checkpoint es de otra selección: "
+                             f"{ {k: checkpoint.get(k) for k in query} }")
+        else:
+            offset = checkpoint["offset"]
+            # Retomar sigue la misma corrida salvo que se pida otra
+            as_run = as_run or checkpoint.get("as_run")
+            print(f"[*] Retomando desde la posición {offset} (corrida {as_run})")
+    as_run = as_run or time.strftime("replay-%Y%m%dT%H%M%SZ", time.gmtime())
+
+    def on_checkpoint(done):
+        save_checkpoint(checkpoint_path, dict(
+            query, log=log_path, as_run=as_run, offset=done,
+            updated_at=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        ))
+
+    selection = Selection(region, source, run_id, tag=as_run, timed=faithful)
+    pace = None
+    if faithful:
+        pace = FaithfulPacer(speed)
+        if workers != 1:
+            print("[*] Modo fiel: 1 worker para conservar el orden")
+        workers, rate = 1, 0
+        # Bloques chicos: a ritmo original el progreso y el checkpoint avanzan igual
+        chunk_size = min(chunk_size, 50)
+
+    service = None
+    if source_input == "db":
+        service = open_lineage()
+        # Con región / fuente / run_id la DB ya filtra por índice; el offset cuenta eventos
+        items, total, origin = db_events(service, start, end, selection), None, "la DB de auditoría"
+    else:
+        # Con --start/--end el índice de los segmentos evita descomprimir lo que queda fuera del rango
+        items, total, origin = iter_lines(log_path, start, end), estimate_records(log_path, start, end), log_path
+    pacing = f"fiel x{speed:g}" if faithful else ("máxima" if not rate else f"{rate:g} ev/s")
+    print(f"[*] Iniciando Replay desde {origin} hacia '{exchange}' en {settings.RABBIT_HOST} como corrida "
+          f"'{as_run}': {f'~{total} eventos, ' if total is not None else ''}{workers} workers, tasa {pacing}")
+
+    started = time.monotonic()
     try:
-        # 2. Conexión a RabbitMQ
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters(host=settings.RABBIT_HOST, port=settings.RABBIT_PORT)
+        progress = run_replay(
+            itertools.islice(items, offset, None), lambda: RabbitPublisher(exchange, as_run), workers=workers,
+            rate=rate, chunk_size=chunk_size, offset=offset, total=total, on_checkpoint=on_checkpoint,
+            progress_every=settings.REPLAY_PROGRESS_SECONDS, extract=selection.extract, pace=pace,
+            batch_size=batch_size or settings.REPLAY_BATCH_SIZE,
         )
-        channel = connection.channel()
+    except ReplayError as e:
+        raise SystemExit(f"[!] {e}. Se puede retomar con --resume")
+    finally:
+        if service is not None:
+            service.close()
+
+    elapsed = time.monotonic() - started
+    if progress.skipped:
+        print(f"[!] Líneas corruptas ignoradas: {progress.skipped}")
+    if progress.filtered:
+        print(f"[*] Eventos fuera de la selección: {progress.filtered}")
+    print(f"\n[OK] Replay finalizado exitosamente. Total reinyectados: {progress.published} "
+          f"en {format_duration(elapsed)} ({progress.published / max(elapsed, 1e-6):,.0f} ev/s) "
+          f"como corrida '{as_run}'")
 
-        # Enviamos al 'events_exchange' (el inicio del pipeline) para probar que el Validator y Aggregator vuelvan a procesar todo.
-        TARGET_REPLAY_EXCHANGE = "events_exchange" 
-        
-        # Aseguramos que el exchange exista (por si acaso)
-        channel.exchange_declare(exchange=TARGET_REPLAY_EXCHANGE, exchange_type='topic', durable=True)
-
-        print(f"[*] Iniciando Replay desde {log_path} hacia '{TARGET_REPLAY_EXCHANGE}'...")
-        count = 0
-
-        with open(log_path, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if not line: continue
-                
-                try:
-                    # El log de audit guarda algo como: {"timestamp":..., "event": {...}} o directamente el evento. Intentamos detectar la estructura.
-                    record = json.loads(line)
-                    
-                    # Si el log tiene el evento anidado bajo una llave "event" u "original_event"
-                    if "event" in record and isinstance(record["event"], dict):
-                        payload = record["event"]
-                    elif "original_event" in record:
-                        payload = record["original_event"]
-                    else:
-                        # Asumimos que la línea entera es el evento
-                        payload = record
-
-                    # Extraemos el routing_key original o usamos uno por defecto
-                    
-                    routing_key = payload.get('source', 'replay.generic')
-
-                    # 3. Publicar de nuevo
-                    channel.basic_publish(
-                        exchange=TARGET_REPLAY_EXCHANGE,
-                        routing_key=routing_key,
-                        body=json.dumps(payload),
-                        properties=pika.BasicProperties(
-                            delivery_mode=2, # Persistente
-                            headers={'x-replay': 'true'} # Marca de agua para depuración
-                        )
-                    )
-                    
-                    count += 1
-                    if count % 10 == 0:
-                        print(f" -> Reinyectados {count} eventos...")
-                    
-                    # Pequeña pausa para no saturar
-                    time.sleep(0.05) 
-
-                except json.JSONDecodeError:
-                    print(f"[!] Línea corrupta ignorada.")
-                except Exception as e:
-                    print(f"[!] Error procesando línea: {e}")
-
-        print(f"\n[OK] Replay finalizado exitosamente. Total reinyectados: {count}")
-        connection.close()
-
-    except Exception as e:
-        print(f"[!] Error crítico de conexión o ejecución: {e}")
 
 if __name__ == "__main__":
-    replay_events()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Reinyecta eventos del log de auditoría")
+    parser.add_argument("--input", choices=("log", "db"), default="log",
+                        help="Origen: log JSONL (segmentos) o DB de auditoría (índices de linaje)")
+    parser.add_argument("--file", help="Reinyectar un archivo JSONL (corpus o log suelto) en vez del log")
+    parser.add_argument("--start", help="Timestamp mínimo del evento (ISO, p.ej. 2025-01-01T10:00)")
+    parser.add_argument("--end", help="Timestamp máximo del evento (ISO)")
+    parser.add_argument("--region", help="Solo eventos de esta región")
+    parser.add_argument("--source", help="Solo eventos de esta fuente (p.ej. security.incident)")
+    parser.add_argument("--run-id", default=DEFAULT_RUN, help="Corrida de origen (por defecto el tráfico normal)")
+    parser.add_argument("--any-run", action="store_true", help="Eventos de cualquier corrida")
+    parser.add_argument("--as-run", help="run_id de la corrida nueva (por defecto replay-<fecha UTC>)")
+    parser.add_argument("--rate", type=float, default=settings.REPLAY_RATE,
+                        help="Eventos por segundo en total (0 = lo más rápido posible)")
+    parser.add_argument("--faithful", action="store_true",
+                        help="Reproducir los intervalos originales entre eventos (1 worker)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Factor de velocidad del modo fiel (2 = x2)")
+    parser.add_argument("--workers", type=int, default=settings.REPLAY_WORKERS,
+                        help="Conexiones publicando en paralelo (1 = en orden)")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Líneas por bloque de trabajo")
+    parser.add_argument("--batch-size", type=int, default=settings.REPLAY_BATCH_SIZE,
+                        help="Mensajes por lote (se esperan sus confirms juntos)")
+    parser.add_argument("--resume", action="store_true", help="Retomar desde el último checkpoint")
+    parser.add_argument("--checkpoint", help="Archivo de checkpoint (por defecto REPLAY_CHECKPOINT_PATH)")
+    parser.add_argument("--exchange", default=TARGET_REPLAY_EXCHANGE)
+    args = parser.parse_args()
+    if args.faithful and args.rate:
+        parser.error("--faithful y --rate no se combinan")
+    if args.speed <= 0:
+        parser.error("--speed debe ser > 0")
+    if args.file and args.input == "db":
+        parser.error("--file y --input db no se combinan")
+    if args.batch_size < 1:
+        parser.error("--batch-size debe ser >= 1")
+    replay_events(args.start, args.end, args.rate, args.workers, args.resume, args.checkpoint,
+                  args.exchange, args.chunk_size, args.input, args.region, args.source,
+                  None if args.any_run else args.run_id, args.as_run, args.faithful, args.speed,
+                  args.batch_size, args.file)
@@ -0,0 +1,487 @@
+"""
+Motor de replay del log de auditoría (sin dependencias de RabbitMQ).
+
+- Las líneas se reparten en bloques de chunk_size entre N workers; cada
+  worker tiene su propia conexión (publisher_factory) y publica en lotes de
+  batch_size con un solo round-trip por lote (publish_batch): un bloque
+  cuenta como hecho recién cuando el broker aceptó todos sus mensajes. Si
+  falla, el worker reconecta y republica el bloque completo (al menos una
+  vez: los servicios deduplican por (run_id, event_id)).
+- Un token bucket compartido limita la tasa total (rate = 0: sin límite, el
+  freno es esperar los publisher confirms de cada lote).
+- Checkpoint: offset = líneas del stream cuyos bloques ya están confirmados
+  de forma contigua desde el principio. Con --resume se saltan esas líneas.
+- Progreso cada progress_every segundos con tasa y ETA.
+
+El orden se conserva dentro de cada bloque; entre workers no. Con workers=1
+el replay es en orden.
+
+Replay selectivo (Selection): filtra por región / fuente / run_id de origen
+y etiqueta cada evento con el run_id de la corrida nueva, así el Aggregator
+y el Audit lo separan de la corrida original. El modo fiel (FaithfulPacer)
+reproduce los intervalos entre timestamps de eventos, divididos por speed.
+
+Camino rápido (Selection.extract con bytes): las líneas del log de audit
+tienen un formato fijo (auditlog.format_record), así que el evento se saca
+cortando los bytes de event_content, los campos que hacen falta (region,
+source, run_id, timestamp) se ubican con búsquedas de bytes y el run_id
+nuevo se empalma en los bytes: sin json.loads / json.dumps por línea. Lo
+que no encaja (campos repetidos o con escapes, otros formatos) pasa por la
+decodificación completa.
+"""
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+DEFAULT_RUN = "default"  # run_id de los eventos que no traen uno (tráfico normal)
+FILTERED = object()      # marca de evento descartado por los filtros (no es una línea corrupta)
+
+# Formato de auditlog.format_record: {"audit_timestamp":"<iso>","event_content":<body>}\n
+AUDIT_PREFIX = b'{"audit_timestamp":"'
+CONTENT_KEY = b'","event_content":'
+WRAPPER_KEYS = (b'"event_content"', b'"event":', b'"original_event"')
+
+
+class TokenBucket:
+    """Tasa total entre todos los workers (rate = 0: sin límite)."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate / 10.0)  # ~100 ms de ráfaga
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, n=1):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            # Se reserva aunque quede en negativo: cada caller duerme su propia deuda
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Progress:
+    """Bloques confirmados, offset contiguo para el checkpoint y tasa / ETA."""
+
+    def __init__(self, offset=0, total=None):
+        self.lock = threading.Lock()
+        self.offset = offset        # líneas confirmadas de forma contigua
+        self.next_seq = 0           # próximo bloque que extiende el offset
+        self.pending = {}           # seq -> líneas de bloques confirmados fuera de orden
+        self.published = 0
+        self.skipped = 0
+        self.filtered = 0
+        self.total = total
+        self.started = time.monotonic()
+        self.last_report = (self.started, 0)
+
+    def chunk_done(self, seq, lines, published, skipped, filtered=0):
+        with self.lock:
+            self.published += published
+            self.skipped += skipped
+            self.filtered += filtered
+            self.pending[seq] = lines
+            while self.next_seq in self.pending:
+                self.offset += self.pending.pop(self.next_seq)
+                self.next_seq += 1
+
+    def report(self):
+        with self.lock:
+            now = time.monotonic()
+            last_time, last_count = self.last_report
+            self.last_report = (now, self.published)
+            rate = (self.published - last_count) / max(now - last_time, 1e-6)
+            average = self.published / max(now - self.started, 1e-6)
+            line = f" -> Reinyectados {self.published}"
+            if self.total:
+                done = self.offset
+                line += f"/{self.total} ({100.0 * min(done, self.total) / self.total:.1f}%)"
+                if average > 0:
+                    line += f" | ETA {format_duration(max(self.total - done, 0) / average)}"
+            return line + f" | {rate:,.0f} ev/s (prom. {average:,.0f})"
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+def parse_event(line):
+    """
+    Evento (dict) de una línea del log. El log de audit guarda
+    {"audit_timestamp":.., "event_content": {...}}; se aceptan también "event"
+    / "original_event" o la línea entera como evento. None si está corrupta.
+    """
+    try:
+        record = json.loads(line)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    if not isinstance(record, dict):
+        return None
+    if isinstance(record.get("event_content"), dict):
+        event = record["event_content"]
+    elif isinstance(record.get("event"), dict):
+        event = record["event"]
+    elif "original_event" in record:
+        event = record["original_event"]
+    else:
+        event = record
+    return event if isinstance(event, dict) else None
+
+
+def extract_event(line):
+    """(routing_key, body) de una línea del log, o None si está corrupta."""
+    event = parse_event(line)
+    if event is None:
+        return None
+    return event.get("source", "replay.generic"), json.dumps(event).encode("utf-8")
+
+
+def parse_timestamp(value):
+    """Timestamp ISO del evento -> epoch (sin zona se asume UTC); None si no se entiende."""
+    try:
+        when = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when.timestamp()
+
+
+class Selection:
+    """
+    Qué eventos se reinyectan y cómo: filtros por región, fuente y run_id de
+    origen (None = cualquiera) y run_id nuevo con el que se etiquetan (tag).
+    Con timed=True los mensajes llevan además el epoch del evento para el
+    FaithfulPacer: (routing_key, body, epoch).
+    """
+
+    def __init__(self, region=None, source=None, run_id=None, tag=None, timed=False):
+        self.region = region
+        self.source = source
+        self.run_id = run_id
+        self.tag = tag
+        self.timed = timed
+        # Lo mismo en bytes para el camino rápido
+        self._filters = [(b'"region":', _encode(region)), (b'"source":', _encode(source)),
+                         (b'"run_id":', _encode(run_id))]
+        self._keys = [b'"region":', b'"source":', b'"run_id":'] + ([b'"timestamp":'] if timed else [])
+        self._tag = _encode(tag)
+
+    def matches(self, event):
+        if self.region is not None and event.get("region") != self.region:
+            return False
+        if self.source is not None and event.get("source") != self.source:
+            return False
+        run_id = event.get("run_id") or DEFAULT_RUN
+        if self.run_id is not None and run_id != self.run_id:
+            return False
+        # Nunca los de la corrida que se está generando (la DB los va recibiendo)
+        return self.tag is None or run_id != self.tag
+
+    def message(self, event):
+        if self.tag:
+            event = dict(event, run_id=self.tag)
+        message = (event.get("source", "replay.generic"), json.dumps(event).encode("utf-8"))
+        if self.timed:
+            message += (parse_timestamp(event.get("timestamp")),)
+        return message
+
+    def extract(self, item):
+        """Línea del log o evento (dict, desde la DB) -> mensaje, FILTERED o None (corrupta)."""
+        if isinstance(item, dict):
+            event = item
+        else:
+            message = self._extract_bytes(item)
+            if message is not None:
+                return message
+            event = parse_event(item)
+        if event is None:
+            return None
+        if not self.matches(event):
+            return FILTERED
+        return self.message(event)
+
+    def _extract_bytes(self, line):
+        """Camino rápido sin decodificar; None si la línea necesita el camino lento."""
+        span = event_span(line)
+        if span is None:
+            return None
+        if span != (0, len(line)) and not line.startswith(AUDIT_PREFIX):
+            line = line[span[0]:span[1]]  # evento suelto con espacios alrededor
+            span = (0, len(line))
+        try:
+            fields = {key: _field(line, key, *span) for key in self._keys}
+        except _NeedsDecode:
+            return None
+        if fields[b'"source":'] is None or fields[b'"region":'] is None:
+            return None
+        for key, wanted in self._filters:
+            if wanted is None:
+                continue
+            value = fields[key]
+            if (line[value[0]:value[1]] if value else DEFAULT_RUN.encode()) != wanted:
+                return FILTERED
+        start, end = span
+        run = fields[b'"run_id":']
+        if self._tag is None:
+            event = line[start:end]
+        elif run is None:
+            event = line[start:end - 1] + b',"run_id":"' + self._tag + b'"}'
+        elif line[run[0]:run[1]] == self._tag:
+            return FILTERED  # de la corrida que se está generando
+        else:
+            event = line[start:run[0]] + self._tag + line[run[1]:end]
+        source = fields[b'"source":']
+        message = (line[source[0]:source[1]].decode("utf-8"), event)
+        if self.timed:
+            timestamp = fields[b'"timestamp":']
+            message += (parse_timestamp(line[timestamp[0]:timestamp[1]].decode("ascii", "replace"))
+                        if timestamp else None,)
+        return message
+
+
+class _NeedsDecode(Exception):
+    pass
+
+
+def _field(line, key, start, end):
+    """
+    (inicio, fin) del valor string de key ('"region":') dentro de
+    line[start:end], o None si no está. _NeedsDecode si aparece más de una
+    vez (p.ej. también en el payload), no es un string o tiene una comilla
+    escapada. Otros escapes quedan tal cual (se comparan con _encode).
+    """
+    count = line.count(key, start, end)
+    if not count:
+        return None
+    if count > 1:
+        raise _NeedsDecode
+    value = line.find(key, start, end) + len(key)
+    if line[value] == 0x20:  # "clave": "valor" (json.dumps por defecto)
+        value += 1
+    if line[value] != 0x22:
+        raise _NeedsDecode
+    close = line.find(b'"', value + 1, end)
+    if close < 0 or line[close - 1] == 0x5C:  # comilla escapada: el valor sigue
+        raise _NeedsDecode
+    return value + 1, close
+
+
+def _encode(value):
+    """Valor de filtro / etiqueta como aparece dentro del JSON (sin comillas)."""
+    return None if value is None else json.dumps(value, ensure_ascii=False)[1:-1].encode("utf-8")
+
+
+def event_span(line):
+    """
+    (inicio, fin) de los bytes del evento en la línea, sin decodificarla: el
+    event_content de una línea de audit o la línea entera (sin espacios) si
+    es un evento suelto, p.ej. un corpus JSONL. None si tiene otro formato
+    (envoltorios "event" / "original_event", línea truncada, etc.).
+    """
+    if line.startswith(AUDIT_PREFIX):
+        cut = line.find(CONTENT_KEY, len(AUDIT_PREFIX))
+        end = len(line) - (2 if line.endswith(b"}\n") else 1)
+        if cut < 0 or line[end] != 0x7D:  # "}" que cierra el registro (una línea truncada no lo tiene)
+            return None
+        start = cut + len(CONTENT_KEY)
+    else:
+        if any(key in line for key in WRAPPER_KEYS):
+            return None
+        start = len(line) - len(line.lstrip())
+        end = len(line.rstrip())
+    if end - start < 3 or line[start] != 0x7B or line[end - 1] != 0x7D:
+        return None
+    return start, end
+
+
+class FaithfulPacer:
+    """
+    Reproduce los intervalos originales entre eventos divididos por speed
+    (2.0 = el doble de rápido). El primer evento fija el origen; un evento
+    fuera de orden o ya atrasado (reintentos) sale sin esperar.
+    """
+
+    def __init__(self, speed=1.0):
+        if speed <= 0:
+            raise ValueError("speed debe ser > 0")
+        self.speed = speed
+        self.origin = None  # (epoch del primer evento, time.monotonic() al publicarlo)
+
+    def __call__(self, message):
+        when = message[2] if len(message) > 2 else None
+        if when is None:
+            return
+        if self.origin is None:
+            self.origin = (when, time.monotonic())
+            return
+        delay = self.origin[1] + (when - self.origin[0]) / self.speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def chunks(lines, chunk_size, extract=extract_event):
+    """(seq, cantidad de líneas, [mensajes], descartadas por filtro) de chunk_size líneas."""
+    iterator = iter(lines)
+    for seq in itertools.count():
+        block = list(itertools.islice(iterator, chunk_size))
+        if not block:
+            return
+        messages, filtered = [], 0
+        for message in map(extract, block):
+            if message is FILTERED:
+                filtered += 1
+            elif message is not None:
+                messages.append(message)
+        yield seq, len(block), messages, filtered
+
+
+# --- checkpoint ---
+def load_checkpoint(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path, checkpoint):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+class ReplayError(Exception):
+    pass
+
+
+def run_replay(lines, publisher_factory, workers=4, rate=0, chunk_size=500, offset=0, total=None,
+               on_checkpoint=None, progress_every=5.0, max_retries=5, log=print, extract=extract_event, pace=None,
+               batch_size=200):
+    """
+    Publica las líneas (ya salteadas hasta offset) con `workers` publishers.
+    publisher_factory() -> objeto con publish(routing_key, body) que bloquea
+    hasta que el broker acepta el mensaje (o lanza) y close(); si además
+    tiene publish_batch(mensajes) se usa con lotes de batch_size.
+    on_checkpoint(offset) se llama periódicamente y al final. extract(línea)
+    -> mensaje, FILTERED o None (p.ej. Selection.extract); pace(mensaje) se
+    llama antes de publicar cada uno (FaithfulPacer, con workers=1, sin
+    lotes). Devuelve el Progress final.
+    """
+    bucket = TokenBucket(rate)
+    if rate:
+        # Bloques de ~1 s de trabajo: el progreso y el checkpoint avanzan aunque la tasa sea baja
+        chunk_size = max(1, min(chunk_size, int(rate)))
+        # Lotes del tamaño de la ráfaga del bucket: la tasa se respeta también dentro del bloque
+        batch_size = max(1, min(batch_size, int(bucket.capacity)))
+    progress = Progress(offset, total)
+    work = queue.Queue(maxsize=2 * workers)  # acota la lectura adelantada
+    failed = threading.Event()
+    errors = []
+
+    def worker():
+        publisher = None
+        try:
+            while True:
+                item = work.get()
+                if item is None:
+                    return
+                seq, n_lines, messages, filtered = item
+                for attempt in itertools.count(1):
+                    if failed.is_set():
+                        return
+                    try:
+                        if publisher is None:
+                            publisher = publisher_factory()
+                        if pace is None and hasattr(publisher, "publish_batch"):
+                            for i in range(0, len(messages), batch_size):
+                                batch = messages[i:i + batch_size]
+                                bucket.acquire(len(batch))
+                                publisher.publish_batch(batch)
+                        else:
+                            for message in messages:
+                                if pace is not None:
+                                    pace(message)
+                                bucket.acquire()
+                                publisher.publish(message[0], message[1])
+                        break
+                    except Exception as e:
+                        _close(publisher)
+                        publisher = None
+                        if attempt >= max_retries:
+                            errors.append(e)
+                            failed.set()
+                            return
+                        log(f"[!] Error publicando bloque {seq} (intento {attempt}): {e}. Reconectando...")
+                        time.sleep(min(2 ** attempt * 0.1, 5))
+                progress.chunk_done(seq, n_lines, len(messages), n_lines - len(messages) - filtered, filtered)
+        finally:
+            _close(publisher)
+
+    threads = [threading.Thread(target=worker, name=f"replay-{i}", daemon=True) for i in range(workers)]
+    for t in threads:
+        t.start()
+
+    stop_reporter = threading.Event()
+
+    def reporter():
+        while not stop_reporter.wait(progress_every):
+            log(progress.report())
+            if on_checkpoint is not None:
+                on_checkpoint(progress.offset)
+
+    reporter_thread = threading.Thread(target=reporter, name="replay-progress", daemon=True)
+    reporter_thread.start()
+
+    try:
+        for item in chunks(lines, chunk_size, extract):
+            while not failed.is_set():
+                try:
+                    work.put(item, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+            if failed.is_set():
+                break
+    finally:
+        for _ in threads:
+            # Si los workers murieron la cola puede estar llena: no bloquear
+            while any(t.is_alive() for t in threads):
+                try:
+                    work.put(None, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+        for t in threads:
+            t.join()
+        stop_reporter.set()
+        reporter_thread.join()
+        if on_checkpoint is not None:
+            on_checkpoint(progress.offset)
+
+    if errors:
+        raise ReplayError(f"replay interrumpido en el offset {progress.offset}: {errors[0]}")
+    return progress
+
+
+def _close(publisher):
+    if publisher is not None:
+        try:
+            publisher.close()
+        except Exception:
+            pass
@@ -0,0 +1,293 @@
+"""
+Almacenamiento de auditoría particionado en shards SQLite por día (o por
+cantidad de filas), con un catálogo chico (catalog.db).
+
+  AUDIT_SHARD_DIR/
+    catalog.db                  shards(id, path, day, state, min_ts, max_ts, ...)
+    audit-20250101-0001.db      un archivo por shard, mismo esquema que audit.db
+    audit-20250102-0002.db
+
+- El writer solo escribe en el shard activo. Al rotar (cambio de día UTC o
+  AUDIT_SHARD_MAX_ROWS eventos) el shard anterior se sella en segundo plano:
+  checkpoint, PRAGMA optimize, VACUUM, journal DELETE y archivo de solo
+  lectura; en el catálogo queda su rango de timestamps de eventos.
+- events_in / metrics_out / trace mantienen su semántica:
+    * un evento con timestamp anterior a la apertura del shard activo se
+      busca en los shards previos (AUDIT_SHARD_LOOKBACK) antes de insertarlo,
+      para no duplicarlo si se reentrega después de rotar;
+    * si la traza de una métrica nombra eventos de un shard previo, quedan en
+      trace_external (event_id + shard) en vez de fallar por FK.
+    * un roll-up (metric_id de fecha/hora) que aparece por primera vez en el
+      shard activo copia la fila del shard previo antes del upsert: el
+      total y la revision siguen completos aunque el día cruce una rotación.
+- Las consultas de linaje (lineage.ShardedLineageService) solo abren los
+  shards cuyo rango de tiempo se solapa con la consulta.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+import db
+
+SHARD_POLICIES = ("none", "day", "rows")
+TS_FORMAT = "%Y-%m-%dT%H:%M:%SZ"  # mismo formato que el timestamp de los eventos
+
+Shard = namedtuple("Shard", "id path day state opened_at min_ts max_ts")
+
+
+def open_catalog(directory, readonly=False):
+    path = os.path.join(directory, "catalog.db")
+    if readonly:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False, timeout=5)
+        conn.execute("PRAGMA busy_timeout=5000;")
+        return conn
+    os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA busy_timeout=5000;")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS shards (
+          id INTEGER PRIMARY KEY,
+          path TEXT NOT NULL,
+          day TEXT NOT NULL,
+          state TEXT NOT NULL DEFAULT 'active',   -- active | sealing | sealed
+          opened_at TEXT NOT NULL,
+          sealed_at TEXT,
+          events INTEGER,
+          min_ts TEXT,
+          max_ts TEXT,
+          bytes INTEGER
+        )
+        """
+    )
+    conn.commit()
+    return conn
+
+
+def list_shards(catalog):
+    return [
+        Shard(*row)
+        for row in catalog.execute("SELECT id, path, day, state, opened_at, min_ts, max_ts FROM shards ORDER BY id")
+    ]
+
+
+def shards_for_range(shards, start=None, end=None):
+    """
+    Shards que pueden tener eventos con timestamp en [start, end]. Los no
+    sellados (o vacíos) siempre entran: su rango todavía no está cerrado.
+    """
+    selected = []
+    for shard in shards:
+        if shard.state != "sealed" or shard.min_ts is None:
+            selected.append(shard)
+        elif (start is None or shard.max_ts >= start) and (end is None or shard.min_ts <= end):
+            selected.append(shard)
+    return selected
+
+
+def readonly_connection(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=5)
+    conn.execute("PRAGMA busy_timeout=5000;")
+    return conn
+
+
+def seal_shard(directory, shard):
+    """Compacta un shard rotado, lo deja de solo lectura y registra su rango en el catálogo."""
+    conn = sqlite3.connect(shard.path, timeout=30)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+    events, min_ts, max_ts = conn.execute("SELECT count(*), min(timestamp), max(timestamp) FROM events_in").fetchone()
+    conn.execute("PRAGMA optimize;")
+    conn.execute("VACUUM;")
+    conn.execute("PRAGMA journal_mode=DELETE;")
+    conn.close()
+    os.chmod(shard.path, 0o444)
+
+    catalog = open_catalog(directory)
+    with catalog:
+        catalog.execute(
+            """
+            UPDATE shards SET state = 'sealed', sealed_at = datetime('now'),
+                   events = ?, min_ts = ?, max_ts = ?, bytes = ?
+            WHERE id = ?
+            """,
+            (events, min_ts, max_ts, os.path.getsize(shard.path), shard.id),
+        )
+    catalog.close()
+    print(f"[*] Shard {shard.id} sellado: {events} eventos, {min_ts} .. {max_ts}")
+
+
+class ShardStore:
+    """Lado escritor: shard activo, rotación, sellado y búsquedas en shards previos."""
+
+    def __init__(self, directory, shard_by="day", max_rows=0, lookback=1, legacy_db=None, seal_async=True):
+        if shard_by not in SHARD_POLICIES or shard_by == "none":
+            raise ValueError(f"Política de shards inválida: {shard_by}")
+        self.directory = directory
+        self.shard_by = shard_by
+        self.max_rows = max_rows
+        self.lookback = lookback
+        self.seal_async = seal_async
+        self.sealers = []
+        self.catalog = open_catalog(directory)
+
+        shards = list_shards(self.catalog)
+        if not shards and legacy_db and os.path.exists(legacy_db):
+            # Un audit.db previo pasa a ser el primer shard (se sella en la próxima rotación)
+            self._register(legacy_db)
+            shards = list_shards(self.catalog)
+        for shard in shards:
+            if shard.state == "sealing":  # sellado interrumpido por un reinicio
+                self._seal(shard)
+            elif shard.state == "sealed":
+                self._upgrade_sealed(shard)
+        active = [s for s in shards if s.state == "active"]
+        self._open_active(active[-1] if active else self._create())
+
+    def _upgrade_sealed(self, shard):
+        """Un shard sellado con un esquema viejo se migra y se vuelve a sellar (al arrancar)."""
+        conn = readonly_connection(shard.path)
+        version = db.schema_version(conn)
+        conn.close()
+        if version >= db.SCHEMA_VERSION:
+            return
+        os.chmod(shard.path, 0o644)
+        db.init_db(shard.path).close()
+        seal_shard(self.directory, shard)
+
+    def _register(self, path):
+        with self.catalog:
+            cur = self.catalog.execute(
+                "INSERT INTO shards(path, day, opened_at) VALUES (?, ?, ?)",
+                (path, time.strftime("%Y-%m-%d", time.gmtime()), time.strftime(TS_FORMAT, time.gmtime())),
+            )
+        return cur.lastrowid
+
+    def _create(self):
+        day = time.strftime("%Y-%m-%d", time.gmtime())
+        with self.catalog:
+            cur = self.catalog.execute(
+                "INSERT INTO shards(path, day, opened_at) VALUES ('', ?, ?)",
+                (day, time.strftime(TS_FORMAT, time.gmtime())),
+            )
+            path = os.path.join(self.directory, f"audit-{day.replace('-', '')}-{cur.lastrowid:04d}.db")
+            self.catalog.execute("UPDATE shards SET path = ? WHERE id = ?", (path, cur.lastrowid))
+        return next(s for s in list_shards(self.catalog) if s.id == cur.lastrowid)
+
+    def _open_active(self, shard):
+        self.active = shard
+        self.conn = db.init_db(shard.path)
+        # max(id) alcanza como contador (los ids son crecientes) y no recorre la tabla
+        self.rows = self.conn.execute("SELECT coalesce(max(id), 0) FROM events_in").fetchone()[0]
+
+    def connection(self):
+        """Conexión del shard activo (rota antes si corresponde). Llamar entre transacciones."""
+        if self._should_rotate():
+            self.rotate()
+        return self.conn
+
+    def _should_rotate(self):
+        if not self.rows:
+            return False
+        if self.shard_by == "day" and time.strftime("%Y-%m-%d", time.gmtime()) != self.active.day:
+            return True
+        return bool(self.max_rows) and self.rows >= self.max_rows
+
+    def note_events(self, count):
+        self.rows += count
+
+    def rotate(self):
+        old = self.active
+        self.conn.close()
+        with self.catalog:
+            self.catalog.execute("UPDATE shards SET state = 'sealing' WHERE id = ?", (old.id,))
+        self._open_active(self._create())
+        print(f"[*] Shard {old.id} rotado; activo: {os.path.basename(self.active.path)}")
+        self._seal(old._replace(state="sealing"))
+
+    def _seal(self, shard):
+        if not self.seal_async:
+            seal_shard(self.directory, shard)
+            return
+        self.sealers = [t for t in self.sealers if t.is_alive()]
+        sealer = threading.Thread(target=self._run_sealer, args=(shard,), name="audit-shard-sealer", daemon=True)
+        sealer.start()
+        self.sealers.append(sealer)
+
+    def _run_sealer(self, shard):
+        try:
+            seal_shard(self.directory, shard)
+        except Exception as e:
+            print(f"[!] Error sellando shard {shard.id}: {e}")
+
+    def previous_shards(self):
+        """Los AUDIT_SHARD_LOOKBACK shards anteriores al activo, del más nuevo al más viejo."""
+        shards = [s for s in list_shards(self.catalog) if s.id < self.active.id]
+        return list(reversed(shards))[:self.lookback]
+
+    def resolve_external(self, event_ids, run_id="default"):
+        """{event_id: shard_id} de los eventos de la corrida run_id que están en shards previos."""
+        found = {}
+        pending = set(event_ids)
+        for shard in self.previous_shards():
+            if not pending:
+                break
+            conn = readonly_connection(shard.path)
+            try:
+                rows = conn.execute(
+                    """
+                    SELECT e.event_id FROM json_each(?) j
+                    JOIN events_in e ON e.event_id = j.value AND e.run_id = ?
+                    """,
+                    (json.dumps(list(pending)), run_id),
+                ).fetchall()
+            finally:
+                conn.close()
+            for (event_id,) in rows:
+                found[event_id] = shard.id
+            pending.difference_update(found)
+        return found
+
+    def previous_rollup(self, table, metric_id):
+        """
+        (revision, metrics_json, generations_json) de un roll-up en el shard
+        previo más nuevo que lo tenga, o None. Con AUDIT_SHARD_BY=rows un día
+        puede cruzar varios shards: cada fila nueva parte de la anterior.
+        """
+        for shard in self.previous_shards():
+            conn = readonly_connection(shard.path)
+            try:
+                row = conn.execute(
+                    f"SELECT revision, metrics_json, generations_json FROM {table} WHERE metric_id = ?",
+                    (metric_id,),
+                ).fetchone()
+            finally:
+                conn.close()
+            if row is not None:
+                return row
+        return None
+
+    def filter_new(self, rows):
+        """
+        Descarta filas de event_row que ya están en un shard previo (mismo
+        event_id y run_id). Solo se busca para eventos con timestamp anterior
+        a la apertura del shard activo.
+        """
+        older = {}
+        for row in rows:
+            if row[1] < self.active.opened_at:
+                older.setdefault(row[7], []).append(row[0])
+        if not older:
+            return rows
+        known = {(event_id, run_id) for run_id, event_ids in older.items()
+                 for event_id in self.resolve_external(event_ids, run_id)}
+        return [row for row in rows if (row[0], row[7]) not in known] if known else rows
+
+    def close(self):
+        self.conn.close()
+        for sealer in self.sealers:
+            sealer.join()
+        self.catalog.close()
@@ -0,0 +1,137 @@
+"""
+Backends de almacenamiento del Audit Service (AUDIT_STORAGE).
+
+  sqlite    una DB (AUDIT_DB_PATH) o shards por fecha (shards.py); un solo
+            writer por archivo
+  postgres  pgstorage.py: ingesta con COPY y pool de conexiones, varios
+            consumidores del Audit pueden escribir en paralelo
+
+Los dos exponen lo mismo al writer de main.py:
+
+  connection()            conexión para el próximo lote (entre transacciones;
+                          `with conn:` hace COMMIT / ROLLBACK, como sqlite3)
+  release(conn)           devolverla al terminar el lote (al pool, si hay)
+  store_events(conn, rows)            filas de db.event_row, sin COMMIT
+  store_metric_and_trace(conn, msg)   métrica + traza, sin COMMIT; si falta
+                                      un evento lanza IntegrityError
+  store_hourly_metric(conn, msg)      roll-up por hora (metrics.hourly), sin COMMIT
+  after_batch(n_events)   contadores / tareas después del commit
+  db_path                 archivo de la DB activa (None si no es un archivo)
+  maintenance_connection()  conexión para maintenance.py (None: no aplica)
+  close()
+  Error                   clase base de los errores de la DB (para el log)
+"""
+import sqlite3
+
+import db
+from payloadcodec import PayloadEncoder
+from shards import ShardStore
+
+BACKENDS = ("sqlite", "postgres")
+
+
+class SQLiteStorage:
+    name = "sqlite"
+    Error = sqlite3.Error
+
+    def __init__(self, db_path, shard_by="none", shard_dir=None, shard_max_rows=0, shard_lookback=1,
+                 payload_codec="json", compress_level=6, dict_sample=1000, seal_async=True):
+        self.payload_codec = payload_codec
+        self.compress_level = compress_level
+        self.dict_sample = dict_sample
+        self.encoder = None  # PayloadEncoder de la conexión actual si payload_codec = zlib
+        self.shard_store = None
+        self.conn = None
+        if shard_by == "none":
+            self.conn = db.init_db(db_path)
+            self._path = db_path
+        else:
+            # Un audit.db existente queda registrado como primer shard
+            self.shard_store = ShardStore(shard_dir, shard_by=shard_by, max_rows=shard_max_rows,
+                                          lookback=shard_lookback, legacy_db=db_path, seal_async=seal_async)
+
+    @property
+    def db_path(self):
+        return self.shard_store.active.path if self.shard_store is not None else self._path
+
+    def connection(self):
+        # Con shards, la rotación se hace acá, entre transacciones
+        conn = self.shard_store.connection() if self.shard_store is not None else self.conn
+        self._prepare_encoder(conn)
+        return conn
+
+    def release(self, conn):
+        pass  # la conexión es de larga vida (la usa solo el writer)
+
+    def maintenance_connection(self):
+        """Conexión del writer sin rotar shards."""
+        return self.shard_store.conn if self.shard_store is not None else self.conn
+
+    def store_events(self, conn, rows):
+        """Con shards, los eventos que ya están en un shard previo no se vuelven a insertar."""
+        if rows and self.shard_store is not None:
+            rows = self.shard_store.filter_new(rows)
+        if rows:
+            db.store_events(conn, rows, self.encoder)
+
+    def store_metric_and_trace(self, conn, metric_msg):
+        """
+        Con shards, la traza puede apuntar a eventos de shards previos
+        (trace_external) y una métrica nueva en el shard activo arranca desde
+        su fila en el shard previo.
+        """
+        if self.shard_store is None:
+            db.store_metric_and_trace(conn, metric_msg)
+            return
+        db.store_metric_and_trace(conn, metric_msg, self.shard_store.resolve_external,
+                                  self.shard_store.previous_rollup)
+
+    def store_hourly_metric(self, conn, metric_msg):
+        previous_rollup = self.shard_store.previous_rollup if self.shard_store is not None else None
+        db.store_hourly_metric(conn, metric_msg, previous_rollup)
+
+    def after_batch(self, n_events):
+        if self.shard_store is not None:
+            self.shard_store.note_events(n_events)
+        if self.encoder is not None:
+            try:
+                self.encoder.train_pending()
+            except sqlite3.Error as e:
+                print(f"[!] Error guardando diccionario de payloads: {e}")
+
+    def close(self):
+        if self.shard_store is not None:
+            self.shard_store.close()
+        elif self.conn is not None:
+            self.conn.close()
+
+    def _prepare_encoder(self, conn):
+        """
+        Encoder de payloads para la conexión del lote (fuera de la transacción:
+        al cambiar de shard copia sus diccionarios a la DB nueva).
+        """
+        if self.payload_codec == "json":
+            return
+        if self.encoder is None or self.encoder.conn is not conn:
+            self.encoder = PayloadEncoder(conn, self.compress_level, self.dict_sample, seed=self.encoder)
+
+
+def open_storage(settings):
+    """Backend según AUDIT_STORAGE (módulo settings del Audit)."""
+    if settings.AUDIT_STORAGE not in BACKENDS:
+        raise ValueError(f"AUDIT_STORAGE desconocido: {settings.AUDIT_STORAGE}")
+    if settings.AUDIT_STORAGE == "postgres":
+        if settings.AUDIT_SHARD_BY != "none":
+            raise ValueError("AUDIT_SHARD_BY no aplica con AUDIT_STORAGE=postgres")
+        from pgstorage import PostgresStorage  # psycopg2 solo hace falta con este backend
+        return PostgresStorage(settings.POSTGRES_DSN, settings.POSTGRES_POOL_SIZE, schema=settings.POSTGRES_SCHEMA)
+    return SQLiteStorage(
+        settings.AUDIT_DB_PATH,
+        shard_by=settings.AUDIT_SHARD_BY,
+        shard_dir=settings.AUDIT_SHARD_DIR,
+        shard_max_rows=settings.AUDIT_SHARD_MAX_ROWS,
+        shard_lookback=settings.AUDIT_SHARD_LOOKBACK,
+        payload_codec=settings.AUDIT_PAYLOAD_CODEC,
+        compress_level=settings.PAYLOAD_COMPRESS_LEVEL,
+        dict_sample=settings.PAYLOAD_DICT_SAMPLE,
+    )
@@ -0,0 +1,165 @@
+"""
+Difusión de las ventanas del Aggregator a los dashboards abiertos (SSE).
+
+El consumer de RabbitMQ llama a publish() una vez por ventana: el estado se
+serializa una sola vez (JSON y frame SSE ya armados) y todos los clientes
+comparten esos mismos bytes. No hay una cola por cliente: cada conexión
+espera en una Condition a que cambie la versión y manda la última ventana.
+Un cliente lento (o una conexión colgada) se saltea ventanas intermedias en
+vez de frenar al consumer, y publish() no depende de cuántos clientes hay.
+
+Lo mismo para GET /data: publish() deja listo el cuerpo (y sus versiones
+gzip / brotli) con un ETag por contenido, así que cada request solo elige
+bytes ya armados o contesta 304 si el navegador ya tiene esa ventana.
+"""
+import gzip
+import hashlib
+import json
+import threading
+
+HEARTBEAT = b": ping\n\n"  # comentario SSE: mantiene viva la conexión a través de proxies
+
+ENCODINGS = ("br", "gzip")  # Content-Encoding soportados, en orden de preferencia
+
+
+def import_brotli():
+    try:
+        import brotli
+    except ImportError:
+        raise SystemExit("[!] DATA_ENCODINGS=br requiere brotli (pip install brotli)")
+    return brotli
+
+
+def compress(payload, encoding):
+    if encoding == "gzip":
+        return gzip.compress(payload, 6, mtime=0)  # mtime fijo: mismos bytes para el mismo contenido
+    if encoding == "br":
+        return import_brotli().compress(payload, quality=5)
+    raise ValueError(f"Content-Encoding no soportado: {encoding}")
+
+
+def choose_encoding(accept_encoding, available):
+    """La codificación preferida entre `available` que acepta el header Accept-Encoding (None = identidad)."""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in ENCODINGS:
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def etag_matches(if_none_match, etag):
+    """Comparación débil de If-None-Match (lista de ETags o "*") contra el ETag actual."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    return any((tag.strip()[2:] if tag.strip().startswith("W/") else tag.strip()) == bare
+               for tag in if_none_match.split(","))
+
+
+class Broadcaster:
+
+    def __init__(self, initial=None, encodings=()):
+        unknown = set(encodings) - set(ENCODINGS)
+        if unknown:
+            raise ValueError(f"Content-Encoding no soportado: {', '.join(sorted(unknown))}")
+        if "br" in encodings:
+            import_brotli()
+        self.encodings = tuple(encodings)
+        self.cond = threading.Condition()
+        self.version = 0
+        self.subscribers = 0
+        self.published = 0
+        self._set(initial if initial is not None else {})
+
+    def publish(self, state):
+        """Nueva ventana: serializa una vez y despierta a los clientes. Devuelve la versión."""
+        payload = json.dumps(state, ensure_ascii=False).encode("utf-8")
+        encoded = {encoding: compress(payload, encoding) for encoding in self.encodings}
+        with self.cond:
+            self.version += 1
+            self.published += 1
+            self._store(state, payload, encoded)
+            self.cond.notify_all()
+            return self.version
+
+    def snapshot(self):
+        """(versión, estado, JSON en bytes, frame SSE) de la última ventana."""
+        with self.cond:
+            return self.version, self.state, self.payload, self.frame
+
+    def representation(self, accept_encoding=None):
+        """(ETag, cuerpo, Content-Encoding o None) de la última ventana para GET /data."""
+        with self.cond:
+            encoding = choose_encoding(accept_encoding, self.encoded)
+            return self.etag, self.encoded[encoding] if encoding else self.payload, encoding
+
+    def wait(self, seen, timeout=None):
+        """
+        Espera una versión distinta de `seen` (también si el servidor se
+        reinició y el cliente trae un Last-Event-ID mayor). Devuelve
+        (versión, frame) o None si vence el timeout.
+        """
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.version != seen, timeout):
+                return None
+            return self.version, self.frame
+
+    def stream(self, last_version=None, heartbeat=15.0):
+        """
+        Generador de una conexión SSE: la ventana actual (si el cliente no la
+        tiene) y después cada ventana nueva; un heartbeat cada `heartbeat` s.
+        """
+        with self.cond:
+            self.subscribers += 1
+        try:
+            yield b"retry: 3000\n\n"
+            seen = last_version
+            if seen is None:
+                seen, _, _, frame = self.snapshot()
+                yield frame
+            while True:
+                update = self.wait(seen, heartbeat)
+                if update is None:
+                    yield HEARTBEAT
+                    continue
+                seen, frame = update
+                yield frame
+        finally:
+            with self.cond:
+                self.subscribers -= 1
+
+    def stats(self):
+        with self.cond:
+            return {"version": self.version, "subscribers": self.subscribers, "published": self.published}
+
+    def _set(self, state):
+        payload = json.dumps(state, ensure_ascii=False).encode("utf-8")
+        self._store(state, payload, {encoding: compress(payload, encoding) for encoding in self.encodings})
+
+    def _store(self, state, payload, encoded):
+        self.state = state
+        self.payload = payload
+        self.encoded = encoded
+        # Por contenido (no por versión): sigue valiendo después de reiniciar el dashboard.
+        # Débil porque se comparte entre las codificaciones del mismo JSON
+        self.etag = 'W/"%s"' % hashlib.blake2b(payload, digest_size=8).hexdigest()
+        self.frame = b"id: %d\nevent: window\ndata: %s\n\n" % (self.version, payload)
+
+
+def parse_last_event_id(value):
+    """Header Last-Event-ID de una reconexión de EventSource (None si falta o no es un número)."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
@@ -2,17 +2,19 @@ import json
 import threading
 import time
 import pika
-from flask import Flask, render_template, jsonify
+from flask import Flask, Response, render_template, jsonify, request
 import settings
+from livefeed import Broadcaster, etag_matches, parse_last_event_id
 
 app = Flask(__name__)
 
-# --- ESTADO GLOBAL (Memoria compartida entre hilos) ---
-current_state = {
+# --- ESTADO COMPARTIDO ENTRE HILOS ---
+# Última ventana pre-serializada para /data y /stream (una serialización y compresión por ventana)
+feed = Broadcaster({
     "status": "waiting",
     "last_update": None,
     "stats_by_region": {}
-}
+}, encodings=settings.DATA_ENCODINGS)
 
 # --- RABBITMQ CONSUMER (Background Thread) ---
 def start_consumer():
@@ -29,16 +31,18 @@ def start_consumer():
             result = channel.queue_declare(queue='', exclusive=True) 
             queue_name = result.method.queue
 
-            channel.queue_bind(exchange=settings.INPUT_EXCHANGE, queue=queue_name, routing_key="#")
+            # Solo resúmenes de ventana (metrics.daily y resultados de shards no son para el dashboard)
+            channel.queue_bind(exchange=settings.INPUT_EXCHANGE, queue=queue_name, routing_key=settings.ROUTING_KEY)
 
             print("[*] Dashboard escuchando actualizaciones...")
 
             def callback(ch, method, properties, body):
-                global current_state
                 try:
                     data = json.loads(body)
-                    # Actualizamos el estado global que lee Flask
-                    current_state = data
+                    if data.get("run_id", "default") != settings.RUN_ID:
+                        return  # ventana de otra corrida (replay)
+                    # Actualizamos el estado que lee Flask y avisamos a los clientes SSE
+                    feed.publish(data)
                     print(" [D] Dashboard actualizado con nueva ventana.")
                 except Exception as e:
                     print(f"Error parseando dashboard data: {e}")
@@ -57,7 +61,30 @@ def index():
 
 @app.route('/data')
 def get_data():
-    return jsonify(current_state)
+    """Bytes ya armados por el consumer; 304 si el navegador ya tiene esta ventana"""
+    etag, body, encoding = feed.representation(request.headers.get('Accept-Encoding'))
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return Response(status=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(body, mimetype='application/json', headers=headers)
+
+@app.route('/stream')
+def stream():
+    """Server-Sent Events: cada ventana nueva se empuja a todos los dashboards abiertos"""
+    last_version = parse_last_event_id(request.headers.get('Last-Event-ID'))
+    if feed.subscribers >= settings.STREAM_MAX_CLIENTS:
+        return Response("demasiados clientes, usar /data", status=503, headers={"Retry-After": "10"})
+    return Response(
+        feed.stream(last_version, heartbeat=settings.STREAM_HEARTBEAT_SECONDS),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route('/stream/stats')
+def stream_stats():
+    return jsonify(feed.stats())
 
 def main():
     # 1. Iniciar Consumer en un hilo aparte (Daemon muere cuando muere el main)
@@ -66,7 +93,8 @@ def main():
 
     # 2. Iniciar Web Server (Bloqueante)
     print(f"[*] Web Server corriendo en puerto {settings.WEB_PORT}")
-    app.run(host='0.0.0.0', port=settings.WEB_PORT, debug=False)
+    # threaded: cada conexión de /stream ocupa un hilo que pasa casi todo el tiempo esperando
+    app.run(host='0.0.0.0', port=settings.WEB_PORT, debug=False, threaded=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
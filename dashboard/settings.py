@@ -7,6 +7,18 @@ RABBIT_PORT = int(os.getenv('RABBITMQ_PORT', 5672))
 # Escuchamos los resúmenes del Aggregator
 INPUT_EXCHANGE = 'analytics_exchange'
 QUEUE_NAME = 'dashboard_queue'
+ROUTING_KEY = 'analytics.window'
+# Corrida que se muestra: los resúmenes de un replay traen otro run_id
+RUN_ID = os.getenv('DASHBOARD_RUN_ID', 'default')
 
 # Configuración Web
-WEB_PORT = int(os.getenv('WEB_PORT', 5000))
\ No newline at end of file
+WEB_PORT = int(os.getenv('WEB_PORT', 5000))
+
+# Push de ventanas por SSE (/stream): heartbeat para proxies y tope de conexiones
+# abiertas (pasado el tope, el navegador vuelve al polling de /data)
+STREAM_HEARTBEAT_SECONDS = float(os.getenv('STREAM_HEARTBEAT_SECONDS', 15))
+STREAM_MAX_CLIENTS = int(os.getenv('STREAM_MAX_CLIENTS', 500))
+
+# Codificaciones de /data preparadas una vez por ventana (gzip, br; vacío = sin comprimir).
+# br requiere el paquete brotli
+DATA_ENCODINGS = tuple(e.strip() for e in os.getenv('DATA_ENCODINGS', 'gzip').split(',') if e.strip())
@@ -8,4 +8,4 @@ if [ -z "$(docker compose ps -q audit)" ]; then
 fi
 
 # Ejecutamos el script interno
-docker compose exec audit python replay.py
\ No newline at end of file
+docker compose exec audit python replay.py "$@"
\ No newline at end of file
@@ -47,8 +47,9 @@ sleep 10
 
 print_header "FASE 4: VERIFICACIÓN DE AUDITORÍA"
 echo "Verificando logs guardados..."
-if [ -f "data/audit_log.jsonl" ]; then
-    lines=$(wc -l < data/audit_log.jsonl)
+if ls data/audit_log*.jsonl* >/dev/null 2>&1; then
+    # Cuenta el segmento activo y los rotados (usa los índices de los sellados)
+    lines=$(docker compose exec -T audit python logsegments.py count)
     echo "[OK] Archivo de auditoría encontrado con $lines eventos procesados."
 else
     echo "[ERROR] No se encontró el archivo de auditoría."
@@ -0,0 +1,10 @@
+#!/bin/bash
+echo "--- Iniciando Aggregator Particionado (2 shards + merge) ---"
+
+# El Validator reparte los eventos en 2 particiones por región (hashing consistente)
+# y cada shard del Aggregator publica parciales que combina aggregator_merge.
+export PARTITIONS=2
+export PARTITION_KEY=${PARTITION_KEY:-region}
+export MERGE_SHARDS=true
+
+docker compose --profile partitioned up --build
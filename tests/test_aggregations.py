@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Tests para las agregaciones configurables del payload (aggregations.py)
+"""
+
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "aggregator"))
+
+from aggregations import AggregationPlan, WindowAggregations, bucket_labels, make_getter  # noqa: E402
+from windows import build_window_result, merge_window_results  # noqa: E402
+
+SPECS = [
+    {"name": "by_type_severity", "source": "security.incident", "kind": "count",
+     "by": ["payload.crime_type", "payload.severity"]},
+    {"name": "age", "source": "survey.victimization", "kind": "histogram",
+     "field": "payload.respondent_age", "buckets": [18, 30, 60]},
+    {"name": "reported", "source": "survey.victimization", "kind": "ratio",
+     "field": "payload.reported"},
+    {"name": "by_source", "kind": "count", "by": ["source"]},
+]
+
+
+def incident(crime_type, severity):
+    return {"source": "security.incident", "payload": {"crime_type": crime_type, "severity": severity}}
+
+
+def survey(age, reported):
+    return {"source": "survey.victimization", "payload": {"respondent_age": age, "reported": reported}}
+
+
+class TestAggregations(unittest.TestCase):
+    """Tests para specs compiladas y su estado por ventana"""
+
+    def setUp(self):
+        self.plan = AggregationPlan(SPECS)
+        self.window = WindowAggregations(self.plan)
+
+    def feed(self, region, events):
+        for event in events:
+            self.window.update(region, event["source"], event)
+
+    def test_getter_paths(self):
+        """Test de getters compilados para paths con puntos"""
+        event = {"a": 1, "payload": {"b": 2, "c": {"d": 3}}}
+        self.assertEqual(make_getter("a")(event), 1)
+        self.assertEqual(make_getter("payload.b")(event), 2)
+        self.assertEqual(make_getter("payload.c.d")(event), 3)
+        self.assertIsNone(make_getter("payload.x.y")(event))
+
+    def test_bucket_labels(self):
+        """Test de etiquetas de histograma"""
+        self.assertEqual(bucket_labels([18, 30]), ["<18", "18-29", ">=30"])
+
+    def test_single_pass_results(self):
+        """Test que todas las specs se evalúan en la misma pasada"""
+        self.feed("norte", [incident("theft", "high"), incident("theft", "high"),
+                            survey(25, True), survey(70, False), survey(40, True)])
+
+        result = self.plan.finalize_wire(self.window.to_wire())["norte"]
+
+        self.assertEqual(result["by_type_severity"], {"theft|high": 2})
+        self.assertEqual(result["age"], {"18-29": 1, ">=60": 1, "30-59": 1})
+        self.assertEqual(result["reported"], {"true": 2, "false": 1, "ratio": 0.6667})
+        self.assertEqual(result["by_source"], {"security.incident": 2, "survey.victimization": 3})
+
+    def test_unknown_kind(self):
+        """Test que un tipo de agregación desconocido falla al compilar"""
+        with self.assertRaises(ValueError):
+            AggregationPlan([{"name": "x", "kind": "median", "field": "a"}])
+
+    def test_merge_across_shards(self):
+        """Test que los estados de dos shards se combinan sumando"""
+        self.feed("sur", [survey(20, True)])
+        a = build_window_result(0, 1, 1, {"sur": {"survey.victimization": 1}}, {"sur": {"e1"}},
+                                self.window.to_wire())
+        self.window.reset()
+        self.feed("sur", [survey(21, False)])
+        b = build_window_result(0, 2, 1, {"sur": {"survey.victimization": 1}}, {"sur": {"e2"}},
+                                self.window.to_wire())
+
+        merged = merge_window_results([a, b], self.plan)
+        result = self.plan.finalize_wire(merged["aggregations_by_region"])["sur"]
+
+        self.assertEqual(result["age"], {"18-29": 2})
+        self.assertEqual(result["reported"]["ratio"], 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Tests para el detector de anomalías EWMA del Aggregator (anomaly.py)
+"""
+
+import os
+import random
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "aggregator"))
+
+from anomaly import EwmaDetector  # noqa: E402
+from windows import build_window_result, merge_window_results  # noqa: E402
+
+
+def window(i, stats, duration=5.0):
+    return {"window_start": i * duration, "window_end": (i + 1) * duration, "stats_by_region": stats}
+
+
+class TestEwmaDetector(unittest.TestCase):
+    """Tests para EwmaDetector"""
+
+    def setUp(self):
+        self.rng = random.Random(11)
+        self.detector = EwmaDetector(alpha=0.1, threshold=4.0, warmup=10)
+
+    def steady(self, n, level=10):
+        for i in range(n):
+            count = self.rng.randint(level - level // 10, level + level // 10)
+            alerts = self.detector.check_window(window(i, {"norte": {"security.incident": count}}))
+            self.assertEqual(alerts, [])
+
+    def test_no_alerts_during_warmup_and_steady_state(self):
+        """Test que tráfico estable no genera alertas"""
+        self.steady(40)
+
+    def test_burst_raises_spike(self):
+        """Test que una ráfaga genera una alerta spike"""
+        self.steady(30)
+        alerts = self.detector.check_window(window(30, {"norte": {"security.incident": 80}}))
+
+        self.assertEqual(len(alerts), 1)
+        self.assertEqual(alerts[0]["direction"], "spike")
+        self.assertEqual(alerts[0]["region"], "norte")
+        self.assertEqual(alerts[0]["observed"], 80)
+
+    def test_missing_cell_counts_as_drop(self):
+        """Test que una celda que deja de recibir eventos genera una alerta drop"""
+        self.steady(30, level=100)
+        alerts = self.detector.check_window(window(30, {"sur": {"migration.case": 1}}))
+
+        drops = [a for a in alerts if a["region"] == "norte"]
+        self.assertEqual(len(drops), 1)
+        self.assertEqual(drops[0]["direction"], "drop")
+
+    def test_idle_window_counts_as_drop(self):
+        """Test que una ventana sin tráfico (stats_by_region vacío, como el cierre ocioso) genera drop en cada celda"""
+        self.steady(30, level=100)
+        idle = build_window_result(150.0, 155.0, 0, {}, {})
+        alerts = self.detector.check_window(idle)
+
+        self.assertEqual([(a["region"], a["direction"], a["observed"]) for a in alerts], [("norte", "drop", 0)])
+
+    def test_rates_are_normalized_by_duration(self):
+        """Test que una ventana el doble de larga con el doble de eventos no es anómala"""
+        self.steady(30)
+        alerts = self.detector.check_window(window(15, {"norte": {"security.incident": 20}}, duration=10.0))
+        self.assertEqual(alerts, [])
+
+
+    def test_catchup_windows_freeze_baselines(self):
+        """Test que las ventanas con backlog de catch-up no alertan ni mueven las líneas base"""
+        self.steady(30)
+        baselines = {key: list(value) for key, value in self.detector.baselines.items()}
+        for i in range(30, 40):  # drenando la cola: 6x el tráfico normal y una región nueva
+            backlog = window(i, {"norte": {"security.incident": 60}, "sur": {"migration.case": 30}})
+            self.assertEqual(self.detector.check_window(backlog, frozen=True), [])
+        self.assertEqual(self.detector.baselines, baselines)
+        # Al volver al modo normal se compara contra la línea base de antes del backlog
+        self.assertEqual(self.detector.check_window(window(40, {"norte": {"security.incident": 10}})), [])
+        alerts = self.detector.check_window(window(41, {"norte": {"security.incident": 80}}))
+        self.assertEqual([a["direction"] for a in alerts], ["spike"])
+
+    def test_backlog_flag_survives_shard_merge(self):
+        """Test que si un shard estaba en catch-up el resultado combinado queda marcado"""
+        normal = build_window_result(0.0, 5.0, 1, {"norte": {"security.incident": 1}}, {"norte": {"a"}})
+        backlog = build_window_result(0.0, 5.0, 1, {"sur": {"security.incident": 1}}, {"sur": {"b"}}, backlog=True)
+        self.assertFalse(merge_window_results([normal, normal])["backlog"])
+        self.assertTrue(merge_window_results([normal, backlog])["backlog"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Tests para el esquema normalizado y las migraciones del Audit Service (db.py)
+"""
+
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import unittest
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "audit"))
+
+import db  # noqa: E402
+
+LEGACY_SCHEMA = """
+CREATE TABLE events_in (
+  event_id TEXT PRIMARY KEY, timestamp TEXT NOT NULL, region TEXT NOT NULL, source TEXT NOT NULL,
+  schema_version TEXT, correlation_id TEXT, payload_json TEXT NOT NULL,
+  run_id TEXT DEFAULT 'default', inserted_at TEXT DEFAULT (datetime('now'))
+);
+CREATE TABLE metrics_out (
+  metric_id TEXT PRIMARY KEY, date TEXT NOT NULL, region TEXT NOT NULL,
+  run_id TEXT DEFAULT 'default', metrics_json TEXT NOT NULL, created_at TEXT DEFAULT (datetime('now'))
+);
+CREATE TABLE trace (
+  event_id TEXT NOT NULL, metric_id TEXT NOT NULL, contribution_type TEXT DEFAULT 'window_member',
+  PRIMARY KEY (event_id, metric_id),
+  FOREIGN KEY (event_id) REFERENCES events_in(event_id),
+  FOREIGN KEY (metric_id) REFERENCES metrics_out(metric_id)
+);
+"""
+
+
+class AuditDbTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "audit.db")
+        rng = random.Random(7)
+        self.ids = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(20)]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def event(self, event_id):
+        return {"event_id": event_id, "timestamp": "2025-01-01T00:00:00Z", "region": "norte",
+                "source": "incident.created", "payload": {"a": 1}}
+
+
+class TestNormalizedSchema(AuditDbTestCase):
+    """Tests para la traza con rowids enteros"""
+
+    def setUp(self):
+        super().setUp()
+        self.conn = db.init_db(self.path)
+        with self.conn:
+            db.store_events(self.conn, [db.event_row(self.event(i), "default") for i in self.ids])
+
+    def tearDown(self):
+        self.conn.close()
+        super().tearDown()
+
+    def test_fresh_db_version(self):
+        """Test que una DB nueva queda en la última versión del esquema"""
+        self.assertEqual(db.schema_version(self.conn), db.SCHEMA_VERSION)
+        self.assertEqual(self.conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2)  # INCREMENTAL
+
+    def test_fresh_schema_matches_migrated(self):
+        """Test que una DB nueva se crea sin migraciones y queda igual que una v2 migrada"""
+        def shape(conn):
+            objects = conn.execute("SELECT type, name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'").fetchall()
+            return {(kind, name, tuple(conn.execute(f"PRAGMA table_info({name})").fetchall()) if kind == "table" else ())
+                    for kind, name in objects}
+
+        fresh = sqlite3.connect(os.path.join(self.dir.name, "fresh.db"))
+        self.assertEqual(db.migrate(fresh), 0)
+        migrated = sqlite3.connect(os.path.join(self.dir.name, "v2.db"))
+        with migrated:
+            db.create_schema_v2(migrated)
+            migrated.execute("PRAGMA user_version = 2")
+        self.assertEqual(db.migrate(migrated), db.SCHEMA_VERSION - 2)
+        self.assertEqual(shape(fresh), shape(migrated))
+        fresh.close()
+        migrated.close()
+
+    def test_bulk_trace(self):
+        """Test que la traza se inserta completa y se lee con los ids de texto"""
+        with self.conn:
+            db.store_metric_and_trace(self.conn, {"metric_id": "m1", "date": "2025-01-01", "region": "norte",
+                                                  "metrics": {"x": 20}, "input_event_ids": self.ids + self.ids[:3]})
+        rows = self.conn.execute("SELECT event_id FROM trace_view WHERE metric_id = 'm1'").fetchall()
+        self.assertEqual(sorted(r[0] for r in rows), sorted(self.ids))
+
+    def test_missing_event_rolls_back_metric(self):
+        """Test que una traza con eventos no auditados revierte la métrica"""
+        with self.assertRaises(sqlite3.IntegrityError):
+            with self.conn:
+                db.store_metric_and_trace(self.conn, {"metric_id": "m2", "date": "2025-01-01", "region": "norte",
+                                                      "metrics": {}, "input_event_ids": self.ids[:2] + ["no-existe"]})
+        self.assertEqual(self.conn.execute("SELECT count(*) FROM metrics_out").fetchone()[0], 0)
+        self.assertEqual(self.conn.execute("SELECT count(*) FROM trace").fetchone()[0], 0)
+
+    def test_replay_run_is_stored_apart(self):
+        """Test que un evento reinyectado con otro run_id se guarda aparte y la traza usa la fila de su corrida"""
+        with self.conn:
+            db.store_events(self.conn, [db.event_row(self.event(i), "replay-1") for i in self.ids[:3]])
+            db.store_events(self.conn, [db.event_row(self.event(self.ids[0]), "replay-1")])  # reentrega
+            db.store_metric_and_trace(self.conn, {"metric_id": "m3", "date": "2025-01-01", "region": "norte",
+                                                  "run_id": "replay-1", "metrics": {}, "input_event_ids": self.ids[:3]})
+        self.assertEqual(self.conn.execute("SELECT count(*) FROM events_in").fetchone()[0], 23)
+        runs = self.conn.execute(
+            "SELECT DISTINCT e.run_id FROM trace t JOIN events_in e ON e.id = t.event_rowid"
+        ).fetchall()
+        self.assertEqual(runs, [("replay-1",)])
+        # Un evento de la corrida original no resuelve la traza de otra corrida
+        with self.assertRaises(sqlite3.IntegrityError):
+            with self.conn:
+                db.store_metric_and_trace(self.conn, {"metric_id": "m4", "date": "2025-01-01", "region": "norte",
+                                                      "run_id": "replay-1", "metrics": {},
+                                                      "input_event_ids": self.ids[5:6]})
+
+
+class TestRollupGenerations(AuditDbTestCase):
+    """Tests para el upsert de roll-ups cuando el Aggregator se reinicia"""
+
+    def setUp(self):
+        super().setUp()
+        self.conn = db.init_db(self.path)
+        with self.conn:
+            db.store_events(self.conn, [db.event_row(self.event(i), "default") for i in self.ids])
+
+    def tearDown(self):
+        self.conn.close()
+        super().tearDown()
+
+    def rollup(self, generation, revision, count, event_ids):
+        return {"metric_id": "d1", "date": "2025-01-01", "region": "norte", "generation": generation,
+                "revision": revision, "metrics": {"security.incident": count}, "input_event_ids": event_ids}
+
+    def stored(self, table="metrics_out"):
+        revision, metrics = self.conn.execute(
+            f"SELECT revision, metrics_json FROM {table} WHERE metric_id = 'd1'").fetchone()
+        return revision, json.loads(metrics)
+
+    def test_restart_mid_day_keeps_totals(self):
+        """Test que tras un reinicio a mitad del día la revision 1 de la nueva generación suma y no pisa"""
+        with self.conn:
+            for revision in (1, 2, 3):  # generación A: acumulado 2, 4, 6
+                db.store_metric_and_trace(self.conn, self.rollup("A", revision, 2 * revision,
+                                                                 self.ids[2 * revision - 2:2 * revision]))
+        self.assertEqual(self.stored(), (3, {"security.incident": 6}))
+        with self.conn:  # reinicio: generación B arranca de cero
+            db.store_metric_and_trace(self.conn, self.rollup("B", 1, 1, self.ids[6:7]))
+        self.assertEqual(self.stored(), (4, {"security.incident": 7}))
+        with self.conn:  # redelivery de A y mensaje viejo de B: no cambian la fila
+            db.store_metric_and_trace(self.conn, self.rollup("A", 2, 4, self.ids[2:4]))
+            db.store_metric_and_trace(self.conn, self.rollup("B", 1, 1, self.ids[6:7]))
+            db.store_metric_and_trace(self.conn, self.rollup("B", 2, 3, self.ids[7:9]))
+        self.assertEqual(self.stored(), (5, {"security.incident": 9}))
+        self.assertEqual(self.conn.execute("SELECT count(*) FROM trace").fetchone()[0], 9)
+
+    def test_legacy_row_is_kept_as_a_generation(self):
+        """Test que una fila previa a las generaciones se conserva al llegar una generación nueva"""
+        with self.conn:
+            legacy = self.rollup(None, 2, 5, self.ids[:5])
+            del legacy["generation"]
+            db.store_metric_and_trace(self.conn, legacy)
+            self.conn.execute("UPDATE metrics_out SET generations_json = NULL")  # como una fila anterior a v9
+            db.store_metric_and_trace(self.conn, self.rollup("A", 1, 2, self.ids[5:7]))
+        self.assertEqual(self.stored(), (3, {"security.incident": 7}))
+
+    def test_hourly_rollup_is_stored(self):
+        """Test que metrics.hourly se guarda en metrics_hourly con el mismo upsert por generación"""
+        msg = dict(self.rollup("A", 1, 2, []), hour="2025-01-01T10", granularity="hour")
+        with self.conn:
+            db.store_hourly_metric(self.conn, msg)
+            db.store_hourly_metric(self.conn, dict(msg, generation="B"))
+        self.assertEqual(self.stored("metrics_hourly"), (2, {"security.incident": 4}))
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(metrics_hourly)")}
+        self.assertNotIn("change_seq", columns)  # el watermark de export.py es solo de metrics_out
+        self.assertEqual(self.conn.execute("SELECT count(*) FROM metrics_out").fetchone()[0], 0)
+
+
+class TestLegacyMigration(AuditDbTestCase):
+    """Tests para la migración desde el esquema de ids de texto"""
+
+    def test_migrates_legacy_db(self):
+        """Test que eventos, métricas y traza sobreviven a la migración"""
+        legacy = sqlite3.connect(self.path)
+        legacy.executescript(LEGACY_SCHEMA)
+        legacy.executemany(
+            "INSERT INTO events_in(event_id, timestamp, region, source, payload_json) VALUES (?, 't', 'norte', 's', '{}')",
+            [(i,) for i in self.ids],
+        )
+        legacy.execute("INSERT INTO metrics_out(metric_id, date, region, metrics_json) VALUES ('m1', 'd', 'norte', '{}')")
+        legacy.executemany("INSERT INTO trace(event_id, metric_id) VALUES (?, 'm1')", [(i,) for i in self.ids[:5]])
+        legacy.commit()
+        legacy.close()
+
+        conn = db.init_db(self.path)
+        self.assertEqual(db.schema_version(conn), db.SCHEMA_VERSION)
+        self.assertEqual(conn.execute("SELECT count(*) FROM events_in").fetchone()[0], 20)
+        self.assertEqual(conn.execute("SELECT revision FROM metrics_out").fetchone()[0], 0)
+        rows = conn.execute("SELECT event_id FROM trace_view WHERE metric_id = 'm1'").fetchall()
+        self.assertEqual(sorted(r[0] for r in rows), sorted(self.ids[:5]))
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.assertFalse(any(t.endswith("_v1") for t in tables))
+        self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+        conn.close()
+
+        # Reabrir no vuelve a migrar
+        conn = db.init_db(self.path)
+        self.assertEqual(db.migrate(conn), 0)
+        conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
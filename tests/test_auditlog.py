@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Tests para el log JSONL con buffer del Audit Service (auditlog.py)
+"""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "audit"))
+
+from auditlog import AuditLogWriter, format_record  # noqa: E402
+
+TS = "2025-01-01T00:00:00"
+
+
+class TestFormatRecord(unittest.TestCase):
+    """Tests para el formato de cada línea"""
+
+    def test_raw_body_is_embedded(self):
+        """Test que el body se escribe sin re-serializar"""
+        body = b'{"event_id": "e1",  "payload": {"x": "\xc3\xb1"}}'
+        line = format_record(body, TS)
+        self.assertTrue(line.endswith(b"}\n"))
+        self.assertIn(body, line)
+        entry = json.loads(line)
+        self.assertEqual(entry["audit_timestamp"], TS)
+        self.assertEqual(entry["event_content"], {"event_id": "e1", "payload": {"x": "ñ"}})
+
+    def test_multiline_body_is_reencoded(self):
+        """Test que un body con saltos de línea queda en una sola línea"""
+        body = json.dumps({"event_id": "e1", "payload": {"a": 1}}, indent=2).encode()
+        line = format_record(body, TS)
+        self.assertEqual(line.count(b"\n"), 1)
+        self.assertEqual(json.loads(line)["event_content"]["payload"], {"a": 1})
+
+
+class TestAuditLogWriter(unittest.TestCase):
+    """Tests para el volcado por tamaño, tiempo y cierre"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "audit_log.jsonl")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def lines(self):
+        with open(self.path, "rb") as f:
+            return f.read().splitlines()
+
+    def test_buffers_until_flush_bytes(self):
+        """Test que no se escribe hasta superar flush_bytes"""
+        writer = AuditLogWriter(self.path, flush_bytes=200, flush_interval=60)
+        writer.write(b'{"n": 1}', TS)
+        self.assertEqual(self.lines(), [])
+        for n in range(2, 6):
+            writer.write(b'{"n": %d}' % n, TS)
+        self.assertGreater(len(self.lines()), 0)
+        writer.close()
+        self.assertEqual([json.loads(l)["event_content"]["n"] for l in self.lines()], [1, 2, 3, 4, 5])
+
+    def test_interval_flush(self):
+        """Test que maybe_flush vuelca cuando venció el intervalo"""
+        writer = AuditLogWriter(self.path, flush_interval=0)
+        writer.write(b'{"n": 1}', TS)
+        writer.maybe_flush()
+        self.assertEqual(len(self.lines()), 1)
+        writer.close()
+
+    def test_batch_sync(self):
+        """Test que con fsync=batch sync() vuelca el buffer"""
+        writer = AuditLogWriter(self.path, flush_interval=60, fsync="batch")
+        writer.write(b'{"n": 1}', TS)
+        writer.sync()
+        self.assertEqual(len(self.lines()), 1)
+        writer.close()
+
+    def test_unknown_fsync_policy(self):
+        """Test que una política de fsync desconocida es un error"""
+        with self.assertRaises(ValueError):
+            AuditLogWriter(self.path, fsync="siempre")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Tests para el modo catch-up del Aggregator (catchup.py)
+"""
+
+import os
+import sys
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "aggregator"))
+
+from catchup import CATCHUP, NORMAL, CatchUpController, bulk_decode, event_lag  # noqa: E402
+
+
+class TestCatchUpController(unittest.TestCase):
+    """Tests para la histéresis del controlador"""
+
+    def setUp(self):
+        self.controller = CatchUpController(enter_lag=30, exit_lag=5, enter_depth=5000, exit_depth=500)
+
+    def test_enters_on_lag(self):
+        """Test que un lag alto activa el modo catch-up"""
+        self.assertIsNone(self.controller.observe(lag=2))
+        self.assertEqual(self.controller.observe(lag=45), CATCHUP)
+        self.assertTrue(self.controller.catching_up)
+
+    def test_enters_on_depth(self):
+        """Test que una cola profunda activa el modo catch-up"""
+        self.assertEqual(self.controller.observe(depth=10000), CATCHUP)
+
+    def test_hysteresis(self):
+        """Test que no sale hasta que lag y profundidad bajan de los umbrales de salida"""
+        self.controller.observe(lag=60, depth=8000)
+        self.assertIsNone(self.controller.observe(lag=10))        # lag aún sobre exit_lag
+        self.assertIsNone(self.controller.observe(lag=1))         # cola aún profunda
+        self.assertEqual(self.controller.observe(depth=100), NORMAL)
+
+
+class TestCatchUpHelpers(unittest.TestCase):
+    """Tests para lag y decodificación en bloque"""
+
+    def test_event_lag(self):
+        """Test de lag calculado desde el timestamp UTC del evento"""
+        now = time.time()
+        stamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now - 120))
+        self.assertAlmostEqual(event_lag({"timestamp": stamp}, now), 120, delta=1)
+        self.assertIsNone(event_lag({"timestamp": "ayer"}))
+        self.assertIsNone(event_lag({}))
+
+    def test_bulk_decode(self):
+        """Test que el lote se decodifica en un solo paso"""
+        events, errors = bulk_decode([b'{"event_id": "a"}', b'{"event_id": "b"}'])
+        self.assertEqual([e["event_id"] for e in events], ["a", "b"])
+        self.assertEqual(errors, 0)
+
+    def test_bulk_decode_isolates_corrupt_messages(self):
+        """Test que un mensaje corrupto no invalida el resto del lote"""
+        events, errors = bulk_decode([b'{"event_id": "a"}', b'no json', b'{"event_id": "c"}', b'3'])
+        self.assertEqual([e["event_id"] for e in events], ["a", "c"])
+        self.assertEqual(errors, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Tests para la matriz de contadores del Aggregator (counters.py)
+"""
+
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "aggregator"))
+
+from counters import CounterMatrix  # noqa: E402
+
+REGIONS = ["norte", "sur", "centro", "este", "oeste"]
+SOURCES = ["security.incident", "survey.victimization", "migration.case"]
+
+
+class TestCounterMatrix(unittest.TestCase):
+    """Tests para CounterMatrix"""
+
+    def setUp(self):
+        self.matrix = CounterMatrix(REGIONS, SOURCES)
+
+    def test_empty_matrix(self):
+        """Test que una matriz nueva está vacía y serializa a {}"""
+        self.assertTrue(self.matrix.is_empty())
+        self.assertEqual(self.matrix.to_dict(), {})
+
+    def test_add_matches_dict_shape(self):
+        """Test que to_dict reproduce la forma JSON histórica sin ceros"""
+        self.matrix.add("norte", "security.incident")
+        self.matrix.add("norte", "security.incident")
+        self.matrix.add("sur", "migration.case")
+
+        self.assertEqual(self.matrix.to_dict(), {
+            "norte": {"security.incident": 2},
+            "sur": {"migration.case": 1},
+        })
+        self.assertEqual(self.matrix.total(), 3)
+
+    def test_unknown_values_are_interned(self):
+        """Test que región/fuente desconocidas amplían la matriz sin perder conteos"""
+        self.matrix.add("norte", "security.incident")
+        self.matrix.add("unknown", "unknown")
+        self.matrix.add("norte", "unknown")
+
+        self.assertEqual(self.matrix.to_dict(), {
+            "norte": {"security.incident": 1, "unknown": 1},
+            "unknown": {"unknown": 1},
+        })
+
+    def test_add_batch(self):
+        """Test que el incremento en bloque equivale a incrementos individuales"""
+        pairs = [("norte", "security.incident")] * 3 + [("este", "survey.victimization"), ("x", "y")]
+        self.matrix.add_batch(pairs)
+
+        expected = CounterMatrix(REGIONS, SOURCES)
+        for region, source in pairs:
+            expected.add(region, source)
+        self.assertEqual(self.matrix.to_dict(), expected.to_dict())
+
+    def test_snapshot_and_reset(self):
+        """Test que el snapshot no cambia tras reset y la matriz queda en cero"""
+        self.matrix.add("oeste", "migration.case")
+        snapshot = self.matrix.snapshot()
+        self.matrix.reset()
+        self.matrix.add("norte", "migration.case")
+
+        self.assertEqual(self.matrix.to_dict(snapshot), {"oeste": {"migration.case": 1}})
+        self.assertEqual(self.matrix.to_dict(), {"norte": {"migration.case": 1}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Tests para la exportación columnar incremental del Audit Service (export.py)
+"""
+
+import importlib.util
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "audit"))
+
+import db  # noqa: E402
+import export  # noqa: E402
+import shards  # noqa: E402
+
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+
+class TestPayloadColumns(unittest.TestCase):
+    """Tests para el aplanado y los tipos de columnas (sin pyarrow)"""
+
+    def test_flatten(self):
+        """Test que los objetos anidados se aplanan con '_'"""
+        flat = export.flatten({"a": 1, "geo": {"lat": -33.4, "lon": -70.6}, "tags": ["x"], "vacío": {}})
+        self.assertEqual(flat, {"payload_a": 1, "payload_geo_lat": -33.4, "payload_geo_lon": -70.6,
+                                "payload_tags": ["x"], "payload_vacío": {}})
+
+    def test_infer_kinds(self):
+        """Test que int+float es float, otras mezclas son json y solo-nulos es string"""
+        rows = [{"a": 1, "b": True, "c": "x", "d": None, "e": 1},
+                {"a": 2.5, "b": False, "c": 3, "d": None, "e": [1]}]
+        self.assertEqual(export.infer_kinds(rows), {"a": "float", "b": "bool", "c": "json", "d": "string", "e": "json"})
+
+    def test_split_payload(self):
+        """Test que lo que no encaja en el esquema va a payload_extra"""
+        columns, extra = export.split_payload({"a": 1, "b": "no-es-int", "nuevo": 3, "j": [1, 2]},
+                                              {"a": "float", "b": "int", "j": "json"})
+        self.assertEqual(columns, {"a": 1, "j": "[1, 2]"})
+        self.assertEqual(extra, {"b": "no-es-int", "nuevo": 3})
+
+    def test_partition_dir(self):
+        """Test que las particiones usan el formato clave=valor"""
+        self.assertEqual(export.partition_dir("events", date="2025-01-01", region="norte", source="a/b"),
+                         os.path.join("events", "date=2025-01-01", "region=norte", "source=a_b"))
+
+
+@unittest.skipUnless(HAS_PYARROW, "pyarrow no está instalado")
+class TestIncrementalExport(unittest.TestCase):
+    """Tests para el watermark y el contenido exportado"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.dir.name, "audit.db")
+        self.out = os.path.join(self.dir.name, "export")
+        self.conn = db.init_db(self.db_path)
+
+    def tearDown(self):
+        self.conn.close()
+        self.dir.cleanup()
+
+    def add(self, numbers, metric_id, revision=0):
+        events = [{"event_id": f"e{n}", "timestamp": "2025-01-01T00:00:00Z", "region": "norte",
+                   "source": "incident.created", "payload": {"n": n, "geo": {"lat": 1.5}}} for n in numbers]
+        with self.conn:
+            db.store_events(self.conn, [db.event_row(e, "default") for e in events])
+            db.store_metric_and_trace(self.conn, {"metric_id": metric_id, "date": "2025-01-01", "region": "norte",
+                                                  "metrics": {"incident.created": len(numbers)}, "revision": revision,
+                                                  "input_event_ids": [e["event_id"] for e in events]})
+
+    def read(self, table):
+        import pyarrow.parquet as pq
+        return pq.read_table(os.path.join(self.out, table)).to_pylist()
+
+    def test_incremental_runs(self):
+        """Test que cada corrida exporta solo lo nuevo (y las métricas que cambiaron)"""
+        self.add(range(5), "m1", revision=1)
+        export.run_export(self.db_path, self.out, settle=0, chunk_rows=2)
+        events = self.read("events")
+        self.assertEqual(sorted(e["event_id"] for e in events), [f"e{n}" for n in range(5)])
+        self.assertEqual(events[0]["payload_geo_lat"], 1.5)
+        self.assertEqual(len(self.read("trace")), 5)
+
+        self.add(range(5, 8), "m1", revision=2)
+        self.assertEqual(export.run_export(self.db_path, self.out, settle=0), 3 + 3 + 1)
+        self.assertEqual(len(self.read("events")), 8)
+        metrics = self.read("metrics")
+        self.assertEqual(sorted(m["revision"] for m in metrics), [1, 2])
+        self.assertEqual(sorted(m["metrics_incident_created"] for m in metrics), [3, 5])
+        self.assertIsNone(metrics[0]["metrics_extra"])
+
+        self.assertEqual(export.run_export(self.db_path, self.out, settle=0), 0)
+
+    def test_settle_delay(self):
+        """Test que los eventos recientes esperan al settle"""
+        self.add(range(3), "m1")
+        export.run_export(self.db_path, self.out, settle=3600)
+        self.assertFalse(os.path.exists(os.path.join(self.out, "events")))
+        self.assertEqual(export.load_watermark(self.out)["events_in"]["id"], 0)
+
+    def test_sharded_export(self):
+        """Test que con shards se exporta cada shard una vez, incluida la traza externa"""
+        shard_dir = os.path.join(self.dir.name, "shards")
+        store = shards.ShardStore(shard_dir, shard_by="rows", max_rows=5, seal_async=False)
+        events = [{"event_id": f"e{n}", "timestamp": "2025-01-01T00:00:00Z", "region": "norte",
+                   "source": "incident.created", "payload": {"n": n}} for n in range(8)]
+        for batch, metrics in ((events[:5], []), (events[5:], [{
+            "metric_id": "m1", "date": "2025-01-01", "region": "norte", "metrics": {},
+            "input_event_ids": [e["event_id"] for e in events],
+        }])):
+            conn = store.connection()
+            with conn:
+                db.store_events(conn, store.filter_new([db.event_row(e, "default") for e in batch]))
+                for metric in metrics:
+                    db.store_metric_and_trace(conn, metric, store.resolve_external)
+            store.note_events(len(batch))
+        store.close()
+
+        self.assertEqual(export.run_export(None, self.out, settle=0, shard_dir=shard_dir), 8 + 8 + 1)
+        self.assertEqual(len(self.read("events")), 8)
+        self.assertEqual(sorted(t["event_id"] for t in self.read("trace")), sorted(e["event_id"] for e in events))
+        watermark = export.load_watermark(self.out)
+        self.assertTrue(watermark["shards"]["1"]["done"])
+        self.assertFalse(watermark["shards"]["2"]["done"])
+        self.assertEqual(export.run_export(None, self.out, settle=0, shard_dir=shard_dir), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
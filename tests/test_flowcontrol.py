@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Tests para el control de flujo del writer del Audit Service (flowcontrol.py)
+"""
+
+import os
+import queue
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "audit"))
+
+from flowcontrol import DeliveryQueue, PrefetchController, QueueStats, is_busy, wal_size  # noqa: E402
+from groupcommit import Delivery  # noqa: E402
+
+
+def delivery(kind, tag):
+    return Delivery(kind, tag, "rk", None, b"{}", None)
+
+
+class TestPrefetchController(unittest.TestCase):
+    """Tests para el ajuste AIMD del prefetch"""
+
+    def setUp(self):
+        self.controller = PrefetchController(10, 100, initial=40, step=10, target_seconds=0.1, wal_limit=1000)
+
+    def test_grows_while_commits_are_fast(self):
+        """Test que el prefetch sube de a un paso con commits rápidos y se detiene en el máximo"""
+        self.assertEqual(self.controller.observe(0.01), 50)
+        for _ in range(10):
+            self.controller.observe(0.01)
+        self.assertEqual(self.controller.prefetch, 100)
+        self.assertIsNone(self.controller.observe(0.01))
+
+    def test_halves_on_contention(self):
+        """Test que latencia alta, busy o WAL grande bajan el prefetch a la mitad sin pasar del mínimo"""
+        self.assertEqual(self.controller.observe(0.5), 20)
+        self.assertEqual(self.controller.reason, "latencia")
+        self.assertEqual(self.controller.observe(0.01, busy=True), 10)
+        self.assertEqual(self.controller.reason, "busy")
+        self.assertIsNone(self.controller.observe(0.01, wal_bytes=5000))
+        self.assertEqual(self.controller.prefetch, 10)
+
+    def test_invalid_range(self):
+        with self.assertRaises(ValueError):
+            PrefetchController(0, 10)
+
+
+class TestDeliveryQueue(unittest.TestCase):
+    """Tests para la cola del writer con prioridad de métricas"""
+
+    def test_metrics_first_fifo_within_kind(self):
+        """Test que las métricas salen antes que los eventos y cada tipo conserva su orden"""
+        q = DeliveryQueue(10)
+        for item in (delivery("event", 1), delivery("event", 2), delivery("metric", 1), delivery("metric", 2)):
+            q.put(item)
+        self.assertEqual(q.qsize("event"), 2)
+        got = [(d.kind, d.delivery_tag) for d in (q.get_nowait() for _ in range(4))]
+        self.assertEqual(got, [("metric", 1), ("metric", 2), ("event", 1), ("event", 2)])
+        self.assertTrue(q.empty())
+        with self.assertRaises(queue.Empty):
+            q.get(timeout=0.01)
+
+    def test_bounded_per_kind(self):
+        """Test que una cola llena de eventos no bloquea a las métricas"""
+        q = DeliveryQueue(1)
+        q.put(delivery("event", 1))
+        q.put(delivery("metric", 1))  # no bloquea: otro tipo
+        blocked = threading.Thread(target=q.put, args=(delivery("event", 2),), daemon=True)
+        blocked.start()
+        blocked.join(0.05)
+        self.assertTrue(blocked.is_alive())
+        q.get_nowait()  # métrica
+        q.get_nowait()  # evento 1 -> libera lugar
+        blocked.join(1)
+        self.assertFalse(blocked.is_alive())
+        self.assertEqual(q.get_nowait().delivery_tag, 2)
+
+
+class TestQueueStats(unittest.TestCase):
+    """Tests para la latencia, el throughput y las señales de contención"""
+
+    def test_snapshot(self):
+        """Test que la latencia es una media móvil y el throughput cuenta solo la última ventana"""
+        stats = QueueStats(window=10, alpha=0.5)
+        stats.note_received(4)
+        stats.note_batch([0.1, 0.3], now=100)
+        stats.note_batch([0.4], requeued=1, now=105)
+        snapshot = stats.snapshot(now=106)
+        self.assertEqual((snapshot["received"], snapshot["committed"], snapshot["requeued"]), (4, 3, 1))
+        self.assertEqual((snapshot["latency_ms"], snapshot["latency_max_ms"]), (300.0, 400.0))
+        self.assertEqual(snapshot["throughput"], 0.3)
+        self.assertEqual(stats.throughput(now=112), 0.1)
+
+    def test_busy_and_wal(self):
+        """Test que se reconoce la contención de SQLite y se mide el WAL"""
+        self.assertTrue(is_busy(sqlite3.OperationalError("database is locked")))
+        self.assertFalse(is_busy(sqlite3.IntegrityError("FOREIGN KEY constraint failed")))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "audit.db")
+            self.assertEqual(wal_size(path), 0)
+            conn = sqlite3.connect(path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.execute("CREATE TABLE t (v)")
+            self.assertGreater(wal_size(path), 0)
+            conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
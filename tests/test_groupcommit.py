@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Tests para el group commit del Audit Service (groupcommit.py)
+"""
+
+import os
+import sqlite3
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "audit"))
+
+from groupcommit import commit_with_bisect  # noqa: E402
+
+
+def write_values(conn, items):
+    for value in items:
+        if value < 0:
+            raise ValueError("valor inválido")
+        conn.execute("INSERT INTO t (v) VALUES (?)", (value,))
+
+
+class TestCommitWithBisect(unittest.TestCase):
+    """Tests para la escritura por lotes con bisección"""
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("CREATE TABLE t (v INTEGER PRIMARY KEY)")
+
+    def rows(self):
+        return [row[0] for row in self.conn.execute("SELECT v FROM t ORDER BY v")]
+
+    def test_whole_batch_commits(self):
+        """Test que un lote sin errores se escribe completo"""
+        ok, failed = commit_with_bisect(self.conn, [1, 2, 3], write_values)
+        self.assertEqual(ok, [1, 2, 3])
+        self.assertEqual(failed, [])
+        self.assertEqual(self.rows(), [1, 2, 3])
+
+    def test_isolates_bad_items(self):
+        """Test que la bisección aísla solo los elementos que fallan"""
+        items = [1, 2, -3, 4, 5, 6, -7, 8]
+        ok, failed = commit_with_bisect(self.conn, items, write_values)
+        self.assertEqual(sorted(ok), [1, 2, 4, 5, 6, 8])
+        self.assertEqual([item for item, _ in failed], [-3, -7])
+        self.assertIsInstance(failed[0][1], ValueError)
+        self.assertEqual(self.rows(), [1, 2, 4, 5, 6, 8])
+
+    def test_failed_batch_is_rolled_back(self):
+        """Test que un intento fallido no deja filas a medias"""
+        ok, failed = commit_with_bisect(self.conn, [1, 1], write_values)
+        self.assertEqual(ok, [1])
+        self.assertEqual(len(failed), 1)
+        self.assertIsInstance(failed[0][1], sqlite3.IntegrityError)
+        self.assertEqual(self.rows(), [1])
+
+    def test_empty_batch(self):
+        """Test que un lote vacío no hace nada"""
+        self.assertEqual(commit_with_bisect(self.conn, [], write_values), ([], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
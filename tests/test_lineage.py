@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Tests para las consultas de linaje del Audit Service (lineage.py)
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "audit"))
+
+import db  # noqa: E402
+import lineage  # noqa: E402
+
+
+def make_event(n):
+    return {
+        "event_id": f"e{n:03d}",
+        "timestamp": f"2025-01-01T00:{n // 2:02d}:00Z",  # de a dos por minuto (empates de timestamp)
+        "region": "norte" if n % 2 else "sur",
+        "source": "incident.created" if n % 3 else "case.updated",
+        "payload": {"n": n},
+    }
+
+
+class LineageTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.dir.name, "audit.db")
+        conn = db.init_db(cls.path)
+        with conn:
+            db.store_events(conn, [db.event_row(make_event(n), "default") for n in range(40)])
+            db.store_metric_and_trace(conn, {"metric_id": "m-all", "date": "2025-01-01", "region": "norte",
+                                             "metrics": {}, "input_event_ids": [f"e{n:03d}" for n in range(40)]})
+            db.store_metric_and_trace(conn, {"metric_id": "m-few", "date": "2025-01-01", "region": "norte",
+                                             "metrics": {"x": 1}, "input_event_ids": ["e001", "e002"]})
+        conn.close()
+        cls.pool = lineage.ReadOnlyPool(cls.path, size=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        cls.dir.cleanup()
+
+
+class TestLineageQueries(LineageTestCase):
+    """Tests para las consultas y la paginación por keyset"""
+
+    def collect(self, fn, *args, limit=7):
+        items, cursor = [], None
+        while True:
+            page = fn(*args, limit=limit, after=cursor)
+            items += page["items"]
+            cursor = page["next"]
+            if cursor is None:
+                return items
+
+    def test_metric_to_events_paginates(self):
+        """Test que las páginas de metric -> events cubren toda la traza sin repetir"""
+        with self.pool.connection() as conn:
+            items = self.collect(lineage.events_for_metric, conn, "m-all")
+        self.assertEqual([e["event_id"] for e in items], [f"e{n:03d}" for n in range(40)])
+        self.assertEqual(items[5]["payload"], {"n": 5})
+
+    def test_event_to_metrics(self):
+        """Test que event -> metrics devuelve todas las métricas del evento"""
+        with self.pool.connection() as conn:
+            page = lineage.metrics_for_event(conn, "e002")
+            self.assertEqual(sorted(m["metric_id"] for m in page["items"]), ["m-all", "m-few"])
+            self.assertIsNone(lineage.metrics_for_event(conn, "no-existe"))
+            self.assertIsNone(lineage.events_for_metric(conn, "no-existe"))
+
+    def test_find_events_filters_and_ties(self):
+        """Test que los filtros y el cursor (timestamp, id) respetan los empates"""
+        with self.pool.connection() as conn:
+            items = self.collect(lineage.find_events, conn, "norte", None, "2025-01-01T00:05:00Z",
+                                 "2025-01-01T00:14:00Z", limit=3)
+            self.assertEqual([e["payload"]["n"] for e in items], [n for n in range(10, 30) if n % 2])
+            items = self.collect(lineage.find_events, conn, None, "case.updated", None, None, limit=4)
+            self.assertEqual([e["payload"]["n"] for e in items], [n for n in range(40) if n % 3 == 0])
+
+    def test_read_only(self):
+        """Test que las conexiones del pool no pueden escribir"""
+        with self.pool.connection() as conn:
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute("DELETE FROM events_in")
+
+
+class TestReplayRuns(unittest.TestCase):
+    """Tests para eventos reinyectados con otro run_id"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.dir.name, "audit.db")
+        conn = db.init_db(path)
+        with conn:
+            db.store_events(conn, [db.event_row(make_event(n), "default") for n in range(10)])
+            db.store_events(conn, [db.event_row(make_event(n), "replay-1") for n in range(4)])
+            db.store_metric_and_trace(conn, {"metric_id": "m-replay", "date": "2025-01-01", "region": "norte",
+                                             "run_id": "replay-1", "metrics": {}, "input_event_ids": ["e001"]})
+        conn.close()
+        self.service = lineage.LineageService(path, pool_size=1)
+
+    def tearDown(self):
+        self.service.close()
+        self.dir.cleanup()
+
+    def test_filters_by_run(self):
+        """Test que find_events / iter_events filtran por run_id y event -> metrics toma la corrida pedida"""
+        self.assertEqual(len(list(lineage.iter_events(self.service, page_size=3))), 14)
+        replayed = list(lineage.iter_events(self.service, run_id="replay-1", page_size=3))
+        self.assertEqual([e["event_id"] for e in replayed], ["e000", "e001", "e002", "e003"])
+        self.assertEqual(self.service.metrics_for_event("e001")["items"], [])
+        page = self.service.metrics_for_event("e001", run_id="replay-1")
+        self.assertEqual([m["metric_id"] for m in page["items"]], ["m-replay"])
+
+
+class TestLineageHttp(LineageTestCase):
+    """Tests para el endpoint HTTP"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = lineage.serve_in_background(cls.path, 0, pool_size=1,
+                                                 stats=lambda: {"queues": {"audit_queue": {"prefetch": 50}}})
+        cls.base = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def get(self, path):
+        with urllib.request.urlopen(self.base + path) as response:
+            return json.loads(response.read())
+
+    def test_routes(self):
+        """Test que las tres rutas responden JSON paginado"""
+        page = self.get("/metrics/m-few/events")
+        self.assertEqual([e["event_id"] for e in page["items"]], ["e001", "e002"])
+        page = self.get("/events/e001/metrics?limit=1")
+        self.assertEqual(len(page["items"]), 1)
+        self.assertIsNotNone(page["next"])
+        page = self.get("/events?region=sur&limit=5&start=2025-01-01T00:10:00Z")
+        self.assertEqual(page["items"][0]["event_id"], "e020")
+
+    def test_stats(self):
+        """Test que /stats devuelve lo que entrega el servicio"""
+        self.assertEqual(self.get("/stats")["queues"]["audit_queue"]["prefetch"], 50)
+
+    def test_not_found(self):
+        """Test que métricas inexistentes y rutas desconocidas dan 404"""
+        for path in ("/metrics/no-existe/events", "/otra"):
+            with self.assertRaises(urllib.error.HTTPError) as ctx:
+                self.get(path)
+            self.assertEqual(ctx.exception.code, 404)
+
+    def test_stats_only(self):
+        """Test que sin servicio de linaje (backend Postgres) solo responde /stats"""
+        server = lineage.serve_in_background(None, 0, stats=lambda: {"ok": True})
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        try:
+            with urllib.request.urlopen(base + "/stats") as response:
+                self.assertEqual(json.loads(response.read()), {"ok": True})
+            with self.assertRaises(urllib.error.HTTPError) as ctx:
+                urllib.request.urlopen(base + "/events?region=sur")
+            self.assertEqual(ctx.exception.code, 404)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Tests para la difusión de ventanas al dashboard por SSE y las respuestas
+cacheadas de /data (dashboard/livefeed.py)
+"""
+
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "dashboard"))
+
+from livefeed import HEARTBEAT, Broadcaster, choose_encoding, etag_matches, parse_last_event_id  # noqa: E402
+
+
+def frame_data(frame):
+    lines = frame.decode("utf-8").strip().split("\n")
+    fields = dict(line.split(": ", 1) for line in lines)
+    return int(fields["id"]), json.loads(fields["data"])
+
+
+class TestBroadcaster(unittest.TestCase):
+    """Tests para el estado pre-serializado compartido por los clientes"""
+
+    def test_serialized_once_and_shared(self):
+        """Test que cada ventana se serializa una vez y todos los clientes reciben los mismos bytes"""
+        feed = Broadcaster({"status": "waiting"})
+        clients = [feed.stream() for _ in range(3)]
+        for client in clients:
+            self.assertEqual(next(client), b"retry: 3000\n\n")
+            self.assertEqual(frame_data(next(client)), (0, {"status": "waiting"}))
+        self.assertEqual(feed.stats()["subscribers"], 3)
+        feed.publish({"stats_by_region": {"norte": {"a": 1}}})
+        frames = [next(client) for client in clients]
+        self.assertTrue(all(frame is frames[0] for frame in frames))
+        self.assertEqual(frame_data(frames[0]), (1, {"stats_by_region": {"norte": {"a": 1}}}))
+        for client in clients:
+            client.close()
+        self.assertEqual(feed.stats()["subscribers"], 0)
+
+    def test_slow_client_skips_to_latest(self):
+        """Test que un cliente atrasado recibe solo la última ventana y no frena a publish"""
+        feed = Broadcaster()
+        client = feed.stream(last_version=0)
+        next(client)
+        started = time.monotonic()
+        for n in range(1000):
+            feed.publish({"n": n})
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(frame_data(next(client)), (1000, {"n": 999}))
+        client.close()
+
+    def test_waits_and_heartbeats(self):
+        """Test que el cliente al día espera la próxima ventana y manda heartbeat si no llega"""
+        feed = Broadcaster()
+        client = feed.stream(last_version=0, heartbeat=0.01)
+        next(client)
+        self.assertEqual(next(client), HEARTBEAT)
+        threading.Timer(0.05, feed.publish, args=({"n": 1},)).start()
+        frame = next(client)
+        while frame == HEARTBEAT:
+            frame = next(client)
+        self.assertEqual(frame_data(frame), (1, {"n": 1}))
+        client.close()
+
+    def test_reconnect_after_restart(self):
+        """Test que un Last-Event-ID de antes de un reinicio del dashboard recibe el estado actual"""
+        feed = Broadcaster({"status": "waiting"})
+        self.assertEqual(feed.wait(57, timeout=0), (0, feed.frame))
+        self.assertIsNone(feed.wait(0, timeout=0))
+        self.assertEqual(parse_last_event_id("57"), 57)
+        self.assertIsNone(parse_last_event_id(None))
+        self.assertIsNone(parse_last_event_id("x"))
+
+
+class TestCachedData(unittest.TestCase):
+    """Tests para las respuestas de /data pre-serializadas con ETag"""
+
+    def test_etag_per_content(self):
+        """Test que el ETag cambia con la ventana y se repite para el mismo contenido"""
+        feed = Broadcaster({"status": "waiting"})
+        first, body, encoding = feed.representation()
+        self.assertEqual((json.loads(body), encoding), ({"status": "waiting"}, None))
+        feed.publish({"n": 1})
+        second = feed.representation()[0]
+        self.assertNotEqual(first, second)
+        self.assertEqual(Broadcaster({"n": 1}).representation()[0], second)  # p. ej. tras un reinicio
+
+    def test_compressed_once_per_version(self):
+        """Test que la versión gzip se arma en publish y cada request recibe los mismos bytes"""
+        feed = Broadcaster(encodings=("gzip",))
+        feed.publish({"stats_by_region": {"norte": {"a": 1}}})
+        etag, body, encoding = feed.representation("gzip, deflate, br")
+        self.assertEqual(encoding, "gzip")
+        self.assertIs(body, feed.representation("gzip")[1])
+        self.assertEqual(json.loads(gzip.decompress(body)), {"stats_by_region": {"norte": {"a": 1}}})
+        self.assertEqual(feed.representation("identity")[1], feed.payload)
+        with self.assertRaises(ValueError):
+            Broadcaster(encodings=("zstd",))
+
+    def test_choose_encoding(self):
+        """Test que se respeta el orden de preferencia y q=0"""
+        self.assertEqual(choose_encoding("gzip, br", {"gzip": b"", "br": b""}), "br")
+        self.assertEqual(choose_encoding("gzip;q=1, br;q=0", {"gzip": b"", "br": b""}), "gzip")
+        self.assertEqual(choose_encoding("*", {"gzip": b""}), "gzip")
+        self.assertIsNone(choose_encoding(None, {"gzip": b""}))
+        self.assertIsNone(choose_encoding("br", {"gzip": b""}))
+
+    def test_if_none_match(self):
+        """Test que If-None-Match acepta listas, "*" y ETags fuertes o débiles"""
+        self.assertTrue(etag_matches('W/"abc"', 'W/"abc"'))
+        self.assertTrue(etag_matches('"x", "abc"', 'W/"abc"'))
+        self.assertTrue(etag_matches("*", 'W/"abc"'))
+        self.assertFalse(etag_matches('W/"old"', 'W/"abc"'))
+        self.assertFalse(etag_matches(None, 'W/"abc"'))
+
+
+if __name__ == "__main__":
+    unittest.main()
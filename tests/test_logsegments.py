@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Tests para los segmentos rotados del log de auditoría (logsegments.py)
+"""
+
+import gzip
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "audit"))
+
+import logsegments  # noqa: E402
+from auditlog import AuditLogWriter  # noqa: E402
+
+
+def event_body(n):
+    return json.dumps({
+        "event_id": f"e{n}",
+        "timestamp": f"2025-01-01T{n // 60:02d}:{n % 60:02d}:00Z",
+        "region": "norte",
+        "source": "incident.created",
+        "payload": {"n": n},
+    }).encode()
+
+
+class TestLogSegments(unittest.TestCase):
+    """Tests para rotación, sellado, índice y lectura por rango"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "audit_log.jsonl")
+        # Segmentos chicos para forzar varias rotaciones
+        self.writer = AuditLogWriter(self.path, flush_bytes=1, segment_bytes=4000, index_every=5, seal_async=False)
+        for n in range(100):
+            self.writer.write(event_body(n), "2025-01-01T00:00:00")
+        self.writer.close()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def event_numbers(self, **kwargs):
+        return [json.loads(line)["event_content"]["payload"]["n"]
+                for line in logsegments.iter_lines(self.path, **kwargs)]
+
+    def test_rotates_and_seals(self):
+        """Test que los segmentos rotados quedan comprimidos e indexados"""
+        segments = logsegments.list_segments(self.path)
+        self.assertGreater(len(segments), 1)
+        for seq in segments:
+            self.assertTrue(logsegments.is_sealed(self.path, seq))
+            self.assertFalse(os.path.exists(logsegments.raw_path(self.path, seq)))
+            gz_path, _ = logsegments.sealed_paths(self.path, seq)
+            index = logsegments.load_index(self.path, seq)
+            # El .gz completo (miembros concatenados) es legible con gzip
+            with gzip.open(gz_path, "rb") as f:
+                self.assertEqual(len(f.read().splitlines()), index["count"])
+            self.assertLess(index["bytes"], index["raw_bytes"])
+
+    def test_reads_everything_in_order(self):
+        """Test que la lectura recorre sellados y activo en orden"""
+        self.assertEqual(self.event_numbers(), list(range(100)))
+        self.assertEqual(logsegments.count_records(self.path), 100)
+
+    def test_time_range(self):
+        """Test que el filtro por timestamp del evento es inclusivo"""
+        numbers = self.event_numbers(start="2025-01-01T00:30:00Z", end="2025-01-01T00:45:00Z")
+        self.assertEqual(numbers, list(range(30, 46)))
+
+    def test_truncated_bounds(self):
+        """Test que un fin truncado cubre todo su minuto/hora/día (--end 2025-01-01T00:45 incluye 00:45:xx)"""
+        self.assertEqual(self.event_numbers(start="2025-01-01T00:30", end="2025-01-01T00:45"), list(range(30, 46)))
+        self.assertEqual(self.event_numbers(start="2025-01-01T01", end="2025-01-01T01"), list(range(60, 100)))
+        self.assertEqual(self.event_numbers(end="2025-01-01"), list(range(100)))
+        self.assertEqual(logsegments.time_bound("2025-01-01T11:00", end=True), "2025-01-01T11:00:59Z")
+        self.assertEqual(logsegments.time_bound("2025-01-01T11:00"), "2025-01-01T11:00:00Z")
+        self.assertEqual(logsegments.estimate_records(self.path, end="2025-01-01T00:04"), 5)
+
+    def test_estimate_records(self):
+        """Test que la estimación por índice es una cota superior cercana de la lectura por rango"""
+        self.assertEqual(logsegments.estimate_records(self.path), 100)
+        estimate = logsegments.estimate_records(self.path, start="2025-01-01T00:30:00Z", end="2025-01-01T00:45:00Z")
+        self.assertGreaterEqual(estimate, 16)
+        self.assertLessEqual(estimate, 16 + 2 * 5)  # a lo sumo un bloque de más en cada borde
+
+    def test_index_ranges(self):
+        """Test que el índice tiene los rangos de tiempo de cada bloque"""
+        seq = logsegments.list_segments(self.path)[0]
+        index = logsegments.load_index(self.path, seq)
+        self.assertEqual(index["event_start"], "2025-01-01T00:00:00Z")
+        self.assertEqual(index["blocks"][0]["count"], 5)
+        self.assertEqual(index["blocks"][1]["event_start"], "2025-01-01T00:05:00Z")
+
+    def test_pending_segment_is_sealed_on_start(self):
+        """Test que un segmento rotado sin sellar se sella al reabrir el writer"""
+        seq = logsegments.next_seq(self.path)
+        os.replace(self.path, logsegments.raw_path(self.path, seq))
+        AuditLogWriter(self.path).close()
+        self.assertTrue(logsegments.is_sealed(self.path, seq))
+        self.assertEqual(self.event_numbers(), list(range(100)))
+
+    def test_mapped_blocks_cut_on_newlines(self):
+        """Test que las ventanas del mmap cortan en saltos de línea, incluso con líneas más largas que la ventana"""
+        path = os.path.join(self.dir.name, "corpus.jsonl")
+        lines = [b"x" * n + b"\n" for n in (3, 40, 1, 7, 100, 2)] + [b"sin-salto"]
+        with open(path, "wb") as f:
+            f.write(b"".join(lines))
+        blocks = list(logsegments.mapped_blocks(path, window=16))
+        self.assertGreater(len(blocks), 1)
+        self.assertEqual([line for block in blocks for line in block], lines)
+        self.assertEqual(list(logsegments.mapped_blocks(os.path.join(self.dir.name, "no-existe"))), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Tests para el mantenimiento de la DB de auditoría (maintenance.py)
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "audit"))
+
+import db  # noqa: E402
+from maintenance import MaintenanceScheduler  # noqa: E402
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestMaintenanceScheduler(unittest.TestCase):
+    """Tests para los checkpoints, optimize y vacuum programados"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "audit.db")
+        self.conn = db.init_db(self.path)
+        self.clock = Clock()
+        self.scheduler = MaintenanceScheduler(quiet_seconds=2, checkpoint_seconds=10, truncate_seconds=60,
+                                              wal_limit=0, optimize_seconds=100, vacuum_seconds=100,
+                                              clock=self.clock)
+
+    def tearDown(self):
+        self.conn.close()
+        self.dir.cleanup()
+
+    def write(self, n=200, start=0):
+        with self.conn:
+            db.store_events(self.conn, [db.event_row({"event_id": f"e{i}", "timestamp": "2025-01-01T00:00:00Z",
+                                                      "region": "norte", "source": "s", "payload": {"x": "y" * 500}},
+                                                     "default") for i in range(start, start + n)])
+        self.scheduler.note_write()
+
+    def test_replaces_autocheckpoint(self):
+        """Test que el scheduler apaga el auto-checkpoint y hace PASSIVE bajo carga cada checkpoint_seconds"""
+        self.assertEqual(self.scheduler.run(self.conn, self.path), [])
+        self.assertEqual(self.conn.execute("PRAGMA wal_autocheckpoint").fetchone()[0], 0)
+        self.write()
+        self.assertEqual(self.scheduler.run(self.conn, self.path), [])  # bajo carga y sin vencer
+        self.clock.now += 10
+        self.write(start=200)
+        self.assertEqual(self.scheduler.run(self.conn, self.path), ["passive"])
+        self.assertFalse(self.scheduler.dirty)
+        self.assertEqual(self.scheduler.tasks["passive"]["runs"], 1)
+
+    def test_quiet_period(self):
+        """Test que en un período quieto se hace un checkpoint y luego optimize, vacuum y TRUNCATE cuando vencen"""
+        self.write()
+        self.clock.now += 3
+        self.assertEqual(self.scheduler.run(self.conn, self.path), ["passive"])
+        self.assertEqual(self.scheduler.run(self.conn, self.path), [])  # una sola vez por período quieto
+        with self.conn:
+            self.conn.execute("DELETE FROM events_in")
+        self.clock.now += 100
+        self.assertEqual(self.scheduler.run(self.conn, self.path), ["optimize", "vacuum", "truncate"])
+        self.assertEqual(self.scheduler.stats()["wal_bytes"], 0)
+        self.assertEqual(self.conn.execute("PRAGMA freelist_count").fetchone()[0], 0)
+
+    def test_oversized_wal_truncates_under_load(self):
+        """Test que un WAL por encima del límite se trunca aunque el writer no esté quieto"""
+        self.scheduler.wal_limit = 1
+        self.write()
+        self.assertEqual(self.scheduler.run(self.conn, self.path), [])
+        self.clock.now += 10
+        self.write(start=200)
+        self.assertEqual(self.scheduler.run(self.conn, self.path), ["truncate"])
+        self.assertEqual(self.scheduler.tasks["truncate"]["last_result"]["busy"], 0)
+        self.assertEqual(os.path.getsize(self.path + "-wal"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Tests para el consumo en micro-lotes del Aggregator (microbatch.py): disparo
+por tamaño y por tiempo, ack(multiple=True) del lote y reproceso uno a uno
+cuando el lote falla
+"""
+
+import json
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "aggregator"))
+
+from aggregations import AggregationPlan  # noqa: E402
+from microbatch import MicroBatcher  # noqa: E402
+from runwindows import RunWindows, is_valid_event  # noqa: E402
+
+REGIONS = ["norte", "sur"]
+SOURCES = ["security.incident"]
+
+
+class FakeChannel:
+    def __init__(self):
+        self.acks = []    # (delivery_tag, multiple)
+        self.nacks = []   # (delivery_tag, requeue)
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acks.append((delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        self.nacks.append((delivery_tag, requeue))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def body(event_id, **fields):
+    event = {"event_id": event_id, "region": "norte", "source": "security.incident", "payload": {}}
+    event.update(fields)
+    return json.dumps(event).encode()
+
+
+class TestMicroBatcher(unittest.TestCase):
+    """Tests para MicroBatcher con un canal falso y el mismo procesamiento que main.process_events"""
+
+    def setUp(self):
+        plan = AggregationPlan([{"name": "kinds", "kind": "count", "by": ["payload.kind"]}])
+        count = plan.aggregations["kinds"].update
+
+        def update(state, event):
+            if event["payload"].get("kind") == "boom":
+                raise ValueError("boom")
+            count(state, event)
+        plan.aggregations["kinds"].update = update
+
+        self.windows = RunWindows(REGIONS, SOURCES, plan)
+        self.calls = []
+        self.channel = FakeChannel()
+        self.clock = FakeClock()
+        self.batcher = MicroBatcher(self.process, max_size=3, max_wait=0.05, clock=self.clock)
+
+    def process(self, channel, bodies):
+        self.calls.append(len(bodies))
+        events = [e for e in (json.loads(b) for b in bodies) if is_valid_event(e)]
+        self.windows.admit(events)
+
+    def feed(self, *bodies):
+        full = False
+        for tag, b in enumerate(bodies, start=len(self.batcher.pending) + 1):
+            full = self.batcher.add(tag, b)
+        return full
+
+    def test_size_trigger_acks_last_tag(self):
+        """Test que el lote se dispara al llegar a max_size y se confirma con el último tag y multiple=True"""
+        self.assertFalse(self.feed(body("a"), body("b")))
+        self.assertTrue(self.feed(body("c")))
+        self.assertEqual(self.batcher.flush(self.channel), (3, 0))
+        self.assertEqual(self.calls, [3])
+        self.assertEqual(self.channel.acks, [(3, True)])
+        self.assertEqual(self.batcher.pending, [])
+        self.assertEqual(self.batcher.flush(self.channel), (0, 0))  # sin pendientes no hay ack
+
+    def test_time_trigger(self):
+        """Test que un lote incompleto vence a los max_wait segundos del primer mensaje"""
+        self.feed(body("a"))
+        self.clock.now = 0.04
+        self.feed(body("b"))
+        self.assertFalse(self.batcher.due())
+        self.clock.now = 0.05
+        self.assertTrue(self.batcher.due())
+        self.batcher.flush(self.channel)
+        self.assertFalse(self.batcher.due())
+        self.assertEqual(self.channel.acks, [(2, True)])
+
+    def test_in_batch_dedup(self):
+        """Test que un duplicado dentro del mismo lote cuenta una vez y el lote se confirma entero"""
+        self.feed(body("a"), body("a"), body("b"))
+        self.batcher.flush(self.channel)
+        self.assertEqual(self.windows.total_processed, 2)
+        self.assertEqual(self.channel.acks, [(3, True)])
+
+    def test_failure_falls_back_to_one_at_a_time(self):
+        """Test que si el lote falla no hay ack múltiple: los buenos se confirman de a uno y el culpable se rechaza"""
+        self.feed(body("a"), body("b", payload={"kind": "boom"}), body("c"))
+        self.assertEqual(self.batcher.flush(self.channel), (2, 1))
+        self.assertEqual(self.calls, [3, 1, 1, 1])
+        self.assertEqual(self.channel.acks, [(1, False), (3, False)])
+        self.assertEqual(self.channel.nacks, [(2, False)])
+        # Las marcas de dedup del lote fallido se deshicieron: a y c cuentan una vez
+        self.assertEqual(self.windows.total_processed, 2)
+        self.assertEqual(self.windows.results(0.0, 1.0)[0]["event_ids_by_region"], {"norte": ["a", "c"]})
+        self.assertEqual((self.batcher.fallbacks, self.batcher.rejected), (1, 1))
+
+    def test_invalid_events_do_not_fail_the_batch(self):
+        """Test que un cuerpo que no es un evento se descarta sin romper el ack del lote"""
+        self.feed(body("a"), b"[1, 2]", body("b", payload="texto"))
+        self.batcher.flush(self.channel)
+        self.assertEqual(self.channel.acks, [(3, True)])
+        self.assertEqual(self.windows.total_processed, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Tests para el modo particionado (Validator + shards del Aggregator)
+No requieren RabbitMQ: solo usan los módulos puros partitioning.py y windows.py
+"""
+
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "validator"))
+sys.path.insert(0, os.path.join(ROOT, "aggregator"))
+
+from partitioning import HashRing, partition_key, partitioned_routing_key  # noqa: E402
+from windows import build_window_result, merge_window_results  # noqa: E402
+
+
+class TestHashRing(unittest.TestCase):
+    """Tests para el anillo de hashing consistente"""
+
+    def test_partition_is_stable(self):
+        """Test que la misma clave cae siempre en la misma partición"""
+        ring = HashRing(4)
+        self.assertEqual(ring.partition_for("norte"), HashRing(4).partition_for("norte"))
+
+    def test_partition_in_range(self):
+        """Test que las particiones están en [0, N)"""
+        ring = HashRing(3)
+        for i in range(200):
+            self.assertIn(ring.partition_for(f"evt-{i}"), range(3))
+
+    def test_consistent_resize_moves_few_keys(self):
+        """Test que pasar de 4 a 5 particiones mueve una fracción pequeña de claves"""
+        keys = [f"evt-{i}" for i in range(2000)]
+        before = HashRing(4)
+        after = HashRing(5)
+        moved = sum(1 for k in keys if before.partition_for(k) != after.partition_for(k))
+        self.assertLess(moved / len(keys), 0.35)
+
+    def test_partition_key_and_routing_key(self):
+        """Test de extracción de clave y routing key particionada"""
+        event = {"event_id": "e1", "region": "sur"}
+        self.assertEqual(partition_key(event, "region"), "sur")
+        self.assertEqual(partition_key(event, "event_id"), "e1")
+        self.assertEqual(partitioned_routing_key("security.incident", 2), "security.incident.p2")
+
+    def test_invalid_partition_count(self):
+        """Test que un anillo sin particiones es un error"""
+        with self.assertRaises(ValueError):
+            HashRing(0)
+
+
+class TestWindowMerge(unittest.TestCase):
+    """Tests para la combinación de resultados de shards"""
+
+    def test_merge_sums_counts_and_unions_ids(self):
+        """Test que el merge suma recuentos y une los event_id"""
+        a = build_window_result(10.0, 15.0, 2, {"norte": {"security.incident": 2}},
+                                {"norte": {"e1", "e2"}}, shard_id=0)
+        b = build_window_result(11.0, 16.0, 1, {"norte": {"security.incident": 1}},
+                                {"norte": {"e3"}}, shard_id=1)
+
+        merged = merge_window_results([a, b])
+
+        self.assertEqual(merged["window_start"], 10.0)
+        self.assertEqual(merged["window_end"], 16.0)
+        self.assertEqual(merged["total_processed"], 3)
+        self.assertEqual(merged["stats_by_region"]["norte"]["security.incident"], 3)
+        self.assertEqual(merged["event_ids_by_region"]["norte"], ["e1", "e2", "e3"])
+
+    def test_merge_empty(self):
+        """Test que sin resultados no hay merge"""
+        self.assertIsNone(merge_window_results([]))
+
+
+if __name__ == '__main__':
+    unittest.main()
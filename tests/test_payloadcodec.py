@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Tests para los payloads comprimidos del Audit Service (payloadcodec.py)
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "audit"))
+
+import db  # noqa: E402
+import lineage  # noqa: E402
+import payloadcodec  # noqa: E402
+
+
+def make_event(n, source="security.incident"):
+    rng = random.Random(n)
+    return {
+        "event_id": f"e{n:05d}",
+        "timestamp": "2025-01-01T00:00:00Z",
+        "region": "norte",
+        "source": source,
+        "payload": {
+            "crime_type": rng.choice(["theft", "assault", "burglary"]),
+            "severity": rng.choice(["low", "medium", "high"]),
+            "location": {"latitude": round(rng.uniform(-55, -17), 4), "longitude": round(rng.uniform(-75, -66), 4)},
+            "reported_by": rng.choice(["citizen", "police", "app"]),
+            "nota": "señal débil",
+        },
+    }
+
+
+class TestTraining(unittest.TestCase):
+    """Tests para el entrenamiento del diccionario"""
+
+    def test_dictionary_has_repeated_fragments(self):
+        """Test que el diccionario junta los fragmentos repetidos, con los más frecuentes al final"""
+        samples = [db.event_row(make_event(n), "default")[6] for n in range(200)]
+        zdict = payloadcodec.train_dictionary(samples)
+        self.assertIn('"reported_by": '.encode(), zdict)
+        # "nota" está en todas las muestras; cada severidad en un tercio
+        self.assertGreater(zdict.index('"nota": "señal débil"'.encode()), zdict.index(b'"severity": "low"'))
+        self.assertLessEqual(len(zdict), payloadcodec.DICT_SIZE)
+
+    def test_nothing_repeated(self):
+        """Test que sin repeticiones el diccionario queda vacío"""
+        self.assertEqual(payloadcodec.train_dictionary(['{"a": 1}', '{"b": 2}']), b"")
+
+
+class TestEncoder(unittest.TestCase):
+    """Tests para la escritura comprimida y la lectura transparente"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "audit.db")
+        self.conn = db.init_db(self.path)
+        self.encoder = payloadcodec.PayloadEncoder(self.conn, sample_size=50)
+
+    def tearDown(self):
+        self.conn.close()
+        self.dir.cleanup()
+
+    def store(self, numbers):
+        rows = [db.event_row(make_event(n), "default") for n in numbers]
+        with self.conn:
+            db.store_events(self.conn, rows, self.encoder)
+        self.encoder.train_pending()
+        return rows
+
+    def test_roundtrip_with_dictionary(self):
+        """Test que después de entrenar se comprime con diccionario y se lee el mismo JSON"""
+        rows = self.store(range(50)) + self.store(range(50, 100))
+        dict_ids = self.conn.execute(
+            "SELECT DISTINCT substr(hex(payload_blob), 1, 4) FROM events_in WHERE id > 50"
+        ).fetchall()
+        self.assertEqual(dict_ids, [("0001",)])
+        stored = self.conn.execute(
+            "SELECT audit_payload(payload_json, payload_blob) FROM events_in ORDER BY id"
+        ).fetchall()
+        self.assertEqual([s for (s,) in stored], [row[6] for row in rows])
+        blob = self.conn.execute("SELECT length(payload_blob) FROM events_in WHERE id = 100").fetchone()[0]
+        self.assertLess(blob, len(rows[-1][6]) / 2)
+
+    def test_small_payload_stays_text(self):
+        """Test que un payload que no achica queda en payload_json"""
+        event = dict(make_event(1), payload={})
+        with self.conn:
+            db.store_events(self.conn, [db.event_row(event, "default")], self.encoder)
+        self.assertEqual(self.conn.execute("SELECT payload_json, payload_blob FROM events_in").fetchone(), ("{}", None))
+
+    def test_rollback_keeps_dictionaries_consistent(self):
+        """Test que un lote revertido no deja diccionarios a medias"""
+        with self.assertRaises(sqlite3.IntegrityError):
+            with self.conn:
+                db.store_events(self.conn, [db.event_row(make_event(n), "default") for n in range(50)], self.encoder)
+                raise sqlite3.IntegrityError("falla simulada")
+        self.assertEqual(self.conn.execute("SELECT count(*) FROM payload_dicts").fetchone()[0], 0)
+        self.encoder.train_pending()
+        self.store(range(50, 60))
+        self.assertEqual(self.conn.execute("SELECT count(*) FROM payload_dicts").fetchone()[0], 1)
+
+    def test_seed_copies_dictionaries(self):
+        """Test que un encoder nuevo (otro shard) hereda los diccionarios del anterior"""
+        self.store(range(50))
+        other = db.init_db(os.path.join(self.dir.name, "shard2.db"))
+        try:
+            encoder = payloadcodec.PayloadEncoder(other, seed=self.encoder)
+            self.assertEqual(other.execute("SELECT source FROM payload_dicts").fetchall(), [("security.incident",)])
+            self.assertIn("security.incident", encoder.compressors)
+        finally:
+            other.close()
+
+    def test_lineage_reads_compressed_payload(self):
+        """Test que las consultas de linaje devuelven el payload decodificado"""
+        self.store(range(60))
+        pool = lineage.ReadOnlyPool(self.path, size=1)
+        try:
+            with pool.connection() as conn:
+                page = lineage.find_events(conn, limit=100)
+        finally:
+            pool.close()
+        self.assertEqual(page["items"][-1]["payload"], make_event(59)["payload"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Tests para el motor de replay del Audit Service (replayengine.py)
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import types
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "audit"))
+
+import replayengine  # noqa: E402
+
+
+def log_line(n):
+    event = {"event_id": f"e{n}", "timestamp": "2025-01-01T00:00:00Z", "source": "security.incident"}
+    return ('{"audit_timestamp":"2025-01-01T00:00:00","event_content":' + json.dumps(event) + "}\n").encode()
+
+
+class FakePublisher:
+    """Publisher en memoria; falla en las publicaciones indicadas (una vez cada una)."""
+    lock = threading.Lock()
+
+    def __init__(self, sink, fail_on=()):
+        self.sink = sink
+        self.fail_on = fail_on
+
+    def publish(self, routing_key, body):
+        event_id = json.loads(body)["event_id"]
+        with self.lock:
+            if event_id in self.fail_on:
+                self.fail_on.remove(event_id)
+                raise ConnectionError("conexión perdida")
+            self.sink.append((routing_key, event_id))
+
+    def close(self):
+        pass
+
+
+class TestHelpers(unittest.TestCase):
+    """Tests para la extracción de eventos, el progreso y el token bucket"""
+
+    def test_extract_event(self):
+        """Test que se reconocen los formatos de línea del log y se ignoran las corruptas"""
+        routing_key, body = replayengine.extract_event(log_line(1))
+        self.assertEqual((routing_key, json.loads(body)["event_id"]), ("security.incident", "e1"))
+        self.assertEqual(replayengine.extract_event(b'{"event": {"event_id": "x"}}')[0], "replay.generic")
+        self.assertIsNone(replayengine.extract_event(b"{corrupta"))
+
+    def test_progress_offset_is_contiguous(self):
+        """Test que el offset solo avanza con bloques confirmados en orden desde el principio"""
+        progress = replayengine.Progress(offset=100)
+        progress.chunk_done(1, 10, 10, 0)
+        self.assertEqual(progress.offset, 100)
+        progress.chunk_done(0, 10, 9, 1)
+        self.assertEqual(progress.offset, 120)
+        self.assertEqual((progress.published, progress.skipped), (19, 1))
+
+    def test_token_bucket_limits_rate(self):
+        """Test que el token bucket reparte la tasa total entre hilos"""
+        bucket = replayengine.TokenBucket(200)
+        start = time.monotonic()
+        threads = [threading.Thread(target=lambda: [bucket.acquire() for _ in range(50)]) for _ in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # 100 tokens a 200/s menos la ráfaga inicial (20): ~0.4 s
+        self.assertGreater(time.monotonic() - start, 0.3)
+
+    def test_format_duration(self):
+        self.assertEqual(replayengine.format_duration(75), "1m15s")
+        self.assertEqual(replayengine.format_duration(3725), "1h02m")
+
+
+class TestSelection(unittest.TestCase):
+    """Tests para el replay selectivo, la etiqueta de corrida y el modo fiel"""
+
+    def event(self, n, **fields):
+        return dict({"event_id": f"e{n}", "timestamp": f"2025-01-01T00:00:{n:02d}Z", "region": "norte",
+                     "source": "security.incident"}, **fields)
+
+    def test_filters_and_tags(self):
+        """Test que se filtra por región / fuente / run_id de origen y se etiqueta con la corrida nueva"""
+        selection = replayengine.Selection(region="norte", run_id="default", tag="replay-1")
+        routing_key, body = selection.extract(self.event(1))
+        self.assertEqual((routing_key, json.loads(body)["run_id"]), ("security.incident", "replay-1"))
+        self.assertIs(selection.extract(self.event(2, region="sur")), replayengine.FILTERED)
+        self.assertIs(selection.extract(self.event(3, run_id="otra")), replayengine.FILTERED)
+        # Los eventos de la corrida que se está generando nunca se vuelven a reinyectar
+        self.assertIs(replayengine.Selection(tag="replay-1").extract(self.event(4, run_id="replay-1")),
+                      replayengine.FILTERED)
+        self.assertIsNone(selection.extract(b"{corrupta"))
+
+    def test_filtered_lines_are_not_corrupt(self):
+        """Test que run_replay cuenta aparte las líneas descartadas por la selección"""
+        sink = []
+        lines = [log_line(n) for n in range(20)] + [b"{corrupta\n"]
+        selection = replayengine.Selection(source="otra.fuente")
+        progress = replayengine.run_replay(lines, lambda: FakePublisher(sink), workers=2, chunk_size=8,
+                                           extract=selection.extract, log=lambda msg: None)
+        self.assertEqual((progress.published, progress.filtered, progress.skipped, progress.offset), (0, 20, 1, 21))
+
+    def test_faithful_pacing(self):
+        """Test que el modo fiel respeta los intervalos entre timestamps divididos por speed"""
+        selection = replayengine.Selection(tag="replay-1", timed=True)
+        events = [self.event(0), self.event(2), self.event(1), self.event(4)]  # uno fuera de orden
+        sink = []
+        start = time.monotonic()
+        replayengine.run_replay(events, lambda: FakePublisher(sink), workers=1, extract=selection.extract,
+                                pace=replayengine.FaithfulPacer(speed=20), log=lambda msg: None)
+        # 4 s de timestamps a x20: ~0.2 s, en el orden de llegada
+        self.assertGreater(time.monotonic() - start, 0.18)
+        self.assertEqual([e for _, e in sink], ["e0", "e2", "e1", "e4"])
+
+    def test_parse_timestamp(self):
+        self.assertEqual(replayengine.parse_timestamp("1970-01-01T00:01:00Z"), 60.0)
+        self.assertEqual(replayengine.parse_timestamp("1970-01-01T00:01:00"), 60.0)
+        self.assertIsNone(replayengine.parse_timestamp("ayer"))
+
+
+class TestBytesPath(unittest.TestCase):
+    """Tests para la extracción sin decodificar (Selection._extract_bytes)"""
+
+    def line(self, **fields):
+        event = dict({"event_id": "e1", "timestamp": "2025-01-01T00:00:01Z", "region": "norte",
+                      "source": "security.incident", "payload": {"n": 1}}, **fields)
+        return ('{"audit_timestamp":"2025-01-01T00:00:00","event_content":' + json.dumps(event) + "}\n").encode()
+
+    def test_same_event_as_slow_path(self):
+        """Test que el camino rápido da el mismo evento que decodificar y reserializar"""
+        selection = replayengine.Selection(region="norte", tag="replay-1", timed=True)
+        for line in (self.line(), self.line(run_id="default"), self.line(payload={"texto": "a\"b"})):
+            fast = selection._extract_bytes(line)
+            slow = selection.message(replayengine.parse_event(line))
+            self.assertIsNotNone(fast)
+            self.assertEqual((fast[0], json.loads(fast[1]), fast[2]), (slow[0], json.loads(slow[1]), slow[2]))
+            self.assertEqual(json.loads(fast[1])["run_id"], "replay-1")
+
+    def test_corpus_line(self):
+        """Test que una línea de corpus (evento suelto) también va por el camino rápido"""
+        line = json.dumps({"event_id": "e1", "region": "sur", "source": "a.b"}).encode() + b"\n"
+        self.assertEqual(replayengine.Selection(tag="r")._extract_bytes(line)[0], "a.b")
+        self.assertIs(replayengine.Selection(region="norte")._extract_bytes(line), replayengine.FILTERED)
+
+    def test_falls_back_when_ambiguous(self):
+        """Test que claves repetidas en el payload o valores escapados van al camino lento"""
+        selection = replayengine.Selection(region="norte", tag="replay-1")
+        for line in (self.line(payload={"region": "sur"}), self.line(region="nor\"te")):
+            self.assertIsNone(selection._extract_bytes(line))
+        # El camino lento decide con el evento decodificado
+        self.assertEqual(selection.extract(self.line(payload={"region": "sur"}))[0], "security.incident")
+        self.assertIs(selection.extract(self.line(region="nor\"te")), replayengine.FILTERED)
+
+    def test_truncated_line_is_corrupt(self):
+        """Test que una línea cortada a la mitad se cuenta como corrupta"""
+        line = self.line()
+        self.assertIsNone(replayengine.Selection(tag="r").extract(line[:len(line) // 2]))
+
+
+class TestRunReplay(unittest.TestCase):
+    """Tests para el replay en paralelo con reintentos y checkpoint"""
+
+    def test_publishes_everything_with_checkpoint(self):
+        """Test que se publica todo y el checkpoint final cubre todas las líneas"""
+        sink, checkpoints = [], []
+        lines = [log_line(n) for n in range(1000)] + [b"{corrupta\n"]
+        progress = replayengine.run_replay(
+            lines, lambda: FakePublisher(sink), workers=3, chunk_size=64,
+            on_checkpoint=checkpoints.append, progress_every=60, log=lambda msg: None,
+        )
+        self.assertEqual(sorted(e for _, e in sink), sorted(f"e{n}" for n in range(1000)))
+        self.assertEqual((progress.published, progress.skipped), (1000, 1))
+        self.assertEqual(checkpoints[-1], 1001)
+
+    def test_retries_chunk_after_failure(self):
+        """Test que un bloque que falla se republica entero por una conexión nueva"""
+        sink, fail_on = [], {"e10"}
+        replayengine.run_replay(
+            [log_line(n) for n in range(100)], lambda: FakePublisher(sink, fail_on), workers=1, chunk_size=50,
+            log=lambda msg: None,
+        )
+        self.assertEqual({e for _, e in sink}, {f"e{n}" for n in range(100)})
+
+    def test_gives_up_and_reports_offset(self):
+        """Test que tras max_retries se corta el replay con el offset confirmado"""
+        class BrokenPublisher(FakePublisher):
+            def publish(self, routing_key, body):
+                if json.loads(body)["event_id"] == "e150":
+                    raise ConnectionError("nack")
+
+        checkpoints = []
+        with self.assertRaises(replayengine.ReplayError):
+            replayengine.run_replay(
+                [log_line(n) for n in range(300)], lambda: BrokenPublisher([]), workers=1, chunk_size=100,
+                max_retries=2, on_checkpoint=checkpoints.append, log=lambda msg: None,
+            )
+        self.assertEqual(checkpoints[-1], 100)
+
+    def test_batched_publisher(self):
+        """Test que con publish_batch se publica en lotes de batch_size y un bloque fallido se repite entero"""
+        class BatchPublisher(FakePublisher):
+            def publish_batch(self, messages):
+                self.sink.append(len(messages))
+                for routing_key, body in messages:
+                    self.publish(routing_key, body)
+
+        sink, fail_on = [], {"e30"}
+        progress = replayengine.run_replay(
+            [log_line(n) for n in range(100)], lambda: BatchPublisher(sink, fail_on), workers=1, chunk_size=50,
+            batch_size=20, log=lambda msg: None,
+        )
+        self.assertEqual([n for n in sink if isinstance(n, int)], [20, 20, 20, 20, 10, 20, 20, 10])
+        self.assertEqual({e for item in sink if not isinstance(item, int) for e in item[1:]},
+                         {f"e{n}" for n in range(100)})
+        self.assertEqual(progress.published, 100)
+
+
+class FakeIOLoop:
+    """ioloop de pika sin sockets: corre callbacks en orden y adelanta el reloj hasta el próximo timer."""
+
+    def __init__(self):
+        self.callbacks = []
+        self.timers = {}
+        self.now = 0.0
+        self.running = False
+
+    def call_later(self, delay, callback):
+        handle = object()
+        self.timers[handle] = (self.now + delay, callback)
+        return handle
+
+    def remove_timeout(self, handle):
+        self.timers.pop(handle, None)
+
+    def start(self):
+        self.running = True
+        while self.running:
+            if self.callbacks:
+                self.callbacks.pop(0)()
+            elif self.timers:
+                handle = min(self.timers, key=lambda h: self.timers[h][0])
+                self.now, callback = self.timers.pop(handle)
+                callback()
+            else:
+                raise AssertionError("ioloop sin eventos pendientes")
+
+    def stop(self):
+        self.running = False
+
+
+class FakeChannel:
+    """Canal con confirms: ack = un Ack(multiple=True) por ráfaga, nack = Nack del tag indicado, none = sin respuesta."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.published = []
+        self.confirmed = 0
+
+    def add_on_close_callback(self, callback):
+        pass
+
+    def exchange_declare(self, exchange, exchange_type, durable, callback):
+        self.connection.ioloop.callbacks.append(lambda: callback(None))
+
+    def confirm_delivery(self, ack_nack_callback, callback):
+        self.on_confirm = ack_nack_callback
+        self.connection.ioloop.callbacks.append(lambda: callback(None))
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.published.append((routing_key, body, properties.headers))
+        tag = len(self.published)
+        mode = self.connection.confirms
+        if mode == "ack":
+            self.connection.ioloop.callbacks.append(self._ack_all)
+        elif mode == "nack":
+            method = (FakeNack if tag == self.connection.nack_tag else FakeAck)(tag, False)
+            self.connection.ioloop.callbacks.append(lambda: self.on_confirm(types.SimpleNamespace(method=method)))
+
+    def _ack_all(self):
+        # El broker agrupa: los acks pendientes llegan en uno solo con multiple=True
+        if self.confirmed < len(self.published):
+            self.confirmed = len(self.published)
+            self.on_confirm(types.SimpleNamespace(method=FakeAck(self.confirmed, True)))
+
+
+class FakeAck:
+    def __init__(self, delivery_tag, multiple):
+        self.delivery_tag = delivery_tag
+        self.multiple = multiple
+
+
+class FakeNack(FakeAck):
+    pass
+
+
+class FakeSelectConnection:
+
+    def __init__(self, parameters, on_open_callback, on_open_error_callback, on_close_callback):
+        self.confirms = "ack"
+        self.nack_tag = None
+        self.ioloop = FakeIOLoop()
+        self.is_open = self.is_closing = self.is_closed = False
+        self.on_close_callback = on_close_callback
+        self.ioloop.callbacks.append(lambda: self._open(on_open_callback))
+
+    def _open(self, on_open_callback):
+        self.is_open = True
+        on_open_callback(self)
+
+    def channel(self, on_open_callback):
+        self.channel_ = FakeChannel(self)
+        self.ioloop.callbacks.append(lambda: on_open_callback(self.channel_))
+
+    def close(self):
+        self.is_open, self.is_closing = False, True
+        self.ioloop.callbacks.append(self._closed)
+
+    def _closed(self):
+        self.is_closing, self.is_closed = False, True
+        self.on_close_callback(self, ConnectionError("cerrada"))
+
+
+fake_pika = types.ModuleType("pika")
+fake_pika.SelectConnection = FakeSelectConnection
+fake_pika.ConnectionParameters = lambda **kwargs: kwargs
+fake_pika.BasicProperties = types.SimpleNamespace
+fake_pika.spec = types.SimpleNamespace(Basic=types.SimpleNamespace(Ack=FakeAck, Nack=FakeNack))
+
+
+class TestRabbitPublisher(unittest.TestCase):
+    """Tests para replay.RabbitPublisher (publisher confirms sobre SelectConnection) con un pika falso"""
+
+    @classmethod
+    def setUpClass(cls):
+        with mock.patch.dict(sys.modules, {"pika": fake_pika}):
+            import replay
+        cls.replay = replay
+
+    def publisher(self, confirms="ack", nack_tag=None, timeout=30.0):
+        publisher = self.replay.RabbitPublisher("events_exchange", "replay-1", timeout=timeout)
+        publisher.connection.confirms, publisher.connection.nack_tag = confirms, nack_tag
+        self.addCleanup(publisher.close)
+        return publisher
+
+    def batch(self, n):
+        return [("security.incident", f"e{i}".encode()) for i in range(n)]
+
+    def test_batch_confirmed_by_multiple_ack(self):
+        """Test que un lote se da por confirmado con un solo Ack(multiple=True) del último tag"""
+        publisher = self.publisher()
+        publisher.publish_batch(self.batch(5))
+        publisher.publish("security.incident", b"e5")
+
+        published = publisher.connection.channel_.published
+        self.assertEqual(len(published), 6)
+        self.assertEqual(published[0][2], {"x-replay": "true", "run_id": "replay-1"})
+        self.assertEqual((publisher.last_tag, publisher.unconfirmed), (6, set()))
+
+    def test_nack_raises(self):
+        """Test que un nack del broker hace fallar el lote (el worker lo reintenta entero)"""
+        publisher = self.publisher(confirms="nack", nack_tag=2)
+        with self.assertRaisesRegex(replayengine.ReplayError, "1 de 3"):
+            publisher.publish_batch(self.batch(3))
+        self.assertEqual(publisher.unconfirmed, set())
+
+    def test_timeout_raises(self):
+        """Test que sin confirms el lote falla al vencer el timeout"""
+        publisher = self.publisher(confirms="none", timeout=5.0)
+        with self.assertRaisesRegex(replayengine.ReplayError, "5s .2 confirms pendientes"):
+            publisher.publish_batch(self.batch(2))
+        self.assertEqual(publisher.connection.ioloop.now, 5.0)
+
+    def test_close(self):
+        """Test que close cierra la conexión sin levantar el error pendiente"""
+        publisher = self.publisher(confirms="none", timeout=1.0)
+        with self.assertRaises(replayengine.ReplayError):
+            publisher.publish_batch(self.batch(1))
+        publisher.close()
+        self.assertTrue(publisher.connection.is_closed)
+        publisher.close()  # idempotente
+
+
+if __name__ == "__main__":
+    unittest.main()
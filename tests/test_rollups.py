@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Tests para los roll-ups incrementales hora/día del Aggregator (rollups.py)
+"""
+
+import os
+import sys
+import unittest
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "aggregator"))
+
+from aggregations import AggregationPlan  # noqa: E402
+from rollups import RollupStore, rollup_metric_id  # noqa: E402
+from windows import build_window_result  # noqa: E402
+
+
+def window_at(when, counts, ids, aggregations=None):
+    ts = datetime.fromisoformat(when).timestamp()
+    return build_window_result(ts - 5, ts, sum(counts.values()), {"norte": counts},
+                               {"norte": set(ids)}, aggregations)
+
+
+class TestRollups(unittest.TestCase):
+    """Tests para RollupStore"""
+
+    def test_daily_rollup_is_upsert(self):
+        """Test que dos ventanas del mismo día actualizan el mismo metric_id"""
+        store = RollupStore()
+        first = store.apply_window(window_at("2025-01-01T10:00:05", {"security.incident": 2}, ["a", "b"]))
+        second = store.apply_window(window_at("2025-01-01T11:30:00", {"security.incident": 1}, ["c"]))
+
+        daily_1 = [u for u in first if u[0] == "metrics.daily"][0]
+        daily_2 = [u for u in second if u[0] == "metrics.daily"][0]
+
+        self.assertEqual(daily_1[1]["metric_id"], daily_2[1]["metric_id"])
+        self.assertEqual(daily_2[1]["metrics"], {"security.incident": 3})
+        self.assertEqual(daily_2[1]["revision"], 2)
+        # La traza solo lleva los eventos nuevos de la ventana
+        self.assertEqual(daily_2[2], ["c"])
+
+    def test_hourly_rollups_split_by_hour(self):
+        """Test que cada hora tiene su propio acumulado"""
+        store = RollupStore()
+        first = store.apply_window(window_at("2025-01-01T10:00:05", {"migration.case": 1}, ["a"]))
+        second = store.apply_window(window_at("2025-01-01T11:00:05", {"migration.case": 1}, ["b"]))
+
+        hourly_1 = [u[1] for u in first if u[0] == "metrics.hourly"][0]
+        hourly_2 = [u[1] for u in second if u[0] == "metrics.hourly"][0]
+
+        self.assertNotEqual(hourly_1["metric_id"], hourly_2["metric_id"])
+        self.assertEqual(hourly_2["hour"], "2025-01-01T11")
+        self.assertEqual(hourly_2["metrics"], {"migration.case": 1})
+
+    def test_metric_id_is_deterministic(self):
+        """Test que el metric_id depende solo de la clave del roll-up"""
+        self.assertEqual(rollup_metric_id("day", "2025-01-01", "sur", "default"),
+                         rollup_metric_id("day", "2025-01-01", "sur", "default"))
+        self.assertNotEqual(rollup_metric_id("day", "2025-01-01", "sur", "default"),
+                            rollup_metric_id("day", "2025-01-01", "sur", "replay-1"))
+
+    def test_aggregations_are_rolled_up(self):
+        """Test que las agregaciones del payload también se acumulan"""
+        plan = AggregationPlan([{"name": "reported", "kind": "ratio", "field": "payload.reported"}])
+        store = RollupStore(plan)
+        store.apply_window(window_at("2025-01-01T10:00:05", {"survey.victimization": 1}, ["a"],
+                                     {"norte": {"reported": {"true": 1}}}))
+        updates = store.apply_window(window_at("2025-01-01T10:00:10", {"survey.victimization": 1}, ["b"],
+                                               {"norte": {"reported": {"false": 1}}}))
+
+        daily = [u[1] for u in updates if u[0] == "metrics.daily"][0]
+        self.assertEqual(daily["aggregations"]["reported"]["ratio"], 0.5)
+
+    def test_stale_rollups_are_pruned(self):
+        """Test que los acumulados viejos se descartan tras la retención"""
+        store = RollupStore(retention_hours=24)
+        store.apply_window(window_at("2025-01-01T10:00:05", {"security.incident": 1}, ["a"]))
+        store.apply_window(window_at("2025-01-03T10:00:05", {"security.incident": 1}, ["b"]))
+
+        periods = {key[1] for key in store.rollups}
+        self.assertEqual(periods, {"2025-01-03", "2025-01-03T10"})
+
+
+    def test_restart_starts_a_new_generation(self):
+        """Test que un RollupStore nuevo (reinicio) publica con otra generación y la revision vuelve a 1"""
+        window = window_at("2025-01-01T10:00:05", {"security.incident": 1}, ["a"])
+        before = RollupStore()
+        before.apply_window(window)
+        daily_before = [u[1] for u in before.apply_window(window) if u[0] == "metrics.daily"][0]
+        daily_after = [u[1] for u in RollupStore().apply_window(window) if u[0] == "metrics.daily"][0]
+
+        self.assertEqual(daily_before["metric_id"], daily_after["metric_id"])
+        self.assertEqual((daily_before["revision"], daily_after["revision"]), (2, 1))
+        self.assertNotEqual(daily_before["generation"], daily_after["generation"])
+        self.assertEqual(RollupStore(generation="g1").apply_window(window)[0][1]["generation"], "g1")
+
+if __name__ == '__main__':
+    unittest.main()
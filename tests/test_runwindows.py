@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Tests para las ventanas por corrida del Aggregator (runwindows.py)
+"""
+
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "aggregator"))
+
+from aggregations import AggregationPlan  # noqa: E402
+from runwindows import RunWindows, is_valid_event  # noqa: E402
+from windows import group_by_run, merge_window_results  # noqa: E402
+
+REGIONS = ["norte", "sur"]
+SOURCES = ["security.incident"]
+
+
+def event(event_id, region="norte", run_id=None):
+    e = {"event_id": event_id, "region": region, "source": "security.incident", "payload": {}}
+    if run_id:
+        e["run_id"] = run_id
+    return e
+
+
+class TestRunWindows(unittest.TestCase):
+    """Tests para la separación por run_id y la deduplicación por (run_id, event_id)"""
+
+    def setUp(self):
+        self.windows = RunWindows(REGIONS, SOURCES, AggregationPlan([]))
+
+    def test_dedup_by_run_and_event(self):
+        """Test que el mismo event_id cuenta una vez por corrida"""
+        fresh, duplicates = self.windows.dedup([event("a"), event("a", run_id="replay-1"), event("a")])
+        self.assertEqual(len(fresh), 2)
+        self.assertEqual(duplicates, ["a"])
+        self.windows.add(fresh)
+        self.assertEqual(self.windows.total_processed, 2)
+
+    def test_results_per_run(self):
+        """Test que cada corrida produce su propio resultado de ventana"""
+        self.windows.add([event("a"), event("b", "sur"), event("a", run_id="replay-1")])
+        results = {r["run_id"]: r for r in self.windows.results(0.0, 10.0)}
+        self.assertEqual(sorted(results), ["default", "replay-1"])
+        self.assertEqual(results["default"]["stats_by_region"], {"norte": {"security.incident": 1},
+                                                                 "sur": {"security.incident": 1}})
+        self.assertEqual(results["replay-1"]["event_ids_by_region"], {"norte": ["a"]})
+        self.windows.reset()
+        self.assertTrue(self.windows.is_empty())
+        self.assertEqual(self.windows.results(0.0, 10.0), [])
+
+    def test_merge_keeps_runs_apart(self):
+        """Test que el merge de shards combina cada corrida por separado"""
+        self.windows.add([event("a"), event("a", run_id="replay-1")])
+        other = RunWindows(REGIONS, SOURCES, AggregationPlan([]))
+        other.add([event("b", run_id="replay-1")])
+        groups = group_by_run(self.windows.results(0.0, 10.0) + other.results(1.0, 11.0))
+        merged = merge_window_results(groups["replay-1"])
+        self.assertEqual((merged["run_id"], merged["total_processed"]), ("replay-1", 2))
+        self.assertEqual(len(groups["default"]), 1)
+
+
+    def test_admit_rolls_back_dedup_marks(self):
+        """Test que si una corrida falla al sumarse sus eventos no quedan marcados como vistos"""
+        plan = AggregationPlan([{"name": "kinds", "kind": "count", "by": ["payload.kind"]}])
+        count = plan.aggregations["kinds"].update
+
+        def update(state, e):
+            if e["payload"].get("boom"):
+                raise ValueError("boom")
+            count(state, e)
+        plan.aggregations["kinds"].update = update
+        windows = RunWindows(REGIONS, SOURCES, plan)
+        bad = dict(event("c", run_id="replay-1"), payload={"boom": True})
+
+        with self.assertRaises(ValueError):
+            windows.admit([event("a"), event("b", run_id="replay-1"), bad])
+        # "default" ya se sumó y sigue marcada; "replay-1" no se tocó y se puede reprocesar
+        self.assertEqual(windows.total_processed, 1)
+        self.assertEqual(windows.admit([event("a")]), ([], ["a"]))
+        windows.admit([event("b", run_id="replay-1")])
+        self.assertEqual(windows.total_processed, 2)
+        self.assertEqual(windows.results(0.0, 10.0)[1]["stats_by_region"], {"norte": {"security.incident": 1}})
+
+    def test_is_valid_event(self):
+        """Test que solo se agregan objetos con ids y claves de texto"""
+        self.assertTrue(is_valid_event(event("a")))
+        self.assertTrue(is_valid_event({"event_id": "a"}))
+        self.assertFalse(is_valid_event(["a"]))
+        self.assertFalse(is_valid_event({"event_id": ["a"]}))
+        self.assertFalse(is_valid_event(dict(event("a"), payload="texto")))
+
+if __name__ == "__main__":
+    unittest.main()
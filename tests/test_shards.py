@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Tests para el almacenamiento en shards del Audit Service (shards.py) y las
+consultas de linaje sobre shards (lineage.ShardedLineageService)
+"""
+
+import json
+import os
+import sqlite3
+import stat
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "audit"))
+
+import db  # noqa: E402
+import lineage  # noqa: E402
+import shards  # noqa: E402
+
+
+def make_event(n):
+    return {
+        "event_id": f"e{n:03d}",
+        "timestamp": f"2025-01-01T00:{n // 2:02d}:00Z",  # de a dos por minuto: e024/e025 empatan entre shards
+        "region": "norte" if n % 2 else "sur",
+        "source": "incident.created",
+        "payload": {"n": n},
+    }
+
+
+def write(store, events=(), metrics=()):
+    """Un lote como lo escribe main.write_deliveries."""
+    conn = store.connection()
+    with conn:
+        rows = store.filter_new([db.event_row(e, "default") for e in events])
+        if rows:
+            db.store_events(conn, rows)
+        for metric in metrics:
+            db.store_metric_and_trace(conn, metric, store.resolve_external, store.previous_rollup)
+    store.note_events(len(events))
+
+
+def count_event(store, event_id):
+    total = 0
+    for shard in shards.list_shards(store.catalog):
+        conn = shards.readonly_connection(shard.path)
+        total += conn.execute("SELECT count(*) FROM events_in WHERE event_id = ?", (event_id,)).fetchone()[0]
+        conn.close()
+    return total
+
+
+class ShardTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = shards.ShardStore(self.dir.name, shard_by="rows", max_rows=25, lookback=2, seal_async=False)
+        write(self.store, [make_event(n) for n in range(25)])
+        # Siguiente lote: rota; llega un evento reentregado y una métrica que cruza la rotación
+        write(self.store, [make_event(n) for n in range(25, 40)] + [make_event(5)], [
+            {"metric_id": "m-all", "date": "2025-01-01", "region": "norte", "metrics": {},
+             "input_event_ids": [f"e{n:03d}" for n in range(40)]},
+        ])
+
+    def tearDown(self):
+        self.store.close()
+        self.dir.cleanup()
+
+
+class TestShardStore(ShardTestCase):
+    """Tests para la rotación, el sellado y la semántica de escritura"""
+
+    def test_rotation_seals_previous_shard(self):
+        """Test que el shard rotado queda sellado, de solo lectura y con su rango en el catálogo"""
+        first, active = shards.list_shards(self.store.catalog)
+        self.assertEqual(first.state, "sealed")
+        self.assertEqual((first.min_ts, first.max_ts), ("2025-01-01T00:00:00Z", "2025-01-01T00:12:00Z"))
+        self.assertFalse(os.stat(first.path).st_mode & stat.S_IWUSR)
+        self.assertEqual(active.state, "active")
+        self.assertEqual(self.store.active.id, active.id)
+
+    def test_redelivered_event_not_duplicated(self):
+        """Test que un evento ya guardado en un shard previo no se vuelve a insertar"""
+        self.assertEqual(count_event(self.store, "e005"), 1)
+
+    def test_trace_crossing_rotation(self):
+        """Test que la traza hacia eventos de un shard previo va a trace_external"""
+        conn = self.store.connection()
+        local = conn.execute("SELECT count(*) FROM trace").fetchone()[0]
+        external = conn.execute("SELECT count(*), min(shard_id), max(shard_id) FROM trace_external").fetchone()
+        self.assertEqual(local, 15)
+        self.assertEqual(external, (25, 1, 1))
+
+    def test_replay_run_not_filtered(self):
+        """Test que un evento viejo reinyectado con otro run_id se guarda en el shard activo"""
+        conn = self.store.connection()
+        with conn:
+            rows = self.store.filter_new([db.event_row(make_event(n), "replay-1") for n in (5, 6)])
+            db.store_events(conn, rows)
+            db.store_metric_and_trace(conn, {"metric_id": "m-replay", "date": "2025-01-01", "region": "norte",
+                                             "run_id": "replay-1", "metrics": {}, "input_event_ids": ["e005"]},
+                                      self.store.resolve_external)
+        self.assertEqual(count_event(self.store, "e005"), 2)
+        self.assertEqual(conn.execute("SELECT count(*) FROM trace_external x JOIN metrics_out m "
+                                      "ON m.id = x.metric_rowid WHERE m.metric_id = 'm-replay'").fetchone()[0], 0)
+
+    def test_missing_event_still_fails(self):
+        """Test que un evento que no está en ningún shard sigue revirtiendo la métrica"""
+        with self.assertRaises(sqlite3.IntegrityError):
+            write(self.store, metrics=[{"metric_id": "m-bad", "date": "2025-01-01", "region": "norte",
+                                        "metrics": {}, "input_event_ids": ["e001", "no-existe"]}])
+        conn = self.store.connection()
+        self.assertIsNone(conn.execute("SELECT 1 FROM metrics_out WHERE metric_id = 'm-bad'").fetchone())
+
+    def test_rollup_crossing_rotation(self):
+        """Test que un roll-up diario que cruza una rotación arranca en el shard nuevo con la fila del previo"""
+        def rollup(generation, revision, count, event_ids):
+            return {"metric_id": "d-norte", "date": "2025-01-01", "region": "norte", "generation": generation,
+                    "revision": revision, "metrics": {"security.incident": count}, "input_event_ids": event_ids}
+
+        write(self.store, metrics=[rollup("A", 1, 3, ["e025", "e026", "e027"])])
+        write(self.store, [make_event(n) for n in range(40, 50)], [rollup("A", 2, 5, ["e040", "e041"])])
+        write(self.store, [make_event(50)], [rollup("B", 1, 1, ["e050"])])  # reinicio tras la rotación
+        self.assertEqual(len(shards.list_shards(self.store.catalog)), 3)
+        revision, metrics = self.store.connection().execute(
+            "SELECT revision, metrics_json FROM metrics_out WHERE metric_id = 'd-norte'").fetchone()
+        # El export se queda con la revision más alta: la del shard nuevo, con A + B
+        self.assertEqual((revision, json.loads(metrics)), (3, {"security.incident": 6}))
+
+    def test_legacy_db_becomes_first_shard(self):
+        """Test que un audit.db existente se registra como primer shard"""
+        with tempfile.TemporaryDirectory() as tmp:
+            legacy = os.path.join(tmp, "audit.db")
+            conn = db.init_db(legacy)
+            with conn:
+                db.store_event(conn, make_event(1), "default")
+            conn.close()
+            store = shards.ShardStore(os.path.join(tmp, "shards"), shard_by="day", legacy_db=legacy)
+            try:
+                self.assertEqual(store.active.path, legacy)
+                self.assertEqual(store.rows, 1)
+            finally:
+                store.close()
+
+    def test_shards_for_range(self):
+        """Test que solo se eligen los shards sellados cuyo rango se solapa con la consulta"""
+        sealed = shards.Shard(1, "a", "d", "sealed", "t", "2025-01-01T00:00:00Z", "2025-01-01T23:59:59Z")
+        active = shards.Shard(2, "b", "d", "active", "t", None, None)
+        self.assertEqual(shards.shards_for_range([sealed, active], start="2025-01-02"), [active])
+        self.assertEqual(shards.shards_for_range([sealed, active], end="2025-01-01T12:00:00Z"), [sealed, active])
+
+
+class TestShardedLineage(ShardTestCase):
+    """Tests para las consultas de linaje repartidas entre shards"""
+
+    def setUp(self):
+        super().setUp()
+        self.service = lineage.ShardedLineageService(self.dir.name, pool_size=1)
+
+    def tearDown(self):
+        self.service.close()
+        super().tearDown()
+
+    def collect(self, fn, *args, limit=7, **kwargs):
+        items, cursor = [], None
+        while True:
+            page = fn(*args, limit=limit, after=cursor, **kwargs)
+            items += page["items"]
+            cursor = page["next"]
+            if cursor is None:
+                return items
+
+    def test_metric_to_events_across_shards(self):
+        """Test que metric -> events junta la traza local y la externa sin repetir"""
+        ids = [e["event_id"] for e in self.collect(self.service.events_for_metric, "m-all")]
+        self.assertEqual(sorted(ids), [f"e{n:03d}" for n in range(40)])
+        self.assertIsNone(self.service.events_for_metric("no-existe"))
+
+    def test_event_to_metrics_across_shards(self):
+        """Test que event -> metrics encuentra métricas de shards posteriores"""
+        page = self.service.metrics_for_event("e003")
+        self.assertEqual([m["metric_id"] for m in page["items"]], ["m-all"])
+        page = self.service.metrics_for_event("e030")
+        self.assertEqual([m["metric_id"] for m in page["items"]], ["m-all"])
+        self.assertIsNone(self.service.metrics_for_event("no-existe"))
+
+    def test_find_events_merges_in_order(self):
+        """Test que la búsqueda mezcla los shards por timestamp y pagina sin huecos ni repetidos"""
+        ids = [e["event_id"] for e in self.collect(self.service.find_events, limit=4)]
+        self.assertEqual(ids, [f"e{n:03d}" for n in range(40)])
+        ids = [e["event_id"] for e in self.collect(self.service.find_events, region="sur", limit=3)]
+        self.assertEqual(ids, [f"e{n:03d}" for n in range(0, 40, 2)])
+
+    def test_find_events_prunes_shards(self):
+        """Test que un rango de tiempo posterior al shard sellado no lo abre"""
+        page = self.service.find_events(start="2025-01-01T00:13:00Z")
+        self.assertEqual(page["items"][0]["event_id"], "e026")
+        self.assertEqual([key[0] for key in self.service.pools], [self.store.active.id])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Tests para los sketches del Aggregator (HyperLogLog y t-digest)
+"""
+
+import os
+import random
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "aggregator"))
+
+from aggregations import AggregationPlan, WindowAggregations  # noqa: E402
+from sketches import HyperLogLog, TDigest  # noqa: E402
+
+
+class TestHyperLogLog(unittest.TestCase):
+    """Tests para HyperLogLog"""
+
+    def test_small_cardinality_is_exact_enough(self):
+        """Test que pocas claves se estiman casi exacto (linear counting)"""
+        hll = HyperLogLog()
+        for i in range(50):
+            hll.add(f"corr-{i}")
+            hll.add(f"corr-{i}")  # duplicados no cuentan
+        self.assertAlmostEqual(hll.estimate(), 50, delta=2)
+
+    def test_large_cardinality_error(self):
+        """Test que el error relativo con 20k claves es pequeño"""
+        hll = HyperLogLog()
+        for i in range(20000):
+            hll.add(i)
+        self.assertLess(abs(hll.estimate() - 20000) / 20000, 0.06)
+
+    def test_merge_is_union(self):
+        """Test que combinar dos HLL estima la unión"""
+        a, b = HyperLogLog(), HyperLogLog()
+        for i in range(3000):
+            a.add(i)
+        for i in range(2000, 5000):
+            b.add(i)
+        a.merge(HyperLogLog.from_wire(b.to_wire()))
+        self.assertLess(abs(a.estimate() - 5000) / 5000, 0.06)
+
+    def test_merge_different_precision_fails(self):
+        """Test que no se combinan HLL de distinta precisión"""
+        with self.assertRaises(ValueError):
+            HyperLogLog(10).merge(HyperLogLog(11))
+
+
+class TestTDigest(unittest.TestCase):
+    """Tests para t-digest"""
+
+    def test_quantiles_uniform(self):
+        """Test de cuantiles sobre una distribución uniforme"""
+        rng = random.Random(7)
+        digest = TDigest()
+        for _ in range(20000):
+            digest.add(rng.uniform(0, 100))
+        self.assertAlmostEqual(digest.quantile(0.5), 50, delta=2)
+        self.assertAlmostEqual(digest.quantile(0.95), 95, delta=1)
+
+    def test_bounded_size(self):
+        """Test que la cantidad de centroides queda acotada"""
+        digest = TDigest(compression=50)
+        for i in range(50000):
+            digest.add(i)
+        self.assertLess(len(digest.to_wire()["m"]), 200)
+
+    def test_merge_and_wire(self):
+        """Test que combinar dos mitades equivale a la distribución completa"""
+        a, b = TDigest(), TDigest()
+        for i in range(5000):
+            (a if i % 2 else b).add(i)
+        merged = TDigest.from_wire(a.to_wire()).merge(TDigest.from_wire(b.to_wire()))
+        self.assertEqual(merged.total, 5000)
+        self.assertAlmostEqual(merged.quantile(0.5), 2500, delta=100)
+
+    def test_empty(self):
+        """Test que un digest vacío no tiene cuantiles"""
+        self.assertIsNone(TDigest().quantile(0.5))
+
+
+class TestSketchAggregations(unittest.TestCase):
+    """Tests para las agregaciones distinct/quantiles"""
+
+    def test_distinct_and_quantiles_specs(self):
+        """Test que las specs de sketches producen estimaciones y sketch serializado"""
+        plan = AggregationPlan([
+            {"name": "corr", "kind": "distinct", "field": "correlation_id"},
+            {"name": "age", "source": "survey.victimization", "kind": "quantiles",
+             "field": "payload.respondent_age", "quantiles": [0.5]},
+        ])
+        window = WindowAggregations(plan)
+        for age in range(18, 91):
+            event = {"source": "survey.victimization", "correlation_id": f"c{age % 10}",
+                     "payload": {"respondent_age": age}}
+            window.update("norte", event["source"], event)
+
+        result = plan.finalize_wire(window.to_wire())["norte"]
+
+        self.assertEqual(result["corr"]["estimate"], 10)
+        self.assertAlmostEqual(result["age"]["p50"], 54, delta=2)
+        self.assertIn("sketch", result["age"])
+
+
+if __name__ == '__main__':
+    unittest.main()
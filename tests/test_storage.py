@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Tests para los backends de almacenamiento del Audit Service (storage.py y
+pgstorage.py). Los de Postgres corren solo con POSTGRES_DSN apuntando a una
+base local (por ejemplo la del perfil "postgres" de docker-compose) y psycopg2.
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import types
+import unittest
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "audit"))
+
+import db  # noqa: E402
+import pgstorage  # noqa: E402
+import storage  # noqa: E402
+from groupcommit import commit_with_bisect  # noqa: E402
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+POSTGRES_DSN = os.getenv("POSTGRES_DSN")
+
+
+def make_event(n, run_id="default"):
+    return {"event_id": f"e{n:03d}", "timestamp": f"2025-01-01T00:{n:02d}:00Z", "region": "norte",
+            "source": "incident.created", "run_id": run_id, "payload": {"n": n, "texto": "a\tb\nc\\d"}}
+
+
+def make_metric(metric_id, event_ids, revision=0):
+    return {"metric_id": metric_id, "date": "2025-01-01", "region": "norte", "metrics": {"count": len(event_ids)},
+            "input_event_ids": event_ids, "revision": revision}
+
+
+def write_batch(store, items):
+    """Un lote como lo escribe main.write_batch: items = [("event"|"metric", mensaje)]."""
+    def write(conn, batch):
+        store.store_events(conn, [db.event_row(msg, msg["run_id"]) for kind, msg in batch if kind == "event"])
+        for kind, msg in batch:
+            if kind == "metric":
+                store.store_metric_and_trace(conn, msg)
+
+    conn = store.connection()
+    try:
+        ok, failed = commit_with_bisect(conn, items, write)
+    finally:
+        store.release(conn)
+    store.after_batch(sum(1 for kind, _ in ok if kind == "event"))
+    return ok, failed
+
+
+class StorageContract:
+    """Comportamiento común a todos los backends (lo que espera main.py)"""
+
+    def count(self, sql):
+        raise NotImplementedError
+
+    def test_redelivered_events_not_duplicated(self):
+        """Test que un evento reentregado no se duplica y uno de otro run sí se guarda"""
+        write_batch(self.store, [("event", make_event(n)) for n in range(5)])
+        ok, failed = write_batch(self.store, [("event", make_event(n)) for n in range(3, 8)]
+                                 + [("event", make_event(1, "replay-1"))])
+        self.assertEqual((len(ok), failed), (6, []))
+        self.assertEqual(self.count("SELECT count(*) FROM events_in"), 9)
+
+    def test_metric_with_trace(self):
+        """Test que la traza crece con cada ventana y una revisión vieja no pisa la fila"""
+        items = [("event", make_event(n)) for n in range(4)]
+        items += [("metric", make_metric("m1", ["e000", "e001", "e002"], revision=2))]
+        write_batch(self.store, items)
+        write_batch(self.store, [("metric", make_metric("m1", ["e003"], revision=1))])
+        self.assertEqual(self.count("SELECT count(*) FROM trace_view WHERE metric_id = 'm1'"), 4)
+        self.assertEqual(self.count("SELECT revision FROM metrics_out WHERE metric_id = 'm1'"), 2)
+
+    def test_missing_event_requeues_only_the_metric(self):
+        """Test que una métrica con eventos faltantes falla sola y no deja filas a medias"""
+        items = [("event", make_event(1)), ("metric", make_metric("m-bad", ["e001", "no-existe"])),
+                 ("metric", make_metric("m-ok", ["e001"]))]
+        ok, failed = write_batch(self.store, items)
+        self.assertEqual([msg["metric_id"] for _, msg in [item for item, _ in failed]], ["m-bad"])
+        self.assertIsInstance(failed[0][1], self.store.Error)
+        self.assertEqual(self.count("SELECT count(*) FROM metrics_out"), 1)
+        self.assertEqual(self.count("SELECT count(*) FROM trace"), 1)
+
+
+class TestSQLiteStorage(StorageContract, unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = storage.SQLiteStorage(os.path.join(self.dir.name, "audit.db"))
+
+    def tearDown(self):
+        self.store.close()
+        self.dir.cleanup()
+
+    def count(self, sql):
+        return self.store.connection().execute(sql).fetchone()[0]
+
+    def test_db_path_and_maintenance(self):
+        """Test que el backend SQLite expone su archivo y la conexión del writer para el mantenimiento"""
+        self.assertEqual(self.store.db_path, os.path.join(self.dir.name, "audit.db"))
+        self.assertIs(self.store.maintenance_connection(), self.store.connection())
+        self.assertIsInstance(sqlite3.IntegrityError("x"), self.store.Error)
+
+    def test_sharded(self):
+        """Test que con shards la conexión rota y los eventos de shards previos no se repiten"""
+        sharded = storage.SQLiteStorage(os.path.join(self.dir.name, "legacy.db"), shard_by="rows",
+                                        shard_dir=os.path.join(self.dir.name, "shards"), shard_max_rows=3,
+                                        seal_async=False)
+        try:
+            write_batch(sharded, [("event", make_event(n)) for n in range(3)])
+            first = sharded.db_path
+            write_batch(sharded, [("event", make_event(n)) for n in range(2, 5)]
+                        + [("metric", make_metric("m1", ["e001", "e004"]))])
+            self.assertNotEqual(sharded.db_path, first)
+            conn = sqlite3.connect(sharded.db_path)
+            self.assertEqual(conn.execute("SELECT count(*) FROM events_in").fetchone()[0], 2)
+            self.assertEqual(conn.execute("SELECT count(*) FROM trace_external").fetchone()[0], 1)
+            conn.close()
+        finally:
+            sharded.close()
+
+
+class TestOpenStorage(unittest.TestCase):
+    """Tests para la elección del backend desde settings"""
+
+    def settings(self, **overrides):
+        values = dict(AUDIT_STORAGE="sqlite", AUDIT_SHARD_BY="none", AUDIT_DB_PATH=":memory:",
+                      AUDIT_SHARD_DIR=None, AUDIT_SHARD_MAX_ROWS=0, AUDIT_SHARD_LOOKBACK=1,
+                      AUDIT_PAYLOAD_CODEC="json", PAYLOAD_COMPRESS_LEVEL=6, PAYLOAD_DICT_SAMPLE=1000)
+        values.update(overrides)
+        return types.SimpleNamespace(**values)
+
+    def test_invalid_combinations(self):
+        """Test que un backend desconocido o Postgres con shards se rechazan antes de conectar"""
+        with self.assertRaises(ValueError):
+            storage.open_storage(self.settings(AUDIT_STORAGE="mysql"))
+        with self.assertRaises(ValueError):
+            storage.open_storage(self.settings(AUDIT_STORAGE="postgres", AUDIT_SHARD_BY="day"))
+
+    def test_default_is_sqlite(self):
+        store = storage.open_storage(self.settings())
+        self.assertEqual(store.name, "sqlite")
+        store.close()
+
+
+class TestCopyText(unittest.TestCase):
+    """Tests para el formato de COPY de pgstorage"""
+
+    def test_escapes_and_nulls(self):
+        """Test que tabs, saltos de línea y barras se escapan y None se vuelve \\N"""
+        self.assertEqual(pgstorage.copy_text([("a\tb", None, "c\nd\\e", 3)]), "a\\tb\t\\N\tc\\nd\\\\e\t3\n")
+        self.assertEqual(pgstorage.copy_text([]), "")
+
+
+@unittest.skipUnless(POSTGRES_DSN and psycopg2, "requiere POSTGRES_DSN y psycopg2")
+class TestPostgresStorage(StorageContract, unittest.TestCase):
+
+    def setUp(self):
+        self.schema = f"audit_test_{uuid.uuid4().hex[:8]}"
+        self.store = pgstorage.PostgresStorage(POSTGRES_DSN, pool_size=2, schema=self.schema)
+
+    def tearDown(self):
+        self.store.close()
+        conn = psycopg2.connect(POSTGRES_DSN)
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(f'DROP SCHEMA "{self.schema}" CASCADE')
+        conn.close()
+
+    def count(self, sql):
+        conn = self.store.connection()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(sql)
+                    return cur.fetchone()[0]
+        finally:
+            self.store.release(conn)
+
+    def test_payload_round_trip(self):
+        """Test que el COPY conserva el payload con tabs, saltos de línea y barras"""
+        write_batch(self.store, [("event", make_event(1))])
+        conn = self.store.connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT payload_json FROM events_in WHERE event_id = 'e001'")
+                self.assertEqual(cur.fetchone()[0], db.event_row(make_event(1), "default")[6])
+            conn.rollback()
+        finally:
+            self.store.release(conn)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Tests para la codificación compacta de trazas (tracecodec.py)
+"""
+
+import json
+import os
+import random
+import sys
+import unittest
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "aggregator"))
+
+from tracecodec import attach_trace, decode_event_ids, encode_event_ids, trace_event_ids  # noqa: E402
+
+# No usamos uuid.uuid4(): test_publisher lo reemplaza a nivel de módulo
+_rng = random.Random(1234)
+
+
+def new_uuid():
+    return str(uuid.UUID(int=_rng.getrandbits(128), version=4))
+
+
+BASE = {"metric_id": "m-1", "date": "2025-01-01", "region": "norte", "run_id": "default",
+        "metrics": {"security.incident": 3}}
+
+
+class TestTraceCodec(unittest.TestCase):
+    """Tests para encode/decode de event_ids"""
+
+    def test_roundtrip(self):
+        """Test que decode(encode(ids)) devuelve los mismos ids ordenados"""
+        ids = [new_uuid() for _ in range(500)]
+        self.assertEqual(decode_event_ids(encode_event_ids(ids)), sorted(ids))
+
+    def test_single_and_empty(self):
+        """Test de casos borde: un id y ninguno"""
+        event_id = new_uuid()
+        self.assertEqual(decode_event_ids(encode_event_ids([event_id])), [event_id])
+        self.assertEqual(decode_event_ids(encode_event_ids([])), [])
+
+    def test_non_uuid_is_not_encoded(self):
+        """Test que ids que no son UUID no se codifican"""
+        self.assertIsNone(encode_event_ids(["event-1"]))
+
+    def test_compact_is_smaller(self):
+        """Test que el mensaje compacto pesa bastante menos que el plano"""
+        ids = [new_uuid() for _ in range(2000)]
+        plain = json.dumps(next(attach_trace(BASE, ids, "plain")))
+        compact = json.dumps(next(attach_trace(BASE, ids, "compact")))
+        self.assertLess(len(compact), len(plain) * 0.6)
+
+    def test_compact_falls_back_to_plain(self):
+        """Test que con ids no UUID el mensaje mantiene la lista plana"""
+        msg = next(attach_trace(BASE, ["b", "a"], "compact"))
+        self.assertEqual(msg["input_event_ids"], ["a", "b"])
+        self.assertEqual(trace_event_ids(msg), ["a", "b"])
+
+    def test_chunking(self):
+        """Test que la traza se reparte en chunks con el mismo metric_id"""
+        ids = [new_uuid() for _ in range(25)]
+        msgs = list(attach_trace(BASE, ids, "compact", chunk_size=10))
+
+        self.assertEqual(len(msgs), 3)
+        self.assertEqual({m["metric_id"] for m in msgs}, {"m-1"})
+        self.assertEqual([m["trace_chunk"]["index"] for m in msgs], [0, 1, 2])
+        decoded = [i for m in msgs for i in trace_event_ids(m)]
+        self.assertEqual(decoded, sorted(ids))
+
+    def test_unknown_encoding(self):
+        """Test que una codificación desconocida es un error"""
+        with self.assertRaises(ValueError):
+            trace_event_ids({"trace_encoding": "zstd-v9"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,11 +7,15 @@ from jsonschema import validate
 import settings
 import schemas
 import os
+from partitioning import HashRing, partition_key, partitioned_routing_key
 
 # Configuración de Retries
 MAX_RETRIES = 3
 BASE_BACKOFF = 1.0 # Segundos
 
+# Anillo de particiones (None si el modo particionado está apagado)
+PARTITION_RING = HashRing(settings.PARTITIONS) if settings.PARTITIONS > 0 else None
+
 def connect_rabbitmq():
     """Conexión robusta con reintentos"""
     while True:
@@ -96,9 +100,10 @@ def callback(ch, method, properties, body):
                 # Éxito: Enviar al exchange de procesamiento
                 ch.basic_publish(
                     exchange=settings.OUTPUT_EXCHANGE,
-                    routing_key=method.routing_key, 
+                    routing_key=output_routing_key(method.routing_key, event_data), 
                     body=body,
-                    properties=pika.BasicProperties(delivery_mode=2)
+                    # Los headers (run_id / x-replay de un replay) siguen al evento
+                    properties=pika.BasicProperties(delivery_mode=2, headers=properties.headers)
                 )
                 print(f" [V] Válido. Reenviado a {settings.OUTPUT_EXCHANGE}")
             else:
@@ -129,6 +134,13 @@ def callback(ch, method, properties, body):
                 ch.basic_ack(delivery_tag=method.delivery_tag)
                 return
 
+def output_routing_key(routing_key, event_data):
+    """Agrega el sufijo de partición si el modo particionado está activo"""
+    if PARTITION_RING is None:
+        return routing_key
+    partition = PARTITION_RING.partition_for(partition_key(event_data, settings.PARTITION_KEY))
+    return partitioned_routing_key(routing_key, partition)
+
 def send_to_dlq(ch, method, body, error_msg, service_name):
     """Helper para enviar a DLQ"""
     # Intentamos parsear para envolver, si falla mandamos raw
@@ -0,0 +1,43 @@
+import bisect
+import hashlib
+
+
+def stable_hash(value: str) -> int:
+    """Hash estable entre procesos (hash() de Python cambia con cada arranque)."""
+    digest = hashlib.md5(value.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+class HashRing:
+    """
+    Anillo de hashing consistente con nodos virtuales.
+    Cambiar el número de particiones solo mueve ~1/N de las claves.
+    """
+
+    def __init__(self, partitions: int, vnodes: int = 64):
+        if partitions < 1:
+            raise ValueError("El anillo necesita al menos una partición")
+        self.partitions = partitions
+        points = []
+        for partition in range(partitions):
+            for vnode in range(vnodes):
+                points.append((stable_hash(f"p{partition}#{vnode}"), partition))
+        points.sort()
+        self._hashes = [h for h, _ in points]
+        self._owners = [p for _, p in points]
+
+    def partition_for(self, key: str) -> int:
+        idx = bisect.bisect(self._hashes, stable_hash(key))
+        if idx == len(self._hashes):
+            idx = 0
+        return self._owners[idx]
+
+
+def partition_key(event: dict, key_field: str) -> str:
+    """Extrae la clave de particionamiento ('region' o 'event_id')."""
+    return str(event.get(key_field) or event.get("event_id") or "")
+
+
+def partitioned_routing_key(routing_key: str, partition: int) -> str:
+    """security.incident -> security.incident.p2 (los shards bindean '#.p2')."""
+    return f"{routing_key}.p{partition}"
@@ -12,4 +12,10 @@ DLQ_EXCHANGE = 'dlq_exchange'           # Donde enviamos los inválidos
 INPUT_QUEUE = 'validator_input_queue'
 
 # Routing Keys (Topics) que vamos a escuchar
-LISTEN_TOPICS = ["security.incident", "survey.victimization", "migration.case"]
\ No newline at end of file
+LISTEN_TOPICS = ["security.incident", "survey.victimization", "migration.case"]
+
+# Particionamiento hacia el Aggregator (0 = desactivado, routing keys originales)
+# Con N > 0 cada evento válido sale con routing key "<source>.p<k>" según un
+# anillo de hashing consistente sobre PARTITION_KEY ("region" o "event_id").
+PARTITIONS = int(os.getenv('PARTITIONS', 0))
+PARTITION_KEY = os.getenv('PARTITION_KEY', 'region')